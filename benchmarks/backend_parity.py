@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import statistics
+import time
+import torch
+
+from src.model.backends import build_backend
+from src.model.model_utils import classify_text, prepare_text
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.settings.config import MODEL_BACKENDS, MODEL_NAME
+from src.utils.text_extractor import extract_text
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
+from werkzeug.datastructures import FileStorage
+
+"""
+Parity and latency of inference backends against fp32 eager.
+
+Extracts text from every file in files/ (files that fail - e.g. images without Tesseract
+installed - are skipped), classifies every text with every backend and reports:
+    - label agreement with eager,
+    - max absolute confidence difference against eager,
+    - mean and p50 latency of a single-text forward pass.
+
+    python -m benchmarks.backend_parity                  # the real model, needs network or HF cache
+    python -m benchmarks.backend_parity --tiny           # tiny random model, offline
+"""
+
+
+def load_texts(files_dir: str) -> dict:
+    texts = {}
+
+    for filename in sorted(os.listdir(files_dir)):
+        with open(os.path.join(files_dir, filename), 'rb') as f:
+            try:
+                text = extract_text(FileStorage(stream=f, filename=filename))
+            except Exception as e:
+                print(f"Skipping {filename}: {e}")
+                continue
+
+        if text:
+            texts[filename] = text
+
+    return texts
+
+
+def run_backend(backend, tokenizer, texts: dict, repeat: int) -> dict:
+    predictions = {}
+    latencies = []
+
+    for filename, text in texts.items():
+        prepared_text = prepare_text(text, tokenizer, torch.device('cpu'))
+        predictions[filename] = classify_text(backend, prepared_text) # warm-up, and the prediction
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            classify_text(backend, prepared_text)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "predictions": predictions,
+        "latency_ms_mean": statistics.mean(latencies),
+        "latency_ms_p50": statistics.median(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label agreement, confidence drift and latency of inference backends vs eager fp32")
+    parser.add_argument('--model', default=MODEL_NAME, help="Hugging Face model name or local snapshot directory")
+    parser.add_argument('--tiny', action='store_true', help="use a tiny randomly initialised model, works offline")
+    parser.add_argument('--files-dir', default='files')
+    parser.add_argument('--backends', nargs='+', default=list(MODEL_BACKENDS), choices=MODEL_BACKENDS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="write the report as JSON to this path")
+    args = parser.parse_args()
+
+    if args.tiny:
+        model, tokenizer = build_tiny_model_and_tokenizer()
+    else:
+        model = DistilBertForSequenceClassification.from_pretrained(args.model).eval()
+        tokenizer = DistilBertTokenizer.from_pretrained(args.model)
+
+    texts = load_texts(args.files_dir)
+    print(f"Texts extracted from {len(texts)} files\n")
+
+    reference = run_backend(build_backend('eager', model), tokenizer, texts, args.repeat)
+    report = {}
+
+    for name in args.backends:
+        result = reference if name == 'eager' else run_backend(build_backend(name, model), tokenizer, texts, args.repeat)
+
+        agreement = sum(
+            result["predictions"][filename][0] == reference["predictions"][filename][0] for filename in texts
+        ) / max(len(texts), 1)
+        max_confidence_diff = max(
+            (abs(result["predictions"][filename][1] - reference["predictions"][filename][1]) for filename in texts),
+            default=0.0,
+        )
+
+        report[name] = {
+            "label_agreement": agreement,
+            "max_confidence_diff": max_confidence_diff,
+            "latency_ms_mean": result["latency_ms_mean"],
+            "latency_ms_p50": result["latency_ms_p50"],
+            "speedup_vs_eager": reference["latency_ms_mean"] / result["latency_ms_mean"],
+        }
+
+    print(f"{'backend':<8} {'agreement':>10} {'max conf diff':>14} {'mean ms':>9} {'p50 ms':>8} {'speedup':>8}")
+    for name, row in report.items():
+        print(f"{name:<8} {row['label_agreement']:>10.1%} {row['max_confidence_diff']:>14.4f} "
+              f"{row['latency_ms_mean']:>9.2f} {row['latency_ms_p50']:>8.2f} {row['speedup_vs_eager']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.reporting import summarize_latencies
+from src.settings.config import (
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_MAX_WAITING,
+    ADMISSION_RESERVED_TEXT_THREADS,
+    ADMISSION_TEXT_BUDGET,
+    OCR_PROCESS_WORKERS,
+    REQUEST_THREADS,
+)
+from src.utils.admission import AdmissionController, OverloadedError, RequestCost
+
+"""
+Latency of cheap requests while the worker is overloaded with OCR, with and without admission control.
+
+A simulated gunicorn worker: --threads request threads, and an OCR pool of --ocr-processes that pages queue for,
+--page-ms each. Scans of 1-4 pages arrive at --overload times what the OCR pool can process, text documents
+(--text-ms of extraction, no OCR) at --text-rps. Nothing here touches a real file or model - only the
+queueing is simulated, so the numbers show the effect of the admission policy and nothing else.
+
+Without admission, scans take up all request threads waiting for OCR, and text documents queue behind them.
+With it, scans beyond the request threads left to OCR (--threads minus --reserved-text-threads), the OCR budget
+and queue are shed with 503, and text documents keep their latency. The defaults are the deployed settings:
+gunicorn's REQUEST_THREADS, the OCR pool and the admission settings of src/settings/config.py.
+
+    python -m benchmarks.bench_admission --seconds 10
+"""
+
+
+def run_variant(controller, args) -> dict:
+    ocr_pool = threading.Semaphore(args.ocr_processes)
+    latencies = {'ocr': [], 'text': []}
+    shed = {'ocr': 0, 'text': 0}
+    lock = threading.Lock()
+
+    def handle(cost: RequestCost, arrived: float):
+        try:
+            if controller is None:
+                extract(cost)
+            else:
+                with controller.admit(cost):
+                    extract(cost)
+        except OverloadedError:
+            with lock:
+                shed[cost.kind] += 1
+            return
+
+        with lock:
+            latencies[cost.kind].append(time.perf_counter() - arrived)
+
+    def extract(cost: RequestCost):
+        for _ in range(cost.ocr_units):
+            with ocr_pool:
+                time.sleep(args.page_ms / 1000)
+        if not cost.ocr_units:
+            time.sleep(args.text_ms / 1000)
+
+    rng = random.Random(0)
+    ocr_rps = args.overload * args.ocr_processes / (args.page_ms / 1000) / 2.5 # 2.5 pages per scan on average
+    total_rps = ocr_rps + args.text_rps
+
+    with ThreadPoolExecutor(max_workers=args.threads) as server:
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            if rng.random() < ocr_rps / total_rps:
+                cost = RequestCost(ocr_units=rng.randint(1, 4), text_units=1)
+            else:
+                cost = RequestCost(text_units=1)
+
+            server.submit(handle, cost, time.perf_counter())
+            time.sleep(rng.expovariate(total_rps))
+
+    return {kind: {**summarize_latencies(latencies[kind]), "shed": shed[kind]} for kind in ('ocr', 'text')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of cheap requests under OCR overload, with and without admission control")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--threads', type=int, default=REQUEST_THREADS, help="request threads of the worker")
+    parser.add_argument('--reserved-text-threads', type=int, default=ADMISSION_RESERVED_TEXT_THREADS)
+    parser.add_argument('--max-waiting', type=int, default=ADMISSION_MAX_WAITING)
+    parser.add_argument('--max-wait-seconds', type=float, default=ADMISSION_MAX_WAIT_SECONDS)
+    parser.add_argument('--ocr-processes', type=int, default=OCR_PROCESS_WORKERS)
+    parser.add_argument('--page-ms', type=float, default=200)
+    parser.add_argument('--text-ms', type=float, default=10)
+    parser.add_argument('--text-rps', type=float, default=20)
+    parser.add_argument('--overload', type=float, default=2.0)
+    args = parser.parse_args()
+
+    variants = {
+        'no admission': None,
+        'admission': AdmissionController(ocr_budget=args.ocr_processes * 4, text_budget=ADMISSION_TEXT_BUDGET, max_waiting=args.max_waiting,
+                                         max_wait_seconds=args.max_wait_seconds, ocr_threads=max(1, args.threads - args.reserved_text_threads)),
+    }
+
+    for name, controller in variants.items():
+        result = run_variant(controller, args)
+        print(f"\n{name}")
+        for kind, stats in result.items():
+            if not stats["count"]:
+                print(f"{kind:<5} served 0  shed {stats['shed']}")
+                continue
+            print(f"{kind:<5} served {stats['count']:>5}  shed {stats['shed']:>5}  p50 {stats['p50_ms']:>8.0f} ms  p99 {stats['p99_ms']:>8.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
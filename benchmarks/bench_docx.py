@@ -0,0 +1,143 @@
+import argparse
+import multiprocessing
+import time
+import zipfile
+
+from docx import Document
+from io import BytesIO
+from PIL import Image, ImageDraw
+from src.utils.text_extractor import extract_text_from_docx, extract_text_from_image
+
+"""
+DOCX extraction: python-docx (the old extract_text_from_docx()) vs the streaming reader.
+
+    python-docx - Document(), then the text of document.paragraphs, or OCR of every image of the body, one by one,
+    streaming   - extract_text_from_docx(): iterparse of the zip parts, unique images OCR'd in parallel.
+
+Two generated documents:
+    text   - --paragraphs paragraphs and a table row every 10 paragraphs,
+    images - no text, --images scans of which only a quarter are unique (needs Tesseract, skipped otherwise).
+
+Every variant runs in a fresh process, which reports its time and the growth of its peak RSS (Linux only).
+
+    python -m benchmarks.bench_docx --paragraphs 50000 --images 8
+"""
+
+
+def make_text_docx(n_paragraphs: int) -> bytes:
+    document = Document()
+    table = None
+
+    for i in range(n_paragraphs):
+        document.add_paragraph(f"Paragraph {i}: this agreement is made between the employer and the employee on the date below.")
+
+        if i % 10 == 0:
+            table = table or document.add_table(rows=0, cols=3)
+            cells = table.add_row().cells
+            cells[0].text, cells[1].text, cells[2].text = f"Item {i}", "Consulting", f"{i}.00"
+
+    docx_bytes = BytesIO()
+    document.save(docx_bytes)
+    return docx_bytes.getvalue()
+
+
+def make_image_docx(n_images: int) -> bytes:
+    empty = BytesIO()
+    Document().save(empty)
+    docx_bytes = BytesIO()
+
+    # python-docx dedupes pictures on save, so duplicates are written to the archive directly, as other editors do
+    with zipfile.ZipFile(empty) as original, zipfile.ZipFile(docx_bytes, 'w', zipfile.ZIP_DEFLATED) as archive:
+        rels = original.read('word/_rels/document.xml.rels').decode()
+        content_types = original.read('[Content_Types].xml').decode()
+        new_rels = []
+
+        for info in original.infolist():
+            if info.filename not in ('word/_rels/document.xml.rels', '[Content_Types].xml'):
+                archive.writestr(info, original.read(info))
+
+        for i in range(n_images):
+            image = Image.new('L', (1240, 1754), 255)
+            ImageDraw.Draw(image).text((100, 100), f"PASSPORT {i % max(1, n_images // 4)}", fill=0)
+            png = BytesIO()
+            image.save(png, format='PNG')
+
+            archive.writestr(f'word/media/image{i}.png', png.getvalue())
+            new_rels.append(f'<Relationship Id="rIdImage{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/image{i}.png"/>')
+
+        archive.writestr('word/_rels/document.xml.rels', rels.replace('</Relationships>', ''.join(new_rels) + '</Relationships>'))
+        archive.writestr('[Content_Types].xml', content_types.replace('</Types>', '<Default Extension="png" ContentType="image/png"/></Types>'))
+
+    return docx_bytes.getvalue()
+
+
+def python_docx_path(docx_bytes: bytes) -> str:
+    document = Document(BytesIO(docx_bytes))
+    text = '\n'.join([p.text for p in document.paragraphs])
+
+    if not text.strip():
+        text = '\n'.join(extract_text_from_image(rel.target_part.blob) for rel in document.part.rels.values() if "image" in rel.reltype)
+
+    return text.strip()
+
+
+VARIANTS = {'python-docx': python_docx_path, 'streaming': extract_text_from_docx}
+
+
+def _rss_kb(field: str) -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def run_variant(name: str, docx_bytes: bytes, result: dict):
+    # importing torch & co. peaks higher than parsing does, so the high-water mark is reset first (Linux only)
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+    baseline_kb = _rss_kb('VmRSS')
+
+    start = time.perf_counter()
+    text = VARIANTS[name](docx_bytes)
+    elapsed = time.perf_counter() - start
+
+    result[name] = {
+        "seconds": elapsed,
+        "chars": len(text),
+        "peak_rss_growth_mb": (_rss_kb('VmHWM') - baseline_kb) / 1024,
+    }
+
+
+def compare(label: str, docx_bytes: bytes):
+    context = multiprocessing.get_context('spawn')
+
+    with context.Manager() as manager:
+        result = manager.dict()
+
+        for name in VARIANTS:
+            process = context.Process(target=run_variant, args=(name, docx_bytes, result))
+            process.start()
+            process.join()
+
+        result = dict(result)
+
+    print(f"\n{label}, {len(docx_bytes) / 1e6:.1f} MB")
+    for name, stats in result.items():
+        print(f"{name:<12} {stats['seconds']:>8.2f} s  {len(docx_bytes) / 1e6 / stats['seconds']:>7.1f} MB/s  "
+              f"peak RSS +{stats['peak_rss_growth_mb']:.1f} MB  {stats['chars']} chars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of DOCX extraction, python-docx vs streaming")
+    parser.add_argument('--paragraphs', type=int, default=50000)
+    parser.add_argument('--images', type=int, default=8)
+    args = parser.parse_args()
+
+    compare(f"text: {args.paragraphs} paragraphs", make_text_docx(args.paragraphs))
+
+    if args.images:
+        compare(f"images: {args.images} scans, {max(1, args.images // 4)} unique", make_image_docx(args.images))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import tempfile
+import threading
+import time
+
+from benchmarks.reporting import summarize_latencies
+from src.model.registry import ModelRegistry, activate_version
+from src.model.startup import StartupProfile
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.utils.classifier import classify_file
+
+"""
+Latency of requests while a new model version is rolled out, see src/model/registry.py.
+
+Client threads classify texts of mixed lengths one at a time, like /classify-file requests would, while the
+registry moves from v1 to v2 half way through --seconds:
+
+    restart - the way a rollout worked before: the worker is down while v2 loads, requests wait for it,
+              then v2 serves cold,
+    cold    - hot swap, v2 loaded in the background and swapped in without warm-up,
+    warm    - hot swap, v2 loaded and warmed up in the background before it's swapped in (the default).
+
+Latencies are reported by window: before the rollout, while v2 loads, the first --first requests on v2 and the rest.
+Tiny random models by default; --model-dir takes two snapshots of the real model (subdirectories v1 and v2).
+
+    python -m benchmarks.bench_hot_swap --clients 4
+    python -m benchmarks.bench_hot_swap --model-dir models/registry --seconds 30
+"""
+
+TEXTS = [
+    "invoice number 1234 total amount due within 30 days",
+    "this agreement is made between the employer and the employee on the date below. " * 12,
+    "passport united kingdom of great britain surname given names nationality date of birth",
+    "driving licence full name address date of issue categories " * 30,
+]
+
+
+def run_variant(registry_dir: str, variant: str, args) -> dict:
+    activate_version(registry_dir, 'v1')
+    registry = ModelRegistry(registry_dir=registry_dir, profile=StartupProfile(processes=1, warmup=variant == 'warm'))
+    down = threading.Event() # a restarting worker takes no requests
+    down.set()
+    rollout = {}
+    samples = []
+    samples_lock = threading.Lock()
+    stop = threading.Event()
+
+    def client(client_id: int):
+        i = client_id
+
+        while not stop.is_set():
+            start = time.perf_counter()
+            down.wait()
+
+            with registry.use() as served:
+                classify_file(TEXTS[i % len(TEXTS)], served.model, tokenizer=served.tokenizer, device=served.device)
+
+            with samples_lock:
+                samples.append((start, time.perf_counter() - start, served.version))
+            i += 1
+
+    def roll_out():
+        rollout["start"] = time.perf_counter()
+
+        if variant == 'restart':
+            down.clear()
+            registry.swap_to('v2')
+            down.set()
+        else:
+            registry.swap_to('v2')
+
+        rollout["end"] = time.perf_counter()
+
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in clients:
+        thread.start()
+
+    time.sleep(args.seconds / 2)
+    roll_out()
+    time.sleep(args.seconds / 2)
+    stop.set()
+
+    for thread in clients:
+        thread.join()
+
+    after = sorted((start, latency) for start, latency, version in samples if version == 'v2')
+
+    return {
+        "before": summarize_latencies([latency for start, latency, _ in samples if start < rollout["start"]]),
+        "loading": summarize_latencies([latency for start, latency, version in samples if rollout["start"] <= start < rollout["end"] and version == 'v1']),
+        "first": summarize_latencies([latency for _, latency in after[:args.first]]),
+        "after": summarize_latencies([latency for _, latency in after[args.first:]]),
+        "rollout_s": rollout["end"] - rollout["start"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of requests while a new model version is rolled out")
+    parser.add_argument('--model-dir', help="registry directory with snapshots v1 and v2, tiny random models if not given")
+    parser.add_argument('--clients', type=int, default=4, help="concurrent client threads")
+    parser.add_argument('--seconds', type=float, default=6.0, help="duration of a variant, the rollout starts half way")
+    parser.add_argument('--first', type=int, default=20, help="requests on v2 counted as its first ones")
+    args = parser.parse_args()
+
+    registry_dir = args.model_dir
+
+    if registry_dir is None:
+        registry_dir = tempfile.mkdtemp(prefix='model-registry-')
+        build_tiny_model_and_tokenizer(save_dir=f'{registry_dir}/v1', seed=0)
+        build_tiny_model_and_tokenizer(save_dir=f'{registry_dir}/v2', seed=1)
+
+    print(f"{'variant':<8} {'rollout s':>9} {'window':<8} {'count':>6} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+
+    for variant in ('restart', 'cold', 'warm'):
+        result = run_variant(registry_dir, variant, args)
+
+        for window in ('before', 'loading', 'first', 'after'):
+            summary = result[window]
+
+            if not summary["count"]:
+                print(f"{variant:<8} {result['rollout_s']:>9.2f} {window:<8} {0:>6}")
+                continue
+
+            print(f"{variant:<8} {result['rollout_s']:>9.2f} {window:<8} {summary['count']:>6} {summary['p50_ms']:>7.1f} {summary['p99_ms']:>7.1f} {summary['max_ms']:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
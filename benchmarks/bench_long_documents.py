@@ -0,0 +1,86 @@
+import argparse
+import time
+import torch
+
+from src.model.model_utils import _logits_to_predictions, classify_texts, encode_windows
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.settings.config import ID_TO_LABEL, LONG_DOCUMENT_STRIDE
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+
+"""
+Cost of classifying long documents with sliding windows, by document length.
+
+    truncated  - classify_texts() with max_windows=1, everything after the first 512 tokens is dropped,
+    sequential - the same windows as below, but one forward pass per window,
+    batched    - classify_texts() with --max-windows, all windows of a batch of documents in shared forward passes.
+
+A batch of --batch-size documents of every length is classified --repeat times.
+
+    python -m benchmarks.bench_long_documents --tiny
+    python -m benchmarks.bench_long_documents --model models/distilbert --max-windows 8
+"""
+
+SENTENCE = "this agreement is made between the employer and the employee on the date below. "
+
+
+def classify_sequentially(model, texts: list, tokenizer, device: torch.device, max_windows: int, stride: int) -> list:
+    logits = []
+
+    for windows in encode_windows(texts, tokenizer, max_windows, stride):
+        window_logits = []
+
+        for window in windows:
+            input_ids = torch.tensor([window.ids], device=device)
+            with torch.no_grad():
+                window_logits.append(model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids)).logits)
+
+        logits.append(torch.cat(window_logits).mean(dim=0))
+
+    return _logits_to_predictions(torch.stack(logits), ID_TO_LABEL)
+
+
+def time_ms(fn, repeat: int) -> float:
+    fn() # warm-up
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        fn()
+
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time of truncated, sequential and batched window classification")
+    parser.add_argument('--model', help="local model snapshot directory")
+    parser.add_argument('--tiny', action='store_true', help="tiny random model, works offline")
+    parser.add_argument('--max-windows', type=int, default=8)
+    parser.add_argument('--stride', type=int, default=LONG_DOCUMENT_STRIDE)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.tiny or not args.model:
+        model, tokenizer = build_tiny_model_and_tokenizer()
+    else:
+        model = DistilBertForSequenceClassification.from_pretrained(args.model).eval()
+        tokenizer = DistilBertTokenizerFast.from_pretrained(args.model)
+
+    device = torch.device('cpu')
+    sentence_tokens = len(tokenizer.tokenize(SENTENCE))
+
+    print(f"{args.batch_size} documents per batch, up to {args.max_windows} windows, stride {args.stride}\n")
+    print(f"{'tokens':>7} {'windows':>8} {'truncated':>11} {'sequential':>11} {'batched':>9}  speed-up")
+
+    for n_tokens in (256, 512, 1024, 2048, 4096, 8192):
+        texts = [SENTENCE * (n_tokens // sentence_tokens)] * args.batch_size
+        n_windows = len(encode_windows(texts[:1], tokenizer, args.max_windows, args.stride)[0])
+
+        truncated = time_ms(lambda: classify_texts(model, texts, tokenizer, device, max_windows=1), args.repeat)
+        sequential = time_ms(lambda: classify_sequentially(model, texts, tokenizer, device, args.max_windows, args.stride), args.repeat)
+        batched = time_ms(lambda: classify_texts(model, texts, tokenizer, device, max_windows=args.max_windows, stride=args.stride), args.repeat)
+
+        print(f"{n_tokens:>7} {n_windows:>8} {truncated:>9.1f}ms {sequential:>9.1f}ms {batched:>7.1f}ms  {sequential / batched:>6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import numpy as np
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.reporting import summarize_latencies
+from src.utils.near_duplicates import NearDuplicateIndex
+from src.utils.text_extractor import extract_text
+from werkzeug.datastructures import FileStorage
+
+"""
+Near-duplicate index of extracted text, see src/utils/near_duplicates.py.
+
+    accuracy - the text of every document in --files-dir is indexed, then looked up again with OCR-like noise
+               (characters misread, lines broken differently) at a few rates: 'hits' is the share of noisy copies
+               that found their document, 'wrong' the share of lookups answered by another document,
+    scale    - the index is filled with --entries entries, then lookups of stored signatures (slightly changed) and of
+               unknown ones are timed, along with signing a text, the memory of the index and saving/loading it.
+
+    python -m benchmarks.bench_near_duplicates --entries 1000000
+"""
+
+MISREADS = {'o': '0', 'l': '1', 'i': 'l', 'e': 'c', 'a': 'o', 's': '5', 'b': '6', 'm': 'rn', 'rn': 'm'}
+
+
+def ocr_noise(text: str, rate: float, rng: random.Random) -> str:
+    chars = []
+
+    for char in text:
+        if rng.random() < rate:
+            chars.append(MISREADS.get(char, rng.choice('.,; ') if char.isalnum() else ''))
+        else:
+            chars.append(char)
+
+    # rescans wrap lines elsewhere
+    return ''.join(chars).replace('\n', ' ').replace('  ', '\n')
+
+
+def load_texts(files_dir: str) -> dict:
+    texts = {}
+
+    for filename in sorted(os.listdir(files_dir)):
+        with open(os.path.join(files_dir, filename), 'rb') as f:
+            text = extract_text(FileStorage(stream=f, filename=filename))
+
+        if text and text.strip():
+            texts[filename] = text
+
+    return texts
+
+
+def run_accuracy(texts: dict, rates: list, copies: int):
+    index = NearDuplicateIndex(max_entries=1000)
+    indexed = {}
+    originals = {} # a document with the text of one indexed before is looked up as that one
+
+    for name, text in texts.items():
+        signature = index.hasher.signature(text)
+
+        if signature is None:
+            continue
+
+        duplicate = index.lookup(signature)
+        originals[name] = duplicate[0] if duplicate else name
+        indexed[name] = text
+
+        if not duplicate:
+            index.add(signature, name, 1.0)
+
+    duplicates = sorted(f"{name} = {original}" for name, original in originals.items() if name != original)
+    print(f"{len(indexed)} of {len(texts)} documents long enough to index, duplicates: {', '.join(duplicates) or 'none'}\n")
+    print(f"{'noise':>6} {'lookups':>8} {'hits':>6} {'wrong':>6}")
+    rng = random.Random(0)
+
+    for rate in rates:
+        hits = wrong = lookups = 0
+
+        for name, text in indexed.items():
+            for _ in range(copies):
+                signature = index.hasher.signature(ocr_noise(text, rate, rng))
+
+                if signature is None:
+                    continue
+
+                result = index.lookup(signature)
+                lookups += 1
+                hits += result is not None and result[0] == originals[name]
+                wrong += result is not None and result[0] != originals[name]
+
+        print(f"{rate:>6.0%} {lookups:>8} {hits / max(1, lookups):>6.0%} {wrong / max(1, lookups):>6.0%}")
+
+
+def run_scale(entries: int, lookups: int):
+    index = NearDuplicateIndex(max_entries=entries)
+    rng = np.random.default_rng(0)
+    signatures = rng.integers(0, 2 ** 32, size=(entries, index.num_perm), dtype=np.uint32)
+
+    start = time.perf_counter()
+    for signature in signatures:
+        index.add(signature, 'invoice', 0.95)
+    print(f"\nfilled {entries} entries in {time.perf_counter() - start:.1f} s")
+
+    memory = sum(array.nbytes for array in (index._signatures, index._label_ids, index._confidences, index._referenced, index._tables))
+    print(f"memory: {memory / 2 ** 20:.0f} MB, {memory / entries:.0f} bytes per entry")
+
+    hit_latencies, miss_latencies, sign_latencies = [], [], []
+    hits = 0
+
+    for i in rng.integers(0, entries, size=lookups):
+        near = signatures[i].copy()
+        near[rng.choice(index.num_perm, size=index.num_perm // 8, replace=False)] += 1 # ~88% of the values agree
+
+        start = time.perf_counter()
+        hits += index.lookup(near) is not None
+        hit_latencies.append(time.perf_counter() - start)
+
+        unknown = rng.integers(0, 2 ** 32, size=index.num_perm, dtype=np.uint32)
+        start = time.perf_counter()
+        index.lookup(unknown)
+        miss_latencies.append(time.perf_counter() - start)
+
+    text = "invoice number 1234 bill to northwind traders total amount due within 30 days " * 25
+    for _ in range(lookups):
+        start = time.perf_counter()
+        index.hasher.signature(text)
+        sign_latencies.append(time.perf_counter() - start)
+
+    print(f"\n{'operation':<18} {'count':>6} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+
+    for name, latencies in (('lookup, near', hit_latencies), ('lookup, unknown', miss_latencies), ('sign 2000 chars', sign_latencies)):
+        summary = summarize_latencies(latencies)
+        print(f"{name:<18} {summary['count']:>6} {summary['p50_ms']:>7.3f} {summary['p99_ms']:>7.3f} {summary['max_ms']:>7.3f}")
+
+    print(f"\nnear signatures found: {hits / lookups:.1%}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'index.npz')
+
+        start = time.perf_counter()
+        index.save(path)
+        saved = time.perf_counter() - start
+
+        start = time.perf_counter()
+        NearDuplicateIndex(max_entries=entries).load(path)
+        print(f"save {saved:.2f} s, load {time.perf_counter() - start:.2f} s, {os.path.getsize(path) / 2 ** 20:.0f} MB on disk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and latency of the near-duplicate index")
+    parser.add_argument('--files-dir', default='files')
+    parser.add_argument('--rates', type=float, nargs='+', default=[0.01, 0.02, 0.05], help="shares of characters misread")
+    parser.add_argument('--copies', type=int, default=20, help="noisy copies of every document looked up")
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    run_accuracy(load_texts(args.files_dir), args.rates, args.copies)
+    run_scale(args.entries, args.lookups)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import pymupdf
+import pytesseract
+import statistics
+import time
+
+from benchmarks.bench_pdf_ocr import make_scanned_pdf
+from PIL import Image
+from io import BytesIO
+from src.settings.config import OCR_LANGUAGE, TESSDATA_PATH
+from src.utils.ocr_engine import OcrError, PytesseractEngine, TesserocrEngine
+
+"""
+OCR time per page: the tesseract CLI vs in-process Tesseract handles.
+
+    pytesseract       - a tesseract process, temp files and a language model load per page,
+    tesserocr-cold    - a new tesserocr handle per page, so the language model is still loaded per page
+                        (no process or temp files); shows how much of the saving is the model load,
+    tesserocr-pooled  - TesserocrEngine, handles loaded once and reused.
+
+Pages of a generated scanned PDF are rendered once up front, so only OCR is timed.
+An engine that can't run (no tesseract binary, no tesserocr or no tessdata) is reported as skipped.
+
+    TESSDATA_PREFIX=/usr/share/tesseract-ocr/5/tessdata python -m benchmarks.bench_ocr_engines --pages 10
+"""
+
+
+def render_pages(n_pages: int) -> list:
+    pdf_doc = pymupdf.open(stream=make_scanned_pdf(n_pages), filetype='pdf')
+    pages = [Image.open(BytesIO(page.get_pixmap(dpi=300).tobytes('png'))).convert('L') for page in pdf_doc]
+    pdf_doc.close()
+    return pages
+
+
+def time_per_page(image_to_string, pages: list, repeat: int) -> float:
+    image_to_string(pages[0]) # warm-up
+
+    latencies = []
+    for _ in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            image_to_string(page)
+            latencies.append(time.perf_counter() - start)
+
+    return statistics.mean(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR time per page of pytesseract vs persistent tesserocr handles")
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    pages = render_pages(args.pages)
+    print(f"{len(pages)} pages of {pages[0].size[0]}x{pages[0].size[1]} px, {args.repeat} rounds\n")
+
+    def tesserocr_cold(image):
+        engine = TesserocrEngine(pool_size=1)
+
+        try:
+            return engine.image_to_string(image)
+        finally:
+            engine.close()
+
+    def tesserocr_pooled():
+        engine = TesserocrEngine(pool_size=1)
+        return engine.image_to_string
+
+    engines = {
+        'pytesseract': lambda: PytesseractEngine().image_to_string,
+        'tesserocr-cold': lambda: tesserocr_cold,
+        'tesserocr-pooled': tesserocr_pooled,
+    }
+
+    results = {}
+    for name, make in engines.items():
+        try:
+            results[name] = time_per_page(make(), pages, args.repeat)
+        except (ImportError, RuntimeError, OSError, OcrError, pytesseract.TesseractNotFoundError) as e:
+            print(f"{name:<17} skipped: {type(e).__name__}: {e}")
+
+    baseline = results.get('pytesseract') or results.get('tesserocr-cold')
+    for name, ms_per_page in results.items():
+        print(f"{name:<17} {ms_per_page:>9.1f} ms/page  {baseline / ms_per_page:>5.2f}x")
+
+    print(f"\nlanguage: {OCR_LANGUAGE}, tessdata: {TESSDATA_PATH or 'default'}")
+
+
+if __name__ == '__main__':
+    main()
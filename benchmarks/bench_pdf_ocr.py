@@ -0,0 +1,87 @@
+import argparse
+import pymupdf
+import time
+
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+from src.utils.text_extractor import extract_text_from_pdf
+
+"""
+Serial vs parallel OCR of a scanned (image-only) PDF.
+
+Generates a PDF of N pages, every page being a picture of text with no text layer,
+so that every page goes through rasterisation + Tesseract. Needs Tesseract installed.
+
+    python -m benchmarks.bench_pdf_ocr --pages 20 --repeat 3
+"""
+
+LINES = [
+    "EMPLOYMENT CONTRACT",
+    "This agreement is made between the Employer and the Employee.",
+    "The Employee shall perform the duties described in Schedule A.",
+    "Salary is payable monthly in arrears on the last working day.",
+    "Either party may terminate this contract with one month notice.",
+]
+
+
+def make_scanned_pdf(n_pages: int) -> bytes:
+    """
+    Builds an image-only PDF with n_pages A4 pages of text.
+
+    :param n_pages: Number of pages
+    :type n_pages: int
+    :return: PDF bytes
+    :rtype: bytes
+    """
+    font = ImageFont.load_default(size=28)
+    pdf_doc = pymupdf.open()
+
+    for page_num in range(n_pages):
+        image = Image.new('L', (1240, 1754), color=255) # A4 at 150 dpi
+        draw = ImageDraw.Draw(image)
+
+        for line_num, line in enumerate([f"Page {page_num + 1}", *LINES * 4]):
+            draw.text((100, 100 + line_num * 60), line, fill=0, font=font)
+
+        png = BytesIO()
+        image.save(png, format='PNG')
+
+        page = pdf_doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=png.getvalue())
+
+    pdf_bytes = pdf_doc.tobytes(deflate=True)
+    pdf_doc.close()
+    return pdf_bytes
+
+
+def time_extraction(pdf_bytes: bytes, parallel_ocr: bool, repeat: int) -> float:
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_text_from_pdf(pdf_bytes, parallel_ocr=parallel_ocr)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs parallel OCR of a generated scanned PDF")
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pdf_bytes = make_scanned_pdf(args.pages)
+
+    extract_text_from_pdf(pdf_bytes, parallel_ocr=True) # spawns the OCR process pool, so it's not timed
+    serial = time_extraction(pdf_bytes, parallel_ocr=False, repeat=args.repeat)
+    parallel = time_extraction(pdf_bytes, parallel_ocr=True, repeat=args.repeat)
+
+    print(f"pages:    {args.pages}")
+    print(f"serial:   {serial:.2f}s ({serial / args.pages:.3f}s/page)")
+    print(f"parallel: {parallel:.2f}s ({parallel / args.pages:.3f}s/page)")
+    print(f"speedup:  {serial / parallel:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import multiprocessing
+import pymupdf
+import resource
+import time
+
+from benchmarks.bench_pdf_ocr import make_scanned_pdf
+from io import BytesIO
+from PIL import Image, ImageEnhance, ImageFilter
+from src.settings.config import OCR_DPI
+
+"""
+Rasterisation of image-only PDF pages for OCR: the old PNG round-trip vs the direct greyscale path.
+
+    png     - RGB pixmap, encoded to PNG, decoded by PIL, converted to greyscale, sharpened
+              and passed through a contrast enhancer of factor 1 (what ocr_pdf_page() used to do),
+    direct  - greyscale pixmap, wrapped by PIL without a copy and sharpened (what ocr_pdf_page() does now).
+
+OCR itself is left out - it takes the same image either way - so the numbers are the overhead of
+getting a page to Tesseract. Every variant runs in a fresh process, which reports the growth of
+its peak RSS while processing the pages.
+
+    python -m benchmarks.bench_pdf_rasterise --pages 10
+"""
+
+
+def png_path(page: pymupdf.Page, dpi: int) -> Image.Image:
+    pix_map = page.get_pixmap(dpi=dpi)
+    image = Image.open(BytesIO(pix_map.tobytes('png'))).convert('L')
+    image = image.filter(ImageFilter.SHARPEN)
+    return ImageEnhance.Contrast(image).enhance(1)
+
+
+def direct_path(page: pymupdf.Page, dpi: int) -> Image.Image:
+    pix_map = page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY, alpha=False)
+    image = Image.frombuffer('L', (pix_map.width, pix_map.height), pix_map.samples_mv, 'raw', 'L', pix_map.stride, 1)
+    return image.filter(ImageFilter.SHARPEN)
+
+
+VARIANTS = {'png': png_path, 'direct': direct_path}
+
+
+def run_variant(name: str, pdf_bytes: bytes, dpi: int, result: dict):
+    pdf_doc = pymupdf.open(stream=pdf_bytes, filetype='pdf')
+    VARIANTS[name](pdf_doc[0], dpi) # warm-up, loads codecs
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for page in pdf_doc:
+        VARIANTS[name](page, dpi)
+    elapsed = time.perf_counter() - start
+
+    result[name] = {
+        "ms_per_page": elapsed / len(pdf_doc) * 1000,
+        "peak_rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of rendering PDF pages for OCR")
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--dpi', type=int, default=OCR_DPI)
+    args = parser.parse_args()
+
+    pdf_bytes = make_scanned_pdf(args.pages)
+    context = multiprocessing.get_context('spawn')
+
+    with context.Manager() as manager:
+        result = manager.dict()
+
+        for name in VARIANTS:
+            process = context.Process(target=run_variant, args=(name, pdf_bytes, args.dpi, result))
+            process.start()
+            process.join()
+
+        result = dict(result)
+
+    print(f"{args.pages} pages at {args.dpi} dpi\n")
+    for name, stats in result.items():
+        print(f"{name:<7} {stats['ms_per_page']:>8.1f} ms/page  peak RSS +{stats['peak_rss_growth_mb']:.1f} MB")
+
+    png, direct = result['png'], result['direct']
+    print(f"\ndirect: {png['ms_per_page'] / direct['ms_per_page']:.1f}x faster, {png['peak_rss_growth_mb'] - direct['peak_rss_growth_mb']:.1f} MB less peak memory")
+
+
+if __name__ == '__main__':
+    main()
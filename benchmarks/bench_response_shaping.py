@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+
+from flask import Flask, jsonify
+from src.utils.response_shaping import iter_gzip_json, truncate_text
+
+"""
+Payload size and serialisation time of a classify response, by response shape.
+
+The response of a --pages page contract (about 3000 characters of text per page), and of /classify-files
+with --files such contracts, are serialised as the Flask app does it:
+
+    full      - jsonify() with the whole file_text, as every response was before response shaping,
+    none      - ?text=none, no file_text,
+    truncated - ?text_max_chars=2000,
+    gzip-N    - Accept-Encoding: gzip, the whole text streamed through iter_gzip_json() at zlib level N.
+
+Times are the best of --repeat runs, the text is random words, so that it compresses about as well as real text
+rather than as well as a repeated sentence.
+
+    python -m benchmarks.bench_response_shaping --pages 100
+"""
+
+WORDS = ("agreement", "party", "parties", "shall", "hereby", "clause", "payment", "term", "termination", "notice",
+         "liability", "confidential", "information", "services", "provider", "client", "effective", "date", "section",
+         "obligations", "governing", "law", "amount", "invoice", "days", "written", "consent", "breach", "the", "of",
+         "and", "to", "in", "any", "such", "this", "by", "with", "for", "or")
+
+
+def make_text(n_pages: int, rng: random.Random) -> str:
+    pages = []
+    for i in range(n_pages):
+        words = [rng.choice(WORDS) for _ in range(400)]
+        pages.append(f"Page {i + 1}. " + " ".join(words) + f" {rng.randint(1, 10_000)}.")
+    return "\n".join(pages)
+
+
+def measure(serialise, repeat: int) -> tuple:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_bytes = serialise()
+        best = min(best, time.perf_counter() - start)
+    return n_bytes, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload size and serialisation time of classify responses, by response shape")
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    result = {"file_class": "contract", "confidence": 0.97, "file_text": make_text(args.pages, rng)}
+    payloads = {
+        f"/classify-file, {args.pages} pages": result,
+        f"/classify-files, {args.files} x {args.pages} pages": {"results": [{"filename": f"{i}.pdf", **result} for i in range(args.files)]},
+    }
+
+    app = Flask(__name__)
+
+    for name, payload in payloads.items():
+        results = payload.get('results', [payload])
+        shapes = {
+            'full': payload,
+            'none': {**payload, "results": [{k: v for k, v in r.items() if k != 'file_text'} for r in results]} if 'results' in payload
+                    else {k: v for k, v in payload.items() if k != 'file_text'},
+            'truncated': {"results": [truncate_text(r, 2000) for r in results]} if 'results' in payload else truncate_text(payload, 2000),
+        }
+
+        print(f"\n{name}")
+        with app.app_context():
+            for shape, shaped in shapes.items():
+                n_bytes, seconds = measure(lambda: len(jsonify(shaped).get_data()), args.repeat)
+                print(f"{shape:<10} {n_bytes / 1024:>9.1f} kB  {seconds * 1000:>7.2f} ms")
+
+        for level in (1, 5, 9):
+            n_bytes, seconds = measure(lambda: sum(map(len, iter_gzip_json(payload, level=level))), args.repeat)
+            print(f"{'gzip-' + str(level):<10} {n_bytes / 1024:>9.1f} kB  {seconds * 1000:>7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
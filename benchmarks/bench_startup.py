@@ -0,0 +1,113 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.reporting import summarize_latencies
+
+"""
+Startup vs steady-state latency of the forward pass, by startup profile (see src/model/startup.py).
+
+Every variant runs in fresh processes - a warm-up, a trace or thread settings can't be undone within one:
+
+    cold    - loaded, used as it is: the first requests pay for the cold start,
+    warm    - warmed up at every TOKEN_LENGTH_BUCKETS length before the first request,
+    trace   - traced to TorchScript, then warmed up,
+    compile - torch.compile'd, then warmed up (with --compile only, it takes a while).
+
+A process loads the model, prepares it, then classifies --requests texts of mixed lengths one at a time, like
+single /classify-file requests would. 'ready' is the time from the start of loading to the first request,
+'first' the latency of the first request, 'p50'/'p99' the steady state over the rest.
+With --processes N, N processes run every variant at once, sharing the cores - once with the thread budget
+(cores // N threads each) and once, as 'unbudgeted', with torch's default of every core in every process.
+
+    python -m benchmarks.bench_startup --tiny
+    python -m benchmarks.bench_startup --model models/distilbert --processes 4 --compile
+"""
+
+TEXTS = [
+    "invoice number 1234 total amount due within 30 days",
+    "this agreement is made between the employer and the employee on the date below. " * 12,
+    "passport united kingdom of great britain surname given names nationality date of birth",
+    "driving licence full name address date of issue categories " * 30,
+]
+
+
+def run_child(args):
+    import torch
+
+    from src.model.backends import EagerBackend
+    from src.model.model_utils import classify_texts
+    from src.model.startup import StartupProfile, prepare_model
+
+    start = time.perf_counter()
+
+    if args.tiny:
+        from src.model.tiny_model import build_tiny_model_and_tokenizer
+        model, tokenizer = build_tiny_model_and_tokenizer()
+    else:
+        from src.model.model_preloader import load_model_from_snapshot
+        from transformers import DistilBertTokenizerFast
+        model = load_model_from_snapshot(args.model)
+        tokenizer = DistilBertTokenizerFast.from_pretrained(args.model, local_files_only=True)
+
+    device = torch.device('cpu')
+    backend = EagerBackend(model)
+    variant = args.child
+
+    if variant == 'unbudgeted':
+        report = {"threads": torch.get_num_threads()}
+    else:
+        profile = StartupProfile(processes=args.processes, optimization='none' if variant in ('cold', 'warm') else variant, warmup=variant != 'cold')
+        report = prepare_model(backend, tokenizer, device, profile)
+
+    ready = time.perf_counter() - start
+    latencies = []
+
+    for i in range(args.requests):
+        request_start = time.perf_counter()
+        classify_texts(backend, [TEXTS[i % len(TEXTS)]], tokenizer, device)
+        latencies.append(time.perf_counter() - request_start)
+
+    print(json.dumps({"threads": report["threads"], "ready_s": ready, "first_ms": latencies[0] * 1000, **summarize_latencies(latencies[1:])}))
+
+
+def run_variant(args, variant: str) -> list:
+    command = [sys.executable, '-m', 'benchmarks.bench_startup', '--child', variant, '--requests', str(args.requests), '--processes', str(args.processes)]
+    command += ['--tiny'] if args.tiny else ['--model', args.model]
+
+    processes = [subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) for _ in range(args.processes)]
+    return [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in processes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup vs steady-state latency of the forward pass, by startup profile")
+    parser.add_argument('--model', help="local model snapshot directory")
+    parser.add_argument('--tiny', action='store_true', help="tiny random model, works offline")
+    parser.add_argument('--processes', type=int, default=1, help="processes running at once, like gunicorn workers")
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--compile', action='store_true', help="also the torch.compile variant")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.tiny and not args.model:
+        raise SystemExit("Pass --model <snapshot directory> or --tiny")
+
+    if args.child:
+        run_child(args)
+        return
+
+    variants = ['cold', 'warm', 'trace'] + (['compile'] if args.compile else []) + (['unbudgeted'] if args.processes > 1 else [])
+    print(f"{'variant':<11} {'threads':>7} {'ready s':>8} {'first ms':>9} {'p50 ms':>7} {'p99 ms':>7}")
+
+    for variant in variants:
+        results = run_variant(args, variant)
+        # the slowest process, which is what the last worker to be ready serves with
+        worst = max(results, key=lambda result: result["p50_ms"])
+        print(f"{variant:<11} {worst['threads']:>7} {max(r['ready_s'] for r in results):>8.2f} {max(r['first_ms'] for r in results):>9.1f} "
+              f"{worst['p50_ms']:>7.1f} {worst['p99_ms']:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import time
+
+from benchmarks.bench_pdf_ocr import make_scanned_pdf
+from src.utils.text_extractor import extract_text_from_image, extract_text_from_pdf
+from src.utils.tiered_ocr import OcrPass, ocr_pass_context
+
+"""
+OCR time and text of the fast tier vs full resolution, see src/utils/tiered_ocr.py.
+
+Every document - a generated scanned PDF of --pages pages, and the images and scanned PDFs in --files-dir -
+is extracted at the full tier (what OCR did before) and under a fast tier pass. For the fast pass the table shows
+how many reads were kept and how many were too short and escalated; 'words' is the share of words of the full
+resolution text also found in the fast text, a rough measure of what the classifier loses.
+
+Escalations for low classifier confidence aren't simulated here: a document escalated that way costs
+its fast pass plus a full one, so the saving overall is about the fast saving minus the escalation rate
+(GET /ocr-tier-stats) times the full time. Needs Tesseract (tesserocr and tessdata, or the tesseract binary).
+
+    TESSDATA_PREFIX=/usr/share/tesseract-ocr/5/tessdata python -m benchmarks.bench_tiered_ocr --pages 5
+"""
+
+
+def load_documents(files_dir: str, n_pages: int) -> list:
+    documents = [(f"generated scan, {n_pages} pages", extract_text_from_pdf, make_scanned_pdf(n_pages))]
+
+    for filename in sorted(os.listdir(files_dir)):
+        with open(os.path.join(files_dir, filename), 'rb') as f:
+            file_bytes = f.read()
+
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+            documents.append((filename, extract_text_from_image, file_bytes))
+        elif filename.lower().endswith('.pdf'):
+            documents.append((filename, extract_text_from_pdf, file_bytes))
+
+    return documents
+
+
+def timed_extraction(extract, file_bytes: bytes, ocr_pass: OcrPass = None) -> tuple:
+    with ocr_pass_context(ocr_pass):
+        start = time.perf_counter()
+        # serial, so that the time is the CPU time of OCR rather than of a pool
+        text = extract(file_bytes, parallel_ocr=False) if extract is extract_text_from_pdf else extract(file_bytes)
+        return text, time.perf_counter() - start
+
+
+def word_recall(text: str, reference: str) -> float:
+    reference_words = set(reference.lower().split())
+
+    if not reference_words:
+        return 1.0
+
+    return len(reference_words & set(text.lower().split())) / len(reference_words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR time and text of the fast tier vs full resolution")
+    parser.add_argument('--files-dir', default='files')
+    parser.add_argument('--pages', type=int, default=5)
+    args = parser.parse_args()
+
+    total_full = total_fast = 0.0
+    print(f"{'document':<40} {'full s':>7} {'fast s':>7} {'kept':>5} {'short':>5} {'words':>6}")
+
+    for name, extract, file_bytes in load_documents(args.files_dir, args.pages):
+        full_text, full_seconds = timed_extraction(extract, file_bytes)
+        ocr_pass = OcrPass('fast')
+        fast_text, fast_seconds = timed_extraction(extract, file_bytes, ocr_pass)
+
+        # PDFs with a text layer aren't OCR'd at all
+        if not ocr_pass.reads['fast'] + ocr_pass.reads['full']:
+            continue
+
+        total_full += full_seconds
+        total_fast += fast_seconds
+        print(f"{name[:40]:<40} {full_seconds:>7.2f} {fast_seconds:>7.2f} {ocr_pass.fast_reads_kept:>5} {ocr_pass.short_escalations:>5} {word_recall(fast_text, full_text):>6.0%}")
+
+    if total_full:
+        print(f"\ntotal: full {total_full:.2f} s, fast tier {total_fast:.2f} s ({1 - total_fast / total_full:.0%} less)")
+
+
+if __name__ == '__main__':
+    main()
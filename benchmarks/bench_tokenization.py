@@ -0,0 +1,90 @@
+import argparse
+import itertools
+import time
+import torch
+
+from benchmarks.backend_parity import load_texts
+from src.model.model_utils import prepare_text, prepare_texts, prepare_texts_bucketed
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.settings.config import BATCH_MAX_SIZE, MODEL_NAME
+from transformers import DistilBertTokenizer, DistilBertTokenizerFast
+
+"""
+Tokenization throughput: the old path vs the Rust backend with length buckets.
+
+    old      - DistilBertTokenizer (pure python before transformers 5) called once per text, as prepare_text() used to,
+    fast     - prepare_text(), one text at a time through the cached Rust encoder,
+    bucketed - prepare_texts_bucketed() on batches of BATCH_MAX_SIZE texts.
+
+Texts are extracted from the files in files/. Also reports how many padding tokens a batch carries
+when padded to its longest member vs padded per length bucket.
+
+    python -m benchmarks.bench_tokenization                 # the real tokenizer, needs network or HF cache
+    python -m benchmarks.bench_tokenization --tiny          # tiny vocabulary, offline
+"""
+
+
+def throughput(fn, texts: list, rounds: int) -> float:
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        fn(texts)
+
+    return len(texts) * rounds / (time.perf_counter() - start)
+
+
+def batches(texts: list, batch_size: int):
+    iterator = iter(texts)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenization throughput of the old and the new prepare_text path")
+    parser.add_argument('--model', default=MODEL_NAME, help="Hugging Face model name or local snapshot directory")
+    parser.add_argument('--tiny', action='store_true', help="use the tiny model's vocabulary, works offline")
+    parser.add_argument('--files-dir', default='files')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=BATCH_MAX_SIZE)
+    args = parser.parse_args()
+
+    if args.tiny:
+        _, fast_tokenizer = build_tiny_model_and_tokenizer()
+        slow_tokenizer = DistilBertTokenizer.from_pretrained(fast_tokenizer.name_or_path)
+    else:
+        fast_tokenizer = DistilBertTokenizerFast.from_pretrained(args.model)
+        slow_tokenizer = DistilBertTokenizer.from_pretrained(args.model)
+
+    cpu = torch.device('cpu')
+    texts = list(load_texts(args.files_dir).values())
+    texts = (texts * (args.batch_size * 2 // max(len(texts), 1) + 1))[:args.batch_size * 2]
+
+    def old(texts):
+        for text in texts:
+            slow_tokenizer(text, truncation=True, padding=True, return_tensors='pt')
+
+    def fast(texts):
+        for text in texts:
+            prepare_text(text, fast_tokenizer, cpu)
+
+    def bucketed(texts):
+        for batch in batches(texts, args.batch_size):
+            prepare_texts_bucketed(batch, fast_tokenizer, cpu)
+
+    print(f"{len(texts)} texts, {args.rounds} rounds, old tokenizer: {type(slow_tokenizer).__name__} (fast: {slow_tokenizer.is_fast})\n")
+
+    results = {name: throughput(fn, texts, args.rounds) for name, fn in (('old', old), ('fast', fast), ('bucketed', bucketed))}
+    for name, texts_per_sec in results.items():
+        print(f"{name:<9} {texts_per_sec:>10.1f} texts/s  {texts_per_sec / results['old']:>6.2f}x")
+
+    padded = sum(prepare_texts(batch, fast_tokenizer, cpu)['input_ids'].numel() for batch in batches(texts, args.batch_size))
+    bucket_padded = sum(
+        prepared['input_ids'].numel()
+        for batch in batches(texts, args.batch_size)
+        for _, prepared in prepare_texts_bucketed(batch, fast_tokenizer, cpu)
+    )
+    print(f"\ntoken slots per batch, padded to longest: {padded}, padded per bucket: {bucket_padded} ({1 - bucket_padded / padded:.1%} fewer)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import multiprocessing
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.utils import text_extractor
+from src.utils.intake import open_upload
+from src.utils.text_extractor import extract_text
+from werkzeug.datastructures import FileStorage
+
+"""
+Extraction from large uploads spooled to disk: read into bytes (as before open_upload()) vs memory-mapped.
+
+--uploads PDFs of --pages text pages each are extracted at the same time, as by concurrent requests,
+in full or lazily (?text=none, only the first pages are needed). A bytes copy of an upload is private,
+anonymous memory of the worker; a mapping is page cache, paged in only where the extractor reads and shared
+with the kernel. The peak of anonymous RSS (RssAnon) is sampled every few milliseconds while extracting.
+
+    python -m benchmarks.bench_upload_intake --uploads 4 --pages 2000
+"""
+
+
+def make_pdf(n_pages: int) -> bytes:
+    import pymupdf
+
+    pdf_doc = pymupdf.open()
+    for i in range(n_pages):
+        page = pdf_doc.new_page()
+        for line in range(40):
+            page.insert_text((40, 40 + line * 18), f"Page {i} line {line}: invoice total amount due, payment terms 30 days.")
+
+    # uncompressed, so that the upload is as large as such scans and exports usually are
+    pdf_bytes = pdf_doc.tobytes(garbage=0, deflate=False)
+    pdf_doc.close()
+    return pdf_bytes
+
+
+def _rss_anon_kb() -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1])
+
+
+def _spool(pdf_bytes: bytes) -> FileStorage:
+    stream = tempfile.TemporaryFile()
+    stream.write(pdf_bytes)
+    stream.seek(0)
+    return FileStorage(stream=stream, filename='upload.pdf')
+
+
+def run_variant(variant: str, pdf_bytes: bytes, n_uploads: int, lazy: bool, result: dict):
+    text_extractor.OCR_PARALLEL = False
+    min_bytes = 0 if variant == 'mmap' else float('inf')
+    text_extractor.open_upload = partial(open_upload, mmap_min_bytes=min_bytes)
+    tokenizer = build_tiny_model_and_tokenizer()[1] if lazy else None # only its vocabulary matters here
+
+    files = [_spool(pdf_bytes) for _ in range(n_uploads)]
+    del pdf_bytes
+
+    baseline_kb = _rss_anon_kb()
+    peak_kb = baseline_kb
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak_kb
+        while not done.is_set():
+            peak_kb = max(peak_kb, _rss_anon_kb())
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_uploads) as pool:
+        texts = list(pool.map(partial(extract_text, tokenizer=tokenizer), files))
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    sampler.join()
+
+    result[variant] = {"seconds": elapsed, "peak_anon_growth_mb": (peak_kb - baseline_kb) / 1024, "chars": sum(map(len, texts))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker memory of extraction from large uploads, read vs memory-mapped")
+    parser.add_argument('--uploads', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+
+    pdf_bytes = make_pdf(args.pages)
+    print(f"{args.uploads} concurrent uploads of {len(pdf_bytes) / 1e6:.1f} MB")
+
+    context = multiprocessing.get_context('spawn')
+
+    for lazy in (False, True):
+        with context.Manager() as manager:
+            result = manager.dict()
+
+            for variant in ('read', 'mmap'):
+                process = context.Process(target=run_variant, args=(variant, pdf_bytes, args.uploads, lazy, result))
+                process.start()
+                process.join()
+
+            result = dict(result)
+
+        print(f"\n{'lazy (text=none)' if lazy else 'full'}")
+        for variant, stats in result.items():
+            print(f"{variant:<5} {stats['seconds']:>7.2f} s  peak RssAnon +{stats['peak_anon_growth_mb']:.1f} MB  {stats['chars']} chars")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import json
+
+"""
+Compares two JSON results of the same benchmark (micro or load_test), e.g. saved on two commits:
+
+    python -m benchmarks.compare results/micro-main.json results/micro-branch.json
+
+Prints the old and the new value of every latency percentile and throughput, and the relative change.
+"""
+
+METRICS = ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def rows(report: dict) -> dict:
+    results = report["results"]
+
+    if report["benchmark"] == 'load_test':
+        return {
+            f"concurrency {level['concurrency']}": {**level["latency"], "throughput_rps": level["throughput_rps"]}
+            for level in results["levels"]
+        }
+
+    return {name: result["summary"] for name, result in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    if old["benchmark"] != new["benchmark"]:
+        raise SystemExit(f"Can't compare {old['benchmark']} with {new['benchmark']} results")
+
+    print(f"{old['benchmark']}: {old['git_revision']} -> {new['git_revision']}\n")
+
+    old_rows, new_rows = rows(old), rows(new)
+    for name in [name for name in old_rows if name in new_rows]:
+        print(name)
+
+        for metric in (*METRICS, 'throughput_rps'):
+            before, after = old_rows[name].get(metric), new_rows[name].get(metric)
+
+            if before is None or after is None:
+                continue
+
+            change = f"{(after - before) / before:+.1%}" if before else '-'
+            print(f"    {metric:<15} {before:>10.2f} {after:>10.2f}  {change}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import itertools
+import logging
+import os
+import random
+import requests
+import socket
+import tempfile
+import threading
+import time
+
+from benchmarks.reporting import save_results, summarize_latencies
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+End-to-end load test of /classify-file.
+
+Sends a mix of the files in files/ at given concurrency levels and reports, per level,
+p50/p95/p99 latency, throughput and response status counts. Every level sends --requests
+requests after --warmup requests that are not measured.
+
+By default the app is started in this process - the Flask app on a threaded werkzeug server, or with --app asgi
+the async app on uvicorn - with the tiny random model saved as a local snapshot, so the test runs offline.
+The result cache and the near-duplicate index are disabled (CACHE_ENABLED=0, NEAR_DUPLICATE_ENABLED=0), otherwise
+every file after the first round would be a cache hit or reuse the label of its first round instead of running inference.
+Point --url at a running server to test that instead, e.g. gunicorn started with CACHE_ENABLED=0 NEAR_DUPLICATE_ENABLED=0.
+
+Files that need OCR fail with 400 where Tesseract isn't installed, limit the mix with --types then.
+
+    python -m benchmarks.load_test --concurrency 1 4 16 --output results/load.json
+    python -m benchmarks.load_test --app asgi --types pdf txt docx
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --model-path models/distilbert
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(app_kind: str, model_path: str = None) -> str:
+    """
+    Starts the app in a background thread and returns its base URL.
+    Settings are read from the environment on import, so nothing from src is imported before this is called.
+    """
+    os.environ['CACHE_ENABLED'] = '0'
+    os.environ['NEAR_DUPLICATE_ENABLED'] = '0'
+    os.environ['MODEL_PATH'] = model_path or tempfile.mkdtemp(prefix='tiny-snapshot-')
+
+    if not model_path:
+        from src.model.tiny_model import build_tiny_model_and_tokenizer
+        build_tiny_model_and_tokenizer(save_dir=os.environ['MODEL_PATH'])
+
+    port = free_port()
+
+    if app_kind == 'asgi':
+        import uvicorn
+        from src.asgi_app import app
+
+        server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+        threading.Thread(target=server.run, daemon=True).start()
+
+        while not server.started:
+            time.sleep(0.05)
+    else:
+        from src.app import app
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING) # no access log line per request
+        server = make_server('127.0.0.1', port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{port}"
+
+
+def load_mix(files_dir: str, types: list, seed: int) -> list:
+    from src.settings.config import ALLOWED_MIME_TYPES
+
+    mix = []
+    for filename in sorted(os.listdir(files_dir)):
+        ext = filename.rsplit('.', 1)[-1].lower()
+
+        if ext in ALLOWED_MIME_TYPES and (not types or ext in types):
+            with open(os.path.join(files_dir, filename), 'rb') as f:
+                mix.append((filename, f.read(), ALLOWED_MIME_TYPES[ext]))
+
+    random.Random(seed).shuffle(mix)
+    return mix
+
+
+def run_level(url: str, mix: list, concurrency: int, n_requests: int, warmup: int) -> dict:
+    files = itertools.cycle(mix)
+    files_lock = threading.Lock()
+    local = threading.local()
+
+    def send() -> tuple:
+        with files_lock:
+            filename, file_bytes, mimetype = next(files)
+
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+
+        start = time.perf_counter()
+        try:
+            status = local.session.post(f"{url}/classify-file", files={'file': (filename, file_bytes, mimetype)}).status_code
+        except requests.RequestException:
+            status = 'connection_error'
+
+        return time.perf_counter() - start, status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: send(), range(warmup)))
+
+        start = time.perf_counter()
+        responses = list(pool.map(lambda _: send(), range(n_requests)))
+        duration = time.perf_counter() - start
+
+    statuses = {}
+    for _, status in responses:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "duration_s": duration,
+        "throughput_rps": n_requests / duration,
+        "statuses": statuses,
+        "latency": summarize_latencies([latency for latency, _ in responses]),
+        "latency_ok": summarize_latencies([latency for latency, status in responses if status == 200]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of /classify-file: latency percentiles and throughput at given concurrency levels")
+    parser.add_argument('--url', help="base URL of a running server, by default the app is started in this process")
+    parser.add_argument('--app', default='flask', choices=('flask', 'asgi'), help="app started in this process")
+    parser.add_argument('--model-path', help="local snapshot for the app started in this process, the tiny model by default")
+    parser.add_argument('--files-dir', default='files')
+    parser.add_argument('--types', nargs='+', help="file extensions in the mix, all allowed types by default")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=200, help="measured requests per concurrency level")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0, help="seed of the order of files in the mix")
+    parser.add_argument('--output', help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    url = args.url or start_server(args.app, args.model_path)
+    mix = load_mix(args.files_dir, args.types, args.seed)
+
+    if not mix:
+        raise SystemExit(f"No files to send in {args.files_dir}")
+
+    print(f"{len(mix)} files in the mix, target: {url}\n")
+    print(f"{'concurrency':>11} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+
+    results = []
+    for concurrency in args.concurrency:
+        result = run_level(url, mix, concurrency, args.requests, args.warmup)
+        latency = result["latency"]
+        results.append(result)
+
+        print(f"{concurrency:>11} {result['throughput_rps']:>8.1f} {latency['p50_ms']:>9.1f} {latency['p95_ms']:>9.1f} {latency['p99_ms']:>9.1f}  {result['statuses']}")
+
+    if args.output:
+        save_results(args.output, 'load_test', vars(args), {"levels": results, "files": [filename for filename, _, _ in mix]})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import os
+import time
+import torch
+
+from benchmarks.reporting import save_results, summarize_latencies
+from src.model.model_utils import classify_text, prepare_text
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.settings.config import ALLOWED_IMAGE_EXTENSIONS, MODEL_NAME
+from src.utils.text_extractor import extract_text_from_docx, extract_text_from_image, extract_text_from_pdf
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Callable, Dict, List
+
+"""
+Micro-benchmarks of the pipeline's building blocks, on the files in files/:
+
+    extract_text_from_pdf    - every .pdf (serial OCR, so the number is about one process),
+    extract_text_from_docx   - every .docx,
+    extract_text_from_image  - every image, needs Tesseract,
+    prepare_text             - text of every file that has any,
+    classify_text            - the forward pass on every prepared text.
+
+Every call is repeated --repeat times after one warm-up call. A function whose input fails
+(e.g. no Tesseract installed) is reported as skipped with the error, the rest still runs.
+
+    python -m benchmarks.micro --tiny --output results/micro.json     # tiny random model, offline
+    python -m benchmarks.micro --model models/distilbert               # a local snapshot
+"""
+
+
+def time_calls(fn: Callable, inputs: Dict[str, object], repeat: int) -> dict:
+    per_input = {}
+    latencies = []
+    skipped = {}
+    outputs = {}
+
+    for name, value in inputs.items():
+        try:
+            outputs[name] = fn(value) # warm-up, and the output
+        except Exception as e:
+            skipped[name] = f"{type(e).__name__}: {e}"
+            continue
+
+        input_latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(value)
+            input_latencies.append(time.perf_counter() - start)
+
+        per_input[name] = summarize_latencies(input_latencies)["mean_ms"]
+        latencies.extend(input_latencies)
+
+    return {"summary": summarize_latencies(latencies), "per_input_mean_ms": per_input, "skipped": skipped, "outputs": outputs}
+
+
+def read_files(files_dir: str, extensions: tuple) -> Dict[str, bytes]:
+    files = {}
+
+    for filename in sorted(os.listdir(files_dir)):
+        if filename.lower().endswith(extensions):
+            with open(os.path.join(files_dir, filename), 'rb') as f:
+                files[filename] = f.read()
+
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of text extraction, tokenization and the forward pass")
+    parser.add_argument('--model', default=MODEL_NAME, help="Hugging Face model name or local snapshot directory")
+    parser.add_argument('--tiny', action='store_true', help="use a tiny randomly initialised model, works offline")
+    parser.add_argument('--files-dir', default='files')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.tiny:
+        model, tokenizer = build_tiny_model_and_tokenizer()
+    else:
+        model = DistilBertForSequenceClassification.from_pretrained(args.model).eval()
+        tokenizer = DistilBertTokenizerFast.from_pretrained(args.model)
+
+    cpu = torch.device('cpu')
+    results = {}
+
+    extractors: List[tuple] = [
+        ('extract_text_from_pdf', lambda file_bytes: extract_text_from_pdf(file_bytes, parallel_ocr=False), ('.pdf',)),
+        ('extract_text_from_docx', extract_text_from_docx, ('.docx',)),
+        ('extract_text_from_image', extract_text_from_image, ALLOWED_IMAGE_EXTENSIONS),
+    ]
+
+    texts = {}
+    for name, fn, extensions in extractors:
+        results[name] = time_calls(fn, read_files(args.files_dir, extensions), args.repeat)
+        texts.update({filename: text for filename, text in results[name].pop("outputs").items() if text})
+
+    for filename, file_bytes in read_files(args.files_dir, ('.txt',)).items():
+        texts[filename] = file_bytes.decode('utf-8', errors='ignore').strip()
+
+    results['prepare_text'] = time_calls(lambda text: prepare_text(text, tokenizer, cpu), texts, args.repeat)
+    prepared_texts = results['prepare_text'].pop("outputs")
+    results['classify_text'] = time_calls(lambda prepared_text: classify_text(model, prepared_text), prepared_texts, args.repeat)
+    results['classify_text'].pop("outputs")
+
+    print(f"{'function':<25} {'calls':>6} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'skipped':>8}")
+    for name, result in results.items():
+        summary = result["summary"]
+
+        if not summary["count"]:
+            print(f"{name:<25} {0:>6} {'-':>10} {'-':>10} {'-':>10} {len(result['skipped']):>8}")
+            continue
+
+        print(f"{name:<25} {summary['count']:>6} {summary['mean_ms']:>10.2f} {summary['p50_ms']:>10.2f} {summary['p95_ms']:>10.2f} {len(result['skipped']):>8}")
+
+    for name, result in results.items():
+        for filename, error in result["skipped"].items():
+            print(f"skipped {name}({filename}): {error}")
+
+    if args.output:
+        save_results(args.output, 'micro', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
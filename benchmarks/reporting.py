@@ -0,0 +1,76 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import torch
+
+from typing import Dict, List
+
+"""
+Shared by the benchmarks that save JSON results (micro, load_test): latency summaries and
+the metadata needed to compare results across commits - git revision, machine and library versions.
+"""
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile, q in 0-100.
+    """
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarizes latencies given in seconds, in milliseconds.
+    """
+    if not latencies:
+        return {"count": 0}
+
+    return {
+        "count": len(latencies),
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return f"{revision}-dirty" if dirty else revision
+
+
+def run_metadata() -> Dict[str, object]:
+    return {
+        "git_revision": git_revision(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+    }
+
+
+def save_results(path: str, benchmark: str, args: Dict[str, object], results: Dict[str, object]):
+    """
+    Writes results together with run metadata and the arguments of the run, so that two files can be compared.
+    """
+    report = {"benchmark": benchmark, **run_metadata(), "args": args, "results": results}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nResults saved to {path}")
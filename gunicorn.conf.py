@@ -0,0 +1,51 @@
+import os
+
+from src.model.startup import prepare_model, startup_profile
+from src.settings.config import REQUEST_THREADS
+from src.utils.metrics import mark_process_dead, reset_metrics_dir
+from src.utils.process_stats import get_memory_usage
+
+"""
+Gunicorn settings, used by the dockerfile: gunicorn -c gunicorn.conf.py run:app
+
+preload_app loads the app - and with it the model - once in the master, before workers are forked.
+With MODEL_PATH set, weights are memory-mapped from the snapshot, so all workers share the same
+pages instead of loading 260MB each. Memory of every worker is logged once it's ready - compare
+rss_anon_mb (private) with rss_file_mb (shared model pages).
+
+Workers share the cores (CPU_CORE_BUDGET) for forward passes, and each warms the model up
+after it's forked, before it takes requests - see src/model/startup.py. With MODEL_REGISTRY_DIR set,
+every worker swaps in new model versions itself, without a restart - see src/model/registry.py.
+
+With METRICS_DIR set, workers write metrics to files in that directory and /metrics sums them up.
+Files of a previous run are removed here, before the app is preloaded.
+"""
+
+reset_metrics_dir()
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+threads = REQUEST_THREADS # concurrent requests of one worker share a forward pass, see src/model/batching.py
+preload_app = True
+
+startup_profile.processes = workers
+startup_profile.after_fork = True
+
+
+def when_ready(server):
+    server.log.info(f"Master ready, memory: {get_memory_usage()}")
+
+
+def post_worker_init(worker):
+    from src.app import model_registry # preloaded in the master
+
+    served = model_registry.active
+
+    if served.model is not None:
+        prepare_model(served.model, served.tokenizer, served.device, startup_profile)
+
+    worker.log.info(f"Worker {worker.pid} ready, memory: {get_memory_usage()}")
+
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
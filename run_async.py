@@ -0,0 +1,13 @@
+import os
+import uvicorn
+
+from src.settings.config import ASYNC_WORKERS
+
+if __name__ == "__main__":
+    """
+    Async counterpart of run.py, see src/asgi_app.py.
+    Same port as run.py, so only one of them can be running at a time.
+    """
+    # every worker loads its own model - they share the cores, see src/model/startup.py
+    os.environ.setdefault('WEB_CONCURRENCY', str(ASYNC_WORKERS))
+    uvicorn.run("src.asgi_app:app", host="127.0.0.1", port=5001, workers=ASYNC_WORKERS)
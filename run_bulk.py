@@ -0,0 +1,30 @@
+import argparse
+import signal
+
+from src.model.registry import ModelRegistry
+from src.settings.config import BULK_WORKERS, TEXT_MODES
+from src.utils.bulk import BulkClassifier
+
+if __name__ == "__main__":
+    """
+    Classifies every file of a directory tree into a JSONL file, without the app, see src/utils/bulk.py.
+    Run it again with the same --output to resume after a crash or Ctrl+C / SIGTERM, which stop it
+    after the files in flight are written. The whole run is classified by the model version active when it starts.
+    """
+    parser = argparse.ArgumentParser(description="Classify every file of a directory tree into a JSONL file")
+    parser.add_argument('root', help="directory to classify, walked recursively")
+    parser.add_argument('--output', required=True, help="JSONL file results are appended to, and resumed from")
+    parser.add_argument('--text', choices=TEXT_MODES, default='none', help="'full' also writes the extracted text of every file")
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS, help="extraction processes")
+    parser.add_argument('--retry-errors', action='store_true', help="try files that failed in an earlier run again")
+    args = parser.parse_args()
+
+    served = ModelRegistry().active
+    print(f"Model version: {served.version}")
+    bulk = BulkClassifier(served.model, served.tokenizer, served.device, text_mode=args.text, workers=args.workers)
+
+    signal.signal(signal.SIGINT, lambda *_: bulk.stop())
+    signal.signal(signal.SIGTERM, lambda *_: bulk.stop())
+
+    summary = bulk.run(args.root, args.output, retry_errors=args.retry_errors)
+    print(f"Done: {summary}")
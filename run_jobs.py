@@ -0,0 +1,37 @@
+import signal
+import threading
+
+from src.model.registry import ModelRegistry
+from src.settings.config import JOBS_WORKERS
+from src.utils.job_queue import get_job_queue
+from src.utils.job_worker import JobWorkerPool, process_job
+from src.utils.result_cache import get_result_cache
+
+if __name__ == "__main__":
+    """
+    Worker pool processing jobs submitted to /jobs, see src/utils/job_worker.py.
+    Runs next to run.py (or gunicorn) and shares the job database with it (JOBS_DB_PATH). Stops on Ctrl+C / SIGTERM,
+    after the jobs being processed are done. Swaps model versions like the app does, see src/model/registry.py.
+    """
+    model_registry = ModelRegistry()
+    result_cache = get_result_cache()
+    job_queue = get_job_queue()
+
+    def process(job):
+        with model_registry.use() as served:
+            return process_job(job, served.model, served.tokenizer, served.device, result_cache=result_cache, model_version=served.version)
+
+    pool = JobWorkerPool(job_queue, process)
+    pool.start()
+    print(f"{JOBS_WORKERS} job workers started, queue: {job_queue.db_path}")
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+
+    print("Stopping job workers")
+    pool.stop()
@@ -1,36 +1,390 @@
-from flask import Flask, request, jsonify
+from contextlib import contextmanager
+from flask import Flask, Response, request, jsonify
 
-from src.model.model_preloader import load_model_and_tokenizer
+from src.model.registry import ModelRegistry, ModelVersion, serve_with_model
+from src.settings.config import MAX_REQUEST_BYTES
 
-from src.utils.classifier import classify_file
+from src.utils.admission import estimate_cost, get_admission_controller
+from src.utils.classifier import cascade_report, classify_file, classify_files
 from src.utils.error_interceptor import error_interceptor
-from src.utils.text_extractor import extract_text
-from src.utils.validators import validate_model_state, get_and_validate_uploaded_file, validate_file_text
+from src.utils.job_queue import QueueFullError, get_job_queue
+from src.utils.metrics import render_metrics, time_stage, track_request
+from src.utils.near_duplicates import get_near_duplicate_index
+from src.utils.response_shaping import iter_gzip_json, should_compress, truncate_text
+from src.utils.result_cache import get_result_cache, make_cache_key
+from src.utils.text_extractor import extract_text, extract_texts
+from src.utils.tiered_ocr import new_ocr_pass, ocr_tier_stats, review_ocr_pass
+from src.utils.validators import (
+    ValidationError,
+    validate_model_state,
+    get_and_validate_uploaded_file,
+    get_and_validate_uploaded_files,
+    get_and_validate_text_mode,
+    get_and_validate_text_max_chars,
+    validate_uploaded_file,
+    validate_file_text,
+    validate_request_size,
+)
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
-pretrained_model, tokenizer, device = load_model_and_tokenizer()
+model_registry = ModelRegistry()
+result_cache = get_result_cache()
+job_queue = get_job_queue()
+admission = get_admission_controller()
+
+def get_cached_result(cache_key: str, text_mode: str) -> dict:
+    """
+    Returns the cached result for cache_key, if it holds everything the request asks for.
+
+    :param cache_key: Cache key of the uploaded file, None if caching is disabled
+    :type cache_key: str
+    :param text_mode: Text mode of the request
+    :type text_mode: str
+    :return: Cached result or None
+    :rtype: dict
+    """
+    return result_cache.get_for_text_mode(cache_key, text_mode) if cache_key else None
+
+def shaped_response(payload: dict) -> Response:
+    """
+    JSON response of a classify route, gzipped and streamed if the client accepts it
+    and it carries enough text, see src/utils/response_shaping.py
+
+    :param payload: Response body, with file_text already truncated if the client asked for it
+    :type payload: dict
+    :return: Response object
+    :rtype: flask.Response
+    """
+    if should_compress(payload, request.headers.get('Accept-Encoding')):
+        response = Response(iter_gzip_json(payload), mimetype='application/json', headers={'Content-Encoding': 'gzip'})
+    else:
+        response = jsonify(payload)
+
+    response.vary.add('Accept-Encoding')
+    return response
+
+@contextmanager
+def admitted(files: list, text_mode: str):
+    """
+    Holds the extraction of files within the admission budgets of this worker, see src/utils/admission.py.
+    Raises OverloadedError (503) if the request has to be shed.
+
+    :param files: Validated uploads about to be extracted
+    :type files: list
+    :param text_mode: Text mode of the request
+    :type text_mode: str
+    """
+    if not admission:
+        yield
+        return
+
+    with time_stage('estimate_cost'):
+        cost = estimate_cost(files, lazy=text_mode == 'none')
+
+    with admission.admit(cost):
+        yield
+
+def reread_unsure(files: list, file_texts: list, predictions: list, ocr_passes: list, text_mode: str, served: ModelVersion) -> tuple:
+    """
+    Reads files again at full resolution whose text, read by fast OCR, left the classifier unsure,
+    and classifies them again, see review_ocr_pass().
+
+    :param files: Extracted uploads
+    :type files: list
+    :param file_texts: Text of every file
+    :type file_texts: list
+    :param predictions: (label, confidence) of every file
+    :type predictions: list
+    :param ocr_passes: Tiered OCR pass every file was extracted with
+    :type ocr_passes: list
+    :param text_mode: Text mode of the request
+    :type text_mode: str
+    :param served: Model version serving the request
+    :type served: ModelVersion
+    :return: A tuple consisting of: texts and predictions, with those of files read again replaced
+    :rtype: tuple
+    """
+    unsure = []
+    for i, (ocr_pass, (_, confidence)) in enumerate(zip(ocr_passes, predictions)):
+        full_pass = review_ocr_pass(ocr_pass, confidence)
+
+        if full_pass:
+            unsure.append((i, full_pass))
+
+    if not unsure:
+        return file_texts, predictions
+
+    with admitted([files[i] for i, _ in unsure], text_mode):
+        reread_texts = extract_texts([files[i] for i, _ in unsure], tokenizer=served.tokenizer if text_mode == 'none' else None, ocr_passes=[full_pass for _, full_pass in unsure])
+
+    reread_predictions = classify_files(reread_texts, served.model, tokenizer=served.tokenizer, device=served.device)
+    file_texts, predictions = list(file_texts), list(predictions)
+
+    for (i, full_pass), file_text, prediction in zip(unsure, reread_texts, reread_predictions):
+        review_ocr_pass(full_pass, prediction[1])
+
+        # a full read that fails doesn't throw away the fast one
+        if file_text:
+            file_texts[i], predictions[i] = file_text, prediction
+
+    return file_texts, predictions
 
 @app.route('/classify-file', methods=['POST'])
+@track_request('classify-file')
 @error_interceptor
-def classify_file_route():
+@serve_with_model(model_registry)
+def classify_file_route(served: ModelVersion):
     """
-    Classifies a file uploaded via POST request.
+    Classifies a file uploaded via POST request, with the model version active when the request came in.
 
-    :return: JSON response with classification results or error message.
+    :return: JSON response with classification results and the model version, or error message.
     """
     # could be done with pydantic as well
-    validate_model_state(pretrained_model, tokenizer, device)
+    validate_model_state(served.model, served.tokenizer, served.device)
 
-    file = get_and_validate_uploaded_file(request)
+    with time_stage('validate'):
+        validate_request_size(request.content_length)
+        file = get_and_validate_uploaded_file(request)
+        text_mode = get_and_validate_text_mode(request)
+        text_max_chars = get_and_validate_text_max_chars(request)
 
-    file_text = extract_text(file)
+    # same bytes + same model version = same result, no need to extract and classify again
+    with time_stage('cache_lookup'):
+        cache_key = make_cache_key(file, served.version) if result_cache else None
+        cached_result = get_cached_result(cache_key, text_mode)
+
+    if cached_result:
+        return shaped_response(truncate_text({**cached_result, "model_version": served.version}, text_max_chars)), 200
+
+    ocr_pass = new_ocr_pass(text_mode)
+
+    # without file_text in the response, there's no point in extracting more text than the model can take in
+    with admitted([file], text_mode):
+        file_text = extract_text(file, tokenizer=served.tokenizer if text_mode == 'none' else None, ocr_pass=ocr_pass)
     validate_file_text(file_text)
     
-    file_class, confidence = classify_file(file_text, pretrained_model, tokenizer=tokenizer, device=device)
+    file_class, confidence = classify_file(file_text, served.model, tokenizer=served.tokenizer, device=served.device)
+    full_pass = review_ocr_pass(ocr_pass, confidence)
+
+    # text read by fast OCR left the classifier unsure, the file is read again at full resolution
+    if full_pass:
+        with admitted([file], text_mode):
+            file_text = extract_text(file, tokenizer=served.tokenizer if text_mode == 'none' else None, ocr_pass=full_pass) or file_text
+
+        file_class, confidence = classify_file(file_text, served.model, tokenizer=served.tokenizer, device=served.device)
+        review_ocr_pass(full_pass, confidence)
     
     if all([file_text, file_class, confidence]):
-        return jsonify({"file_class": file_class, "confidence": confidence, "file_text": file_text}), 200
+        result = {"file_class": file_class, "confidence": confidence}
+
+        if text_mode == 'full':
+            result["file_text"] = file_text
+
+        if cache_key:
+            result_cache.put(cache_key, result)
+
+        return shaped_response(truncate_text({**result, "model_version": served.version}, text_max_chars)), 200
     
     return jsonify({"error": "Unable to classify document."}), 400
 
+@app.route('/classify-files', methods=['POST'])
+@track_request('classify-files')
+@error_interceptor
+@serve_with_model(model_registry)
+def classify_files_route(served: ModelVersion):
+    """
+    Classifies many files uploaded via a single POST request, under the 'files' form-data key.
+    Text is extracted from files in parallel and all texts are classified in a batch.
+
+    Every file gets its own entry in the results, in upload order - either a classification or an error,
+    so one failed file doesn't fail the whole batch. All files are classified by the same model version.
+
+    :return: JSON response with per-file classification results and the model version, or error message.
+    """
+    validate_model_state(served.model, served.tokenizer, served.device)
+
+    with time_stage('validate'):
+        validate_request_size(request.content_length)
+        files = get_and_validate_uploaded_files(request)
+        text_mode = get_and_validate_text_mode(request)
+        text_max_chars = get_and_validate_text_max_chars(request)
+
+    results = [{"filename": file.filename} for file in files]
+
+    valid = []
+    for result, file in zip(results, files):
+        try:
+            with time_stage('validate'):
+                validate_uploaded_file(file)
+        except ValidationError as e:
+            result["error"] = str(e)
+            continue
+
+        with time_stage('cache_lookup'):
+            cache_key = make_cache_key(file, served.version) if result_cache else None
+            cached_result = get_cached_result(cache_key, text_mode)
+
+        if cached_result:
+            result.update(cached_result)
+        else:
+            valid.append((result, file, cache_key))
+
+    ocr_passes = [new_ocr_pass(text_mode) for _ in valid]
+
+    with admitted([file for _, file, _ in valid], text_mode):
+        file_texts = extract_texts([file for _, file, _ in valid], tokenizer=served.tokenizer if text_mode == 'none' else None, ocr_passes=ocr_passes)
+
+    extracted = []
+    for (result, file, cache_key), file_text, ocr_pass in zip(valid, file_texts, ocr_passes):
+        try:
+            validate_file_text(file_text)
+            extracted.append((result, file, cache_key, file_text, ocr_pass))
+        except ValidationError as e:
+            result["error"] = str(e)
+
+    file_texts = [file_text for _, _, _, file_text, _ in extracted]
+    predictions = classify_files(file_texts, served.model, tokenizer=served.tokenizer, device=served.device)
+    file_texts, predictions = reread_unsure([file for _, file, _, _, _ in extracted], file_texts, predictions, [ocr_pass for *_, ocr_pass in extracted], text_mode, served)
+
+    for (result, _, cache_key, _, _), file_text, (file_class, confidence) in zip(extracted, file_texts, predictions):
+        if all([file_text, file_class, confidence]):
+            file_result = {"file_class": file_class, "confidence": confidence}
+
+            if text_mode == 'full':
+                file_result["file_text"] = file_text
+
+            result.update(file_result)
+
+            if cache_key:
+                result_cache.put(cache_key, file_result)
+        else:
+            result["error"] = "Unable to classify document."
+
+    return shaped_response({"results": [truncate_text(result, text_max_chars) for result in results], "model_version": served.version}), 200
+
+@app.route('/jobs', methods=['POST'])
+@track_request('jobs')
+@error_interceptor
+def submit_job_route():
+    """
+    Queues a file uploaded via POST request for classification by the job workers (run_jobs.py).
+    Meant for large documents, e.g. long scans, that would otherwise keep the request open for as long as OCR takes.
+
+    :return: JSON response with the job ID, or error message. 503 with Retry-After if the queue is full.
+    """
+    with time_stage('validate'):
+        validate_request_size(request.content_length)
+        file = get_and_validate_uploaded_file(request)
+        text_mode = get_and_validate_text_mode(request)
+
+    try:
+        job_id = job_queue.submit(file.read(), file.filename, file.mimetype, text_mode)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+
+    return jsonify({"job_id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@error_interceptor
+def job_status_route(job_id: str):
+    """
+    Reports the status of a job, and its result (same as a /classify-file response) once it's done.
+
+    :return: JSON response with the job status, 404 if there's no such job or it has expired.
+    """
+    job = job_queue.get(job_id)
+
+    if job is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+
+    return jsonify(job), 200
+
+@app.route('/job-stats', methods=['GET'])
+def job_stats_route():
+    """
+    Reports the number of jobs in every status and the queue depth.
+
+    :return: JSON response with job queue statistics.
+    """
+    return jsonify(job_queue.stats()), 200
+
+@app.route('/admission-stats', methods=['GET'])
+def admission_stats_route():
+    """
+    Reports budgets in use, queue depths and shed requests of admission control in this worker process.
+
+    :return: JSON response with admission statistics.
+    """
+    if not admission:
+        return jsonify({"enabled": False}), 200
+
+    return jsonify({"enabled": True, **admission.stats()}), 200
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats_route():
+    """
+    Reports hit/miss counters of the result cache of this worker process.
+
+    :return: JSON response with cache statistics.
+    """
+    if not result_cache:
+        return jsonify({"enabled": False}), 200
+
+    return jsonify({"enabled": True, **result_cache.stats()}), 200
+
+@app.route('/cascade-stats', methods=['GET'])
+def cascade_stats_route():
+    """
+    Reports early exits of the lexical pre-classifier in this worker process, its agreement with the transformer
+    and the CPU time it saved, see src/utils/classifier.py.
+
+    :return: JSON response with cascade statistics.
+    """
+    served = model_registry.active
+    return jsonify(cascade_report(served.model, served.tokenizer, served.device)), 200
+
+@app.route('/near-duplicate-stats', methods=['GET'])
+def near_duplicate_stats_route():
+    """
+    Reports lookups, hits and evictions of the near-duplicate index of the served model version in this worker
+    process, see src/utils/near_duplicates.py.
+
+    :return: JSON response with near-duplicate index statistics.
+    """
+    index = get_near_duplicate_index(model_registry.active.model)
+
+    if index is None:
+        return jsonify({"enabled": False}), 200
+
+    return jsonify({"enabled": True, **index.stats()}), 200
+
+@app.route('/ocr-tier-stats', methods=['GET'])
+def ocr_tier_stats_route():
+    """
+    Reports reads and time spent per OCR tier in this worker process, the share of fast reads that were kept
+    and escalations to full resolution, see src/utils/tiered_ocr.py.
+
+    :return: JSON response with tiered OCR statistics.
+    """
+    return jsonify(ocr_tier_stats.stats()), 200
+
+@app.route('/model-version', methods=['GET'])
+def model_version_route():
+    """
+    Reports the model version served by this worker process, versions in memory and swaps, see src/model/registry.py.
+
+    :return: JSON response with model registry statistics.
+    """
+    return jsonify(model_registry.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Exposes request, stage and OCR metrics in Prometheus text format, see src/utils/metrics.py.
+
+    :return: Prometheus text response.
+    """
+    body, content_type = render_metrics()
+    return Response(body, status=200, content_type=content_type)
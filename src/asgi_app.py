@@ -0,0 +1,525 @@
+import asyncio
+
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import FormData, QueryParams, UploadFile
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from typing import Optional
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from src.app import model_registry, result_cache, job_queue, admission
+from src.model.registry import ModelVersion, serve_with_model
+from src.settings.config import MAX_FILES_PER_REQUEST
+
+from src.utils.admission import estimate_cost
+from src.utils.classifier import cascade_report, classify_file_async, classify_files_async
+from src.utils.error_interceptor import async_error_interceptor
+from src.utils.job_queue import QueueFullError
+from src.utils.metrics import render_metrics, time_stage, track_request_async
+from src.utils.near_duplicates import get_near_duplicate_index
+from src.utils.response_shaping import iter_gzip_json, should_compress, truncate_text
+from src.utils.result_cache import make_cache_key
+from src.utils.text_extractor import extract_text_and_ocr_pass_in_worker, extract_text_in_worker, get_extraction_process_pool, reset_extraction_process_pool
+from src.utils.tiered_ocr import OcrPass, new_ocr_pass, ocr_tier_stats, review_ocr_pass
+from src.utils.validators import (
+    ValidationError,
+    validate_model_state,
+    get_and_validate_uploaded_file,
+    get_and_validate_uploaded_files,
+    get_and_validate_text_mode,
+    get_and_validate_text_max_chars,
+    validate_uploaded_file,
+    validate_file_text,
+    validate_request_size,
+)
+
+"""
+Async (ASGI) serving mode, started with run_async.py.
+
+The Flask app holds a gunicorn thread for the whole request - while a slow client uploads,
+while PyMuPDF parses and while Tesseract OCRs. Here a single event loop serves all connections
+of a worker process, and nothing CPU-heavy runs on it:
+
+    1. uploads are parsed from the request stream by python-multipart and spooled to temporary files,
+    2. text extraction runs in a process pool (see get_extraction_process_pool()),
+    3. inference runs on the batch scheduler's thread (see classify_file_async()),
+    4. hashing uploads and the result cache run in Starlette's thread pool.
+
+Endpoints and responses are the same as in src/app.py, and so are the model registry, the result cache,
+the validators, the extractors and the classifier - this module only does the awaiting.
+"""
+
+
+class UploadRequest:
+    """
+    Uploaded files and query parameters of a request, in the shape the validators expect from a flask.Request.
+    """
+
+    def __init__(self, form: FormData, query_params: QueryParams):
+        self.files = MultiDict()
+        self.args = MultiDict(query_params.multi_items())
+
+        for key, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                self.files.add(key, FileStorage(stream=value.file, filename=value.filename, content_type=value.content_type))
+
+
+def get_content_length(request: Request) -> Optional[int]:
+    """
+    Size of the request body as declared by the client, None if it's sent without Content-Length.
+
+    :param request: Received request object
+    :type request: starlette.requests.Request
+    :return: Content-Length in bytes
+    :rtype: Optional[int]
+    """
+    content_length = request.headers.get('content-length')
+    return int(content_length) if content_length else None
+
+
+def get_cached_result(file: FileStorage, text_mode: str, model_version: str) -> tuple:
+    """
+    Hashes the uploaded file and looks the result up in the cache. Blocking, run it in a thread pool.
+
+    :param file: Uploaded file
+    :type file: FileStorage
+    :param text_mode: Text mode of the request
+    :type text_mode: str
+    :param model_version: Model version serving the request
+    :type model_version: str
+    :return: A tuple consisting of: cache key (None if caching is disabled) and cached result (None on a miss)
+    :rtype: tuple
+    """
+    if not result_cache:
+        return None, None
+
+    with time_stage('cache_lookup'):
+        cache_key = make_cache_key(file, model_version)
+        return cache_key, result_cache.get_for_text_mode(cache_key, text_mode)
+
+
+def _read_upload(file: FileStorage) -> bytes:
+    # from the start, a file read again at full OCR resolution has been read before
+    file.stream.seek(0)
+    return file.read()
+
+
+async def extract_text_async(file: FileStorage, lazy: bool = False, ocr_pass: OcrPass = None) -> str:
+    """
+    Extracts text from the uploaded file in the extraction process pool, without blocking the event loop.
+
+    :param file: Uploaded file
+    :type file: FileStorage
+    :param lazy: extract only text that fits the model input, see extract_text_within_token_budget()
+    :type lazy: bool
+    :param ocr_pass: tiered OCR pass, gets the reads counted in the worker, see src/utils/tiered_ocr.py
+    :type ocr_pass: OcrPass
+    :return: Text read from the file
+    :rtype: str
+    """
+    file_bytes = await run_in_threadpool(_read_upload, file)
+    # workers keep the tokenizer the pool started with, it only counts tokens - versions of the model share it
+    pool = get_extraction_process_pool(model_registry.active.tokenizer)
+    loop = asyncio.get_running_loop()
+
+    try:
+        if ocr_pass is None:
+            return await loop.run_in_executor(pool, extract_text_in_worker, file_bytes, file.filename, lazy)
+
+        file_text, worker_pass = await loop.run_in_executor(pool, extract_text_and_ocr_pass_in_worker, file_bytes, file.filename, lazy, ocr_pass)
+        ocr_pass.add(worker_pass)
+        return file_text
+    except BrokenProcessPool:
+        reset_extraction_process_pool(pool)
+        raise
+
+
+async def _extract_text_safely(file: FileStorage, lazy: bool = False, ocr_pass: OcrPass = None) -> str:
+    try:
+        return await extract_text_async(file, lazy, ocr_pass=ocr_pass)
+    except Exception as e:
+        print(f"Error extracting text from {file.filename}: {e}")
+        return ""
+
+
+def _estimate_cost(files: list, text_mode: str):
+    with time_stage('estimate_cost'):
+        return estimate_cost(files, lazy=text_mode == 'none')
+
+
+@asynccontextmanager
+async def admitted(files: list, text_mode: str):
+    """
+    Holds the extraction of files within the admission budgets of this worker, see src/utils/admission.py.
+    Waiting for budget doesn't block the event loop. Raises OverloadedError (503) if the request has to be shed.
+
+    :param files: Validated uploads about to be extracted
+    :type files: list
+    :param text_mode: Text mode of the request
+    :type text_mode: str
+    """
+    if not admission:
+        yield
+        return
+
+    cost = await run_in_threadpool(_estimate_cost, files, text_mode)
+
+    async with admission.admit_async(cost):
+        yield
+
+
+def shaped_response(request: Request, payload: dict) -> Response:
+    """
+    JSON response of a classify route, gzipped and streamed if the client accepts it
+    and it carries enough text, see src/utils/response_shaping.py
+
+    :param request: Received request object
+    :type request: starlette.requests.Request
+    :param payload: Response body, with file_text already truncated if the client asked for it
+    :type payload: dict
+    :return: Response object
+    :rtype: starlette.responses.Response
+    """
+    headers = {'Vary': 'Accept-Encoding'}
+
+    # the generator is iterated in Starlette's thread pool, compressing doesn't block the event loop
+    if should_compress(payload, request.headers.get('accept-encoding')):
+        return StreamingResponse(iter_gzip_json(payload), status_code=200, media_type='application/json', headers={**headers, 'Content-Encoding': 'gzip'})
+
+    return JSONResponse(payload, status_code=200, headers=headers)
+
+
+async def reread_unsure(files: list, file_texts: list, predictions: list, ocr_passes: list, text_mode: str, served: ModelVersion) -> tuple:
+    """
+    Reads files again at full resolution whose text, read by fast OCR, left the classifier unsure,
+    and classifies them again, see review_ocr_pass(). The uploads must still be open.
+
+    :param files: Extracted uploads
+    :type files: list
+    :param file_texts: Text of every file
+    :type file_texts: list
+    :param predictions: (label, confidence) of every file
+    :type predictions: list
+    :param ocr_passes: Tiered OCR pass every file was extracted with
+    :type ocr_passes: list
+    :param text_mode: Text mode of the request
+    :type text_mode: str
+    :param served: Model version serving the request
+    :type served: ModelVersion
+    :return: A tuple consisting of: texts and predictions, with those of files read again replaced
+    :rtype: tuple
+    """
+    unsure = []
+    for i, (ocr_pass, (_, confidence)) in enumerate(zip(ocr_passes, predictions)):
+        full_pass = review_ocr_pass(ocr_pass, confidence)
+
+        if full_pass:
+            unsure.append((i, full_pass))
+
+    if not unsure:
+        return file_texts, predictions
+
+    async with admitted([files[i] for i, _ in unsure], text_mode):
+        reread_texts = await asyncio.gather(*[_extract_text_safely(files[i], lazy=text_mode == 'none', ocr_pass=full_pass) for i, full_pass in unsure])
+
+    reread_predictions = await classify_files_async(reread_texts, served.model, tokenizer=served.tokenizer, device=served.device)
+    file_texts, predictions = list(file_texts), list(predictions)
+
+    for (i, full_pass), file_text, prediction in zip(unsure, reread_texts, reread_predictions):
+        review_ocr_pass(full_pass, prediction[1])
+
+        # a full read that fails doesn't throw away the fast one
+        if file_text:
+            file_texts[i], predictions[i] = file_text, prediction
+
+    return file_texts, predictions
+
+
+def _store_result(cache_key: str, result: dict):
+    if cache_key:
+        result_cache.put(cache_key, result)
+
+
+@track_request_async('classify-file')
+@async_error_interceptor
+@serve_with_model(model_registry)
+async def classify_file_route(request: Request, served: ModelVersion) -> Response:
+    """
+    Classifies a file uploaded via POST request, with the model version active when the request came in.
+
+    :return: JSON response with classification results and the model version, or error message.
+    """
+    validate_model_state(served.model, served.tokenizer, served.device)
+
+    # before the body is read and spooled
+    validate_request_size(get_content_length(request))
+
+    async with request.form() as form:
+        upload_request = UploadRequest(form, request.query_params)
+
+        with time_stage('validate'):
+            file = get_and_validate_uploaded_file(upload_request)
+            text_mode = get_and_validate_text_mode(upload_request)
+            text_max_chars = get_and_validate_text_max_chars(upload_request)
+
+        cache_key, cached_result = await run_in_threadpool(get_cached_result, file, text_mode, served.version)
+
+        if cached_result:
+            return shaped_response(request, truncate_text({**cached_result, "model_version": served.version}, text_max_chars))
+
+        ocr_pass = new_ocr_pass(text_mode)
+
+        async with admitted([file], text_mode):
+            file_text = await extract_text_async(file, lazy=text_mode == 'none', ocr_pass=ocr_pass)
+
+        validate_file_text(file_text)
+
+        file_class, confidence = await classify_file_async(file_text, served.model, tokenizer=served.tokenizer, device=served.device)
+        full_pass = review_ocr_pass(ocr_pass, confidence)
+
+        # text read by fast OCR left the classifier unsure, the file is read again at full resolution
+        if full_pass:
+            async with admitted([file], text_mode):
+                file_text = await extract_text_async(file, lazy=text_mode == 'none', ocr_pass=full_pass) or file_text
+
+            file_class, confidence = await classify_file_async(file_text, served.model, tokenizer=served.tokenizer, device=served.device)
+            review_ocr_pass(full_pass, confidence)
+
+    if all([file_text, file_class, confidence]):
+        result = {"file_class": file_class, "confidence": confidence}
+
+        if text_mode == 'full':
+            result["file_text"] = file_text
+
+        await run_in_threadpool(_store_result, cache_key, result)
+
+        return shaped_response(request, truncate_text({**result, "model_version": served.version}, text_max_chars))
+
+    return JSONResponse({"error": "Unable to classify document."}, status_code=400)
+
+
+@track_request_async('classify-files')
+@async_error_interceptor
+@serve_with_model(model_registry)
+async def classify_files_route(request: Request, served: ModelVersion) -> Response:
+    """
+    Classifies many files uploaded via a single POST request, under the 'files' form-data key.
+    Files are extracted concurrently in the process pool and all texts are classified in a batch, by the same model version.
+
+    :return: JSON response with per-file classification results and the model version, or error message.
+    """
+    validate_model_state(served.model, served.tokenizer, served.device)
+
+    # before the body is read and spooled
+    validate_request_size(get_content_length(request))
+
+    # one more than allowed, so that the validator reports too many files with its own message
+    async with request.form(max_files=MAX_FILES_PER_REQUEST + 1) as form:
+        upload_request = UploadRequest(form, request.query_params)
+
+        with time_stage('validate'):
+            files = get_and_validate_uploaded_files(upload_request)
+            text_mode = get_and_validate_text_mode(upload_request)
+            text_max_chars = get_and_validate_text_max_chars(upload_request)
+
+        results = [{"filename": file.filename} for file in files]
+
+        valid = []
+        for result, file in zip(results, files):
+            try:
+                with time_stage('validate'):
+                    validate_uploaded_file(file)
+            except ValidationError as e:
+                result["error"] = str(e)
+                continue
+
+            cache_key, cached_result = await run_in_threadpool(get_cached_result, file, text_mode, served.version)
+
+            if cached_result:
+                result.update(cached_result)
+            else:
+                valid.append((result, file, cache_key))
+
+        ocr_passes = [new_ocr_pass(text_mode) for _ in valid]
+
+        async with admitted([file for _, file, _ in valid], text_mode):
+            file_texts = await asyncio.gather(*[_extract_text_safely(file, lazy=text_mode == 'none', ocr_pass=ocr_pass) for (_, file, _), ocr_pass in zip(valid, ocr_passes)])
+
+        extracted = []
+        for (result, file, cache_key), file_text, ocr_pass in zip(valid, file_texts, ocr_passes):
+            try:
+                validate_file_text(file_text)
+                extracted.append((result, file, cache_key, file_text, ocr_pass))
+            except ValidationError as e:
+                result["error"] = str(e)
+
+        file_texts = [file_text for _, _, _, file_text, _ in extracted]
+        predictions = await classify_files_async(file_texts, served.model, tokenizer=served.tokenizer, device=served.device)
+        file_texts, predictions = await reread_unsure([file for _, file, _, _, _ in extracted], file_texts, predictions, [ocr_pass for *_, ocr_pass in extracted], text_mode, served)
+
+    for (result, _, cache_key, _, _), file_text, (file_class, confidence) in zip(extracted, file_texts, predictions):
+        if all([file_text, file_class, confidence]):
+            file_result = {"file_class": file_class, "confidence": confidence}
+
+            if text_mode == 'full':
+                file_result["file_text"] = file_text
+
+            result.update(file_result)
+            await run_in_threadpool(_store_result, cache_key, file_result)
+        else:
+            result["error"] = "Unable to classify document."
+
+    return shaped_response(request, {"results": [truncate_text(result, text_max_chars) for result in results], "model_version": served.version})
+
+
+def _submit_job(file: FileStorage, text_mode: str) -> str:
+    return job_queue.submit(file.read(), file.filename, file.mimetype, text_mode)
+
+
+@track_request_async('jobs')
+@async_error_interceptor
+async def submit_job_route(request: Request) -> JSONResponse:
+    """
+    Queues a file uploaded via POST request for classification by the job workers (run_jobs.py).
+
+    :return: JSON response with the job ID, or error message. 503 with Retry-After if the queue is full.
+    """
+    # before the body is read and spooled
+    validate_request_size(get_content_length(request))
+
+    async with request.form() as form:
+        upload_request = UploadRequest(form, request.query_params)
+
+        with time_stage('validate'):
+            file = get_and_validate_uploaded_file(upload_request)
+            text_mode = get_and_validate_text_mode(upload_request)
+
+        try:
+            job_id = await run_in_threadpool(_submit_job, file, text_mode)
+        except QueueFullError as e:
+            return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+
+@async_error_interceptor
+async def job_status_route(request: Request) -> JSONResponse:
+    """
+    Reports the status of a job, and its result (same as a /classify-file response) once it's done.
+
+    :return: JSON response with the job status, 404 if there's no such job or it has expired.
+    """
+    job = await run_in_threadpool(job_queue.get, request.path_params['job_id'])
+
+    if job is None:
+        return JSONResponse({"error": "Job not found. It may have expired."}, status_code=404)
+
+    return JSONResponse(job, status_code=200)
+
+
+async def job_stats_route(request: Request) -> JSONResponse:
+    """
+    Reports the number of jobs in every status and the queue depth.
+
+    :return: JSON response with job queue statistics.
+    """
+    return JSONResponse(await run_in_threadpool(job_queue.stats), status_code=200)
+
+
+async def admission_stats_route(request: Request) -> JSONResponse:
+    """
+    Reports budgets in use, queue depths and shed requests of admission control in this worker process.
+
+    :return: JSON response with admission statistics.
+    """
+    if not admission:
+        return JSONResponse({"enabled": False}, status_code=200)
+
+    return JSONResponse({"enabled": True, **admission.stats()}, status_code=200)
+
+
+async def cache_stats_route(request: Request) -> JSONResponse:
+    """
+    Reports hit/miss counters of the result cache of this worker process.
+
+    :return: JSON response with cache statistics.
+    """
+    if not result_cache:
+        return JSONResponse({"enabled": False}, status_code=200)
+
+    return JSONResponse({"enabled": True, **result_cache.stats()}, status_code=200)
+
+
+async def cascade_stats_route(request: Request) -> JSONResponse:
+    """
+    Reports early exits of the lexical pre-classifier in this worker process, its agreement with the transformer
+    and the CPU time it saved, see src/utils/classifier.py.
+
+    :return: JSON response with cascade statistics.
+    """
+    served = model_registry.active
+    return JSONResponse(cascade_report(served.model, served.tokenizer, served.device), status_code=200)
+
+
+async def near_duplicate_stats_route(request: Request) -> JSONResponse:
+    """
+    Reports lookups, hits and evictions of the near-duplicate index of the served model version in this worker
+    process, see src/utils/near_duplicates.py.
+
+    :return: JSON response with near-duplicate index statistics.
+    """
+    index = get_near_duplicate_index(model_registry.active.model)
+
+    if index is None:
+        return JSONResponse({"enabled": False}, status_code=200)
+
+    return JSONResponse({"enabled": True, **index.stats()}, status_code=200)
+
+
+async def ocr_tier_stats_route(request: Request) -> JSONResponse:
+    """
+    Reports reads and time spent per OCR tier in this worker process, the share of fast reads that were kept
+    and escalations to full resolution, see src/utils/tiered_ocr.py.
+
+    :return: JSON response with tiered OCR statistics.
+    """
+    return JSONResponse(ocr_tier_stats.stats(), status_code=200)
+
+
+async def model_version_route(request: Request) -> JSONResponse:
+    """
+    Reports the model version served by this worker process, versions in memory and swaps, see src/model/registry.py.
+
+    :return: JSON response with model registry statistics.
+    """
+    return JSONResponse(model_registry.stats(), status_code=200)
+
+
+async def metrics_route(request: Request) -> Response:
+    """
+    Exposes request, stage and OCR metrics in Prometheus text format, see src/utils/metrics.py.
+
+    :return: Prometheus text response.
+    """
+    body, content_type = render_metrics()
+    return Response(body, status_code=200, media_type=content_type)
+
+
+app = Starlette(routes=[
+    Route('/classify-file', classify_file_route, methods=['POST']),
+    Route('/classify-files', classify_files_route, methods=['POST']),
+    Route('/jobs', submit_job_route, methods=['POST']),
+    Route('/jobs/{job_id}', job_status_route, methods=['GET']),
+    Route('/job-stats', job_stats_route, methods=['GET']),
+    Route('/admission-stats', admission_stats_route, methods=['GET']),
+    Route('/cache-stats', cache_stats_route, methods=['GET']),
+    Route('/cascade-stats', cascade_stats_route, methods=['GET']),
+    Route('/near-duplicate-stats', near_duplicate_stats_route, methods=['GET']),
+    Route('/ocr-tier-stats', ocr_tier_stats_route, methods=['GET']),
+    Route('/model-version', model_version_route, methods=['GET']),
+    Route('/metrics', metrics_route, methods=['GET']),
+])
@@ -0,0 +1,189 @@
+import abc
+import os
+import tempfile
+import torch
+
+from src.settings.config import MODEL_BACKENDS, MODEL_OPTIMIZATIONS
+from transformers import DistilBertForSequenceClassification
+from transformers.modeling_outputs import SequenceClassifierOutput
+from typing import Dict
+
+"""
+Inference backends.
+
+The fine-tuned model is always loaded as fp32 PyTorch DistilBertForSequenceClassification,
+but that's not necessarily the fastest way to run it on a CPU. A backend wraps the loaded
+model and runs the forward pass its own way:
+
+    1. eager - plain fp32 PyTorch, the reference,
+    2. int8 - PyTorch dynamic quantization; weights of Linear layers are stored as int8 and
+    activations are quantized on the fly. Roughly 4x smaller Linear layers and faster matmuls on CPU,
+    at the cost of a small drift in confidences,
+    3. onnx - the model exported to an ONNX graph and run by ONNX Runtime, which fuses
+    attention and layer norm ops. Needs `pip install onnx onnxruntime`.
+
+Every backend is called like the model itself - backend(**prepared_texts).logits - so
+classify_batch() doesn't care which one it got. Which one is used is set in settings (MODEL_BACKEND).
+The eager forward pass can further be traced or compiled at startup, see src/model/startup.py.
+Use benchmarks/backend_parity.py to check label agreement and latency against eager before switching.
+"""
+
+
+class InferenceBackend(abc.ABC):
+    """
+    Runs forward passes of a loaded DistilBertForSequenceClassification.
+    """
+    name = None
+
+    def __init__(self, model: DistilBertForSequenceClassification):
+        self.model = model
+        self.config = model.config
+
+    @abc.abstractmethod
+    def __call__(self, **inputs: torch.Tensor) -> SequenceClassifierOutput:
+        pass
+
+
+class EagerBackend(InferenceBackend):
+    """
+    fp32 PyTorch, exactly as loaded - or traced / compiled at startup, see optimize().
+    """
+    name = 'eager'
+
+    def __init__(self, model: DistilBertForSequenceClassification):
+        super().__init__(model)
+        self.forward = model
+        self.optimization = 'none'
+
+    def optimize(self, optimization: str, example_inputs: Dict[str, torch.Tensor]):
+        """
+        Swaps the forward pass for an optimised one. Parameters stay shared with the loaded model, so
+        memory-mapped weights are still shared between processes.
+
+            trace - TorchScript graph of the forward pass, recorded on example_inputs; no Python overhead per op,
+            compile - torch.compile with dynamic shapes; kernels are generated on the first pass of every shape,
+            which is why it only pays off with a warm-up.
+
+        :param optimization: One of MODEL_OPTIMIZATIONS
+        :type optimization: str
+        :param example_inputs: Tokenized batch to trace with, it should be padded, so that the attention mask is traced too
+        :type example_inputs: Dict[str, torch.Tensor]
+        """
+        if optimization == 'trace':
+            with torch.no_grad():
+                self.forward = torch.jit.trace(self.model, example_kwarg_inputs=example_inputs, strict=False)
+        elif optimization == 'compile':
+            self.forward = torch.compile(self.model, dynamic=True)
+        elif optimization == 'none':
+            self.forward = self.model
+        else:
+            raise ValueError(f"Unknown model optimization: {optimization}. Available optimizations: {', '.join(MODEL_OPTIMIZATIONS)}")
+
+        self.optimization = optimization
+
+    def __call__(self, **inputs: torch.Tensor) -> SequenceClassifierOutput:
+        with torch.no_grad():
+            outputs = self.forward(**inputs)
+
+        # a traced forward pass returns a plain dict
+        return outputs if isinstance(outputs, SequenceClassifierOutput) else SequenceClassifierOutput(logits=outputs['logits'])
+
+
+class QuantizedBackend(InferenceBackend):
+    """
+    PyTorch dynamic int8 quantization of Linear layers. CPU only.
+    """
+    name = 'int8'
+
+    def __init__(self, model: DistilBertForSequenceClassification):
+        super().__init__(model)
+
+        if next(model.parameters()).device.type != 'cpu':
+            raise ValueError("int8 backend runs on CPU only")
+
+        self.quantized_model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def __call__(self, **inputs: torch.Tensor) -> SequenceClassifierOutput:
+        with torch.no_grad():
+            return self.quantized_model(**inputs)
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    The model exported to ONNX and run by ONNX Runtime on CPU.
+    """
+    name = 'onnx'
+    input_names = ('input_ids', 'attention_mask')
+
+    def __init__(self, model: DistilBertForSequenceClassification, onnx_path: str = None):
+        super().__init__(model)
+
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("onnx backend requires ONNX Runtime: pip install onnx onnxruntime")
+
+        self.onnx_path = onnx_path or os.path.join(tempfile.mkdtemp(prefix='distilbert-onnx-'), 'model.onnx')
+
+        if not os.path.exists(self.onnx_path):
+            export_to_onnx(model, self.onnx_path)
+
+        self.session = onnxruntime.InferenceSession(self.onnx_path, providers=['CPUExecutionProvider'])
+
+    def __call__(self, **inputs: torch.Tensor) -> SequenceClassifierOutput:
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        logits = self.session.run(['logits'], feed)[0]
+        return SequenceClassifierOutput(logits=torch.from_numpy(logits))
+
+
+def export_to_onnx(model: DistilBertForSequenceClassification, onnx_path: str):
+    """
+    Exports the model to an ONNX graph with dynamic batch and sequence length.
+
+    :param model: Model in evaluation mode
+    :type model: transformers.DistilBertForSequenceClassification
+    :param onnx_path: Where to write the graph
+    :type onnx_path: str
+    """
+    dummy_input = torch.ones((1, 8), dtype=torch.long, device=next(model.parameters()).device)
+    dynamic_axes = {
+        'input_ids': {0: 'batch', 1: 'sequence'},
+        'attention_mask': {0: 'batch', 1: 'sequence'},
+        'logits': {0: 'batch'},
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy_input, dummy_input),
+            onnx_path,
+            input_names=list(OnnxBackend.input_names),
+            output_names=['logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+
+    print(f"Model exported to ONNX: {onnx_path}")
+
+
+BACKENDS: Dict[str, type] = {backend.name: backend for backend in (EagerBackend, QuantizedBackend, OnnxBackend)}
+
+
+def build_backend(name: str, model: DistilBertForSequenceClassification, **kwargs) -> InferenceBackend:
+    """
+    Wraps loaded model in the inference backend of given name.
+
+    :param name: One of MODEL_BACKENDS
+    :type name: str
+    :param model: Loaded model in evaluation mode
+    :type model: transformers.DistilBertForSequenceClassification
+    :return: Backend instance, callable like the model
+    :rtype: InferenceBackend
+    """
+    if name not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}. Available backends: {', '.join(MODEL_BACKENDS)}")
+
+    return BACKENDS[name](model, **kwargs)
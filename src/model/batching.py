@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+import torch
+
+from concurrent.futures import Future
+from src.model.model_utils import classify_texts
+from src.settings.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from src.utils.metrics import BATCH_SIZE
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Dict, List, Tuple
+
+"""
+Dynamic micro-batching in front of the model.
+
+Every /classify-file request used to run its own forward pass with a batch of one.
+On CPU the forward pass is the most expensive part of a request, and running 8 texts
+through DistilBERT at once costs a lot less than 8 separate passes.
+
+So requests don't call the model directly anymore. They put their text on a queue and
+wait. A single background thread takes the first text from the queue, waits up to
+max_wait_ms for more texts to arrive (or until max_batch_size is reached), runs them
+through the model as padded batches - one per length bucket, see prepare_texts_bucketed() - and
+hands every caller its own (label, confidence).
+
+Under low traffic a request pays at most max_wait_ms extra. Under high traffic
+batches fill up before the timeout and throughput goes up.
+"""
+
+_STOP = object()
+
+
+class BatchScheduler:
+    """
+    Collects texts submitted from many threads and classifies them in batches on a single worker thread.
+    """
+
+    def __init__(self, model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device,
+                 max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        # CPU time of the worker thread spent in classify_texts() and number of texts it classified,
+        # the cascade uses them to estimate how much CPU an early exit saves. Per thread, request threads
+        # working meanwhile aren't counted - nor are torch's intra-op threads, so it's a lower bound
+        self.cpu_seconds = 0.0
+        self.texts_classified = 0
+        self._thread = None # started lazily, so that the scheduler survives a fork (e.g. gunicorn --preload)
+
+    def submit(self, text: str) -> Future:
+        """
+        Queues text for classification.
+
+        :param text: Raw text to classify
+        :type text: str
+        :return: Future resolving to a (label, confidence) tuple
+        :rtype: concurrent.futures.Future
+        """
+        self._ensure_running()
+
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def classify(self, text: str) -> Tuple[str, float]:
+        """
+        Queues text for classification and blocks until its batch has been processed.
+
+        :param text: Raw text to classify
+        :type text: str
+        :return: A tuple consisting of a predicted label and associated confidence
+        :rtype: Tuple[str, float]
+        """
+        return self.submit(text).result()
+
+    def classify_many(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """
+        Queues all texts at once and waits for all of them, so they end up in as few batches as possible.
+
+        :param texts: Raw texts to classify
+        :type texts: List[str]
+        :return: A (label, confidence) tuple for every text, in order
+        :rtype: List[Tuple[str, float]]
+        """
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Stops the worker thread after the already queued texts have been processed.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(_STOP)
+                self._thread.join()
+            self._thread = None
+
+    def _ensure_running(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self, first) -> Tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is _STOP:
+                return batch, True
+
+            batch.append(item)
+
+        return batch, False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+
+            if first is _STOP:
+                return
+
+            batch, stop = self._collect_batch(first)
+            self._process(batch)
+
+            if stop:
+                return
+
+    def _process(self, batch: list):
+        texts = [text for text, _ in batch]
+        BATCH_SIZE.observe(len(texts))
+
+        start = time.thread_time()
+
+        try:
+            results = classify_texts(self.model, texts, self.tokenizer, self.device)
+        except Exception as e:
+            print(f"Error while classifying a batch of {len(batch)}: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.cpu_seconds += time.thread_time() - start
+        self.texts_classified += len(texts)
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_schedulers: Dict[int, BatchScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device) -> BatchScheduler:
+    """
+    Returns the scheduler serving given model, creating it on first use.
+    There's one scheduler per model instance, shared by all request threads.
+
+    :param model: DistilBERT-type model instance
+    :type model: transformers.DistilBertForSequenceClassification
+    :param tokenizer: DistilBERT-type tokenizer, applied to text
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :return: Scheduler instance
+    :rtype: BatchScheduler
+    """
+    key = id(model)
+    scheduler = _schedulers.get(key)
+
+    if scheduler is None or scheduler.model is not model:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(key)
+
+            if scheduler is None or scheduler.model is not model:
+                scheduler = BatchScheduler(model, tokenizer, device)
+                _schedulers[key] = scheduler
+
+    return scheduler
+
+
+def close_scheduler(model: DistilBertForSequenceClassification):
+    """
+    Stops and forgets the scheduler of a model that's no longer served, so that the model can be freed.
+
+    :param model: DistilBERT-type model instance
+    :type model: transformers.DistilBertForSequenceClassification
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.pop(id(model), None)
+
+    if scheduler is not None:
+        scheduler.close()
@@ -0,0 +1,339 @@
+import argparse
+import json
+import math
+import numpy as np
+import os
+import re
+import threading
+import time
+import torch
+import zlib
+
+from collections import Counter
+from src.model.model_preloader import load_model_and_tokenizer
+from src.model.model_utils import classify_texts
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.settings.config import (
+    ID_TO_LABEL,
+    LEXICAL_CONFIDENCE_THRESHOLD,
+    LEXICAL_MAX_CHARS,
+    LEXICAL_MODEL_PATH,
+    LEXICAL_N_FEATURES,
+    LEXICAL_TARGET_AGREEMENT,
+    MODEL_NAME,
+)
+from src.utils.text_extractor import extract_text
+from typing import List, Optional, Tuple
+from werkzeug.datastructures import FileStorage
+
+"""
+Lexical pre-classifier, the cheap first stage of the classification cascade (see src/utils/classifier.py).
+
+Many documents give themselves away in their first words - "INVOICE", "PASSPORT", "CONTRACT OF EMPLOYMENT" -
+and still every one of them paid for a DistilBERT forward pass. This model reads words and word pairs
+of the text, hashed into LEXICAL_N_FEATURES buckets (no vocabulary to store), and scores them with
+a linear softmax classifier - tens of microseconds per document, against milliseconds for the transformer.
+When its confidence is above the calibrated threshold, its label is the answer. Otherwise the text goes on
+to the transformer.
+
+The model is distilled from the transformer: it's fit on the transformer's labels, not on human ones,
+and the threshold is calibrated on out-of-fold predictions so that at least LEXICAL_TARGET_AGREEMENT of the
+documents it answers get the label the transformer would have given them.
+
+    python -m src.model.lexical --files-dir files --texts corpus.jsonl --output models/lexical.npz
+    LEXICAL_MODEL_PATH=models/lexical.npz python run.py
+"""
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def hash_features(text: str, n_features: int = LEXICAL_N_FEATURES, max_chars: int = LEXICAL_MAX_CHARS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turns text into a sparse, L2-normalised vector of hashed unigram and bigram counts (sublinear tf).
+    crc32 is used rather than hash(), which is salted per process.
+
+    :param text: Raw text, only its first max_chars characters are read
+    :type text: str
+    :param n_features: Number of hash buckets
+    :type n_features: int
+    :param max_chars: Cap on the text read, bounds the cost of very long documents
+    :type max_chars: int
+    :return: A tuple consisting of: bucket indices and their values
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    tokens = TOKEN_PATTERN.findall(text[:max_chars].lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    counts = Counter(zlib.crc32(gram.encode('utf-8')) % n_features for gram in grams)
+
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+
+    return indices, values / np.linalg.norm(values)
+
+
+class LexicalClassifier:
+    """
+    Linear softmax classifier over hashed n-gram features.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: List[str], threshold: float = math.inf):
+        self.weights = weights.astype(np.float32) # n_features x n_labels
+        self.bias = bias.astype(np.float32)
+        self.labels = list(labels)
+        self.threshold = threshold
+
+    @property
+    def n_features(self) -> int:
+        return self.weights.shape[0]
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        """
+        :param text: Raw text
+        :type text: str
+        :return: Probability of every label, in the order of self.labels
+        :rtype: np.ndarray
+        """
+        indices, values = hash_features(text, self.n_features)
+        logits = values @ self.weights[indices] + self.bias
+        exp = np.exp(logits - logits.max())
+
+        return exp / exp.sum()
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        :param text: Raw text
+        :type text: str
+        :return: A tuple consisting of: the most likely label and its probability
+        :rtype: Tuple[str, float]
+        """
+        probabilities = self.predict_proba(text)
+        best = int(probabilities.argmax())
+
+        return self.labels[best], float(probabilities[best])
+
+    def save(self, path: str):
+        """
+        Saves weights, labels and threshold to a .npz file.
+
+        :param path: Output file
+        :type path: str
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels), threshold=self.threshold)
+
+    @classmethod
+    def load(cls, path: str) -> 'LexicalClassifier':
+        """
+        :param path: File written by save()
+        :type path: str
+        :return: Loaded classifier
+        :rtype: LexicalClassifier
+        """
+        with np.load(path) as data:
+            return cls(data['weights'], data['bias'], data['labels'].tolist(), float(data['threshold']))
+
+
+def fit_lexical_classifier(texts: List[str], labels: List[str], label_names: List[str] = None, n_features: int = LEXICAL_N_FEATURES,
+                           epochs: int = 200, l2: float = 1e-4, seed: int = 0) -> LexicalClassifier:
+    """
+    Fits the linear classifier with full-batch Adam on the softmax cross-entropy, with L2 regularisation.
+
+    :param texts: Training texts
+    :type texts: List[str]
+    :param labels: Label of every text, e.g. the transformer's prediction
+    :type labels: List[str]
+    :param label_names: All labels the model can predict, defaults to the labels in ID_TO_LABEL
+    :type label_names: List[str]
+    :param n_features: Number of hash buckets
+    :type n_features: int
+    :param epochs: Optimisation steps
+    :type epochs: int
+    :param l2: Weight of the L2 penalty
+    :type l2: float
+    :param seed: Seed of weight initialisation
+    :type seed: int
+    :return: Fitted classifier, with no threshold (it never answers on its own until calibrated)
+    :rtype: LexicalClassifier
+    """
+    label_names = list(label_names or ID_TO_LABEL.values())
+    label_ids = torch.tensor([label_names.index(label) for label in labels])
+
+    rows, columns, values = [], [], []
+    for row, text in enumerate(texts):
+        indices, text_values = hash_features(text, n_features)
+        rows.extend([row] * len(indices))
+        columns.extend(indices.tolist())
+        values.extend(text_values.tolist())
+
+    features = torch.sparse_coo_tensor([rows, columns], values, (len(texts), n_features), dtype=torch.float32, check_invariants=True).coalesce()
+
+    generator = torch.Generator().manual_seed(seed)
+    weights = (torch.randn(n_features, len(label_names), generator=generator) * 0.01).requires_grad_()
+    bias = torch.zeros(len(label_names), requires_grad=True)
+    optimizer = torch.optim.Adam([weights, bias], lr=0.1)
+
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        logits = torch.sparse.mm(features, weights) + bias
+        loss = torch.nn.functional.cross_entropy(logits, label_ids) + l2 * weights.pow(2).sum()
+        loss.backward()
+        optimizer.step()
+
+    return LexicalClassifier(weights.detach().numpy(), bias.detach().numpy(), label_names)
+
+
+def calibrate_threshold(confidences: List[float], agreements: List[bool], target_agreement: float = LEXICAL_TARGET_AGREEMENT) -> float:
+    """
+    Finds the lowest confidence threshold at which the predictions above it agree with the transformer
+    at least target_agreement of the time - the lowest threshold lets the most documents exit early.
+
+    :param confidences: Confidence of lexical predictions on held-out texts
+    :type confidences: List[float]
+    :param agreements: Whether each of those predictions matched the transformer's label
+    :type agreements: List[bool]
+    :param target_agreement: Required agreement among early exits
+    :type target_agreement: float
+    :return: Threshold, inf if no threshold reaches the target
+    :rtype: float
+    """
+    ranked = sorted(zip(confidences, agreements), reverse=True)
+    threshold = math.inf
+    agreed = 0
+
+    for n, (confidence, agreement) in enumerate(ranked, start=1):
+        agreed += agreement
+
+        # the threshold can only sit between distinct confidences
+        is_last_of_value = n == len(ranked) or ranked[n][0] < confidence
+
+        if is_last_of_value and agreed / n >= target_agreement:
+            threshold = confidence
+
+    return threshold
+
+
+def cross_validate(texts: List[str], labels: List[str], folds: int = 5, **fit_kwargs) -> Tuple[List[str], List[float]]:
+    """
+    Out-of-fold predictions: every text is predicted by a model that wasn't fit on it.
+
+    :param texts: Texts
+    :type texts: List[str]
+    :param labels: Their labels
+    :type labels: List[str]
+    :param folds: Number of folds, capped at the number of texts
+    :type folds: int
+    :return: A tuple consisting of: predicted label and confidence of every text
+    :rtype: Tuple[List[str], List[float]]
+    """
+    folds = max(2, min(folds, len(texts)))
+    predictions = [None] * len(texts)
+
+    for fold in range(folds):
+        held_out = [i for i in range(len(texts)) if i % folds == fold]
+        train = [i for i in range(len(texts)) if i % folds != fold]
+        model = fit_lexical_classifier([texts[i] for i in train], [labels[i] for i in train], **fit_kwargs)
+
+        for i in held_out:
+            predictions[i] = model.predict(texts[i])
+
+    return [label for label, _ in predictions], [confidence for _, confidence in predictions]
+
+
+_lexical_classifier = None
+_lexical_classifier_lock = threading.Lock()
+
+
+def get_lexical_classifier() -> Optional[LexicalClassifier]:
+    """
+    Returns the process-wide lexical classifier loaded from LEXICAL_MODEL_PATH, or None if the cascade is disabled.
+    LEXICAL_CONFIDENCE_THRESHOLD, if set, overrides the calibrated threshold.
+
+    :return: Classifier instance
+    :rtype: Optional[LexicalClassifier]
+    """
+    global _lexical_classifier
+
+    if not LEXICAL_MODEL_PATH:
+        return None
+
+    with _lexical_classifier_lock:
+        if _lexical_classifier is None:
+            _lexical_classifier = LexicalClassifier.load(LEXICAL_MODEL_PATH)
+
+            if LEXICAL_CONFIDENCE_THRESHOLD is not None:
+                _lexical_classifier.threshold = LEXICAL_CONFIDENCE_THRESHOLD
+
+            print(f"Lexical pre-classifier loaded from {LEXICAL_MODEL_PATH}, threshold: {_lexical_classifier.threshold:.3f}")
+
+    return _lexical_classifier
+
+
+def load_corpus(files_dir: str = None, texts_path: str = None) -> List[str]:
+    texts = []
+
+    if files_dir:
+        for filename in sorted(os.listdir(files_dir)):
+            with open(os.path.join(files_dir, filename), 'rb') as f:
+                try:
+                    texts.append(extract_text(FileStorage(stream=f, filename=filename)))
+                except Exception as e:
+                    print(f"Skipping {filename}: {e}")
+
+    if texts_path:
+        with open(texts_path) as f:
+            texts.extend(json.loads(line)["text"] for line in f if line.strip())
+
+    return [text for text in texts if text and text.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit and calibrate the lexical pre-classifier against the transformer's labels")
+    parser.add_argument('--files-dir', help="documents to extract training texts from")
+    parser.add_argument('--texts', help="JSONL file with a {\"text\": ...} object per line, e.g. texts of past uploads")
+    parser.add_argument('--output', required=True, help="where to save the model, later passed as LEXICAL_MODEL_PATH")
+    parser.add_argument('--model', default=MODEL_NAME, help="teacher: Hugging Face model name or local snapshot directory")
+    parser.add_argument('--tiny', action='store_true', help="tiny random teacher, works offline - for trying the tool out only")
+    parser.add_argument('--target-agreement', type=float, default=LEXICAL_TARGET_AGREEMENT)
+    parser.add_argument('--folds', type=int, default=5)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.files_dir, args.texts)
+    if len(texts) < 2:
+        raise SystemExit("Need at least 2 texts to fit and calibrate, pass --files-dir and/or --texts")
+
+    if args.tiny:
+        teacher, tokenizer = build_tiny_model_and_tokenizer()
+        device = torch.device('cpu')
+    else:
+        teacher, tokenizer, device = load_model_and_tokenizer(args.model)
+
+    start = time.process_time()
+    labels = [label for label, _ in classify_texts(teacher, texts, tokenizer, device)]
+    transformer_cpu = (time.process_time() - start) / len(texts)
+
+    predicted, confidences = cross_validate(texts, labels, args.folds)
+    agreements = [label == teacher_label for label, teacher_label in zip(predicted, labels)]
+    threshold = calibrate_threshold(confidences, agreements, args.target_agreement)
+
+    model = fit_lexical_classifier(texts, labels)
+    model.threshold = threshold
+    model.save(args.output)
+
+    start = time.process_time()
+    for text in texts:
+        model.predict(text)
+    lexical_cpu = (time.process_time() - start) / len(texts)
+
+    exits = [agreement for confidence, agreement in zip(confidences, agreements) if confidence >= threshold]
+    print(f"{len(texts)} texts, labels: {dict(Counter(labels))}")
+    print(f"out-of-fold agreement with the transformer: {sum(agreements) / len(agreements):.1%}")
+    print(f"threshold {threshold:.3f}: early exits {len(exits) / len(texts):.1%}, agreement on them {sum(exits) / len(exits) if exits else 0:.1%}")
+    print(f"CPU per text: lexical {lexical_cpu * 1e6:.0f}us, transformer {transformer_cpu * 1e3:.1f}ms")
+    print(f"Saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
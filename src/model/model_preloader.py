@@ -1,7 +1,16 @@
+import json
+import mmap
+import os
+import struct
+import time
 import torch
 
-from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
-from typing import Tuple
+from src.model.backends import InferenceBackend, build_backend
+from src.model.startup import StartupProfile, prepare_model
+from src.settings.config import MODEL_BACKEND, MODEL_BACKENDS, MODEL_NAME, MODEL_PATH, MODEL_REVISION, ONNX_MODEL_PATH
+from src.utils.process_stats import get_memory_usage
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Dict, Tuple
 
 """
 The goal is to preload the model on application startup, so that, given a 
@@ -94,28 +103,153 @@ Let's consider our options.
     All in all, it was a great experience for me and I am quite satisfied with the result. I hope you'll be too!
 """
 
-def load_model_and_tokenizer(model_name: str = 'kris-szczepaniak/DistilBERT-document-classifier') -> Tuple[DistilBertForSequenceClassification, DistilBertTokenizer, torch.device]:
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool,
+}
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Memory-maps a .safetensors file and returns its tensors as views of the mapping - nothing is copied.
+
+    The file is mapped copy-on-write, so pages are read from disk on first access and live in the OS page cache.
+    Every process mapping the same file (e.g. gunicorn workers) shares them, as long as nobody writes to the weights.
+
+    :param path: Path to a .safetensors file
+    :type path: str
+    :return: Tensors by name
+    :rtype: Dict[str, torch.Tensor]
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        count = (end - begin) // dtype.itemsize
+
+        if count == 0:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + begin).reshape(info['shape'])
+
+    return tensors
+
+
+def load_model_from_snapshot(model_path: str) -> DistilBertForSequenceClassification:
+    """
+    Loads the model from a local snapshot directory (config.json + model.safetensors) without any hub lookups.
+
+    The model skeleton is built on the meta device (no memory, no random init) and the memory-mapped
+    weights are assigned to it as they are. Loaded this way in the gunicorn master (preload_app), 
+    the weights are shared by all workers instead of being copied into each of them.
+
+    Falls back to a regular from_pretrained(), if the checkpoint doesn't map 1:1 onto the model.
+
+    :param model_path: Local snapshot directory, see src/model/snapshot.py
+    :type model_path: str
+    :return: Model in evaluation mode
+    :rtype: transformers.DistilBertForSequenceClassification
     """
-    Loads DistilBERT-type model for sequence classification and a corresponding tokenizer from HuggingFace repository.
+    config = DistilBertConfig.from_pretrained(model_path, local_files_only=True)
+    weights_path = os.path.join(model_path, 'model.safetensors')
+
+    if os.path.exists(weights_path):
+        with torch.device('meta'):
+            model = DistilBertForSequenceClassification(config)
+
+        state_dict = mmap_safetensors(weights_path)
+        missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+
+        # position_ids is a non-persistent buffer - it's not in the checkpoint, it's just a range
+        embeddings = model.distilbert.embeddings
+        if getattr(embeddings, 'position_ids', None) is not None and embeddings.position_ids.is_meta:
+            embeddings.position_ids = torch.arange(config.max_position_embeddings).expand((1, -1))
+
+        still_meta = [name for name, tensor in [*model.named_parameters(), *model.named_buffers()] if tensor.is_meta]
+
+        if not still_meta and not unexpected:
+            return model.eval()
+
+        print(f"Checkpoint doesn't map onto the model (missing: {still_meta}, unexpected: {unexpected}), loading without mmap")
+
+    return DistilBertForSequenceClassification.from_pretrained(model_path, local_files_only=True).eval()
+
+
+def load_model_and_tokenizer(model_name: str = MODEL_NAME, backend: str = MODEL_BACKEND, model_path: str = MODEL_PATH,
+                             profile: StartupProfile = None, onnx_path: str = ONNX_MODEL_PATH, revision: str = MODEL_REVISION) -> Tuple[InferenceBackend, DistilBertTokenizerFast, torch.device]:
+    """
+    Loads DistilBERT-type model for sequence classification and a corresponding tokenizer from HuggingFace repository,
+    or - if model_path is given - from a local snapshot, offline and memory-mapped (see load_model_from_snapshot()).
+    The model is wrapped in an inference backend, that runs the forward pass (see src/model/backends.py),
+    and prepared for serving according to the startup profile, if one is given (see src/model/startup.py).
 
     :param model_name: must be a DistilBERT Sequence Classifier
     :type model_name: str
-    :return: A tuple consisting of: pretrained model instance, tokenizer instance and detected device type
-    :rtype: Tuple[DistilBertForSequenceClassification, DistilBertTokenizer, torch.device]
+    :param backend: inference backend, one of MODEL_BACKENDS. int8 and onnx run on CPU only.
+    :type backend: str
+    :param model_path: local snapshot directory; if given, model_name is not used and the hub is never contacted
+    :type model_path: str
+    :param profile: thread budget, optimisation and warm-up; left to the caller if None or marked after_fork
+    :type profile: StartupProfile
+    :param onnx_path: where the onnx backend reuses the exported graph from, or exports it to
+    :type onnx_path: str
+    :param revision: branch, tag or commit hash of model_name on the hub, not used with model_path
+    :type revision: str
+    :return: A tuple consisting of: inference backend wrapping pretrained model instance, tokenizer instance and detected device type
+    :rtype: Tuple[InferenceBackend, DistilBertTokenizerFast, torch.device]
     """
-    if '/' not in model_name or len(model_name) < 10:
+    if not model_path and ('/' not in model_name or len(model_name) < 10):
         raise ValueError("model_name incorrect")
+
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend}. Available backends: {', '.join(MODEL_BACKENDS)}")
     
     try:
-        pretrained_model = DistilBertForSequenceClassification.from_pretrained(model_name)
-        tokenizer = DistilBertTokenizer.from_pretrained(model_name)
+        start = time.perf_counter()
 
-        device = torch('cuda') if torch.cuda.is_available() else torch.device('cpu')
+        if model_path:
+            pretrained_model = load_model_from_snapshot(model_path)
+            tokenizer = DistilBertTokenizerFast.from_pretrained(model_path, local_files_only=True)
+        else:
+            pretrained_model = DistilBertForSequenceClassification.from_pretrained(model_name, revision=revision)
+            tokenizer = DistilBertTokenizerFast.from_pretrained(model_name, revision=revision)
+
+        use_cuda = torch.cuda.is_available() and backend == 'eager'
+        device = torch.device('cuda') if use_cuda else torch.device('cpu')
         pretrained_model.to(device)
+        pretrained_model.eval() # we don't need to train, evaluation mode enabled once for all requests
+
+        backend_kwargs = {'onnx_path': onnx_path} if backend == 'onnx' else {}
+        inference_backend = build_backend(backend, pretrained_model, **backend_kwargs)
+
+        elapsed = time.perf_counter() - start
+        rss_mb = get_memory_usage().get('rss_mb')
         
-        print(f"Model {model_name} loaded successfully!")
+        print(f"Model {model_path or model_name} loaded successfully! Backend: {backend}, took {elapsed:.2f}s, process RSS: {rss_mb} MB")
+
+        if profile is not None and not profile.after_fork:
+            prepare_model(inference_backend, tokenizer, device, profile)
+            print(f"Ready to serve {time.perf_counter() - start:.2f}s after the start of loading")
 
-        return pretrained_model, tokenizer, device
+        return inference_backend, tokenizer, device
     
     except OSError as e:
         print(f"Failed to load model/tokenizer: {e}")
@@ -125,5 +259,3 @@ def load_model_and_tokenizer(model_name: str = 'kris-szczepaniak/DistilBERT-docu
         print(f"Unexpected error: {e}")
 
     return None, None, None
-
-
@@ -1,27 +1,282 @@
+import threading
 import torch
 import torch.nn.functional as F
 
-from src.settings.config import ID_TO_LABEL
-from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
-from typing import Dict, Tuple
+from src.settings.config import ID_TO_LABEL, LONG_DOCUMENT_MAX_WINDOWS, LONG_DOCUMENT_STRIDE, MAX_SEQUENCE_LENGTH, TOKEN_LENGTH_BUCKETS
+from src.utils.metrics import time_stage
+from tokenizers import Encoding, Tokenizer
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Dict, List, Tuple
 
+"""
+Tokenization goes straight to the Rust `tokenizers` backend of the fast tokenizer.
 
-def prepare_text(text: str, tokenizer: DistilBertTokenizer, device: torch.device) -> Dict[str, torch.Tensor]:
+Calling the transformers tokenizer reconfigures truncation and padding of its backend on every call
+and pads the whole batch to its longest member. Instead, a copy of the backend, configured once for
+truncation and no padding, is cached per tokenizer (get_encoder()), texts are encoded with its
+encode_batch() - in parallel, outside the GIL - and padded here.
+
+For batches, texts are grouped into length buckets (TOKEN_LENGTH_BUCKETS) and every bucket is padded
+only to its own longest member, so a 20-token invoice doesn't get padded to 512 tokens just because a
+contract landed in the same batch.
+
+Long documents: the model sees at most 512 tokens, so by default everything after them is cut off.
+With LONG_DOCUMENT_MAX_WINDOWS > 1, the token stream is split into overlapping windows of 512 tokens
+(the encoder's own truncation with a stride, every window gets its [CLS] and [SEP]). All windows of all
+texts of a batch go through the same bucketed forward passes as single-window texts, and the logits of
+a text's windows are averaged into one prediction. A document of N windows costs N rows in a batch,
+not N model calls.
+"""
+
+_encoders: Dict[Tuple[int, int], Tuple[DistilBertTokenizerFast, Tokenizer]] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(tokenizer: DistilBertTokenizerFast, stride: int = 0) -> Tokenizer:
+    """
+    Returns a cached copy of the tokenizer's Rust backend, configured to truncate to the model's max input length 
+    and not to pad. The tokenizer itself is left untouched.
+
+    :param tokenizer: - fast tokenizer, as loaded by load_model_and_tokenizer()
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param stride: - number of tokens consecutive windows overlap by, the text cut off by truncation is kept
+    in Encoding.overflowing as further windows
+    :type stride: int
+    :return: Configured backend tokenizer
+    :rtype: tokenizers.Tokenizer
+    """
+    key = (id(tokenizer), stride)
+    cached = _encoders.get(key)
+
+    if cached is None or cached[0] is not tokenizer:
+        with _encoders_lock:
+            encoder = Tokenizer.from_str(tokenizer.backend_tokenizer.to_str())
+            encoder.enable_truncation(max_length=min(tokenizer.model_max_length, MAX_SEQUENCE_LENGTH), stride=stride)
+            encoder.no_padding()
+
+            cached = (tokenizer, encoder)
+            _encoders[key] = cached
+
+    return cached[1]
+
+
+def close_encoders(tokenizer: DistilBertTokenizerFast):
+    """
+    Forgets the backend copies cached for a tokenizer that's no longer used, so that both can be freed.
+
+    :param tokenizer: - fast tokenizer, as passed to get_encoder()
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    """
+    with _encoders_lock:
+        for key in [key for key, cached in _encoders.items() if cached[0] is tokenizer]:
+            del _encoders[key]
+
+
+def _to_tensors(encodings: List[Encoding], pad_token_id: int, device: torch.device) -> Dict[str, torch.Tensor]:
+    max_length = max(len(encoding.ids) for encoding in encodings)
+
+    input_ids = torch.full((len(encodings), max_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(encodings), max_length), dtype=torch.long)
+
+    for row, encoding in enumerate(encodings):
+        input_ids[row, :len(encoding.ids)] = torch.tensor(encoding.ids, dtype=torch.long)
+        attention_mask[row, :len(encoding.ids)] = 1
+
+    return {'input_ids': input_ids.to(device), 'attention_mask': attention_mask.to(device)}
+
+
+def prepare_text(text: str, tokenizer: DistilBertTokenizerFast, device: torch.device) -> Dict[str, torch.Tensor]:
     """
     This function is to prepare the raw text, so that it can be passed to a transformer model by 
     tokenizing it and converting to PyTorch tensors.
     
     :param text: - raw input string to be tokenized
     :type text: str
-    :param tokenizer: - DistilBertTokenizer-type; converts raw text to token IDs, attention masks, and all that a transformer model needs
-    :type tokenizer: transformers.DistilBertTokenizer
+    :param tokenizer: - DistilBertTokenizerFast-type; converts raw text to token IDs, attention masks, and all that a transformer model needs
+    :type tokenizer: transformers.DistilBertTokenizerFast
     :param device: - CPU or GPU, inferred by PyTorch while preloading the model
     :type device: torch.device
     :return: Dictionary of tokenized input tensors ready for the model.
     :rtype: Dict[str, torch.Tensor]
     """
-    encoded_input = tokenizer(text, truncation=True, padding=True, return_tensors='pt')
-    return encoded_input.to(device)
+    return prepare_texts([text], tokenizer, device)
+
+
+def prepare_texts(texts: List[str], tokenizer: DistilBertTokenizerFast, device: torch.device) -> Dict[str, torch.Tensor]:
+    """
+    Batched version of prepare_text(). All texts are tokenized at once and padded
+    to the longest one, attention mask makes sure padding doesn't affect the predictions.
+
+    :param texts: raw input strings to be tokenized
+    :type texts: List[str]
+    :param tokenizer: DistilBertTokenizerFast-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: CPU or GPU, inferred by PyTorch while preloading the model
+    :type device: torch.device
+    :return: Dictionary of tokenized input tensors of shape (len(texts), longest sequence)
+    :rtype: Dict[str, torch.Tensor]
+    """
+    if not tokenizer.is_fast: # slow, pure-python tokenizer - no Rust backend to go to
+        return tokenizer(texts, truncation=True, padding=True, return_tensors='pt').to(device)
+
+    encodings = get_encoder(tokenizer).encode_batch(texts)
+    return _to_tensors(encodings, tokenizer.pad_token_id, device)
+
+
+def prepare_texts_bucketed(texts: List[str], tokenizer: DistilBertTokenizerFast, device: torch.device,
+                           buckets: Tuple[int, ...] = TOKEN_LENGTH_BUCKETS) -> List[Tuple[List[int], Dict[str, torch.Tensor]]]:
+    """
+    Tokenizes texts at once and groups them by length, so that every group is padded only to its own longest member.
+    A text goes to the smallest bucket its token count fits in.
+
+    :param texts: raw input strings to be tokenized
+    :type texts: List[str]
+    :param tokenizer: DistilBertTokenizerFast-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: CPU or GPU, inferred by PyTorch while preloading the model
+    :type device: torch.device
+    :param buckets: upper bounds of bucket lengths in tokens, ascending
+    :type buckets: Tuple[int, ...]
+    :return: For every non-empty bucket: indices of its texts in texts, and its tokenized input tensors
+    :rtype: List[Tuple[List[int], Dict[str, torch.Tensor]]]
+    """
+    if not tokenizer.is_fast:
+        return [(list(range(len(texts))), prepare_texts(texts, tokenizer, device))]
+
+    encodings = get_encoder(tokenizer).encode_batch(texts)
+    return _bucket_encodings(encodings, tokenizer.pad_token_id, device, buckets)
+
+
+def _bucket_encodings(encodings: List[Encoding], pad_token_id: int, device: torch.device,
+                      buckets: Tuple[int, ...]) -> List[Tuple[List[int], Dict[str, torch.Tensor]]]:
+    grouped: Dict[int, List[int]] = {}
+
+    for i, encoding in enumerate(encodings):
+        bucket = next((bound for bound in buckets if len(encoding.ids) <= bound), buckets[-1])
+        grouped.setdefault(bucket, []).append(i)
+
+    return [
+        (indices, _to_tensors([encodings[i] for i in indices], pad_token_id, device))
+        for _, indices in sorted(grouped.items())
+    ]
+
+
+def encode_windows(texts: List[str], tokenizer: DistilBertTokenizerFast, max_windows: int = LONG_DOCUMENT_MAX_WINDOWS,
+                   stride: int = LONG_DOCUMENT_STRIDE) -> List[List[Encoding]]:
+    """
+    Splits the token stream of every text into overlapping windows of the model's max input length.
+
+    :param texts: raw input strings to be tokenized
+    :type texts: List[str]
+    :param tokenizer: DistilBertTokenizerFast-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param max_windows: window budget per text, windows after it are dropped; 1 means plain truncation
+    :type max_windows: int
+    :param stride: number of tokens consecutive windows overlap by
+    :type stride: int
+    :return: Windows of every text, in order, at least one per text
+    :rtype: List[List[tokenizers.Encoding]]
+    """
+    if max_windows <= 1:
+        return [[encoding] for encoding in get_encoder(tokenizer).encode_batch(texts)]
+
+    encodings = get_encoder(tokenizer, stride).encode_batch(texts)
+    return [[encoding, *encoding.overflowing][:max_windows] for encoding in encodings]
+
+
+def classify_batch(model: DistilBertForSequenceClassification, prepared_texts: Dict[str, torch.Tensor], id_to_label: Dict[int, str] = ID_TO_LABEL) -> List[Tuple[str, float]]:
+    """
+    Classifies a batch of prepared texts in a single forward pass.
+
+    The model is expected to be in evaluation mode already - it is switched once, when it's loaded.
+    The forward pass is run by whichever inference backend wraps the model (see src/model/backends.py),
+    a bare model works too.
+
+    :param model: The transformer model, or an inference backend wrapping it, to use for classification.
+    :type model: transformers.DistilBertForSequenceClassification | src.model.backends.InferenceBackend
+    :param prepared_texts: The tokenized and padded batch, as returned by prepare_texts().
+    :type prepared_texts: Dict[str, torch.Tensor]
+    :param id_to_label: A dictionary mapping class IDs to labels.
+    :type id_to_label: Dict[int, str]
+    :return: The predicted label and confidence score for every row of the batch, in order.
+    :rtype: List[Tuple[str, float]]
+    """
+    with torch.no_grad(): # disable gradient calculation for speed
+        outputs = model(**prepared_texts)
+
+    return _logits_to_predictions(outputs.logits, id_to_label)
+
+
+def _logits_to_predictions(logits: torch.Tensor, id_to_label: Dict[int, str]) -> List[Tuple[str, float]]:
+    probabilities = F.softmax(logits, dim=1) # softmax to get probs
+    confidences, predicted_class_ids = torch.max(probabilities, dim=1) # the class with the highest pred. prob
+
+    return [
+        (id_to_label[class_id], confidence)
+        for class_id, confidence in zip(predicted_class_ids.tolist(), confidences.tolist())
+    ]
+
+
+def classify_texts(model: DistilBertForSequenceClassification, texts: List[str], tokenizer: DistilBertTokenizerFast, device: torch.device,
+                   id_to_label: Dict[int, str] = ID_TO_LABEL, max_windows: int = LONG_DOCUMENT_MAX_WINDOWS,
+                   stride: int = LONG_DOCUMENT_STRIDE) -> List[Tuple[str, float]]:
+    """
+    Tokenizes texts into length buckets and classifies every bucket in its own forward pass.
+    With max_windows > 1 every text is split into up to max_windows overlapping windows, all windows are
+    bucketed together and a text's prediction comes from the mean of its windows' logits.
+
+    :param model: The transformer model, or an inference backend wrapping it, to use for classification.
+    :type model: transformers.DistilBertForSequenceClassification | src.model.backends.InferenceBackend
+    :param texts: raw input strings
+    :type texts: List[str]
+    :param tokenizer: DistilBertTokenizerFast-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: CPU or GPU, inferred by PyTorch while preloading the model
+    :type device: torch.device
+    :param id_to_label: A dictionary mapping class IDs to labels.
+    :type id_to_label: Dict[int, str]
+    :param max_windows: window budget per text, 1 means plain truncation to the model's max input length
+    :type max_windows: int
+    :param stride: number of tokens consecutive windows overlap by
+    :type stride: int
+    :return: The predicted label and confidence score for every text, in order.
+    :rtype: List[Tuple[str, float]]
+    """
+    if max_windows <= 1 or not tokenizer.is_fast:
+        results = [None] * len(texts)
+
+        with time_stage('tokenize'):
+            buckets = prepare_texts_bucketed(texts, tokenizer, device)
+
+        for indices, prepared_texts in buckets:
+            with time_stage('forward'):
+                predictions = classify_batch(model, prepared_texts, id_to_label)
+
+            for i, result in zip(indices, predictions):
+                results[i] = result
+
+        return results
+
+    with time_stage('tokenize'):
+        windows = encode_windows(texts, tokenizer, max_windows, stride)
+        encodings = [encoding for text_windows in windows for encoding in text_windows]
+        owners = torch.tensor([i for i, text_windows in enumerate(windows) for _ in text_windows], device=device)
+        buckets = _bucket_encodings(encodings, tokenizer.pad_token_id, device, TOKEN_LENGTH_BUCKETS)
+
+    logits = None
+
+    for indices, prepared_texts in buckets:
+        with time_stage('forward'), torch.no_grad():
+            bucket_logits = model(**prepared_texts).logits
+
+        if logits is None:
+            logits = torch.zeros(len(texts), bucket_logits.shape[1], dtype=bucket_logits.dtype, device=bucket_logits.device)
+
+        # sum the logits of every text's windows, wherever they landed
+        logits.index_add_(0, owners[indices].to(logits.device), bucket_logits)
+
+    counts = torch.tensor([len(text_windows) for text_windows in windows], dtype=logits.dtype, device=logits.device)
+    return _logits_to_predictions(logits / counts.unsqueeze(1), id_to_label)
 
 
 def classify_text(model: DistilBertForSequenceClassification, prepared_text: Dict[str, torch.Tensor], id_to_label: Dict[int, str] = ID_TO_LABEL) -> Tuple[str, float]:
@@ -37,13 +292,5 @@ def classify_text(model: DistilBertForSequenceClassification, prepared_text: Dic
     :return: The predicted label and confidence score.
     :rtype: Tuple[str, float]
     """
-    model.eval() # we don't need to train, evaluation mode enabled
-    with torch.no_grad(): # disable gradient calculation for speed
-        outputs = model(**prepared_text)
-        logits = outputs.logits # get raw output
-        probabilities = F.softmax(logits, dim=1) # softmax to get probs
-        predicted_class_id = torch.argmax(probabilities, dim=1).item() # get the class with the highest pred. prob
-        predicted_label = ID_TO_LABEL[predicted_class_id]
-        confidence = probabilities[0, predicted_class_id].item() # pred confidence score
-
+    predicted_label, confidence = classify_batch(model, prepared_text, id_to_label)[0]
     return predicted_label, confidence
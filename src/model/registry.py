@@ -0,0 +1,410 @@
+import argparse
+import asyncio
+import gc
+import os
+import threading
+import time
+import torch
+import weakref
+
+from contextlib import contextmanager
+from functools import wraps
+from src.model.backends import InferenceBackend
+from src.model.batching import close_scheduler
+from src.model.model_preloader import load_model_and_tokenizer
+from src.model.model_utils import close_encoders
+from src.model.snapshot import model_identity
+from src.model.startup import StartupProfile, prepare_model, startup_profile
+from src.settings.config import MODEL_MAX_RESIDENT_VERSIONS, MODEL_NAME, MODEL_PATH, MODEL_REGISTRY_DIR, MODEL_REGISTRY_POLL_SECONDS
+from src.utils.metrics import MODEL_SWAPS
+from src.utils.near_duplicates import close_near_duplicate_index, get_near_duplicate_index
+from transformers import DistilBertTokenizerFast
+from typing import Dict, List, Optional
+
+"""
+Versioned local model registry, and hot swap of the model served without restarting workers.
+
+A registry is a directory of local snapshots (see src/model/snapshot.py), one per version, and a CURRENT file
+naming the version to serve:
+
+    models/
+        CURRENT            <- "2024-06-retrain"
+        2024-05-initial/   <- config.json, model.safetensors, tokenizer files
+        2024-06-retrain/
+
+    python -m src.model.snapshot --revision <commit hash> --output models/2024-06-retrain
+    python -m src.model.registry activate 2024-06-retrain --registry models
+
+Every serving process watches CURRENT (every MODEL_REGISTRY_POLL_SECONDS, from a thread started with the first
+request - after gunicorn forked it). When it names another version, the process loads it in the background,
+applies the startup profile to it - a new version is warmed up before it takes a single request - and swaps it in.
+The swap is a pointer under a lock: a request pins the version it starts with (use()) and finishes on it, even if
+a swap happens meanwhile, so there's no reload on the request path and no request sees two versions. The old
+version is released - its scheduler stopped, its weights freed - once its last request is done.
+
+At most MODEL_MAX_RESIDENT_VERSIONS versions are in memory: the one served, and one being loaded or draining.
+A swap waits for the previous old version to drain before it loads the next one. A version that fails to load
+is remembered and not retried until its directory changes - the active version keeps serving.
+
+Without MODEL_REGISTRY_DIR, the model is loaded once from MODEL_PATH / MODEL_NAME, as before, and its version
+is MODEL_NAME@MODEL_REVISION, or the snapshot's name and fingerprint - see model_identity().
+"""
+
+CURRENT_FILE = 'CURRENT'
+
+
+class ModelVersion:
+    """
+    A loaded version of the model, and the number of requests being served with it.
+    """
+
+    def __init__(self, version: Optional[str], model: Optional[InferenceBackend], tokenizer: Optional[DistilBertTokenizerFast], device: Optional[torch.device]):
+        """
+        :param version: Version name, the snapshot directory in the registry
+        :type version: Optional[str]
+        :param model: Inference backend, None if loading failed
+        :type model: Optional[InferenceBackend]
+        :param tokenizer: DistilBERT-type tokenizer
+        :type tokenizer: Optional[transformers.DistilBertTokenizerFast]
+        :param device: Device type (CPU or GPU) as read by PyTorch
+        :type device: Optional[torch.device]
+        """
+        self.version = version
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.in_flight = 0
+        self.loaded_at = time.time()
+
+
+def list_versions(registry_dir: str) -> List[str]:
+    """
+    :param registry_dir: Registry directory
+    :type registry_dir: str
+    :return: Names of the versions in the registry, sorted
+    :rtype: List[str]
+    """
+    return sorted(name for name in os.listdir(registry_dir) if os.path.isdir(os.path.join(registry_dir, name)) and not name.startswith('.'))
+
+
+def read_current_version(registry_dir: str) -> Optional[str]:
+    """
+    :param registry_dir: Registry directory
+    :type registry_dir: str
+    :return: Version named in the CURRENT file, None if there's none
+    :rtype: Optional[str]
+    """
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def activate_version(registry_dir: str, version: str):
+    """
+    Points CURRENT at a version. The file is replaced atomically, serving processes never read half of it.
+
+    :param registry_dir: Registry directory
+    :type registry_dir: str
+    :param version: Version to serve
+    :type version: str
+    """
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"Unknown model version: {version}. Available versions: {', '.join(list_versions(registry_dir))}")
+
+    temp_path = os.path.join(registry_dir, f'.{CURRENT_FILE}.{os.getpid()}')
+
+    with open(temp_path, 'w') as f:
+        f.write(version + '\n')
+
+    os.replace(temp_path, os.path.join(registry_dir, CURRENT_FILE))
+
+
+class ModelRegistry:
+    """
+    The version of the model this process serves, swapped without a restart when the registry's CURRENT changes.
+    """
+
+    def __init__(self, registry_dir: str = MODEL_REGISTRY_DIR, model_name: str = MODEL_NAME, model_path: str = MODEL_PATH,
+                 profile: StartupProfile = startup_profile, poll_seconds: float = MODEL_REGISTRY_POLL_SECONDS,
+                 max_resident: int = MODEL_MAX_RESIDENT_VERSIONS):
+        """
+        Loads the version to serve - CURRENT of the registry, or model_path / model_name without one.
+
+        :param registry_dir: Registry directory, None to serve model_path / model_name without swaps
+        :type registry_dir: str
+        :param model_name: Hugging Face model name, loaded without a registry or model_path
+        :type model_name: str
+        :param model_path: Local snapshot directory, used without a registry
+        :type model_path: str
+        :param profile: Startup profile the first version is loaded with, and every version swapped in is prepared with
+        :type profile: StartupProfile
+        :param poll_seconds: How often CURRENT is read
+        :type poll_seconds: float
+        :param max_resident: Versions in memory at once, at least 2 - the one served and the one swapped in
+        :type max_resident: int
+        """
+        self.registry_dir = registry_dir
+        self.profile = profile
+        self.poll_seconds = poll_seconds
+        self.max_resident = max(2, max_resident)
+
+        self._lock = threading.Condition()
+        self._swap_lock = threading.Lock()
+        self._draining: List[ModelVersion] = []
+        self._failed: Dict[str, Dict] = {}
+        self._swaps = 0
+        self._last_swap = None
+        self._watcher = None
+        self._stopped = threading.Event()
+
+        if registry_dir is None:
+            version = model_identity(model_name, model_path)
+            self.active = ModelVersion(version, *load_model_and_tokenizer(model_name, model_path=model_path, profile=profile))
+            self._open_near_duplicate_index(self.active)
+            return
+
+        version = read_current_version(registry_dir)
+
+        if version is None:
+            print(f"No {CURRENT_FILE} version in model registry {registry_dir}, nothing to serve until one is activated")
+            self.active = ModelVersion(None, None, None, None)
+            return
+
+        version_dir = self._version_dir(version)
+        self.active = ModelVersion(version, *load_model_and_tokenizer(model_name, model_path=version_dir, onnx_path=os.path.join(version_dir, 'model.onnx'), profile=profile))
+        self._open_near_duplicate_index(self.active)
+
+    @staticmethod
+    def _open_near_duplicate_index(served: ModelVersion):
+        # before the version takes requests, with the index saved for it - the saved labels are this version's only
+        if served.model is not None:
+            get_near_duplicate_index(served.model, served.version)
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.registry_dir, os.path.basename(version))
+
+    @contextmanager
+    def use(self):
+        """
+        Pins the active version for the duration of a request - it's served by that version to the end,
+        whatever is swapped in meanwhile.
+
+        :return: The version serving the request
+        :rtype: ModelVersion
+        """
+        if self._watcher is None and self.registry_dir is not None:
+            self.start_watcher()
+
+        with self._lock:
+            served = self.active
+            served.in_flight += 1
+
+        try:
+            yield served
+        finally:
+            with self._lock:
+                served.in_flight -= 1
+
+                if served.in_flight == 0 and served is not self.active:
+                    self._lock.notify_all()
+
+    def start_watcher(self):
+        """
+        Starts the thread swapping versions when CURRENT changes. Started by the first request, so that it runs
+        in every forked worker rather than in the gunicorn master.
+        """
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='model-registry', daemon=True)
+                self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.poll_seconds):
+            try:
+                self.release_drained()
+                version = read_current_version(self.registry_dir)
+
+                if version is not None and version != self.active.version and not self._failed_before(version):
+                    self.swap_to(version)
+            except Exception as e:
+                print(f"Model registry watcher error: {e}")
+
+    def _failed_before(self, version: str) -> bool:
+        failure = self._failed.get(version)
+        return failure is not None and failure["mtime"] == self._mtime(version)
+
+    def _mtime(self, version: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self._version_dir(version))
+        except OSError:
+            return None
+
+    def release_drained(self):
+        """
+        Releases old versions whose last request is done - called by the watcher and by swap_to().
+        """
+        with self._lock:
+            drained = [served for served in self._draining if served.in_flight == 0]
+            self._draining = [served for served in self._draining if served.in_flight > 0]
+
+        if not drained:
+            return
+
+        weights = []
+
+        while drained:
+            served = drained.pop()
+
+            if served.model is not None:
+                close_scheduler(served.model)
+                close_near_duplicate_index(served.model)
+                close_encoders(served.tokenizer)
+                weights.append(weakref.ref(served.model.model))
+
+            print(f"Model version {served.version} released")
+            del served
+
+        # eager weights are freed by reference counting as the version is dropped. A traced forward pass holds them
+        # in a reference cycle, which only a full collection frees - it stops every thread for a while, so it's
+        # run only when it's needed to stay within max_resident
+        if any(ref() is not None for ref in weights):
+            gc.collect()
+
+    def swap_to(self, version: str) -> bool:
+        """
+        Loads a version, prepares it with the startup profile and makes it the active one. Requests in flight
+        finish on the version they started with, the old version is released once they're done.
+        Waits for earlier old versions to drain first, so that no more than max_resident versions are in memory.
+
+        :param version: Version in the registry
+        :type version: str
+        :return: Whether the version is served now, False if it failed to load
+        :rtype: bool
+        """
+        if self.registry_dir is None:
+            raise ValueError("Model versions can only be swapped with MODEL_REGISTRY_DIR set")
+
+        with self._swap_lock:
+            if version == self.active.version:
+                return True
+
+            # the active version and the one about to be loaded are resident too
+            with self._lock:
+                self._lock.wait_for(lambda: sum(served.in_flight > 0 for served in self._draining) + 2 <= self.max_resident)
+
+            self.release_drained()
+
+            start = time.perf_counter()
+            version_dir = self._version_dir(version)
+            model, tokenizer, device = load_model_and_tokenizer(model_path=version_dir, onnx_path=os.path.join(version_dir, 'model.onnx'))
+
+            try:
+                if model is None:
+                    raise RuntimeError("model or tokenizer could not be loaded")
+
+                prepare_model(model, tokenizer, device, self.profile)
+            except Exception as e:
+                print(f"Model version {version} failed to load, still serving {self.active.version}: {e}")
+                self._failed[version] = {"error": str(e), "mtime": self._mtime(version)}
+                MODEL_SWAPS.labels(outcome='failed').inc()
+                return False
+
+            served = ModelVersion(version, model, tokenizer, device)
+            self._open_near_duplicate_index(served)
+
+            with self._lock:
+                previous = self.active
+                self.active = served
+                self._draining.append(previous)
+                self._swaps += 1
+                self._last_swap = {"from": previous.version, "to": version, "load_seconds": time.perf_counter() - start, "at": time.time()}
+
+            self._failed.pop(version, None)
+            MODEL_SWAPS.labels(outcome='swapped').inc()
+            print(f"Model version {version} swapped in after {time.perf_counter() - start:.2f}s, {previous.version} drains {previous.in_flight} requests")
+            # the old version mustn't outlive its release here - its weights would look like they need a full collection
+            del previous
+
+        self.release_drained()
+        return True
+
+    def stats(self) -> Dict:
+        """
+        :return: Active version, versions in memory with their requests in flight, swaps and failed versions
+        :rtype: Dict
+        """
+        with self._lock:
+            resident = [self.active, *self._draining]
+
+            return {
+                "registry": self.registry_dir,
+                "active": self.active.version,
+                "resident": [{"version": served.version, "in_flight": served.in_flight, "loaded_at": served.loaded_at,
+                              "state": 'active' if served is self.active else 'draining'} for served in resident],
+                "swaps": self._swaps,
+                "last_swap": self._last_swap,
+                "failed": {version: failure["error"] for version, failure in self._failed.items()},
+            }
+
+
+def serve_with_model(registry: ModelRegistry):
+    """
+    Decorates a route, sync or async, to run with a version pinned by registry.use(), passed as served.
+
+    :param registry: Model registry of the app
+    :type registry: ModelRegistry
+    """
+    def decorator(route):
+        if asyncio.iscoroutinefunction(route):
+            @wraps(route)
+            async def async_route(*args, **kwargs):
+                with registry.use() as served:
+                    return await route(*args, served=served, **kwargs)
+
+            return async_route
+
+        @wraps(route)
+        def sync_route(*args, **kwargs):
+            with registry.use() as served:
+                return route(*args, served=served, **kwargs)
+
+        return sync_route
+
+    return decorator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the versions of a model registry, or activate one")
+    parser.add_argument('command', choices=['list', 'activate'])
+    parser.add_argument('version', nargs='?', help="version to activate")
+    parser.add_argument('--registry', default=MODEL_REGISTRY_DIR, help="registry directory, MODEL_REGISTRY_DIR by default")
+    args = parser.parse_args()
+
+    if not args.registry:
+        raise SystemExit("Pass --registry <directory> or set MODEL_REGISTRY_DIR")
+
+    if args.command == 'list':
+        current = read_current_version(args.registry)
+
+        for version in list_versions(args.registry):
+            print(f"{'*' if version == current else ' '} {version}")
+        return
+
+    if not args.version:
+        raise SystemExit("Pass the version to activate")
+
+    try:
+        activate_version(args.registry, args.version)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    print(f"{args.version} activated, serving processes swap it in within {MODEL_REGISTRY_POLL_SECONDS}s")
+
+
+if __name__ == '__main__':
+    main()
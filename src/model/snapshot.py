@@ -0,0 +1,78 @@
+import argparse
+import hashlib
+import os
+
+from huggingface_hub import snapshot_download
+from src.settings.config import MODEL_NAME, MODEL_REVISION
+
+"""
+Takes a local, pinned snapshot of the model from Hugging Face, to be loaded with MODEL_PATH - or saved as a version
+of a model registry, see src/model/registry.py.
+
+With a snapshot, startup doesn't need the network and the weights can be memory-mapped 
+(see load_model_from_snapshot()). Pin the revision to a commit hash, so that every deploy serves 
+exactly the same model.
+
+    python -m src.model.snapshot --revision <commit hash> --output models/distilbert
+    MODEL_PATH=models/distilbert gunicorn -c gunicorn.conf.py run:app
+"""
+
+SNAPSHOT_FILES = ['config.json', 'model.safetensors', '*.txt', 'tokenizer*.json', 'special_tokens_map.json']
+
+
+def download_snapshot(output_dir: str, model_name: str = MODEL_NAME, revision: str = MODEL_REVISION) -> str:
+    """
+    Downloads config, safetensors weights and tokenizer files of the model to output_dir.
+
+    :param output_dir: Local snapshot directory
+    :type output_dir: str
+    :param model_name: Hugging Face model name
+    :type model_name: str
+    :param revision: Branch, tag or commit hash
+    :type revision: str
+    :return: Path to the snapshot
+    :rtype: str
+    """
+    return snapshot_download(repo_id=model_name, revision=revision, local_dir=output_dir, allow_patterns=SNAPSHOT_FILES)
+
+
+def model_identity(model_name: str = MODEL_NAME, model_path: str = None, revision: str = MODEL_REVISION) -> str:
+    """
+    Names the model served without a registry, for cache keys and model_version in responses: name@revision of
+    the hub model, or the snapshot directory's name and a fingerprint of its files - their names, sizes and
+    modification times, so that a snapshot replaced at the same MODEL_PATH is a different model. The weights aren't read.
+
+    :param model_name: Hugging Face model name
+    :type model_name: str
+    :param model_path: Local snapshot directory, if the model is loaded from one
+    :type model_path: str
+    :param revision: Branch, tag or commit hash the hub model is loaded at
+    :type revision: str
+    :return: Model identity
+    :rtype: str
+    """
+    if not model_path:
+        return f"{model_name}@{revision}"
+
+    digest = hashlib.sha256()
+
+    for filename in sorted(os.listdir(model_path)):
+        stat = os.stat(os.path.join(model_path, filename))
+        digest.update(f"{filename}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode('utf-8'))
+
+    return f"{os.path.basename(os.path.normpath(model_path))}@{digest.hexdigest()[:12]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download a pinned local snapshot of the model")
+    parser.add_argument('--output', required=True, help="snapshot directory, later passed as MODEL_PATH")
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--revision', default=MODEL_REVISION, help="commit hash to pin to")
+    args = parser.parse_args()
+
+    path = download_snapshot(args.output, args.model, args.revision)
+    print(f"Snapshot of {args.model}@{args.revision} saved to {path}")
+
+
+if __name__ == '__main__':
+    main()
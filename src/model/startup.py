@@ -0,0 +1,199 @@
+import statistics
+import time
+import torch
+
+from src.model.backends import EagerBackend, InferenceBackend
+from src.model.model_utils import classify_batch, prepare_texts, prepare_texts_bucketed
+from src.settings.config import (
+    CPU_CORE_BUDGET,
+    MODEL_OPTIMIZATION,
+    MODEL_OPTIMIZATIONS,
+    SERVING_PROCESSES,
+    TOKEN_LENGTH_BUCKETS,
+    TORCH_INTEROP_THREADS,
+    WARMUP_BATCH_SIZES,
+    WARMUP_ENABLED,
+    WARMUP_ROUNDS,
+)
+from transformers import DistilBertTokenizerFast
+from typing import Dict, Tuple
+
+"""
+Startup profile - what a process does with the model after loading it, before it takes requests.
+
+1. Thread budget. torch's intra-op pool defaults to every core, in every process - 4 gunicorn workers on
+   4 cores ran 16 threads fighting for them. A process gets CPU_CORE_BUDGET // SERVING_PROCESSES threads instead.
+2. Optimisation of the eager forward pass, optionally: traced to TorchScript or torch.compile'd, see EagerBackend.optimize().
+3. Warm-up. The first forward pass of every shape is slow (allocator, oneDNN kernels, compiled graphs), so that cost
+   used to land on the first requests after a deploy. Batches of WARMUP_BATCH_SIZES at every length of
+   TOKEN_LENGTH_BUCKETS (the shapes the batch scheduler pads to) are run WARMUP_ROUNDS times each. The first pass
+   of a shape is its cold latency, the median of the rest its steady-state one - both are logged, with the time
+   startup took, and kept in the report prepare_model() returns.
+
+load_model_and_tokenizer() runs it all when given a profile. A preforking server (gunicorn with preload_app)
+loads the model in the master, but forward passes in the master would start an OpenMP pool that forked workers
+can't use safely - there the profile is marked after_fork and every worker runs prepare_model() itself,
+once it's forked and before it takes requests (see gunicorn.conf.py).
+"""
+
+
+class StartupProfile:
+    """
+    How a process prepares the model for serving.
+    """
+
+    def __init__(self, processes: int = SERVING_PROCESSES, core_budget: int = CPU_CORE_BUDGET, interop_threads: int = TORCH_INTEROP_THREADS,
+                 optimization: str = MODEL_OPTIMIZATION, warmup: bool = WARMUP_ENABLED, warmup_lengths: Tuple[int, ...] = TOKEN_LENGTH_BUCKETS,
+                 warmup_batch_sizes: Tuple[int, ...] = WARMUP_BATCH_SIZES, warmup_rounds: int = WARMUP_ROUNDS, after_fork: bool = False):
+        """
+        :param processes: Processes running forward passes on this machine, sharing core_budget
+        :type processes: int
+        :param core_budget: Cores for forward passes, all processes together
+        :type core_budget: int
+        :param interop_threads: Threads of torch's inter-op pool
+        :type interop_threads: int
+        :param optimization: One of MODEL_OPTIMIZATIONS
+        :type optimization: str
+        :param warmup: Whether forward passes are warmed up
+        :type warmup: bool
+        :param warmup_lengths: Sequence lengths warmed up, in tokens
+        :type warmup_lengths: Tuple[int, ...]
+        :param warmup_batch_sizes: Batch sizes warmed up at every length
+        :type warmup_batch_sizes: Tuple[int, ...]
+        :param warmup_rounds: Forward passes per shape, at least 2 - the first is cold
+        :type warmup_rounds: int
+        :param after_fork: The model is loaded before a fork, prepare_model() is left to every forked process
+        :type after_fork: bool
+        """
+        if optimization not in MODEL_OPTIMIZATIONS:
+            raise ValueError(f"Unknown model optimization: {optimization}. Available optimizations: {', '.join(MODEL_OPTIMIZATIONS)}")
+
+        self.processes = processes
+        self.core_budget = core_budget
+        self.interop_threads = interop_threads
+        self.optimization = optimization
+        self.warmup = warmup
+        self.warmup_lengths = warmup_lengths
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.warmup_rounds = max(2, warmup_rounds)
+        self.after_fork = after_fork
+
+    @property
+    def intra_op_threads(self) -> int:
+        return max(1, self.core_budget // max(1, self.processes))
+
+
+# the profile of this process - gunicorn.conf.py adjusts it before the app is preloaded
+startup_profile = StartupProfile()
+
+
+def apply_thread_budget(profile: StartupProfile) -> int:
+    """
+    Sets torch's thread pools of this process to the profile's share of the cores.
+
+    :param profile: Startup profile
+    :type profile: StartupProfile
+    :return: Intra-op threads set
+    :rtype: int
+    """
+    torch.set_num_threads(profile.intra_op_threads)
+
+    try:
+        torch.set_num_interop_threads(profile.interop_threads)
+    except RuntimeError:
+        # can be set once per process only, before any inter-op work - e.g. the master already set it
+        pass
+
+    return profile.intra_op_threads
+
+
+def make_warmup_texts(length: int, batch_size: int) -> list:
+    # 'invoice' is a single token, length - 2 of them plus [CLS] and [SEP] make about length tokens
+    return ["invoice " * max(1, length - 2)] * batch_size
+
+
+def warm_up(backend: InferenceBackend, tokenizer: DistilBertTokenizerFast, device: torch.device, profile: StartupProfile) -> Dict[str, Dict[str, float]]:
+    """
+    Runs forward passes of every warm-up shape, the way the batch scheduler does, but outside of metrics.
+
+    :param backend: Inference backend
+    :type backend: InferenceBackend
+    :param tokenizer: DistilBERT-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :param profile: Startup profile, tells the shapes and rounds
+    :type profile: StartupProfile
+    :return: Cold and steady-state latency in ms by shape ('<batch size>x<length>')
+    :rtype: Dict[str, Dict[str, float]]
+    """
+    shapes = {}
+
+    for length in profile.warmup_lengths:
+        for batch_size in profile.warmup_batch_sizes:
+            buckets = prepare_texts_bucketed(make_warmup_texts(length, batch_size), tokenizer, device)
+            latencies = []
+
+            for _ in range(profile.warmup_rounds):
+                start = time.perf_counter()
+
+                for _, prepared_texts in buckets:
+                    classify_batch(backend, prepared_texts)
+
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            shapes[f"{batch_size}x{length}"] = {"cold_ms": latencies[0], "warm_ms": statistics.median(latencies[1:])}
+
+    return shapes
+
+
+def prepare_model(backend: InferenceBackend, tokenizer: DistilBertTokenizerFast, device: torch.device, profile: StartupProfile) -> Dict:
+    """
+    Applies the startup profile to a loaded model: thread budget, optimisation and warm-up, see the module docstring.
+    The backend is optimised in place.
+
+    :param backend: Inference backend wrapping the loaded model
+    :type backend: InferenceBackend
+    :param tokenizer: DistilBERT-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :param profile: Startup profile
+    :type profile: StartupProfile
+    :return: Threads, optimisation applied, seconds spent on optimisation and warm-up, and warm-up latencies by shape
+    :rtype: Dict
+    """
+    report = {"threads": apply_thread_budget(profile), "optimization": 'none', "optimize_seconds": 0.0, "warmup_seconds": 0.0, "shapes": {}}
+
+    if profile.optimization != 'none':
+        if isinstance(backend, EagerBackend):
+            start = time.perf_counter()
+            # padded, so that tracing goes through the attention mask
+            backend.optimize(profile.optimization, prepare_texts(["invoice total due", "invoice"], tokenizer, device))
+            report["optimization"] = profile.optimization
+            report["optimize_seconds"] = time.perf_counter() - start
+        else:
+            print(f"Model optimization {profile.optimization} applies to the eager backend only, {backend.name} is used as it is")
+
+    if profile.warmup:
+        start = time.perf_counter()
+
+        try:
+            report["shapes"] = warm_up(backend, tokenizer, device, profile)
+        except Exception as e:
+            if report["optimization"] == 'none':
+                raise
+
+            # e.g. torch.compile without a C++ compiler, it only fails on the first forward pass
+            print(f"Optimized forward pass failed ({type(e).__name__}: {e}), falling back to eager")
+            backend.optimize('none', {})
+            report["optimization"] = 'none'
+            report["shapes"] = warm_up(backend, tokenizer, device, profile)
+
+        report["warmup_seconds"] = time.perf_counter() - start
+
+    shapes = ", ".join(f"{shape} {latency['cold_ms']:.0f}/{latency['warm_ms']:.0f}" for shape, latency in report["shapes"].items())
+    print(f"Model prepared: {report['threads']} threads, optimization: {report['optimization']} ({report['optimize_seconds']:.2f}s), "
+          f"warm-up {report['warmup_seconds']:.2f}s" + (f", cold/warm ms: {shapes}" if shapes else ""))
+
+    return report
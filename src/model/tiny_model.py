@@ -0,0 +1,69 @@
+import os
+import tempfile
+import torch
+
+from src.settings.config import ID_TO_LABEL
+from transformers import DistilBertConfig, DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Tuple
+
+"""
+A tiny, randomly initialised DistilBERT stand-in.
+
+The real classifier lives on Hugging Face and weighs ~260MB, which is not something
+we want to download in tests or benchmarks. This model has the same architecture,
+the same labels and the same tokenizer type, so every code path that touches
+the model can be exercised offline. Its predictions are of course meaningless.
+"""
+
+TINY_VOCAB = [
+    '[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]',
+    *list('abcdefghijklmnopqrstuvwxyz0123456789.,:;-/'),
+    *[f'##{c}' for c in 'abcdefghijklmnopqrstuvwxyz0123456789'],
+    'invoice', 'passport', 'driving', 'license', 'licence', 'contract', 'employment',
+    'total', 'amount', 'due', 'date', 'name', 'number', 'agreement', 'party', 'the',
+    'of', 'and', 'to', 'for', 'nationality', 'birth', 'expiry', 'issue', 'vat', 'tax',
+]
+
+
+def build_tiny_model_and_tokenizer(save_dir: str = None, seed: int = 0) -> Tuple[DistilBertForSequenceClassification, DistilBertTokenizerFast]:
+    """
+    Builds a tiny DistilBERT sequence classifier with random weights and a matching WordPiece tokenizer.
+
+    :param save_dir: If given, model and tokenizer are saved there with save_pretrained(), so they can be loaded like a local snapshot
+    :type save_dir: str
+    :param seed: Seed for weight initialisation, so that runs are reproducible
+    :type seed: int
+    :return: A tuple consisting of: model instance in evaluation mode and tokenizer instance
+    :rtype: Tuple[DistilBertForSequenceClassification, DistilBertTokenizerFast]
+    """
+    config = DistilBertConfig(
+        vocab_size=len(TINY_VOCAB),
+        dim=32,
+        n_layers=2,
+        n_heads=2,
+        hidden_dim=64,
+        max_position_embeddings=512,
+        initializer_range=0.5,
+        num_labels=len(ID_TO_LABEL),
+        id2label=ID_TO_LABEL,
+        label2id={label: idx for idx, label in ID_TO_LABEL.items()},
+    )
+
+    torch.manual_seed(seed)
+    model = DistilBertForSequenceClassification(config)
+    model.eval()
+
+    vocab_dir = save_dir or tempfile.mkdtemp(prefix='tiny-distilbert-')
+    os.makedirs(vocab_dir, exist_ok=True)
+    vocab_file = os.path.join(vocab_dir, 'vocab.txt')
+
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(TINY_VOCAB) + '\n')
+
+    tokenizer = DistilBertTokenizerFast.from_pretrained(vocab_dir, model_max_length=512)
+
+    if save_dir:
+        model.save_pretrained(save_dir)
+        tokenizer.save_pretrained(save_dir)
+
+    return model, tokenizer
@@ -1,3 +1,5 @@
+import os
+
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'docx', 'txt'}
 
 ALLOWED_MIME_TYPES = {
@@ -11,4 +13,157 @@ ALLOWED_MIME_TYPES = {
 
 ALLOWED_IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png')
 
-ID_TO_LABEL = {0: 'invoice', 1: 'driving_license', 2: 'contract', 3: 'passport'}
\ No newline at end of file
+# Upload intake, see src/utils/intake.py
+MAX_UPLOAD_BYTES = { # per file, by extension - larger files are rejected before they're parsed
+    'pdf': 50 * 1024 * 1024,
+    'docx': 20 * 1024 * 1024,
+    'png': 20 * 1024 * 1024,
+    'jpg': 20 * 1024 * 1024,
+    'jpeg': 20 * 1024 * 1024,
+    'txt': 5 * 1024 * 1024,
+}
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', 256 * 1024 * 1024)) # whole request body, all files of /classify-files included
+UPLOAD_MMAP_MIN_BYTES = 1024 * 1024 # uploads spooled to disk from this size up are memory-mapped for extraction, smaller ones are read
+UPLOAD_SNIFF_BYTES = 8192 # bytes looked at to tell the real type of an upload
+
+MODEL_NAME = 'kris-szczepaniak/DistilBERT-document-classifier'
+MODEL_REVISION = os.getenv('MODEL_REVISION', 'main') # pin to a commit hash when taking a snapshot for deployment
+MODEL_PATH = os.getenv('MODEL_PATH') # local snapshot directory - if set, the model is loaded from there, offline and memory-mapped
+
+# Versioned model registry and hot swap, see src/model/registry.py
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR') # a snapshot per version subdirectory, CURRENT names the one served - MODEL_PATH / MODEL_NAME if not set
+MODEL_REGISTRY_POLL_SECONDS = 5 # how often a serving process looks at CURRENT
+MODEL_MAX_RESIDENT_VERSIONS = 2 # the version served and one being swapped in or draining, a third waits until one is released
+
+# How the forward pass is run, see src/model/backends.py
+MODEL_BACKENDS = ('eager', 'int8', 'onnx')
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'eager')
+ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH') # exported graph is reused from here, exported to a temp dir if not set
+
+# Startup profile of a process serving the model, see src/model/startup.py
+SERVING_PROCESSES = int(os.getenv('WEB_CONCURRENCY', 1)) # processes running forward passes on this machine, gunicorn.conf.py sets its worker count
+REQUEST_THREADS = int(os.getenv('REQUEST_THREADS', 8)) # request threads of a gunicorn worker, concurrent requests share a forward pass
+CPU_CORE_BUDGET = int(os.getenv('CPU_CORE_BUDGET', os.cpu_count() or 1)) # cores all of them may use for forward passes together
+TORCH_INTEROP_THREADS = 1 # forward passes are run one at a time by the batch scheduler, there's nothing to run alongside
+MODEL_OPTIMIZATIONS = ('none', 'trace', 'compile')
+MODEL_OPTIMIZATION = os.getenv('MODEL_OPTIMIZATION', 'none') # eager backend only, 'compile' needs a C++ compiler and takes ~30s of warm-up
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1') != '0'
+WARMUP_BATCH_SIZES = (1, 4) # batch sizes warmed up at every length in TOKEN_LENGTH_BUCKETS
+WARMUP_ROUNDS = 3 # forward passes per shape, the first is cold and the rest tell the steady-state latency
+
+ID_TO_LABEL = {0: 'invoice', 1: 'driving_license', 2: 'contract', 3: 'passport'}
+
+# Tokenization, see src/model/model_utils.py
+MAX_SEQUENCE_LENGTH = 512 # DistilBERT's max input length in tokens
+TOKEN_LENGTH_BUCKETS = (64, 128, 256, 512) # a batch is split by these lengths, so short texts aren't padded to long ones
+
+# Long documents, see src/model/model_utils.py
+LONG_DOCUMENT_MAX_WINDOWS = int(os.getenv('LONG_DOCUMENT_MAX_WINDOWS', 1)) # windows of MAX_SEQUENCE_LENGTH tokens classified per text, 1 = plain truncation
+LONG_DOCUMENT_STRIDE = 128 # tokens consecutive windows overlap by
+
+# Lexical pre-classifier, the first stage of the classification cascade, see src/model/lexical.py
+LEXICAL_MODEL_PATH = os.getenv('LEXICAL_MODEL_PATH') # fitted with python -m src.model.lexical, the cascade is off if not set
+LEXICAL_CONFIDENCE_THRESHOLD = float(os.environ['LEXICAL_CONFIDENCE_THRESHOLD']) if os.getenv('LEXICAL_CONFIDENCE_THRESHOLD') else None # overrides the calibrated one
+LEXICAL_TARGET_AGREEMENT = 0.99 # share of early exits that must match the transformer's label, when calibrating
+LEXICAL_N_FEATURES = 2 ** 18 # hash buckets of word and word-pair features
+LEXICAL_MAX_CHARS = 20_000 # the lexical model reads only the beginning of a long text
+LEXICAL_AUDIT_RATE = 0.05 # share of early exits also sent to the transformer in the background, to measure agreement
+
+# Micro-batching of concurrent classification requests, see src/model/batching.py
+BATCH_MAX_SIZE = 16 # max number of texts in a single forward pass
+BATCH_MAX_WAIT_MS = 10 # how long the first request in a batch may wait for company
+
+# Multi-file requests (/classify-files)
+MAX_FILES_PER_REQUEST = 100
+EXTRACTION_WORKERS = 4 # threads extracting text from uploaded files in parallel
+
+# Async serving mode (run_async.py), see src/asgi_app.py
+ASYNC_EXTRACTION_WORKERS = max(1, min(4, os.cpu_count() or 1)) # processes extracting text, shared by all connections of a worker
+ASYNC_WORKERS = int(os.getenv('ASYNC_WORKERS', 1)) # uvicorn worker processes, each loads its own model
+
+# Bulk classification of a directory tree (run_bulk.py), see src/utils/bulk.py
+BULK_WORKERS = max(1, (os.cpu_count() or 2) - 1) # extraction processes, one core is left to the forward pass
+BULK_IN_FLIGHT_PER_WORKER = 4 # files extracted or classified at once per worker, bounds memory and keeps the workers busy
+BULK_CLASSIFY_THREADS = BATCH_MAX_SIZE # threads feeding extracted texts to the batch scheduler, one batch worth
+BULK_REPORT_SECONDS = 10 # how often throughput is printed
+BULK_EXTRACTION_RETRIES = 2 # times a file is given to a new pool after the extraction pool died under it, then it's left for the next run
+
+# Result cache keyed on upload bytes, see src/utils/result_cache.py
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', '1') != '0' # CACHE_ENABLED=0 e.g. for load tests, which upload the same files over and over
+CACHE_MAX_ENTRIES = 1024 # in-memory LRU tier, per worker process
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH') # optional SQLite tier shared by all workers, disabled if not set
+CACHE_DB_MAX_ENTRIES = 100_000
+
+# Job API (/jobs) for long documents, see src/utils/job_queue.py
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'jobs.sqlite') # SQLite database shared by the app and the job workers (run_jobs.py)
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2)) # jobs processed at once by a run_jobs.py process
+JOBS_MAX_QUEUED = 1000 # queued and running jobs, POST /jobs answers 503 above that
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETRY_DELAY_SECONDS = 5 # multiplied by the number of attempts so far
+JOBS_LEASE_SECONDS = 10 * 60 # a running job is given to another worker after this long, in case its worker died
+JOBS_QUEUED_TTL_SECONDS = 60 * 60 # a job nobody picked up in this time expires
+JOBS_RESULT_TTL_SECONDS = 24 * 60 * 60 # finished jobs are kept for this long after they finished
+JOBS_POLL_SECONDS = 0.5 # how long an idle worker waits before looking for jobs again
+
+# Prometheus metrics, see src/utils/metrics.py
+METRICS_DIR = os.getenv('METRICS_DIR') # shared by all processes of a server, needed to sum up metrics of gunicorn workers and process pools
+
+# OCR engine, see src/utils/ocr_engine.py
+OCR_ENGINES = ('tesserocr', 'pytesseract')
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'tesserocr') # falls back to pytesseract if tesserocr can't be loaded
+OCR_ENGINE_POOL_SIZE = max(1, min(4, os.cpu_count() or 1)) # Tesseract handles per process, each holds a loaded language model
+OCR_LANGUAGE = 'eng'
+TESSDATA_PATH = os.getenv('TESSDATA_PREFIX') # directory with <OCR_LANGUAGE>.traineddata, tesserocr's built-in default if not set
+
+# Rendering of PDF pages without a text layer for OCR, see ocr_pdf_page()
+OCR_DPI = int(os.getenv('OCR_DPI', 300))
+OCR_MAX_PAGE_PIXELS = 25_000_000 # larger pages (posters, drawings) are rendered at a lower dpi, ~25MB per greyscale page at most
+
+# Parallel OCR of scanned PDF pages, see extract_text_from_pdf()
+OCR_PARALLEL = True
+OCR_PARALLEL_MIN_PAGES = 2 # a single page is OCR'd in the request thread, a process pool would only add overhead
+OCR_PROCESS_WORKERS = max(1, min(4, os.cpu_count() or 1)) # processes shared by all requests of a worker
+OCR_WORKERS_PER_REQUEST = 4 # max processes a single document can occupy
+
+# Tiered OCR - a fast low-resolution read first, full resolution only when needed, see src/utils/tiered_ocr.py
+OCR_TIERS = ('fast', 'full')
+OCR_FAST_TIER_TEXT_MODES = tuple(mode for mode in os.getenv('OCR_FAST_TIER_TEXT_MODES', 'none').split(',') if mode) # requests in these text modes start at the fast tier, '' = never
+OCR_FAST_SCALE = 0.5 # fast tier resolution relative to the full one, e.g. PDF pages at 150 instead of 300 dpi
+OCR_FAST_MIN_SIDE = 1000 # images aren't downscaled below this many pixels on their longer side
+OCR_FAST_TOP_FRACTION = 1.0 # share of the page (from the top, where titles are) the fast tier reads, 1.0 = whole page
+OCR_FAST_MIN_CHARS = 40 # a fast read with fewer letters and digits is too short and the page is read again at full resolution
+OCR_ESCALATION_CONFIDENCE = float(os.getenv('OCR_ESCALATION_CONFIDENCE', 0.8)) # a document classified from fast reads below this confidence is read again
+
+# Near-duplicate index of classified texts, see src/utils/near_duplicates.py
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', '0') == '1' # off by default: answers change for near-identical texts, and every worker holds its own index
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.7)) # estimated Jaccard similarity of character shingles above which a stored label is reused - 1-2% OCR noise keeps texts above it, different documents of /files are at 0.2 at most
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', 100_000)) # per worker process and model version, about 260 bytes each
+NEAR_DUPLICATE_MIN_CONFIDENCE = OCR_ESCALATION_CONFIDENCE # results less confident than this aren't stored - they'd stop a full-resolution read from being classified again
+NEAR_DUPLICATE_MAX_CHARS = 2000 # of normalised text, about what 512 tokens of the model read
+NEAR_DUPLICATE_MIN_CHARS = 64 # shorter texts have too few shingles to tell a near-duplicate, they aren't indexed
+NEAR_DUPLICATE_SHINGLE_CHARS = 5
+NEAR_DUPLICATE_NUM_PERM = 64 # MinHash signature length
+NEAR_DUPLICATE_BANDS = 16 # LSH bands of NUM_PERM // BANDS rows, candidates are found from Jaccard similarity of about 0.5 up
+NEAR_DUPLICATE_INDEX_DIR = os.getenv('NEAR_DUPLICATE_INDEX_DIR') # indexes are saved there at exit and loaded at startup, memory only if not set
+
+# Lazy extraction, see extract_text_within_token_budget()
+TEXT_CHUNK_CHARS = 2000 # .txt files are tokenized in blocks of about this many characters
+TEXT_MODES = ('full', 'none') # 'none' - file_text not needed in the response, so only text that fits the model input is extracted
+
+# Response shaping of the classify routes, see src/utils/response_shaping.py
+RESPONSE_GZIP_ENABLED = os.getenv('RESPONSE_GZIP_ENABLED', '1') != '0' # responses are gzipped for clients sending Accept-Encoding: gzip
+RESPONSE_GZIP_MIN_CHARS = 4096 # responses with less file_text than this are sent as they are, compressing them isn't worth it
+RESPONSE_GZIP_LEVEL = 1 # zlib level - on extracted text, higher ones save little more egress for 2-5x the CPU, see benchmarks/bench_response_shaping.py
+RESPONSE_CHUNK_BYTES = 64 * 1024 # compressed bytes sent per chunk of a streamed response
+
+# Admission control and load shedding, see src/utils/admission.py
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') != '0'
+ADMISSION_OCR_BUDGET = int(os.getenv('ADMISSION_OCR_BUDGET', OCR_PROCESS_WORKERS * 4)) # pages (images) being OCR'd at once, per worker process
+ADMISSION_TEXT_BUDGET = int(os.getenv('ADMISSION_TEXT_BUDGET', 32)) # text units (files, weighted by size) being extracted at once, per worker process
+ADMISSION_MAX_WAITING = 16 # requests of a kind (ocr / text) that may wait for budget, more are shed with 503 right away
+ADMISSION_RESERVED_TEXT_THREADS = 2 # request threads of a worker (REQUEST_THREADS) OCR requests may never hold, waiting or extracting - kept for text requests
+ADMISSION_MAX_WAIT_SECONDS = 5.0 # a waiting request is shed with 503 after this long
+ADMISSION_SAMPLE_PAGES = 3 # PDF pages looked at to tell how many pages will need OCR
+ADMISSION_LAZY_OCR_PAGES = 2 # pages a lazy extraction (?text=none) typically OCRs before the token budget is full
+ADMISSION_TEXT_UNIT_BYTES = 256 * 1024 # a file to extract costs a text unit per this many bytes of upload, at least 1
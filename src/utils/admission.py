@@ -0,0 +1,423 @@
+import asyncio
+import math
+import pymupdf
+import threading
+import time
+import zipfile
+
+from contextlib import asynccontextmanager, contextmanager
+from src.settings.config import (
+    ADMISSION_ENABLED,
+    ADMISSION_LAZY_OCR_PAGES,
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_MAX_WAITING,
+    ADMISSION_OCR_BUDGET,
+    ADMISSION_RESERVED_TEXT_THREADS,
+    ADMISSION_SAMPLE_PAGES,
+    ADMISSION_TEXT_BUDGET,
+    ADMISSION_TEXT_UNIT_BYTES,
+    ALLOWED_IMAGE_EXTENSIONS,
+    REQUEST_THREADS,
+)
+from src.utils.docx_reader import MEDIA_PREFIX, iter_docx_text
+from src.utils.intake import FileBuffer, get_upload_size, open_stream, open_upload
+from src.utils.metrics import ADMISSION_IN_FLIGHT, ADMISSION_SHED, ADMISSION_WAITING, time_stage
+from src.utils.text_extractor import extract_file_extension
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from werkzeug.datastructures import FileStorage
+
+"""
+Admission control and load shedding.
+
+Without it, every request that reaches a worker starts extracting right away - when a burst of scans comes in,
+OCR requests take all CPU and all threads, and a one-page text PDF waits behind them until gunicorn times it out.
+Instead, every request is first given a cost (estimate_cost()):
+
+    ocr - pages or images that will need OCR: an image is 1, a PDF is its page count times the share of
+          ADMISSION_SAMPLE_PAGES sampled pages without a text layer, a DOCX without text is its unique images,
+    text - files to extract, weighted by size: a unit per ADMISSION_TEXT_UNIT_BYTES of upload, at least 1 a file
+           (an image is always 1, its cost is in OCR).
+
+and takes it from the budgets of the worker process (ADMISSION_OCR_BUDGET pages, ADMISSION_TEXT_BUDGET units)
+for as long as extraction runs. Requests that don't fit wait in a queue of their kind - ocr if they need any OCR,
+text otherwise - so a queue full of scans never holds up cheap requests, which take only text budget.
+A queue is bounded (ADMISSION_MAX_WAITING) and so is the wait (ADMISSION_MAX_WAIT_SECONDS): past either,
+the request is shed with 503 and a Retry-After of about the time an admitted request of its kind holds its budget.
+A fast 503 lets the client or the load balancer retry elsewhere, instead of waiting for a timeout.
+
+In the sync app a request holds one of the worker's REQUEST_THREADS request threads while it waits, not only while
+it extracts. With only budgets and queues, scans fill every thread before their queue is full - nothing is shed,
+and text requests wait in gunicorn's backlog, where admission control can't see them. So OCR requests, waiting
+or extracting, may hold at most REQUEST_THREADS - ADMISSION_RESERVED_TEXT_THREADS threads; more are shed right away.
+
+Lazy extraction (?text=none) stops once the model input is full, so its OCR cost is capped at ADMISSION_LAZY_OCR_PAGES
+and a file costs a single text unit, whatever its size.
+Queue depths, budgets in use and shed counts are reported under GET /admission-stats and in Prometheus metrics.
+"""
+
+ASYNC_POLL_SECONDS = 0.005 # how often a request waiting on the event loop checks for budget
+
+
+class OverloadedError(Exception):
+    def __init__(self, message, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RequestCost:
+    """
+    What a request takes from the budgets while it's being extracted.
+    """
+
+    def __init__(self, ocr_units: int = 0, text_units: int = 0):
+        self.ocr_units = ocr_units
+        self.text_units = text_units
+
+    @property
+    def kind(self) -> str:
+        return 'ocr' if self.ocr_units else 'text'
+
+    def __add__(self, other: 'RequestCost') -> 'RequestCost':
+        return RequestCost(self.ocr_units + other.ocr_units, self.text_units + other.text_units)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RequestCost) and (self.ocr_units, self.text_units) == (other.ocr_units, other.text_units)
+
+    def __repr__(self) -> str:
+        return f"RequestCost(ocr_units={self.ocr_units}, text_units={self.text_units})"
+
+
+def _pdf_ocr_pages(buffer: FileBuffer, sample_pages: int) -> int:
+    try:
+        pdf_doc = pymupdf.open(stream=memoryview(buffer), filetype='pdf')
+    except Exception:
+        # a broken file costs nothing, its extraction fails fast
+        return 0
+
+    try:
+        n_pages = len(pdf_doc)
+        n_sampled = min(n_pages, sample_pages)
+
+        if not n_sampled:
+            return 0
+
+        # spread over the document - scanned appendices are as common as scanned covers
+        sampled = {round(i * (n_pages - 1) / max(1, n_sampled - 1)) for i in range(n_sampled)}
+        without_text = sum(not pdf_doc.load_page(page_num).get_text().strip() for page_num in sampled)
+
+        return math.ceil(n_pages * without_text / len(sampled))
+    except Exception:
+        return 0
+    finally:
+        pdf_doc.close()
+
+
+def _docx_ocr_images(buffer: FileBuffer) -> int:
+    try:
+        with zipfile.ZipFile(open_stream(buffer)) as archive:
+            lines = iter_docx_text(archive)
+
+            try:
+                if next(lines, None) is not None:
+                    return 0
+            finally:
+                lines.close()
+
+            # unique images, told apart by the CRC and size in the zip's directory - nothing is decompressed
+            return len({(info.CRC, info.file_size) for info in archive.infolist() if info.filename.startswith(MEDIA_PREFIX) and not info.is_dir()})
+    except Exception:
+        return 0
+
+
+def estimate_cost(files: List[FileStorage], lazy: bool = False, sample_pages: int = ADMISSION_SAMPLE_PAGES) -> RequestCost:
+    """
+    Tells what extracting text from files will cost, see the module docstring. Cheap next to extraction:
+    a PDF is opened and a few of its pages read, a DOCX is read up to its first line of text.
+
+    :param files: Validated uploads
+    :type files: List[FileStorage]
+    :param lazy: whether only text that fits the model input will be extracted
+    :type lazy: bool
+    :param sample_pages: PDF pages looked at
+    :type sample_pages: int
+    :return: Cost of all files together
+    :rtype: RequestCost
+    """
+    cost = RequestCost()
+
+    for file in files:
+        ext = extract_file_extension(file.filename) if '.' in file.filename else ''
+        ocr_units = 0
+        text_units = 1
+
+        try:
+            if ext in ALLOWED_IMAGE_EXTENSIONS:
+                ocr_units = 1
+            else:
+                if not lazy:
+                    text_units = max(1, math.ceil(get_upload_size(file) / ADMISSION_TEXT_UNIT_BYTES))
+
+                if ext in ('pdf', 'docx'):
+                    with open_upload(file) as buffer:
+                        ocr_units = _pdf_ocr_pages(buffer, sample_pages) if ext == 'pdf' else _docx_ocr_images(buffer)
+        finally:
+            file.stream.seek(0)
+
+        if lazy:
+            ocr_units = min(ocr_units, ADMISSION_LAZY_OCR_PAGES)
+
+        cost += RequestCost(ocr_units, text_units)
+
+    return cost
+
+
+class AdmissionController:
+    """
+    Budgets of OCR and text work in flight, with a bounded queue for each kind of request, see the module docstring.
+    Safe to use from many threads; the async app uses admit_async(), which waits without blocking the event loop.
+    """
+
+    KINDS = ('ocr', 'text')
+
+    def __init__(self, ocr_budget: int = ADMISSION_OCR_BUDGET, text_budget: int = ADMISSION_TEXT_BUDGET,
+                 max_waiting: int = ADMISSION_MAX_WAITING, max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+                 ocr_threads: Optional[int] = None):
+        """
+        :param ocr_budget: OCR pages in flight at once
+        :type ocr_budget: int
+        :param text_budget: Text units (files, weighted by size) being extracted at once
+        :type text_budget: int
+        :param max_waiting: Requests of a kind that may wait for budget
+        :type max_waiting: int
+        :param max_wait_seconds: How long a request may wait
+        :type max_wait_seconds: float
+        :param ocr_threads: Request threads OCR requests may hold in acquire() and admit(), waiting or admitted - None for no limit
+        :type ocr_threads: Optional[int]
+        """
+        if ocr_budget < 1 or text_budget < 1:
+            raise ValueError("Budgets must be at least 1")
+
+        if ocr_threads is not None and ocr_threads < 1:
+            raise ValueError("OCR requests need at least 1 request thread")
+
+        self.budgets = {'ocr': ocr_budget, 'text': text_budget}
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.ocr_threads = ocr_threads
+
+        self._condition = threading.Condition()
+        self._in_flight = {kind: 0 for kind in self.KINDS}
+        self._waiting = {kind: 0 for kind in self.KINDS}
+        self._threads = {kind: 0 for kind in self.KINDS} # request threads held in acquire() and admit(), not by async requests
+        self._counts = {kind: {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_no_thread": 0, "shed_timeout": 0} for kind in self.KINDS}
+        self._wait_seconds = {kind: 0.0 for kind in self.KINDS}
+        self._hold_seconds = {kind: None for kind in self.KINDS} # moving average of how long admitted requests hold their budget
+
+    def _clamp(self, cost: RequestCost) -> RequestCost:
+        # a request larger than a whole budget gets all of it and runs on its own, rather than never
+        return RequestCost(min(cost.ocr_units, self.budgets['ocr']), min(cost.text_units, self.budgets['text']))
+
+    def _fits(self, cost: RequestCost) -> bool:
+        return (self._in_flight['ocr'] + cost.ocr_units <= self.budgets['ocr']
+                and self._in_flight['text'] + cost.text_units <= self.budgets['text'])
+
+    def _take(self, cost: RequestCost, waited_seconds: float):
+        self._in_flight['ocr'] += cost.ocr_units
+        self._in_flight['text'] += cost.text_units
+        self._counts[cost.kind]["admitted"] += 1
+        self._wait_seconds[cost.kind] += waited_seconds
+
+        ADMISSION_IN_FLIGHT.labels(kind='ocr').inc(cost.ocr_units)
+        ADMISSION_IN_FLIGHT.labels(kind='text').inc(cost.text_units)
+
+    def _shed(self, kind: str, reason: str) -> OverloadedError:
+        self._counts[kind][f"shed_{reason}"] += 1
+        ADMISSION_SHED.labels(kind=kind, reason=reason).inc()
+
+        retry_after = max(1, math.ceil(self._hold_seconds[kind] or 1))
+        return OverloadedError(f"Server is busy with {kind} work, try again in {retry_after} s", retry_after)
+
+    def _enter(self, cost: RequestCost, blocking: bool = False) -> bool:
+        """
+        Admits the request right away if it fits and nobody of its kind is waiting, otherwise puts it in the queue.
+        Call with the lock held.
+        """
+        kind = cost.kind
+
+        if blocking and kind == 'ocr' and self.ocr_threads is not None and self._threads[kind] >= self.ocr_threads:
+            raise self._shed(kind, 'no_thread')
+
+        if not self._waiting[kind] and self._fits(cost):
+            self._take(cost, 0.0)
+            return True
+
+        if self._waiting[kind] >= self.max_waiting:
+            raise self._shed(kind, 'queue_full')
+
+        self._waiting[kind] += 1
+        self._counts[kind]["queued"] += 1
+        ADMISSION_WAITING.labels(kind=kind).inc()
+        return False
+
+    def _leave_queue(self, kind: str):
+        self._waiting[kind] -= 1
+        ADMISSION_WAITING.labels(kind=kind).dec()
+
+    def acquire(self, cost: RequestCost) -> RequestCost:
+        """
+        Takes cost from the budgets, waiting for it if needed. Release it with release().
+
+        :param cost: Cost of the request, see estimate_cost()
+        :type cost: RequestCost
+        :raises OverloadedError: if the queue of the request's kind is full, or the wait is too long
+        :return: Cost actually taken, clamped to the budgets
+        :rtype: RequestCost
+        """
+        cost = self._clamp(cost)
+        start = time.perf_counter()
+
+        with self._condition:
+            admitted = self._enter(cost, blocking=True)
+            self._threads[cost.kind] += 1 # a waiting request holds its thread too
+
+            if admitted:
+                return cost
+
+            try:
+                while not self._fits(cost):
+                    remaining = start + self.max_wait_seconds - time.perf_counter()
+
+                    if remaining <= 0:
+                        self._threads[cost.kind] -= 1
+                        raise self._shed(cost.kind, 'timeout')
+
+                    self._condition.wait(remaining)
+
+                self._take(cost, time.perf_counter() - start)
+            finally:
+                self._leave_queue(cost.kind)
+
+        return cost
+
+    async def acquire_async(self, cost: RequestCost) -> RequestCost:
+        """
+        Same as acquire(), for the event loop - a waiting request polls for budget instead of blocking a thread.
+        """
+        cost = self._clamp(cost)
+        start = time.perf_counter()
+
+        with self._condition:
+            if self._enter(cost):
+                return cost
+
+        try:
+            while True:
+                await asyncio.sleep(ASYNC_POLL_SECONDS)
+
+                with self._condition:
+                    if self._fits(cost):
+                        self._take(cost, time.perf_counter() - start)
+                        return cost
+
+                    if time.perf_counter() - start >= self.max_wait_seconds:
+                        raise self._shed(cost.kind, 'timeout')
+        finally:
+            with self._condition:
+                self._leave_queue(cost.kind)
+
+    def release(self, cost: RequestCost, held_seconds: float, blocking: bool = True):
+        """
+        Gives back what acquire() took.
+
+        :param cost: Cost returned by acquire()
+        :type cost: RequestCost
+        :param held_seconds: how long the request held it, for the Retry-After of shed requests
+        :type held_seconds: float
+        :param blocking: False for what acquire_async() took, which holds no request thread
+        :type blocking: bool
+        """
+        with self._condition:
+            if blocking:
+                self._threads[cost.kind] -= 1
+
+            self._in_flight['ocr'] -= cost.ocr_units
+            self._in_flight['text'] -= cost.text_units
+
+            average = self._hold_seconds[cost.kind]
+            self._hold_seconds[cost.kind] = held_seconds if average is None else 0.8 * average + 0.2 * held_seconds
+
+            self._condition.notify_all()
+
+        ADMISSION_IN_FLIGHT.labels(kind='ocr').dec(cost.ocr_units)
+        ADMISSION_IN_FLIGHT.labels(kind='text').dec(cost.text_units)
+
+    @contextmanager
+    def admit(self, cost: RequestCost) -> Iterator[RequestCost]:
+        """
+        Holds cost for the duration of the block, see acquire().
+
+        :param cost: Cost of the request, see estimate_cost()
+        :type cost: RequestCost
+        """
+        with time_stage('admission_wait'):
+            cost = self.acquire(cost)
+
+        start = time.perf_counter()
+
+        try:
+            yield cost
+        finally:
+            self.release(cost, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def admit_async(self, cost: RequestCost) -> AsyncIterator[RequestCost]:
+        """
+        Same as admit(), for the event loop.
+        """
+        with time_stage('admission_wait'):
+            cost = await self.acquire_async(cost)
+
+        start = time.perf_counter()
+
+        try:
+            yield cost
+        finally:
+            self.release(cost, time.perf_counter() - start, blocking=False)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: Per kind: budget, budget in use, queue depth, request threads held, counters of admitted, queued and shed requests,
+            average wait of admitted requests and how long they hold their budget
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        with self._condition:
+            stats = {}
+
+            for kind in self.KINDS:
+                counts = self._counts[kind]
+                hold_seconds = self._hold_seconds[kind]
+
+                stats[kind] = {
+                    "budget": self.budgets[kind],
+                    "in_flight": self._in_flight[kind],
+                    "waiting": self._waiting[kind],
+                    "threads": self._threads[kind],
+                    **counts,
+                    "avg_wait_ms": 1000 * self._wait_seconds[kind] / counts["admitted"] if counts["admitted"] else 0.0,
+                    "avg_hold_ms": 1000 * hold_seconds if hold_seconds is not None else None,
+                }
+
+            return stats
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    Creates the admission controller of this worker process as configured in settings.
+
+    :return: Controller instance, None if admission control is disabled
+    :rtype: Optional[AdmissionController]
+    """
+    if not ADMISSION_ENABLED:
+        return None
+
+    return AdmissionController(ocr_threads=max(1, REQUEST_THREADS - ADMISSION_RESERVED_TEXT_THREADS))
@@ -0,0 +1,376 @@
+import json
+import os
+import threading
+import time
+import torch
+
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from src.settings.config import (
+    ALLOWED_EXTENSIONS,
+    ALLOWED_MIME_TYPES,
+    BULK_CLASSIFY_THREADS,
+    BULK_EXTRACTION_RETRIES,
+    BULK_IN_FLIGHT_PER_WORKER,
+    BULK_REPORT_SECONDS,
+    BULK_WORKERS,
+)
+from src.utils.classifier import classify_file
+from src.utils.text_extractor import extract_file_extension, extract_text_from_path_in_worker, get_extraction_process_pool, reset_extraction_process_pool
+from src.utils.tiered_ocr import new_ocr_pass, review_ocr_pass
+from src.utils.validators import ValidationError, validate_file_text, validate_uploaded_file
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Dict, Iterator, Optional, Set, Tuple
+from werkzeug.datastructures import FileStorage
+
+"""
+Offline classification of a whole directory tree, for backfills, started with run_bulk.py.
+
+Files go through the same checks, extract_text() and classify_file() as /classify-file, without HTTP:
+
+    1. the main thread walks the tree, checks every file (size, sniffed type, see validate_uploaded_file())
+       and hands its path to the extraction process pool (see get_extraction_process_pool()) - workers read
+       the file themselves, so nothing but paths and texts crosses process boundaries,
+    2. extracted texts are classified by BULK_CLASSIFY_THREADS threads in this process, through the model's
+       batch scheduler - one model instance, texts finishing together share forward passes,
+    3. every result is appended to a JSONL file as soon as it's known, in completion order.
+
+At most workers * BULK_IN_FLIGHT_PER_WORKER files are in flight, so memory doesn't grow with the tree.
+A run that crashed or was stopped picks up where it left off: files already in the output are skipped
+(and a line cut off by the crash is dropped). Files that failed are recorded with an "error" and skipped
+as well, unless the run is told to retry them. Throughput is printed every BULK_REPORT_SECONDS.
+
+When an extraction worker dies (e.g. killed for memory), the pool breaks and every file in flight fails with it -
+through no fault of their own, so none of them is recorded as an error. They go to a new pool, up to
+BULK_EXTRACTION_RETRIES times, and are otherwise left out of the output for the next run to pick up.
+"""
+
+
+def iter_files(root: str) -> Iterator[str]:
+    """
+    Walks a directory tree in a stable order.
+
+    :param root: Directory to walk
+    :type root: str
+    :return: Path of every file, relative to root
+    :rtype: Iterator[str]
+    """
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+
+        for filename in sorted(filenames):
+            yield os.path.relpath(os.path.join(directory, filename), root)
+
+
+def is_supported(path: str) -> bool:
+    return '.' in path and extract_file_extension(path) in ALLOWED_EXTENSIONS
+
+
+class BulkOutput:
+    """
+    JSONL file with a result per line, appended to as results come in.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load_done(self, retry_errors: bool = False) -> Set[str]:
+        """
+        Reads what an earlier run got done. A last line without a newline was cut off by a crash, it's truncated away.
+
+        :param retry_errors: Whether files that failed count as not done
+        :type retry_errors: bool
+        :return: Relative paths of files already in the output
+        :rtype: Set[str]
+        """
+        if not os.path.exists(self.path):
+            return set()
+
+        done = set()
+
+        with open(self.path, 'rb+') as f:
+            content = f.read()
+            complete = content.rfind(b'\n') + 1
+
+            if complete < len(content):
+                print(f"Dropping a cut off line at the end of {self.path}")
+                f.truncate(complete)
+
+        for line in content[:complete].splitlines():
+            if line.strip():
+                record = json.loads(line)
+
+                if not (retry_errors and "error" in record):
+                    done.add(record["path"])
+
+        return done
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+
+            # flushed line by line, a crash loses at most the lines being written
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ThroughputMeter:
+    """
+    Files and bytes done since the start of a run, and over the last report interval.
+    """
+
+    def __init__(self, total: int, report_seconds: float = BULK_REPORT_SECONDS):
+        self.total = total
+        self.report_seconds = report_seconds
+        self.files = 0
+        self.errors = 0
+        self.bytes = 0
+
+        self._start = self._last_report = time.perf_counter()
+        self._files_at_last_report = 0
+        self._lock = threading.Lock()
+
+    def update(self, n_bytes: int, error: bool) -> Optional[str]:
+        """
+        Counts a finished file.
+
+        :return: Progress report if one is due, see report()
+        :rtype: Optional[str]
+        """
+        with self._lock:
+            self.files += 1
+            self.errors += error
+            self.bytes += n_bytes
+
+            now = time.perf_counter()
+
+            if now - self._last_report < self.report_seconds:
+                return None
+
+            recent_rate = (self.files - self._files_at_last_report) / (now - self._last_report)
+            self._last_report, self._files_at_last_report = now, self.files
+
+        return self.report(recent_rate)
+
+    def report(self, recent_rate: float = None) -> str:
+        elapsed = time.perf_counter() - self._start
+        rate = self.files / elapsed if elapsed else 0.0
+        eta = (self.total - self.files) / rate if rate else 0.0
+
+        report = f"{self.files}/{self.total} files, {rate:.1f} files/s"
+
+        if recent_rate is not None:
+            report += f" (last {self.report_seconds:.0f}s: {recent_rate:.1f})"
+
+        return report + f", {self.bytes / elapsed / 1024 ** 2 if elapsed else 0.0:.1f} MB/s, {self.errors} errors, ETA {eta / 60:.0f} min"
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self._start
+        return {"files": self.files, "errors": self.errors, "bytes": self.bytes, "seconds": elapsed, "files_per_second": self.files / elapsed if elapsed else 0.0}
+
+
+class BulkClassifier:
+    """
+    Classifies every supported file of a directory tree into a JSONL file, see the module docstring.
+    """
+
+    def __init__(self, model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device,
+                 text_mode: str = 'none', workers: int = BULK_WORKERS, in_flight_per_worker: int = BULK_IN_FLIGHT_PER_WORKER,
+                 classify_threads: int = BULK_CLASSIFY_THREADS, report_seconds: float = BULK_REPORT_SECONDS):
+        """
+        :param model: DistilBERT-type model instance
+        :type model: transformers.DistilBertForSequenceClassification
+        :param tokenizer: DistilBERT-type tokenizer, applied to text
+        :type tokenizer: transformers.DistilBertTokenizerFast
+        :param device: Device type (CPU or GPU) as read by PyTorch
+        :type device: torch.device
+        :param text_mode: One of TEXT_MODES - 'full' writes file_text to the output, 'none' extracts lazily and doesn't
+        :type text_mode: str
+        :param workers: Extraction processes
+        :type workers: int
+        :param in_flight_per_worker: Files being extracted or classified at once, per worker
+        :type in_flight_per_worker: int
+        :param classify_threads: Threads feeding the batch scheduler
+        :type classify_threads: int
+        :param report_seconds: How often throughput is printed
+        :type report_seconds: float
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.text_mode = text_mode
+        self.workers = workers
+        self.in_flight = workers * in_flight_per_worker
+        self.classify_threads = classify_threads
+        self.report_seconds = report_seconds
+
+        self._stopped = threading.Event()
+        self._interrupted = 0
+        self._interrupted_lock = threading.Lock()
+
+    def stop(self):
+        """
+        Stops handing out files. Files in flight are finished and written, the rest is left for the next run.
+        """
+        self._stopped.set()
+
+    def _extract(self, path: str, ocr_pass) -> Tuple[ProcessPoolExecutor, Future]:
+        pool = get_extraction_process_pool(self.tokenizer, self.workers)
+
+        try:
+            return pool, pool.submit(extract_text_from_path_in_worker, path, self.text_mode == 'none', ocr_pass)
+        except BrokenProcessPool:
+            reset_extraction_process_pool(pool)
+            raise
+
+    @staticmethod
+    def _extracted(pool: ProcessPoolExecutor, extraction: Future) -> tuple:
+        try:
+            return extraction.result()
+        except BrokenProcessPool:
+            # the next file gets a new pool - unless another file in flight saw this one break first and replaced it
+            reset_extraction_process_pool(pool)
+            raise
+
+    def _classify(self, path: str, pool: ProcessPoolExecutor, extraction: Future) -> Dict:
+        file_text, ocr_pass = self._extracted(pool, extraction)
+        validate_file_text(file_text)
+
+        file_class, confidence = classify_file(file_text, self.model, tokenizer=self.tokenizer, device=self.device)
+        full_pass = review_ocr_pass(ocr_pass, confidence)
+
+        # text read by fast OCR left the classifier unsure, the file is read again at full resolution
+        if full_pass:
+            file_text = self._extracted(*self._extract(path, full_pass))[0] or file_text
+            file_class, confidence = classify_file(file_text, self.model, tokenizer=self.tokenizer, device=self.device)
+            review_ocr_pass(full_pass, confidence)
+
+        if not all([file_text, file_class, confidence]):
+            raise ValidationError("Unable to classify document.")
+
+        result = {"file_class": file_class, "confidence": confidence}
+
+        if self.text_mode == 'full':
+            result["file_text"] = file_text
+
+        return result
+
+    def _submit(self, relative_path: str, path: str, n_bytes: int, attempt: int = 0):
+        pool, extraction = self._extract(path, new_ocr_pass(self.text_mode))
+        extraction.add_done_callback(lambda future: self._classify_pool.submit(self._finish, relative_path, path, n_bytes, pool, future, attempt))
+
+    def _finish(self, relative_path: str, path: str, n_bytes: int, pool: ProcessPoolExecutor, extraction: Future, attempt: int):
+        try:
+            record = {"path": relative_path, **self._classify(path, pool, extraction)}
+        except (BrokenProcessPool, CancelledError) as e:
+            # the pool died under the file (or was shut down with it queued), the file itself didn't fail
+            self._retry(relative_path, path, n_bytes, attempt, e)
+            return
+        except Exception as e:
+            record = {"path": relative_path, "error": str(e)}
+
+        self._record(record, n_bytes)
+
+    def _retry(self, relative_path: str, path: str, n_bytes: int, attempt: int, error: BaseException):
+        if attempt < BULK_EXTRACTION_RETRIES and not self._stopped.is_set():
+            try:
+                self._submit(relative_path, path, n_bytes, attempt + 1)
+                return
+            except Exception as e:
+                error = e
+
+        print(f"{relative_path} left for the next run, extraction worker died: {error!r}")
+
+        with self._interrupted_lock:
+            self._interrupted += 1
+
+        self._slots.release()
+
+    def _record(self, record: Dict, n_bytes: int):
+        try:
+            self._output.write(record)
+            report = self._meter.update(n_bytes, "error" in record)
+
+            if report:
+                print(report)
+        finally:
+            self._slots.release()
+
+    def _check(self, path: str) -> int:
+        ext = extract_file_extension(path)
+
+        with open(path, 'rb') as f:
+            validate_uploaded_file(FileStorage(stream=f, filename=os.path.basename(path), content_type=ALLOWED_MIME_TYPES[ext]))
+            return f.seek(0, os.SEEK_END)
+
+    def run(self, root: str, output_path: str, retry_errors: bool = False) -> Dict:
+        """
+        Classifies every supported file under root not yet in the output, until done or stopped.
+
+        :param root: Directory tree to classify
+        :type root: str
+        :param output_path: JSONL file to append results to, and to resume from
+        :type output_path: str
+        :param retry_errors: Whether files that failed in an earlier run are tried again
+        :type retry_errors: bool
+        :return: Files done, errors, bytes, seconds and files per second of this run, files skipped
+        and files left for the next run because extraction workers died
+        :rtype: Dict
+        """
+        self._output = BulkOutput(output_path)
+        done = self._output.load_done(retry_errors)
+
+        relative_paths = [path for path in iter_files(root) if is_supported(path)]
+        todo = [path for path in relative_paths if path not in done]
+        print(f"{len(relative_paths)} files under {root}, {len(relative_paths) - len(todo)} already done, {len(todo)} to go")
+
+        self._meter = ThroughputMeter(len(todo), self.report_seconds)
+        self._slots = threading.BoundedSemaphore(self.in_flight)
+        self._classify_pool = ThreadPoolExecutor(max_workers=self.classify_threads, thread_name_prefix='bulk-classify')
+        self._interrupted = 0
+
+        try:
+            for relative_path in todo:
+                self._slots.acquire()
+
+                if self._stopped.is_set():
+                    self._slots.release()
+                    break
+
+                path = os.path.join(root, relative_path)
+
+                try:
+                    n_bytes = self._check(path)
+                except Exception as e: # validation, a file that vanished or can't be read
+                    self._record({"path": relative_path, "error": str(e)}, 0)
+                    continue
+
+                try:
+                    self._submit(relative_path, path, n_bytes)
+                except BrokenProcessPool as e: # the pool broke between files, it's been replaced
+                    self._retry(relative_path, path, n_bytes, 0, e)
+        finally:
+            # every slot back means every file in flight is written (or left for the next run)
+            for _ in range(self.in_flight):
+                self._slots.acquire()
+
+            self._classify_pool.shutdown()
+            self._output.close()
+
+        summary = self._meter.summary()
+        summary["skipped"] = len(relative_paths) - len(todo)
+        summary["interrupted"] = self._interrupted
+        print(self._meter.report())
+
+        return summary
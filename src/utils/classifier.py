@@ -1,20 +1,185 @@
+import asyncio
+import math
+import random
+import threading
+import time
+import numpy as np
 import torch
 
-from src.model.model_utils import classify_text, prepare_text
-from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
-from typing import Tuple
+from concurrent.futures import Future
+from src.model.batching import BatchScheduler, get_scheduler
+from src.model.lexical import get_lexical_classifier
+from src.settings.config import LEXICAL_AUDIT_RATE
+from src.utils.metrics import CASCADE_TEXTS
+from src.utils.near_duplicates import get_near_duplicate_index
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Dict, List, Optional, Tuple
 
+"""
+Classification of extracted text, as a cascade:
 
-def classify_file(text: str, model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizer, device: torch.device) -> Tuple[str, float]:
+    1. the near-duplicate index (src/utils/near_duplicates.py), if NEAR_DUPLICATE_ENABLED and texts are classified
+       in a single window (LONG_DOCUMENT_MAX_WINDOWS = 1) - a text almost the same
+       as one the transformer classified before (a rescan, a re-export) gets the label it got,
+    2. the lexical pre-classifier (src/model/lexical.py), if LEXICAL_MODEL_PATH is set - when it's confident
+       enough, its label is the answer and the transformer is skipped,
+    3. DistilBERT, through the batch scheduler (src/model/batching.py), for everything else. Its results are
+       stored in the near-duplicate index.
+
+To keep an eye on the first stage, CascadeStats counts early exits and measures agreement with the transformer:
+on deferred texts for free (the lexical label is compared with the transformer's), on early exits by sending
+LEXICAL_AUDIT_RATE of them to the transformer too, in the background. CPU saved is estimated from the scheduler's
+CPU time per text. All of it is reported under GET /cascade-stats.
+"""
+
+
+class CascadeStats:
+    """
+    Counters of the cascade in this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = {"lexical_texts": 0, "early_exits": 0, "deferred": 0, "deferred_agreements": 0, "audited": 0, "audit_agreements": 0}
+            self._lexical_cpu_seconds = 0.0
+
+    def record_lexical(self, cpu_seconds: float, early_exit: bool):
+        with self._lock:
+            self._counts["lexical_texts"] += 1
+            self._counts["early_exits" if early_exit else "deferred"] += 1
+            self._lexical_cpu_seconds += cpu_seconds
+
+        CASCADE_TEXTS.labels(stage='lexical' if early_exit else 'transformer').inc()
+
+    def record_deferred(self, lexical_label: str, transformer_label: str):
+        with self._lock:
+            self._counts["deferred_agreements"] += lexical_label == transformer_label
+
+    def record_audit(self, lexical_label: str, future: Future):
+        if future.exception() is not None:
+            return
+
+        with self._lock:
+            self._counts["audited"] += 1
+            self._counts["audit_agreements"] += lexical_label == future.result()[0]
+
+    def stats(self, scheduler: BatchScheduler = None) -> Dict[str, float]:
+        """
+        :param scheduler: Scheduler of the transformer, its CPU time per text is the cost of a deferred text
+        :type scheduler: BatchScheduler
+        :return: Counters, early exit rate, agreement with the transformer and an estimate of CPU time saved
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            lexical_cpu_seconds = self._lexical_cpu_seconds
+
+        transformer_cpu_per_text = scheduler.cpu_seconds / scheduler.texts_classified if scheduler and scheduler.texts_classified else 0.0
+
+        stats["early_exit_rate"] = stats["early_exits"] / stats["lexical_texts"] if stats["lexical_texts"] else 0.0
+        stats["agreement_on_early_exits"] = stats["audit_agreements"] / stats["audited"] if stats["audited"] else None
+        stats["agreement_on_deferred"] = stats["deferred_agreements"] / stats["deferred"] if stats["deferred"] else None
+        stats["lexical_cpu_seconds"] = lexical_cpu_seconds
+        stats["transformer_cpu_ms_per_text"] = transformer_cpu_per_text * 1000
+        # audited early exits did run through the transformer
+        stats["cpu_seconds_saved"] = (stats["early_exits"] - stats["audited"]) * transformer_cpu_per_text - lexical_cpu_seconds
+
+        return stats
+
+
+cascade_stats = CascadeStats()
+
+
+def pre_classify(text: str, scheduler: BatchScheduler) -> Tuple[Optional[Tuple[str, float]], Optional[str], Optional[np.ndarray]]:
+    """
+    Stages of the cascade before the transformer: near-duplicates of texts classified before, then the lexical pre-classifier.
+
+    :param text: Raw, non-empty text to classify
+    :type text: str
+    :param scheduler: Scheduler of the transformer, used for audits of early exits
+    :type scheduler: BatchScheduler
+    :return: A tuple consisting of: the final (label, confidence) if the text exits early, or None,
+    the lexical label, None if the lexical stage is disabled, and the text's MinHash signature,
+    to store the transformer's result under - None if there's nothing to store
+    :rtype: Tuple[Optional[Tuple[str, float]], Optional[str], Optional[np.ndarray]]
+    """
+    signature = None
+    near_duplicates = get_near_duplicate_index(scheduler.model)
+
+    if near_duplicates is not None:
+        signature = near_duplicates.hasher.signature(text)
+        duplicate = near_duplicates.lookup(signature) if signature is not None else None
+
+        if duplicate:
+            CASCADE_TEXTS.labels(stage='near_duplicate').inc()
+            return duplicate, None, None
+
+    lexical = get_lexical_classifier()
+
+    if lexical is None:
+        return None, None, signature
+
+    # CPU time of this thread only, other requests run meanwhile
+    start = time.thread_time()
+    label, confidence = lexical.predict(text)
+    early_exit = confidence >= lexical.threshold
+    cascade_stats.record_lexical(time.thread_time() - start, early_exit)
+
+    if not early_exit:
+        return None, label, signature
+
+    if random.random() < LEXICAL_AUDIT_RATE:
+        scheduler.submit(text).add_done_callback(lambda future: cascade_stats.record_audit(label, future))
+
+    # lexical labels aren't stored, a near-duplicate only ever reuses the transformer's
+    return (label, confidence), label, None
+
+
+def _record_deferred(scheduler: BatchScheduler, lexical_label: Optional[str], signature: Optional[np.ndarray], prediction: Tuple[str, float]):
+    if lexical_label is not None:
+        cascade_stats.record_deferred(lexical_label, prediction[0])
+
+    if signature is not None:
+        get_near_duplicate_index(scheduler.model).add(signature, *prediction)
+
+
+def cascade_report(model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device) -> Dict:
+    """
+    Cascade statistics of this process, as reported by GET /cascade-stats.
+
+    :param model: DistilBERT-type model instance, whose scheduler's CPU time is the cost of a deferred text
+    :type model: transformers.DistilBertForSequenceClassification
+    :param tokenizer: DistilBERT-type tokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :return: Whether the cascade is enabled, its threshold (None if it never exits early) and CascadeStats.stats()
+    :rtype: Dict
+    """
+    lexical = get_lexical_classifier()
+
+    if lexical is None:
+        return {"enabled": False}
+
+    threshold = lexical.threshold if math.isfinite(lexical.threshold) else None
+    return {"enabled": True, "threshold": threshold, **cascade_stats.stats(get_scheduler(model, tokenizer, device))}
+
+def classify_file(text: str, model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device) -> Tuple[str, float]:
     """
     Classifies raw file text data using model and tokenizer of DistilBERT-type provided.
+    Text goes through the model's batch scheduler, so concurrent requests share a forward pass - unless
+    the lexical pre-classifier is confident about it, see pre_classify().
 
     :param text: Raw text to classify
     :type text: str
     :param model: DistilBERT-type model instance
     :type model: transformers.DistilBertForSequenceClassification
     :param tokenizer: DistilBERT-type tokenizer, applied to text
-    :type tokenizer: transformers.DistilBertTokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
     :param device: Device type (CPU or GPU) as read by PyTorch
     :type device: torch.device
     :return: A tuple consisting of a predicted label (string) and associated confidence in range 0-1 (float).
@@ -22,10 +187,125 @@ def classify_file(text: str, model: DistilBertForSequenceClassification, tokeniz
     """
 
     if text is not None and len(text.strip()) > 0:
-        prepared_text = prepare_text(text, tokenizer, device)
-        predicted_label, confidence = classify_text(model, prepared_text)
+        scheduler = get_scheduler(model, tokenizer, device)
+        early_result, lexical_label, signature = pre_classify(text, scheduler)
+
+        if early_result:
+            return early_result
+
+        predicted_label, confidence = scheduler.classify(text)
+        _record_deferred(scheduler, lexical_label, signature, (predicted_label, confidence))
 
         return predicted_label, confidence
     else:
         return None, None
 
+def classify_files(texts: List[str], model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device) -> List[Tuple[str, float]]:
+    """
+    Classifies text of many files at once. All non-empty texts are queued together, so they are
+    classified in as few forward passes as the batch size allows (a single one for up to BATCH_MAX_SIZE texts).
+
+    :param texts: Raw texts to classify
+    :type texts: List[str]
+    :param model: DistilBERT-type model instance
+    :type model: transformers.DistilBertForSequenceClassification
+    :param tokenizer: DistilBERT-type tokenizer, applied to text
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :return: A (label, confidence) tuple for every text, in order. (None, None) for empty texts.
+    :rtype: List[Tuple[str, float]]
+    """
+    results = [(None, None)] * len(texts)
+    indices = [i for i, text in enumerate(texts) if text is not None and len(text.strip()) > 0]
+
+    if indices:
+        scheduler = get_scheduler(model, tokenizer, device)
+        deferred = []
+
+        for i in indices:
+            early_result, lexical_label, signature = pre_classify(texts[i], scheduler)
+
+            if early_result:
+                results[i] = early_result
+            else:
+                deferred.append((i, lexical_label, signature))
+
+        predictions = scheduler.classify_many([texts[i] for i, _, _ in deferred])
+
+        for (i, lexical_label, signature), prediction in zip(deferred, predictions):
+            results[i] = prediction
+            _record_deferred(scheduler, lexical_label, signature, prediction)
+
+    return results
+
+async def classify_file_async(text: str, model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device) -> Tuple[str, float]:
+    """
+    classify_file() for the async app. The forward pass runs on the batch scheduler's thread,
+    the event loop only waits for its result and keeps serving other connections meanwhile.
+
+    :param text: Raw text to classify
+    :type text: str
+    :param model: DistilBERT-type model instance
+    :type model: transformers.DistilBertForSequenceClassification
+    :param tokenizer: DistilBERT-type tokenizer, applied to text
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :return: A tuple consisting of a predicted label (string) and associated confidence in range 0-1 (float).
+    :rtype: Tuple[str, float]
+    """
+    if text is not None and len(text.strip()) > 0:
+        scheduler = get_scheduler(model, tokenizer, device)
+        early_result, lexical_label, signature = pre_classify(text, scheduler)
+
+        if early_result:
+            return early_result
+
+        prediction = await asyncio.wrap_future(scheduler.submit(text))
+        _record_deferred(scheduler, lexical_label, signature, prediction)
+
+        return prediction
+    else:
+        return None, None
+
+async def classify_files_async(texts: List[str], model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device) -> List[Tuple[str, float]]:
+    """
+    classify_files() for the async app, see classify_file_async().
+
+    :param texts: Raw texts to classify
+    :type texts: List[str]
+    :param model: DistilBERT-type model instance
+    :type model: transformers.DistilBertForSequenceClassification
+    :param tokenizer: DistilBERT-type tokenizer, applied to text
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :return: A (label, confidence) tuple for every text, in order. (None, None) for empty texts.
+    :rtype: List[Tuple[str, float]]
+    """
+    results = [(None, None)] * len(texts)
+    indices = [i for i, text in enumerate(texts) if text is not None and len(text.strip()) > 0]
+
+    if indices:
+        scheduler = get_scheduler(model, tokenizer, device)
+        deferred = []
+
+        for i in indices:
+            early_result, lexical_label, signature = pre_classify(texts[i], scheduler)
+
+            if early_result:
+                results[i] = early_result
+            else:
+                deferred.append((i, lexical_label, signature))
+
+        # all texts are queued before the first await, so they end up in as few batches as possible
+        futures = [asyncio.wrap_future(scheduler.submit(texts[i])) for i, _, _ in deferred]
+        predictions = await asyncio.gather(*futures)
+
+        for (i, lexical_label, signature), prediction in zip(deferred, predictions):
+            results[i] = prediction
+            _record_deferred(scheduler, lexical_label, signature, prediction)
+
+    return results
+
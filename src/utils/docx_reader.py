@@ -0,0 +1,164 @@
+import hashlib
+import re
+import zipfile
+
+from lxml import etree
+from typing import IO, Iterator, List, Tuple
+
+"""
+Streaming reader of DOCX files.
+
+python-docx builds an object tree of the whole document to hand out document.paragraphs - and those
+are only the body's top-level paragraphs, so text in tables, headers and footers was never read.
+A DOCX is a zip archive, its text lives in WordprocessingML parts:
+
+    word/header*.xml - page headers,
+    word/document.xml - the body, tables included,
+    word/footer*.xml - page footers.
+
+Each part is decompressed from the zip as a stream and parsed with lxml's iterparse, paragraph by paragraph.
+Paragraphs are cleared from the tree as soon as their text is taken, so memory doesn't grow with the document.
+A table row is read as one line, cells separated by tabs.
+
+Embedded images (word/media/*) are read only when asked for, deduplicated by SHA-256 of their content -
+a logo repeated on every page or a scan pasted twice is OCR'd once.
+"""
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_P = W_NS + 'p'
+W_TR = W_NS + 'tr'
+W_TC = W_NS + 'tc'
+W_T = W_NS + 't'
+W_TAB = W_NS + 'tab'
+W_BR = W_NS + 'br'
+W_CR = W_NS + 'cr'
+
+BODY_PART = 'word/document.xml'
+HEADER_PART = re.compile(r'word/header\d*\.xml')
+FOOTER_PART = re.compile(r'word/footer\d*\.xml')
+MEDIA_PREFIX = 'word/media/'
+
+
+def _natural_key(name: str) -> Tuple:
+    # header10.xml after header2.xml
+    return tuple(int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name))
+
+
+def get_text_parts(archive: zipfile.ZipFile) -> List[str]:
+    """
+    Names of the parts holding text, in reading order: headers, body, footers.
+
+    :param archive: Open DOCX archive
+    :type archive: zipfile.ZipFile
+    :return: Part names
+    :rtype: List[str]
+    """
+    names = archive.namelist()
+
+    headers = sorted((name for name in names if HEADER_PART.fullmatch(name)), key=_natural_key)
+    footers = sorted((name for name in names if FOOTER_PART.fullmatch(name)), key=_natural_key)
+
+    return headers + [BODY_PART] + footers
+
+
+def _paragraph_text(paragraph: etree._Element) -> str:
+    chunks = []
+
+    for element in paragraph.iter(W_T, W_TAB, W_BR, W_CR):
+        if element.tag == W_T:
+            chunks.append(element.text or '')
+        elif element.tag == W_TAB:
+            chunks.append('\t')
+        else:
+            chunks.append('\n')
+
+    return ''.join(chunks)
+
+
+def _row_text(row: etree._Element) -> str:
+    cells = []
+
+    for cell in row.iterchildren(W_TC):
+        cells.append(' '.join(text for text in (_paragraph_text(p) for p in cell.iterchildren(W_P)) if text.strip()))
+
+    return '\t'.join(cells)
+
+
+def _release(element: etree._Element):
+    # drop the element's content and the already processed siblings before it, so the tree stays small
+    element.clear()
+
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def iter_part_lines(stream: IO[bytes]) -> Iterator[str]:
+    """
+    Yields the text of every paragraph, and of every table row as a whole, of a WordprocessingML part.
+
+    :param stream: Part's XML, e.g. ZipFile.open('word/document.xml')
+    :type stream: IO[bytes]
+    :return: Generator of lines, empty ones included
+    :rtype: Iterator[str]
+    """
+    for _, element in etree.iterparse(stream, events=('end',), tag=(W_P, W_TR), huge_tree=True):
+        parent = element.getparent()
+
+        if element.tag == W_P:
+            # a cell's paragraphs are read with their row
+            if parent is not None and parent.tag == W_TC:
+                continue
+
+            yield _paragraph_text(element)
+        else:
+            yield _row_text(element)
+
+        _release(element)
+
+
+def iter_docx_text(archive: zipfile.ZipFile) -> Iterator[str]:
+    """
+    Yields non-empty lines of all text parts of a DOCX, see get_text_parts().
+
+    :param archive: Open DOCX archive
+    :type archive: zipfile.ZipFile
+    :return: Generator of lines
+    :rtype: Iterator[str]
+    """
+    for name in get_text_parts(archive):
+        try:
+            stream = archive.open(name)
+        except KeyError:
+            continue
+
+        with stream:
+            for line in iter_part_lines(stream):
+                if line.strip():
+                    yield line
+
+
+def iter_unique_images(archive: zipfile.ZipFile) -> Iterator[bytes]:
+    """
+    Yields content of every embedded image, in archive order, skipping exact duplicates.
+
+    :param archive: Open DOCX archive
+    :type archive: zipfile.ZipFile
+    :return: Generator of image bytes
+    :rtype: Iterator[bytes]
+    """
+    seen = set()
+
+    for info in archive.infolist():
+        if not info.filename.startswith(MEDIA_PREFIX) or info.is_dir():
+            continue
+
+        image_bytes = archive.read(info)
+        digest = hashlib.sha256(image_bytes).digest()
+
+        if digest in seen:
+            continue
+
+        seen.add(digest)
+        yield image_bytes
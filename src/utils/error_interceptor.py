@@ -1,10 +1,35 @@
 from flask import jsonify, make_response
 from functools import wraps
+from starlette.responses import JSONResponse
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from src.utils.admission import OverloadedError
+from src.utils.validators import PayloadTooLargeError
+
+
+def _status_code(e: Exception) -> int:
+    # werkzeug raises RequestEntityTooLarge itself for a body over MAX_CONTENT_LENGTH sent without Content-Length
+    if isinstance(e, (PayloadTooLargeError, RequestEntityTooLarge)):
+        return 413
+
+    if isinstance(e, OverloadedError):
+        return 503
+
+    return 400
+
+
+def _headers(e: Exception) -> dict:
+    if isinstance(e, OverloadedError):
+        return {"Retry-After": str(e.retry_after)}
+
+    return {}
 
 
 def error_interceptor(f):
     """
     Intercepts unhandled errors from function calls inside the endpoint.
+    Uploads over the size limits are answered with 413, requests shed by admission control with 503
+    and Retry-After, everything else with 400.
     """
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -12,6 +37,21 @@ def error_interceptor(f):
             return f(*args, **kwargs)
         except Exception as e:
             print(f"Error intercepted: {e}")
-            return make_response(jsonify({"error": str(e)})), 400
+            return make_response(jsonify({"error": str(e)})), _status_code(e), _headers(e)
         
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def async_error_interceptor(f):
+    """
+    Same as error_interceptor(), for endpoints of the async app.
+    """
+    @wraps(f)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await f(*args, **kwargs)
+        except Exception as e:
+            print(f"Error intercepted: {e}")
+            return JSONResponse({"error": str(e)}, status_code=_status_code(e), headers=_headers(e))
+
+    return wrapper
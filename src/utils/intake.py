@@ -0,0 +1,190 @@
+import codecs
+import mmap
+import os
+import zipfile
+
+from contextlib import contextmanager
+from io import BytesIO, UnsupportedOperation
+from src.settings.config import UPLOAD_MMAP_MIN_BYTES, UPLOAD_SNIFF_BYTES
+from src.utils.docx_reader import BODY_PART
+from typing import IO, Iterator, Optional, Union
+from werkzeug.datastructures import FileStorage
+
+"""
+Upload intake - what is known about an upload before any extractor touches it.
+
+Both apps get uploads from their framework already spooled: werkzeug and Starlette keep a file part in memory
+up to 500 kB / 1 MB and roll it over to an anonymous temporary file beyond that. Validation (see validators.py)
+then checks every file against the size limit of its type (MAX_UPLOAD_BYTES) and sniffs its real type
+from the first bytes - the client's filename and MIME type are just claims:
+
+    %PDF-        - pdf (anywhere in the first kB, as PDF readers allow),
+    \\x89PNG...   - png,
+    \\xff\\xd8\\xff  - jpg,
+    PK\\x03\\x04    - zip, and a docx if the zip has word/document.xml,
+    no NUL bytes, valid UTF-8 - txt.
+
+A file that's too large, empty or not what its extension says is rejected before it's parsed, hashed or read.
+
+Extractors take the upload as a buffer from open_upload(): an upload spooled to disk is memory-mapped read-only,
+so its pages are shared page cache the kernel can drop, rather than a private bytes copy on the worker's heap -
+and lazy extraction touches only the pages it reads. Small in-memory uploads are simply read.
+"""
+
+PDF_MAGIC = b'%PDF-'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+JPEG_MAGIC = b'\xff\xd8\xff'
+ZIP_MAGIC = b'PK\x03\x04'
+
+FileBuffer = Union[bytes, mmap.mmap]
+
+
+def get_upload_size(file: FileStorage) -> int:
+    """
+    Size of an uploaded file in bytes, read from its spooled stream without reading the content.
+
+    :param file: Uploaded file
+    :type file: FileStorage
+    :return: Size in bytes
+    :rtype: int
+    """
+    stream = file.stream
+    position = stream.tell()
+
+    try:
+        return stream.seek(0, os.SEEK_END)
+    finally:
+        stream.seek(position)
+
+
+def _is_utf8_text(head: bytes) -> bool:
+    if b'\x00' in head:
+        return False
+
+    # not final - the head may end in the middle of a multi-byte character
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return False
+
+    return True
+
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """
+    Tells the type of a file from its first bytes, see the module docstring.
+
+    :param head: First bytes of the file, UPLOAD_SNIFF_BYTES is plenty
+    :type head: bytes
+    :return: 'pdf', 'png', 'jpg', 'zip', 'txt' or None if the type is not recognised
+    :rtype: Optional[str]
+    """
+    if PDF_MAGIC in head[:1024]:
+        return 'pdf'
+
+    if head.startswith(PNG_MAGIC):
+        return 'png'
+
+    if head.startswith(JPEG_MAGIC):
+        return 'jpg'
+
+    if head.startswith(ZIP_MAGIC):
+        return 'zip'
+
+    if _is_utf8_text(head):
+        return 'txt'
+
+    return None
+
+
+def _is_docx(stream: IO[bytes]) -> bool:
+    # only the zip's central directory is read, nothing is decompressed
+    try:
+        with zipfile.ZipFile(stream) as archive:
+            archive.getinfo(BODY_PART)
+            return True
+    except (zipfile.BadZipFile, KeyError):
+        return False
+
+
+def sniff_upload(file: FileStorage, sniff_bytes: int = UPLOAD_SNIFF_BYTES) -> Optional[str]:
+    """
+    Tells the real type of an uploaded file, see sniff_file_type(). A zip is further told to be a 'docx'
+    if it holds a Word document. Leaves the stream at its start.
+
+    :param file: Uploaded file
+    :type file: FileStorage
+    :param sniff_bytes: number of bytes looked at
+    :type sniff_bytes: int
+    :return: 'pdf', 'png', 'jpg', 'docx', 'zip', 'txt' or None if the type is not recognised
+    :rtype: Optional[str]
+    """
+    stream = file.stream
+
+    try:
+        stream.seek(0)
+        file_type = sniff_file_type(stream.read(sniff_bytes))
+
+        if file_type == 'zip' and _is_docx(stream):
+            file_type = 'docx'
+
+        return file_type
+    finally:
+        stream.seek(0)
+
+
+def _map_stream(stream: IO[bytes]) -> Optional[mmap.mmap]:
+    try:
+        # pending writes must reach the file before it's mapped
+        stream.flush()
+        return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, UnsupportedOperation, ValueError):
+        # an in-memory stream, or a file that can't be mapped
+        return None
+
+
+@contextmanager
+def open_upload(file: FileStorage, mmap_min_bytes: int = UPLOAD_MMAP_MIN_BYTES) -> Iterator[FileBuffer]:
+    """
+    Gives the content of an uploaded file to extractors, memory-mapped if the upload is spooled to disk
+    and at least mmap_min_bytes large, read into bytes otherwise. The mapping is closed on exit.
+
+    :param file: Uploaded file
+    :type file: FileStorage
+    :param mmap_min_bytes: smaller uploads are read, mapping them costs more than it saves
+    :type mmap_min_bytes: int
+    :return: Content of the file, bytes or a read-only mmap
+    :rtype: Iterator[FileBuffer]
+    """
+    mapped = _map_stream(file.stream) if get_upload_size(file) >= mmap_min_bytes else None
+
+    if mapped is None:
+        # from the start, whoever looked at the upload before (e.g. estimate_cost()) may have moved the stream
+        file.stream.seek(0)
+        yield file.read()
+        return
+
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # a view of it is still alive somewhere, e.g. an unfinished PDF - it's unmapped when that's released
+            pass
+
+
+def open_stream(buffer: FileBuffer) -> IO[bytes]:
+    """
+    File-like object reading buffer from its start, without copying it - for readers that take files, e.g. zipfile or PIL.
+
+    :param buffer: Content of a file, see open_upload()
+    :type buffer: FileBuffer
+    :return: Readable, seekable stream
+    :rtype: IO[bytes]
+    """
+    if isinstance(buffer, mmap.mmap):
+        buffer.seek(0)
+        return buffer
+
+    return BytesIO(buffer)
@@ -0,0 +1,349 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from src.settings.config import (
+    JOBS_DB_PATH,
+    JOBS_LEASE_SECONDS,
+    JOBS_MAX_ATTEMPTS,
+    JOBS_MAX_QUEUED,
+    JOBS_QUEUED_TTL_SECONDS,
+    JOBS_RESULT_TTL_SECONDS,
+    JOBS_RETRY_DELAY_SECONDS,
+)
+from typing import Dict, Optional
+
+"""
+Durable queue of classification jobs, in a SQLite database on local disk.
+
+A 50-page scan keeps a request (and a gunicorn thread) busy for as long as OCR takes, and clients
+time out. With the job API, POST /jobs only stores the upload here and answers with a job ID,
+GET /jobs/<job_id> reports the status and, once done, the result. Jobs are run by a separate
+worker pool (run_jobs.py, see src/utils/job_worker.py), so long documents don't hold the
+threads that serve the fast .txt and .docx traffic.
+
+Life of a job:
+
+    queued -> running -> done
+                      -> queued again, if it failed with an unexpected error and has attempts left
+                      -> failed, if the document can't be classified or attempts ran out
+    queued -> expired, if no worker picked it up within JOBS_QUEUED_TTL_SECONDS
+
+A running job is leased to its worker for JOBS_LEASE_SECONDS, and the worker renews the lease while the job
+runs - if the worker dies, the lease runs out and the job is picked up again. Every claim gets a new lease ID,
+complete(), fail() and renew() only change the job while the caller's lease is still the current one, so a
+worker that lost its job (e.g. it stalled past the lease) can't overwrite the result of the one that took over. Finished jobs are deleted JOBS_RESULT_TTL_SECONDS after they finished.
+The queue takes at most JOBS_MAX_QUEUED queued and running jobs; submit() raises QueueFullError above that.
+
+Every statement that changes a job is a single UPDATE, so any number of processes can share the database.
+Unlike the result cache, SQLite errors are not swallowed - a job that wasn't stored must not be acknowledged.
+"""
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+EXPIRED = 'expired'
+
+
+class QueueFullError(Exception):
+    def __init__(self, message, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue with retries, leases, expiry and bounded depth.
+    Safe to use from many threads and processes.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, max_queued: int = JOBS_MAX_QUEUED, max_attempts: int = JOBS_MAX_ATTEMPTS,
+                 retry_delay_seconds: float = JOBS_RETRY_DELAY_SECONDS, lease_seconds: float = JOBS_LEASE_SECONDS,
+                 queued_ttl_seconds: float = JOBS_QUEUED_TTL_SECONDS, result_ttl_seconds: float = JOBS_RESULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.lease_seconds = lease_seconds
+        self.queued_ttl_seconds = queued_ttl_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+
+    def submit(self, file_bytes: bytes, filename: str, mimetype: str, text_mode: str) -> str:
+        """
+        Stores a new job.
+
+        :param file_bytes: Content of the uploaded file
+        :type file_bytes: bytes
+        :param filename: Name of the uploaded file
+        :type filename: str
+        :param mimetype: MIME type of the upload
+        :type mimetype: str
+        :param text_mode: Text mode of the request, one of TEXT_MODES
+        :type text_mode: str
+        :return: Job ID
+        :rtype: str
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        # the depth check and the insert are one statement, so concurrent submits can't overshoot max_queued
+        inserted = self._execute(
+            """
+            INSERT INTO jobs (job_id, status, filename, mimetype, text_mode, payload, attempts, created_at, updated_at, available_at, expires_at)
+            SELECT ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?
+            WHERE (SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)) < ?
+            RETURNING job_id
+            """,
+            (job_id, QUEUED, filename, mimetype, text_mode, sqlite3.Binary(file_bytes), now, now, now,
+             now + self.queued_ttl_seconds, QUEUED, RUNNING, self.max_queued),
+        )
+
+        if not inserted:
+            raise QueueFullError(f"Job queue is full ({self.max_queued} jobs). Try again later.", retry_after=int(self.retry_delay_seconds * 2) or 1)
+
+        return job_id
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Leases the oldest queued job that is due to the caller, and counts an attempt.
+
+        :return: Job with its payload and lease ID, or None if there's nothing to do
+        :rtype: Optional[Dict]
+        """
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        rows = self._execute(
+            """
+            UPDATE jobs SET status = ?, attempts = attempts + 1, lease_id = ?, lease_until = ?, updated_at = ?
+            WHERE job_id = (
+                SELECT job_id FROM jobs WHERE status = ? AND available_at <= ? AND expires_at > ?
+                ORDER BY available_at LIMIT 1
+            )
+            RETURNING job_id, filename, mimetype, text_mode, payload, attempts
+            """,
+            (RUNNING, lease_id, now + self.lease_seconds, now, QUEUED, now, now),
+        )
+
+        if not rows:
+            return None
+
+        job_id, filename, mimetype, text_mode, payload, attempts = rows[0]
+        return {"job_id": job_id, "filename": filename, "mimetype": mimetype, "text_mode": text_mode,
+                "payload": bytes(payload), "attempts": attempts, "lease_id": lease_id}
+
+    def renew(self, job_id: str, lease_id: str) -> bool:
+        """
+        Extends the lease of a running job by lease_seconds from now.
+
+        :param job_id: Job ID
+        :type job_id: str
+        :param lease_id: Lease ID the job was claimed with
+        :type lease_id: str
+        :return: Whether the caller still holds the lease - False if the job was given to another worker or finished
+        :rtype: bool
+        """
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE job_id = ? AND status = ? AND lease_id = ? RETURNING job_id",
+            (now + self.lease_seconds, now, job_id, RUNNING, lease_id),
+        )
+
+        return bool(rows)
+
+    def complete(self, job_id: str, lease_id: str, result: Dict) -> bool:
+        """
+        Marks a running job done and stores its result. The payload isn't needed anymore and is dropped.
+
+        :param job_id: Job ID
+        :type job_id: str
+        :param lease_id: Lease ID the job was claimed with
+        :type lease_id: str
+        :param result: JSON-serialisable result
+        :type result: Dict
+        :return: Whether the result was stored - False if the caller's lease was lost, the job is left as it is then
+        :rtype: bool
+        """
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, payload = NULL, updated_at = ? "
+            "WHERE job_id = ? AND status = ? AND lease_id = ? RETURNING job_id",
+            (DONE, json.dumps(result), time.time(), job_id, RUNNING, lease_id),
+        )
+
+        return bool(rows)
+
+    def fail(self, job_id: str, lease_id: str, error: str, retry: bool = True) -> bool:
+        """
+        Puts a failed job back in the queue, after a delay growing with every attempt,
+        or marks it failed if it shouldn't be retried or has no attempts left.
+
+        :param job_id: Job ID
+        :type job_id: str
+        :param lease_id: Lease ID the job was claimed with
+        :type lease_id: str
+        :param error: Error message, reported by get() if the job fails for good
+        :type error: str
+        :param retry: False for errors another attempt won't fix, e.g. a document without text
+        :type retry: bool
+        :return: Whether the failure was recorded - False if the caller's lease was lost, the job is left as it is then
+        :rtype: bool
+        """
+        now = time.time()
+        rows = self._execute(
+            """
+            UPDATE jobs SET
+                status = CASE WHEN ? AND attempts < ? THEN ? ELSE ? END,
+                payload = CASE WHEN ? AND attempts < ? THEN payload ELSE NULL END,
+                available_at = ? + ? * attempts,
+                error = ?, updated_at = ?
+            WHERE job_id = ? AND status = ? AND lease_id = ?
+            RETURNING job_id
+            """,
+            (retry, self.max_attempts, QUEUED, FAILED, retry, self.max_attempts, now, self.retry_delay_seconds,
+             error, now, job_id, RUNNING, lease_id),
+        )
+
+        return bool(rows)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        :param job_id: Job ID
+        :type job_id: str
+        :return: Status of the job, with the result once it's done or the error if it failed, None if there's no such job
+        :rtype: Optional[Dict]
+        """
+        rows = self._execute(
+            "SELECT status, filename, attempts, result, error, created_at, updated_at FROM jobs WHERE job_id = ?",
+            (job_id,),
+        )
+
+        if not rows:
+            return None
+
+        status, filename, attempts, result, error, created_at, updated_at = rows[0]
+        job = {"job_id": job_id, "status": status, "filename": filename, "attempts": attempts,
+               "created_at": created_at, "updated_at": updated_at}
+
+        if status == DONE:
+            job["result"] = json.loads(result)
+        elif status in (FAILED, EXPIRED):
+            job["error"] = error
+
+        return job
+
+    def expire(self, now: float = None) -> Dict[str, int]:
+        """
+        Housekeeping, run periodically by the worker pool:
+            - running jobs whose lease ran out (their worker died or stopped renewing it) are queued again or failed,
+            - queued jobs nobody picked up in time expire,
+            - finished jobs past JOBS_RESULT_TTL_SECONDS are deleted.
+
+        :param now: Current timestamp, defaults to time.time()
+        :type now: float
+        :return: Number of jobs requeued, expired and deleted
+        :rtype: Dict[str, int]
+        """
+        now = now or time.time()
+
+        requeued = self._execute(
+            """
+            UPDATE jobs SET
+                status = CASE WHEN attempts < ? THEN ? ELSE ? END,
+                payload = CASE WHEN attempts < ? THEN payload ELSE NULL END,
+                error = 'Worker stopped while processing the job', updated_at = ?
+            WHERE status = ? AND lease_until < ?
+            RETURNING job_id
+            """,
+            (self.max_attempts, QUEUED, FAILED, self.max_attempts, now, RUNNING, now),
+        )
+        expired = self._execute(
+            "UPDATE jobs SET status = ?, payload = NULL, error = 'Job expired before it was processed', updated_at = ? "
+            "WHERE status = ? AND expires_at <= ? RETURNING job_id",
+            (EXPIRED, now, QUEUED, now),
+        )
+        deleted = self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ? RETURNING job_id",
+            (DONE, FAILED, EXPIRED, now - self.result_ttl_seconds),
+        )
+
+        return {"requeued": len(requeued), "expired": len(expired), "deleted": len(deleted)}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: Number of jobs in every status and the queue depth (queued and running jobs)
+        :rtype: Dict[str, int]
+        """
+        stats = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, EXPIRED)}
+        stats.update(dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")))
+        stats["depth"] = stats[QUEUED] + stats[RUNNING]
+        stats["max_queued"] = self.max_queued
+
+        return stats
+
+    def clear(self):
+        """
+        Removes all jobs.
+        """
+        self._execute("DELETE FROM jobs")
+
+    def _connection(self) -> sqlite3.Connection:
+        # a connection must not cross a fork, every process opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT NOT NULL, mimetype TEXT, text_mode TEXT NOT NULL,
+                    payload BLOB, attempts INTEGER NOT NULL, result TEXT, error TEXT, lease_id TEXT, lease_until REAL,
+                    created_at REAL NOT NULL, updated_at REAL NOT NULL, available_at REAL NOT NULL, expires_at REAL NOT NULL
+                )
+                """
+            )
+
+            # databases created before leases had IDs
+            if 'lease_id' not in [column[1] for column in self._db.execute("PRAGMA table_info(jobs)")]:
+                try:
+                    self._db.execute("ALTER TABLE jobs ADD COLUMN lease_id TEXT")
+                except sqlite3.OperationalError: # another process added it first
+                    pass
+
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status_available_at ON jobs (status, available_at)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+
+        return self._db
+
+    def _execute(self, query: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            db = self._connection()
+            rows = db.execute(query, params).fetchall()
+            db.commit()
+            return rows
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Returns the process-wide job queue configured in settings. The database is opened on first use.
+
+    :return: Queue instance
+    :rtype: JobQueue
+    """
+    global _job_queue
+
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+
+    return _job_queue
@@ -0,0 +1,203 @@
+import threading
+import time
+import torch
+
+from io import BytesIO
+from src.model.snapshot import model_identity
+from src.settings.config import JOBS_POLL_SECONDS, JOBS_WORKERS, MODEL_PATH
+from src.utils.classifier import classify_file
+from src.utils.job_queue import JobQueue
+from src.utils.result_cache import ResultCache, make_cache_key
+from src.utils.text_extractor import extract_text
+from src.utils.tiered_ocr import new_ocr_pass, review_ocr_pass
+from src.utils.validators import ValidationError, validate_file_text
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import Dict, List
+from werkzeug.datastructures import FileStorage
+
+"""
+Worker pool draining the job queue (src/utils/job_queue.py), started with run_jobs.py.
+
+Every worker thread takes a job, runs it through the same extract_text() and classify_file()
+as /classify-file, and stores the result. Threads of the pool share the model's batch scheduler,
+so jobs that reach the forward pass together are classified in one batch, and the OCR process pool.
+
+Errors another attempt won't fix (no text in the document, validation) fail the job straight away,
+anything else is retried by the queue. While a job runs, its lease is renewed every third of
+JOBS_LEASE_SECONDS, so a long OCR job isn't handed to another worker halfway through. One of the threads
+also runs the queue's housekeeping (lease recovery, expiry) every EXPIRE_EVERY_SECONDS.
+"""
+
+EXPIRE_EVERY_SECONDS = 30
+
+
+def process_job(job: Dict, model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device,
+                result_cache: ResultCache = None, model_version: str = None) -> Dict:
+    """
+    Extracts text from the job's file and classifies it.
+
+    :param job: Job, as returned by JobQueue.claim()
+    :type job: Dict
+    :param model: DistilBERT-type model instance
+    :type model: transformers.DistilBertForSequenceClassification
+    :param tokenizer: DistilBERT-type tokenizer, applied to text
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param device: Device type (CPU or GPU) as read by PyTorch
+    :type device: torch.device
+    :param result_cache: Result cache, shared with the app through its SQLite tier, None to skip it
+    :type result_cache: ResultCache
+    :param model_version: Version of the model, see src/model/registry.py - part of the cache key and the result if given
+    :type model_version: str
+    :return: Result in the shape of a /classify-file response
+    :rtype: Dict
+    """
+    file = FileStorage(stream=BytesIO(job["payload"]), filename=job["filename"], content_type=job["mimetype"])
+    text_mode = job["text_mode"]
+
+    cache_key = make_cache_key(file, model_version or model_identity(model_path=MODEL_PATH)) if result_cache else None
+    cached_result = result_cache.get_for_text_mode(cache_key, text_mode) if cache_key else None
+
+    if cached_result:
+        return {**cached_result, "model_version": model_version} if model_version else cached_result
+
+    ocr_pass = new_ocr_pass(text_mode)
+    file_text = extract_text(file, tokenizer=tokenizer if text_mode == 'none' else None, ocr_pass=ocr_pass)
+    validate_file_text(file_text)
+
+    file_class, confidence = classify_file(file_text, model, tokenizer=tokenizer, device=device)
+    full_pass = review_ocr_pass(ocr_pass, confidence)
+
+    # text read by fast OCR left the classifier unsure, the file is read again at full resolution
+    if full_pass:
+        file_text = extract_text(file, tokenizer=tokenizer if text_mode == 'none' else None, ocr_pass=full_pass) or file_text
+        file_class, confidence = classify_file(file_text, model, tokenizer=tokenizer, device=device)
+        review_ocr_pass(full_pass, confidence)
+
+    if not all([file_text, file_class, confidence]):
+        raise ValidationError("Unable to classify document.")
+
+    result = {"file_class": file_class, "confidence": confidence}
+
+    if text_mode == 'full':
+        result["file_text"] = file_text
+
+    if cache_key:
+        result_cache.put(cache_key, result)
+
+    return {**result, "model_version": model_version} if model_version else result
+
+
+class JobWorkerPool:
+    """
+    Threads taking jobs from the queue and processing them until stopped.
+    """
+
+    def __init__(self, job_queue: JobQueue, process, workers: int = JOBS_WORKERS, poll_seconds: float = JOBS_POLL_SECONDS,
+                 renew_seconds: float = None):
+        """
+        :param job_queue: Queue to drain
+        :type job_queue: JobQueue
+        :param process: Called with a claimed job, returns its result, see process_job()
+        :type process: Callable[[Dict], Dict]
+        :param workers: Number of worker threads
+        :type workers: int
+        :param poll_seconds: How long an idle worker waits before looking for jobs again
+        :type poll_seconds: float
+        :param renew_seconds: How often the lease of a running job is renewed, a third of the queue's lease by default
+        :type renew_seconds: float
+        """
+        self.job_queue = job_queue
+        self.process = process
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.renew_seconds = renew_seconds or job_queue.lease_seconds / 3
+
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._last_expire = 0.0
+        self._expire_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """
+        Lets every worker finish its current job, then stops them.
+        """
+        self._stopped.set()
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_once(self) -> bool:
+        """
+        Claims and processes a single job.
+
+        :return: Whether there was a job to process
+        :rtype: bool
+        """
+        job = self.job_queue.claim()
+
+        if job is None:
+            return False
+
+        start = time.perf_counter()
+        finished = threading.Event()
+        renewer = threading.Thread(target=self._renew_lease, args=(job, finished), name=f"job-lease-{job['job_id']}", daemon=True)
+        renewer.start()
+
+        try:
+            result = self.process(job)
+        except ValidationError as e:
+            print(f"Job {job['job_id']} failed: {e}")
+            recorded = self.job_queue.fail(job["job_id"], job["lease_id"], str(e), retry=False)
+        except Exception as e:
+            print(f"Job {job['job_id']} failed on attempt {job['attempts']}: {e}")
+            recorded = self.job_queue.fail(job["job_id"], job["lease_id"], str(e), retry=True)
+        else:
+            recorded = self.job_queue.complete(job["job_id"], job["lease_id"], result)
+            print(f"Job {job['job_id']} ({job['filename']}) done in {time.perf_counter() - start:.2f}s")
+        finally:
+            finished.set()
+            renewer.join()
+
+        if not recorded:
+            print(f"Job {job['job_id']} lost its lease, its outcome was dropped")
+
+        return True
+
+    def _renew_lease(self, job: Dict, finished: threading.Event):
+        while not finished.wait(self.renew_seconds):
+            try:
+                if not self.job_queue.renew(job["job_id"], job["lease_id"]):
+                    print(f"Job {job['job_id']} lost its lease, another worker may be running it")
+                    return
+            except Exception as e: # e.g. the database is locked for too long, tried again next time
+                print(f"Job {job['job_id']} lease renewal failed: {e}")
+
+    def _expire_if_due(self):
+        with self._expire_lock:
+            if time.time() - self._last_expire < EXPIRE_EVERY_SECONDS:
+                return
+
+            self._last_expire = time.time()
+
+        expired = self.job_queue.expire()
+
+        if any(expired.values()):
+            print(f"Job queue housekeeping: {expired}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._expire_if_due()
+
+                if not self.run_once():
+                    self._stopped.wait(self.poll_seconds)
+
+            except Exception as e: # e.g. the database is locked for too long, keep the worker alive
+                print(f"Job worker error: {e}")
+                self._stopped.wait(self.poll_seconds)
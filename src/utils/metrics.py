@@ -0,0 +1,195 @@
+import contextvars
+import os
+import shutil
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+from src.settings.config import METRICS_DIR
+from typing import Iterator, Tuple
+
+# must be in the environment before prometheus_client is imported, it picks the value storage on import
+if METRICS_DIR:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', METRICS_DIR)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+"""
+Prometheus metrics.
+
+Every request is timed as a whole (classifier_request_seconds) and stage by stage (classifier_stage_seconds):
+
+    validate - reading and validating the upload,
+    cache_lookup - hashing the upload and looking it up in the result cache,
+    estimate_cost, admission_wait - telling what a request will cost and waiting for budget, see src/utils/admission.py,
+    extract - text extraction as a whole, which breaks down into:
+        pdf_parse - opening a PDF and reading its text layer,
+        docx_parse - reading paragraphs and tables of a DOCX,
+        rasterise - rendering a PDF page without text to an image,
+        ocr - Tesseract reading an image,
+    tokenize, forward - the model's share, timed once per bucket of a batch on the batching thread.
+
+Extraction stages are labelled with the type of the file being processed (pdf, docx, txt, png, ...),
+the model stages with an empty file_type, since a batch mixes files of all types.
+
+Without METRICS_DIR, metrics live in memory of the process that records them. That's fine for `python run.py`,
+but every gunicorn worker would report only its own requests, and OCR done in the process pools would be lost.
+With METRICS_DIR set, every process writes its samples to its own memory-mapped files in that directory
+and /metrics sums them up (prometheus_client's multiprocess mode). Recording a sample costs a few microseconds
+either way, so metrics are always on.
+"""
+
+STAGE_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUEST_SECONDS = Histogram('classifier_request_seconds', 'Time spent handling a request', ['endpoint'], buckets=STAGE_BUCKETS)
+REQUESTS = Counter('classifier_requests', 'Handled requests', ['endpoint', 'status'])
+REQUESTS_IN_FLIGHT = Gauge('classifier_requests_in_flight', 'Requests being handled', multiprocess_mode='livesum')
+STAGE_SECONDS = Histogram('classifier_stage_seconds', 'Time spent in a stage of request processing', ['stage', 'file_type'], buckets=STAGE_BUCKETS)
+PAGES = Counter('classifier_pdf_pages', 'PDF pages processed, by how their text was read', ['method'])
+OCR_FALLBACKS = Counter('classifier_ocr_fallbacks', 'Documents without a text layer (or with pages without one) that had to be OCR\'d', ['file_type'])
+UPLOADS_REJECTED = Counter('classifier_uploads_rejected', 'Uploads rejected by intake checks before extraction', ['reason'])
+ADMISSION_SHED = Counter('classifier_admission_shed', 'Requests answered with 503 by admission control', ['kind', 'reason'])
+ADMISSION_WAITING = Gauge('classifier_admission_waiting', 'Requests waiting for admission', ['kind'], multiprocess_mode='livesum')
+ADMISSION_IN_FLIGHT = Gauge('classifier_admission_in_flight', 'Budget units taken by admitted requests', ['kind'], multiprocess_mode='livesum')
+OCR_TIER_READS = Counter('classifier_ocr_tier_reads', 'Pages and images OCR\'d, by tier and whether the read was kept or escalated', ['tier', 'outcome'])
+OCR_TIER_SECONDS = Histogram('classifier_ocr_tier_seconds', 'Time spent reading a page or an image, rendering included, by OCR tier', ['tier'], buckets=STAGE_BUCKETS)
+OCR_ESCALATIONS = Counter('classifier_ocr_escalations', 'Fast OCR reads done again at full resolution, by reason', ['reason'])
+CASCADE_TEXTS = Counter('classifier_cascade_texts', 'Classified texts, by the cascade stage that gave the answer', ['stage'])
+MODEL_SWAPS = Counter('classifier_model_swaps', 'Model versions swapped in, or that failed to load', ['outcome'])
+BATCH_SIZE = Histogram('classifier_batch_size', 'Number of texts in a forward pass', buckets=(1, 2, 4, 8, 16, 32, 64))
+
+_file_type = contextvars.ContextVar('file_type', default='')
+
+
+@contextmanager
+def file_type_context(file_type: str) -> Iterator[None]:
+    """
+    Labels stages timed inside the block (in this thread) with given file type.
+
+    :param file_type: File extension, e.g. 'pdf'
+    :type file_type: str
+    """
+    token = _file_type.set(file_type)
+
+    try:
+        yield
+    finally:
+        _file_type.reset(token)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    """
+    Records how long the block took under given stage, see the module docstring for stage names.
+    Time is recorded even if the block raises.
+
+    :param stage: Stage name
+    :type stage: str
+    """
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage, file_type=_file_type.get()).observe(time.perf_counter() - start)
+
+
+def _status_code(response) -> int:
+    if isinstance(response, tuple):
+        return response[1]
+
+    return response.status_code
+
+
+def track_request(endpoint: str):
+    """
+    Counts and times requests of an endpoint and keeps track of how many are in flight.
+    Put it above error_interceptor, so that it sees the final status code.
+
+    :param endpoint: Endpoint name used as label
+    :type endpoint: str
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            REQUESTS_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            status = 500
+
+            try:
+                response = f(*args, **kwargs)
+                status = _status_code(response)
+                return response
+            finally:
+                REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+                REQUESTS.labels(endpoint=endpoint, status=str(status)).inc()
+                REQUESTS_IN_FLIGHT.dec()
+
+        return wrapper
+
+    return decorator
+
+
+def track_request_async(endpoint: str):
+    """
+    Same as track_request(), for endpoints of the async app.
+
+    :param endpoint: Endpoint name used as label
+    :type endpoint: str
+    """
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            REQUESTS_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            status = 500
+
+            try:
+                response = await f(*args, **kwargs)
+                status = _status_code(response)
+                return response
+            finally:
+                REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+                REQUESTS.labels(endpoint=endpoint, status=str(status)).inc()
+                REQUESTS_IN_FLIGHT.dec()
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Renders all metrics in Prometheus text format. In multiprocess mode, samples of all processes are summed up.
+
+    :return: A tuple consisting of: response body and its content type
+    :rtype: Tuple[bytes, str]
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def reset_metrics_dir():
+    """
+    Removes samples left over by a previous run. Call once at server startup, before workers start.
+    """
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        shutil.rmtree(METRICS_DIR)
+        os.makedirs(METRICS_DIR)
+
+
+def mark_process_dead(pid: int):
+    """
+    Drops the in-flight gauge of a worker process that exited, so it's no longer counted.
+
+    :param pid: Process ID of the exited worker
+    :type pid: int
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
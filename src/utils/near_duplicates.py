@@ -0,0 +1,439 @@
+import atexit
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import threading
+import time
+
+from src.settings.config import (
+    LONG_DOCUMENT_MAX_WINDOWS,
+    NEAR_DUPLICATE_BANDS,
+    NEAR_DUPLICATE_ENABLED,
+    NEAR_DUPLICATE_INDEX_DIR,
+    NEAR_DUPLICATE_MAX_CHARS,
+    NEAR_DUPLICATE_MAX_ENTRIES,
+    NEAR_DUPLICATE_MIN_CHARS,
+    NEAR_DUPLICATE_MIN_CONFIDENCE,
+    NEAR_DUPLICATE_NUM_PERM,
+    NEAR_DUPLICATE_SHINGLE_CHARS,
+    NEAR_DUPLICATE_THRESHOLD,
+)
+from typing import Dict, Optional, Tuple
+
+"""
+Near-duplicate index of classified texts, the first stage of the classification cascade (see src/utils/classifier.py).
+
+The result cache only knows byte-identical uploads, but the same documents keep coming back rescanned, re-exported
+or re-OCR'd - different bytes, almost the same text. Their text is normalised (lowercase, letters and digits,
+single spaces), cut to NEAR_DUPLICATE_MAX_CHARS - about what the model reads - and turned into a MinHash signature
+of its character shingles. A text whose signature agrees with one classified before on at least
+NEAR_DUPLICATE_THRESHOLD of its values (an estimate of the Jaccard similarity of their shingles) gets the stored
+label and confidence, and the transformer is skipped.
+
+Lookups go through LSH: the signature is cut into NEAR_DUPLICATE_BANDS bands and every band is hashed into a table
+of its own, which points at the last entry stored in that bucket. So a lookup reads one slot per band and compares
+at most that many signatures, however many entries there are - no lists of candidates, no probing. An entry
+overwritten in one table is still found through its other bands, and a stale pointer (its slot reused since)
+just fails the comparison.
+
+Memory is fixed when the index is created: NEAR_DUPLICATE_MAX_ENTRIES signatures (uint16 per value, 2 bytes each)
+and bands * 2 * max_entries table slots (4 bytes each) - about 260 bytes per entry, 260MB at a million entries.
+Entries are evicted in CLOCK order: the oldest entry goes first, unless it was reused since it was last passed over.
+
+The stage is off when long documents are classified in several windows (LONG_DOCUMENT_MAX_WINDOWS > 1), since two
+documents with the same first pages would share a label the model never gave the second one.
+
+The stage is off unless NEAR_DUPLICATE_ENABLED is set: it changes answers (a near-identical text gets the stored
+label, not the model's) and costs every worker process the memory of its own index.
+
+Only transformer results at least NEAR_DUPLICATE_MIN_CONFIDENCE sure are stored. There's an index per model version,
+opened by the model registry when it loads the version (see src/model/registry.py), saved to NEAR_DUPLICATE_INDEX_DIR
+(if set) when the version is released or the process exits, and loaded from there when the same version is served again.
+Worker processes share that file - the last one to save overwrites the others, their entries are lost.
+"""
+
+NORMALISE_PATTERN = re.compile(r"[^a-z0-9]+")
+MAX_HASH_BITS = 32
+HASH_SEED = 20240601 # the same permutations in every process and after a restart, so saved signatures stay comparable
+BAND_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+CLOCK_BLOCK = 4096
+
+
+def normalise_text(text: str, max_chars: int = NEAR_DUPLICATE_MAX_CHARS) -> str:
+    """
+    Lowercases text and replaces everything but letters and digits with single spaces.
+
+    :param text: Raw text
+    :type text: str
+    :param max_chars: Characters of the normalised text kept
+    :type max_chars: int
+    :return: Normalised text
+    :rtype: str
+    """
+    # a long text is normalised up to a margin over max_chars only, whatever its length
+    return NORMALISE_PATTERN.sub(' ', text[:max_chars * 2].lower()).strip()[:max_chars]
+
+
+class MinHasher:
+    """
+    MinHash signatures of character shingles, computed with numpy.
+    """
+
+    def __init__(self, num_perm: int = NEAR_DUPLICATE_NUM_PERM, shingle_chars: int = NEAR_DUPLICATE_SHINGLE_CHARS,
+                 max_chars: int = NEAR_DUPLICATE_MAX_CHARS, min_chars: int = NEAR_DUPLICATE_MIN_CHARS, seed: int = HASH_SEED):
+        """
+        :param num_perm: Signature length
+        :type num_perm: int
+        :param shingle_chars: Shingle length, at most 8 - a shingle is packed into a uint64 as it is
+        :type shingle_chars: int
+        :param max_chars: Characters of normalised text signed
+        :type max_chars: int
+        :param min_chars: Characters of normalised text needed for a signature
+        :type min_chars: int
+        :param seed: Seed of the hash functions
+        :type seed: int
+        """
+        rng = np.random.default_rng(seed)
+
+        self.seed = seed
+        self.num_perm = num_perm
+        self.shingle_chars = min(8, shingle_chars)
+        self.max_chars = max_chars
+        self.min_chars = max(min_chars, self.shingle_chars)
+        # multiply-add-shift hashing of 64-bit keys to 32 bits, uint64 arithmetic wraps around
+        self._multipliers = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._increments = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        :param text: Raw text
+        :type text: str
+        :return: uint32 signature of num_perm values, None if the text is shorter than min_chars
+        :rtype: Optional[np.ndarray]
+        """
+        data = np.frombuffer(normalise_text(text, self.max_chars).encode('utf-8'), dtype=np.uint8)
+
+        if len(data) < self.min_chars:
+            return None
+
+        # every shingle packed into one integer, so distinct shingles never collide
+        count = len(data) - self.shingle_chars + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+
+        for offset in range(self.shingle_chars):
+            shingles = (shingles << np.uint64(8)) | data[offset:offset + count].astype(np.uint64)
+
+        shingles = np.unique(shingles)
+        hashes = (shingles[:, None] * self._multipliers + self._increments) >> np.uint64(64 - MAX_HASH_BITS)
+
+        return hashes.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Bounded LSH index of MinHash signatures and the labels they were classified with. Safe to use from many threads.
+    """
+
+    def __init__(self, max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 num_perm: int = NEAR_DUPLICATE_NUM_PERM, bands: int = NEAR_DUPLICATE_BANDS, min_confidence: float = NEAR_DUPLICATE_MIN_CONFIDENCE,
+                 hasher: MinHasher = None, model_version: str = None):
+        """
+        :param max_entries: Signatures kept, the oldest are evicted above it
+        :type max_entries: int
+        :param threshold: Share of signature values a stored entry must agree on to be reused
+        :type threshold: float
+        :param num_perm: Signature length
+        :type num_perm: int
+        :param bands: LSH bands, must divide num_perm
+        :type bands: int
+        :param min_confidence: Results less confident than this aren't stored
+        :type min_confidence: float
+        :param hasher: MinHasher of texts, one with num_perm values by default
+        :type hasher: MinHasher
+        :param model_version: Version of the model whose results are stored, a file saved for another isn't loaded
+        :type model_version: str
+        """
+        if num_perm % bands:
+            raise ValueError(f"{bands} bands don't divide a signature of {num_perm} values")
+
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.min_confidence = min_confidence
+        self.hasher = hasher or MinHasher(num_perm=num_perm)
+        self.model_version = model_version
+
+        # a table twice the entries keeps most of the buckets of an entry to itself
+        self._table_bits = max(4, int(2 * max_entries - 1).bit_length())
+        self._band_rows = np.arange(bands)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        with self._lock:
+            self._signatures = np.zeros((self.max_entries, self.num_perm), dtype=np.uint16)
+            self._label_ids = np.full(self.max_entries, -1, dtype=np.int16)
+            self._confidences = np.zeros(self.max_entries, dtype=np.float32)
+            self._referenced = np.zeros(self.max_entries, dtype=bool)
+            self._tables = np.full((self.bands, 1 << self._table_bits), -1, dtype=np.int32)
+            self._labels = []
+            self._size = 0
+            self._hand = 0
+            self._stats = {"lookups": 0, "hits": 0, "stores": 0, "evictions": 0}
+            self._lookup_seconds = 0.0
+
+    def _buckets(self, signature: np.ndarray) -> np.ndarray:
+        keys = np.zeros(self.bands, dtype=np.uint64)
+
+        for row in signature.reshape(self.bands, -1).astype(np.uint64).T:
+            keys = keys * BAND_MULTIPLIER + row
+
+        # Fibonacci hashing, the top bits of the product are the best mixed
+        return (keys * BAND_MULTIPLIER) >> np.uint64(64 - self._table_bits)
+
+    def lookup(self, signature: np.ndarray) -> Optional[Tuple[str, float]]:
+        """
+        :param signature: Signature of a text, see MinHasher.signature()
+        :type signature: np.ndarray
+        :return: Label and confidence of the most similar stored text, if it's similar enough, else None
+        :rtype: Optional[Tuple[str, float]]
+        """
+        start = time.perf_counter()
+        buckets = self._buckets(signature)
+
+        with self._lock:
+            candidates = self._tables[self._band_rows, buckets]
+            candidates = np.unique(candidates[candidates >= 0])
+            result = None
+
+            if len(candidates):
+                similarities = (self._signatures[candidates] == signature.astype(np.uint16)).mean(axis=1)
+                best = int(similarities.argmax())
+
+                if similarities[best] >= self.threshold:
+                    slot = candidates[best]
+                    self._referenced[slot] = True
+                    result = self._labels[self._label_ids[slot]], float(self._confidences[slot])
+
+            self._stats["lookups"] += 1
+            self._stats["hits"] += result is not None
+            self._lookup_seconds += time.perf_counter() - start
+
+        return result
+
+    def add(self, signature: np.ndarray, label: str, confidence: float) -> bool:
+        """
+        Stores the label a text was classified with, if the classifier was sure enough of it.
+
+        :param signature: Signature of the text, see MinHasher.signature()
+        :type signature: np.ndarray
+        :param label: Predicted label
+        :type label: str
+        :param confidence: Confidence of the prediction
+        :type confidence: float
+        :return: Whether it was stored
+        :rtype: bool
+        """
+        if label is None or confidence is None or confidence < self.min_confidence:
+            return False
+
+        buckets = self._buckets(signature)
+
+        with self._lock:
+            slot = self._next_slot()
+
+            if label not in self._labels:
+                self._labels.append(label)
+
+            self._signatures[slot] = signature.astype(np.uint16)
+            self._label_ids[slot] = self._labels.index(label)
+            self._confidences[slot] = confidence
+            self._referenced[slot] = False
+            self._tables[self._band_rows, buckets] = slot
+            self._stats["stores"] += 1
+
+        return True
+
+    def _next_slot(self) -> int:
+        if self._size < self.max_entries:
+            self._size += 1
+            return self._size - 1
+
+        # CLOCK: entries reused since the hand last passed them get a second chance. The hand moves a block
+        # at a time, after a full round every entry has lost its chance, so it always stops
+        hand = self._hand
+
+        while True:
+            end = min(hand + CLOCK_BLOCK, self.max_entries)
+            unreferenced = np.flatnonzero(~self._referenced[hand:end])
+
+            if len(unreferenced):
+                slot = hand + int(unreferenced[0])
+                self._referenced[hand:slot] = False
+                break
+
+            self._referenced[hand:end] = False
+            hand = end % self.max_entries
+
+        self._hand = (slot + 1) % self.max_entries
+        self._stats["evictions"] += 1
+
+        return slot
+
+    def stats(self) -> Dict[str, float]:
+        """
+        :return: Lookup, hit, store and eviction counters, hit rate, mean lookup time and entries held
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._size
+            lookup_seconds = self._lookup_seconds
+
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["mean_lookup_us"] = lookup_seconds / stats["lookups"] * 1e6 if stats["lookups"] else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["threshold"] = self.threshold
+
+        return stats
+
+    def _meta(self) -> Dict:
+        return {"num_perm": self.num_perm, "bands": self.bands, "max_entries": self.max_entries, "table_bits": self._table_bits,
+                "shingle_chars": self.hasher.shingle_chars, "max_chars": self.hasher.max_chars, "seed": self.hasher.seed,
+                "model_version": self.model_version}
+
+    def save(self, path: str):
+        """
+        Saves entries and tables to a .npz file. The file is replaced atomically, workers saving at once don't mix.
+
+        :param path: Output file
+        :type path: str
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+
+        with self._lock:
+            with open(temp_path, 'wb') as f:
+                np.savez(f, signatures=self._signatures, label_ids=self._label_ids, confidences=self._confidences,
+                         referenced=self._referenced, tables=self._tables, labels=np.array(self._labels, dtype=str),
+                         state=np.array([self._size, self._hand]), meta=np.array(json.dumps(self._meta())))
+
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Loads entries saved by save(), if the file exists and was saved with the same settings, for the same model version.
+
+        :param path: File written by save()
+        :type path: str
+        :return: Whether anything was loaded
+        :rtype: bool
+        """
+        if not os.path.exists(path):
+            return False
+
+        with np.load(path) as data:
+            if json.loads(str(data['meta'])) != self._meta():
+                print(f"Near-duplicate index {path} was saved with other settings or for another model version, starting empty")
+                return False
+
+            with self._lock:
+                self._signatures = data['signatures']
+                self._label_ids = data['label_ids']
+                self._confidences = data['confidences']
+                self._referenced = data['referenced']
+                self._tables = data['tables']
+                self._labels = data['labels'].tolist()
+                self._size, self._hand = (int(value) for value in data['state'])
+
+        return True
+
+
+def index_path(model_version: str) -> Optional[str]:
+    """
+    Where the index of a model version is saved: a file per version in NEAR_DUPLICATE_INDEX_DIR.
+
+    :param model_version: Version served by the model registry, see src/model/registry.py
+    :type model_version: str
+    :return: Path of the .npz file, None if indexes aren't saved
+    :rtype: Optional[str]
+    """
+    if not NEAR_DUPLICATE_INDEX_DIR or not model_version:
+        return None
+
+    return os.path.join(NEAR_DUPLICATE_INDEX_DIR, hashlib.sha256(model_version.encode('utf-8')).hexdigest()[:16] + '.npz')
+
+
+_near_duplicate_indexes: Dict[int, Tuple[NearDuplicateIndex, Optional[str]]] = {}
+_near_duplicate_indexes_lock = threading.Lock()
+
+
+def get_near_duplicate_index(model, model_version: str = None) -> Optional[NearDuplicateIndex]:
+    """
+    Returns the index of a model, created on first use, or None if the near-duplicate stage is disabled.
+    It's disabled with LONG_DOCUMENT_MAX_WINDOWS > 1 too: a signature covers the first NEAR_DUPLICATE_MAX_CHARS,
+    while the model reads many windows - documents starting alike would get each other's label.
+    The model registry creates it with the version it serves, which loads it from NEAR_DUPLICATE_INDEX_DIR and
+    saves it there later - an index first used without a version is kept in memory only.
+
+    :param model: Inference backend or model, its predictions are what the index stores
+    :param model_version: Version of the model, see src/model/registry.py
+    :type model_version: str
+    :return: Index instance
+    :rtype: Optional[NearDuplicateIndex]
+    """
+    if not NEAR_DUPLICATE_ENABLED or LONG_DOCUMENT_MAX_WINDOWS > 1:
+        return None
+
+    entry = _near_duplicate_indexes.get(id(model))
+
+    # an index of another version under the same id() is left from a model freed without being closed
+    if entry is None or (model_version and entry[0].model_version != model_version):
+        with _near_duplicate_indexes_lock:
+            entry = _near_duplicate_indexes.get(id(model))
+
+            if entry is None or (model_version and entry[0].model_version != model_version):
+                index = NearDuplicateIndex(model_version=model_version)
+                path = index_path(model_version)
+
+                if path and index.load(path):
+                    print(f"Near-duplicate index of {model_version} loaded from {path}: {index.stats()['entries']} entries")
+
+                entry = _near_duplicate_indexes[id(model)] = (index, path)
+
+    return entry[0]
+
+
+def close_near_duplicate_index(model):
+    """
+    Saves (if NEAR_DUPLICATE_INDEX_DIR is set) and forgets the index of a model that's no longer served.
+
+    :param model: Inference backend or model
+    """
+    with _near_duplicate_indexes_lock:
+        entry = _near_duplicate_indexes.pop(id(model), None)
+
+    if entry is not None and entry[1]:
+        entry[0].save(entry[1])
+
+
+@atexit.register
+def save_near_duplicate_indexes():
+    """
+    Saves the indexes of all models served by this process, if NEAR_DUPLICATE_INDEX_DIR is set.
+    """
+    with _near_duplicate_indexes_lock:
+        entries = list(_near_duplicate_indexes.values())
+
+    for index, path in entries:
+        if path and index.stats()["stores"]:
+            try:
+                index.save(path)
+            except OSError as e:
+                print(f"Near-duplicate index could not be saved to {path}: {e}")
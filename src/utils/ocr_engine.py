@@ -0,0 +1,201 @@
+import abc
+import os
+import pytesseract
+import queue
+import threading
+
+from PIL import Image
+from src.settings.config import OCR_ENGINE, OCR_ENGINE_POOL_SIZE, OCR_ENGINES, OCR_LANGUAGE, TESSDATA_PATH
+from typing import Dict
+
+"""
+OCR engines.
+
+pytesseract runs the tesseract CLI: every image is written to a temporary file, a new
+process is started, loads the language model, reads the image and writes its output to
+another temporary file. For a 10-page scan that's 10 processes and 10 model loads.
+
+tesserocr binds the Tesseract C++ API instead. A TessBaseAPI handle loads the language
+model once and can then read any number of images, handed over as PIL images in memory.
+Handles aren't thread-safe, so TesserocrEngine keeps a pool of them - a request thread takes
+a handle, reads its image and gives it back. Tesseract releases the GIL while it recognises,
+so handles of one pool do run in parallel.
+
+    1. tesserocr - persistent handles, needs `pip install tesserocr` and tessdata for OCR_LANGUAGE,
+    2. pytesseract - the tesseract CLI, the fallback if tesserocr can't be loaded.
+
+Which one is used is set in settings (OCR_ENGINE). benchmarks/bench_ocr_engines.py compares them per page.
+Whichever it is, an image it fails to read raises OcrError, so callers handle one error type.
+"""
+
+# tesserocr's first import installs signal handlers (cysignals), which only the main thread may do - import it
+# along with this module, at startup, rather than in whichever request or pool thread OCRs the first image
+if OCR_ENGINE == 'tesserocr':
+    try:
+        import tesserocr # noqa: F401
+    except ImportError:
+        pass
+
+
+class OcrError(Exception):
+    """
+    An engine failed to read an image.
+    """
+
+
+class OcrEngine(abc.ABC):
+    """
+    Reads text from images.
+    """
+    name = None
+    errors = () # what the engine raises when it fails to read an image, turned into OcrError
+
+    def image_to_string(self, image: Image.Image) -> str:
+        """
+        :param image: Image to read, e.g. a greyscale page
+        :type image: PIL.Image.Image
+        :return: Recognised text
+        :rtype: str
+        :raises OcrError: if the engine fails to read the image
+        """
+        try:
+            return self._read(image)
+        except self.errors as e:
+            raise OcrError(f"{self.name}: {type(e).__name__}: {e}") from e
+
+    @abc.abstractmethod
+    def _read(self, image: Image.Image) -> str:
+        pass
+
+    def close(self):
+        pass
+
+
+class PytesseractEngine(OcrEngine):
+    """
+    The tesseract CLI, one process per image.
+    """
+    name = 'pytesseract'
+    # a missing tesseract binary (TesseractNotFoundError) isn't an error of one image, it's left as it is
+    errors = (pytesseract.TesseractError, RuntimeError) # RuntimeError - timeout
+
+    def __init__(self, lang: str = OCR_LANGUAGE):
+        self.lang = lang
+
+    def _read(self, image: Image.Image) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+
+class TesserocrEngine(OcrEngine):
+    """
+    Pool of long-lived tesserocr API handles, each with the language model loaded.
+    Handles are created on demand, up to pool_size; a thread that finds all of them busy waits for one.
+    """
+    name = 'tesserocr'
+    errors = (RuntimeError,)
+
+    def __init__(self, pool_size: int = OCR_ENGINE_POOL_SIZE, lang: str = OCR_LANGUAGE, tessdata_path: str = TESSDATA_PATH):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+
+        try:
+            import tesserocr
+        except ImportError:
+            raise ImportError("tesserocr engine requires tesserocr: pip install tesserocr")
+
+        self._tesserocr = tesserocr
+        self.pool_size = pool_size
+        self.lang = lang
+        self.tessdata_path = tessdata_path
+
+        self._handles = queue.LifoQueue() # the most recently used handle has the warmest caches
+        self._lock = threading.Lock()
+        self._created = 0
+
+        # fails here, and not in the middle of a request, if tessdata for lang can't be found
+        self._handles.put(self._create_handle())
+
+    def _create_handle(self):
+        kwargs = {'lang': self.lang}
+
+        if self.tessdata_path:
+            kwargs['path'] = self.tessdata_path
+
+        handle = self._tesserocr.PyTessBaseAPI(**kwargs)
+        self._created += 1
+        return handle
+
+    def _acquire(self):
+        try:
+            return self._handles.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.pool_size:
+                return self._create_handle()
+
+        return self._handles.get()
+
+    def _read(self, image: Image.Image) -> str:
+        handle = self._acquire()
+
+        try:
+            handle.SetImage(image)
+            return handle.GetUTF8Text()
+        finally:
+            handle.Clear()
+            self._handles.put(handle)
+
+    def close(self):
+        while True:
+            try:
+                self._handles.get_nowait().End()
+            except queue.Empty:
+                return
+
+
+ENGINES: Dict[str, type] = {engine.name: engine for engine in (TesserocrEngine, PytesseractEngine)}
+
+
+def build_ocr_engine(name: str, **kwargs) -> OcrEngine:
+    """
+    Creates the OCR engine of given name, falling back to pytesseract if it can't be loaded.
+
+    :param name: One of OCR_ENGINES
+    :type name: str
+    :return: Engine instance
+    :rtype: OcrEngine
+    """
+    if name not in OCR_ENGINES:
+        raise ValueError(f"Unknown OCR engine: {name}. Available engines: {', '.join(OCR_ENGINES)}")
+
+    try:
+        return ENGINES[name](**kwargs)
+    except (ImportError, RuntimeError) as e:
+        print(f"OCR engine {name} is not available, falling back to pytesseract: {e}")
+        return PytesseractEngine()
+
+
+_ocr_engine = None
+_ocr_engine_pid = None
+_ocr_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OcrEngine:
+    """
+    Returns the process-wide OCR engine configured in settings, created on first use.
+    Every process (gunicorn worker, OCR pool worker) gets its own engine - Tesseract handles don't survive a fork.
+
+    :return: Engine instance
+    :rtype: OcrEngine
+    """
+    global _ocr_engine, _ocr_engine_pid
+
+    if _ocr_engine is None or _ocr_engine_pid != os.getpid():
+        with _ocr_engine_lock:
+            if _ocr_engine is None or _ocr_engine_pid != os.getpid():
+                _ocr_engine = build_ocr_engine(OCR_ENGINE)
+                _ocr_engine_pid = os.getpid()
+
+    return _ocr_engine
@@ -0,0 +1,55 @@
+import os
+
+from typing import Dict
+
+"""
+Memory usage of the current process, read from /proc (Linux only - elsewhere it's empty).
+
+    rss_mb - resident set size, what `top` shows,
+    rss_anon_mb - private memory (heap, copied pages),
+    rss_file_mb - file-backed pages, e.g. memory-mapped model weights; shared with other processes mapping the same file,
+    rss_shmem_mb - shared memory,
+    pss_mb - proportional set size; shared pages are split evenly between processes sharing them,
+    so for forked workers it's the honest "how much does one worker cost",
+    private_mb - pages used by this process only (e.g. copied-on-write).
+"""
+
+_STATUS_FIELDS = {
+    'VmRSS': 'rss_mb',
+    'RssAnon': 'rss_anon_mb',
+    'RssFile': 'rss_file_mb',
+    'RssShmem': 'rss_shmem_mb',
+}
+
+_SMAPS_FIELDS = {
+    'Pss': 'pss_mb',
+    'Private_Clean': 'private_mb',
+    'Private_Dirty': 'private_mb',
+}
+
+
+def get_memory_usage(pid: int = None) -> Dict[str, float]:
+    """
+    Reads memory usage of a process.
+
+    :param pid: Process ID, defaults to the current process
+    :type pid: int
+    :return: Memory usage in MB, empty if /proc is not available
+    :rtype: Dict[str, float]
+    """
+    usage = {}
+    pid = pid or os.getpid()
+
+    for path, fields in ((f"/proc/{pid}/status", _STATUS_FIELDS), (f"/proc/{pid}/smaps_rollup", _SMAPS_FIELDS)):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+
+                    if key in fields:
+                        usage[fields[key]] = usage.get(fields[key], 0) + int(value.split()[0]) / 1024 # kB -> MB
+
+        except OSError:
+            pass
+
+    return {key: round(value, 1) for key, value in usage.items()}
@@ -0,0 +1,123 @@
+import json
+import zlib
+
+from src.settings.config import RESPONSE_CHUNK_BYTES, RESPONSE_GZIP_ENABLED, RESPONSE_GZIP_LEVEL, RESPONSE_GZIP_MIN_CHARS
+from typing import Dict, Iterator, Optional
+
+"""
+Response shaping of the classify routes - how much of file_text is sent, and how.
+
+Most clients only read file_class and confidence, yet file_text of a 100-page contract is hundreds of kB
+of JSON to serialise and send on every call. A client can:
+
+    ?text=none             - omit file_text (and extraction stops once the model input is full),
+    ?text_max_chars=N      - get only the first N characters of it, with file_text_truncated and
+                             file_text_length (the full length) added to the result,
+    Accept-Encoding: gzip  - get the response gzip-compressed, streamed in chunks as it's serialised.
+
+Without any of them the response is the same as it has always been. Responses with little text
+(RESPONSE_GZIP_MIN_CHARS) are never compressed. Truncation is applied to the response only,
+the result cache keeps the full text.
+"""
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def truncate_text(result: Dict, text_max_chars: Optional[int]) -> Dict:
+    """
+    Cuts file_text of a result down to text_max_chars characters. The result itself is not changed, it may be cached.
+
+    :param result: Classification result, with or without file_text
+    :type result: Dict
+    :param text_max_chars: Max characters of file_text, None to keep all of it
+    :type text_max_chars: Optional[int]
+    :return: The result, or a copy of it with file_text truncated
+    :rtype: Dict
+    """
+    file_text = result.get('file_text')
+
+    if text_max_chars is None or file_text is None or len(file_text) <= text_max_chars:
+        return result
+
+    return {**result, "file_text": file_text[:text_max_chars], "file_text_truncated": True, "file_text_length": len(file_text)}
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """
+    Tells whether the client accepts gzip, from its Accept-Encoding header, e.g. 'gzip, deflate' or 'gzip;q=0'.
+
+    :param accept_encoding: Value of the Accept-Encoding header, None if it's not sent
+    :type accept_encoding: Optional[str]
+    :return: True if gzip (or *) is accepted with a non-zero quality
+    :rtype: bool
+    """
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.strip().partition(';')
+
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+
+        return True
+
+    return False
+
+
+def _text_chars(payload: Dict) -> int:
+    results = payload.get('results', [payload])
+    return sum(len(result.get('file_text') or '') for result in results)
+
+
+def should_compress(payload: Dict, accept_encoding: Optional[str]) -> bool:
+    """
+    Tells whether a response is worth compressing for this client - compression is enabled,
+    the client accepts gzip, and the payload carries at least RESPONSE_GZIP_MIN_CHARS of file_text.
+
+    :param payload: Response body, a result of /classify-file or {"results": [...]} of /classify-files
+    :type payload: Dict
+    :param accept_encoding: Value of the request's Accept-Encoding header
+    :type accept_encoding: Optional[str]
+    :return: True if the response should be sent gzipped
+    :rtype: bool
+    """
+    return RESPONSE_GZIP_ENABLED and accepts_gzip(accept_encoding) and _text_chars(payload) >= RESPONSE_GZIP_MIN_CHARS
+
+
+def iter_gzip_json(payload: Dict, level: int = RESPONSE_GZIP_LEVEL, chunk_bytes: int = RESPONSE_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Serialises payload to JSON and gzips it on the fly, so that neither the whole JSON document
+    nor the whole compressed body is held at once - every file_text is compressed as soon as it's encoded.
+
+    :param payload: Response body
+    :type payload: Dict
+    :param level: zlib compression level
+    :type level: int
+    :param chunk_bytes: compressed bytes collected before a chunk is yielded
+    :type chunk_bytes: int
+    :return: Chunks of the gzip stream
+    :rtype: Iterator[bytes]
+    """
+    # wbits 16 + MAX_WBITS - a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = []
+    pending_bytes = 0
+
+    for fragment in _encoder.iterencode(payload):
+        compressed = compressor.compress(fragment.encode('utf-8'))
+
+        if compressed:
+            pending.append(compressed)
+            pending_bytes += len(compressed)
+
+        if pending_bytes >= chunk_bytes:
+            yield b''.join(pending)
+            pending, pending_bytes = [], 0
+
+    pending.append(compressor.flush())
+    yield b''.join(pending)
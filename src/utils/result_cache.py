@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from src.settings.config import CACHE_DB_MAX_ENTRIES, CACHE_DB_PATH, CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS
+from typing import Dict, Optional
+from werkzeug.datastructures import FileStorage
+
+"""
+Content-addressed cache of classification results.
+
+We get the same invoices and passport scans over and over again, and every time we
+paid for PDF parsing, OCR and a forward pass. Results are now stored under a hash of
+the uploaded bytes and the model name, so a repeated upload is answered straight
+from the cache - no PyMuPDF, Tesseract or torch involved.
+
+Two tiers:
+    1. in-memory LRU, bounded by number of entries, private to a worker process,
+    2. optional SQLite database on local disk, shared by all gunicorn workers.
+Both tiers expire entries by age (ttl) and size (max entries).
+
+Any SQLite error makes the lookup a miss - the cache should never fail a request.
+"""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+PRUNE_EVERY_N_STORES = 64 # expired and surplus rows are deleted from disk in bulk, not on every store
+
+
+def make_cache_key(file: FileStorage, model_version: str) -> str:
+    """
+    Computes a cache key from the uploaded file content and model version.
+    The file is read in chunks and rewound, so it can still be passed to extract_text().
+
+    :param file: File received in request form-data
+    :type file: FileStorage
+    :param model_version: Version of the model producing results (registry version, or model_identity() without
+    a registry), a different model - another revision, a replaced snapshot - means a different key
+    :type model_version: str
+    :return: Hex digest of the key
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(model_version.encode('utf-8') + b'\0')
+
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier (memory + optional SQLite) cache of classification results, with LRU and TTL eviction.
+    Safe to use from many threads; the SQLite tier is safe to share between processes.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 db_path: str = None, max_db_entries: int = CACHE_DB_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        self._disk_stores = 0
+
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Looks the key up in memory first, then on disk. Disk hits are promoted to memory.
+
+        :param key: Cache key, see make_cache_key()
+        :type key: str
+        :return: Stored result or None on a miss
+        :rtype: Optional[Dict]
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+
+            if entry is not None:
+                stored_at, value = entry
+
+                if now - stored_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+
+                del self._memory[key]
+                self._stats["evictions"] += 1
+
+        entry = self._get_from_disk(key, now)
+
+        if entry is not None:
+            stored_at, value = entry
+            self._put_in_memory(key, value, stored_at)
+            self._count("disk_hits")
+            return value
+
+        self._count("misses")
+        return None
+
+    def get_for_text_mode(self, key: str, text_mode: str) -> Optional[Dict]:
+        """
+        Looks the key up like get(), but returns the result only if it holds everything a request in given text mode needs.
+        A result of lazy extraction has no file_text, so it can't answer a request for the full text.
+
+        :param key: Cache key, see make_cache_key()
+        :type key: str
+        :param text_mode: Text mode of the request, one of TEXT_MODES
+        :type text_mode: str
+        :return: Stored result, without file_text if the mode is 'none', or None
+        :rtype: Optional[Dict]
+        """
+        result = self.get(key)
+
+        if not result:
+            return None
+
+        if text_mode == 'none':
+            return {name: value for name, value in result.items() if name != 'file_text'}
+
+        return result if 'file_text' in result else None
+
+    def put(self, key: str, value: Dict):
+        """
+        Stores a result in both tiers.
+
+        :param key: Cache key, see make_cache_key()
+        :type key: str
+        :param value: JSON-serialisable result
+        :type value: Dict
+        """
+        stored_at = time.time()
+
+        self._put_in_memory(key, value, stored_at)
+        self._put_on_disk(key, value, stored_at)
+        self._count("stores")
+
+    def clear(self):
+        """
+        Removes all entries from both tiers and resets the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._stats = {name: 0 for name in self._stats}
+
+        self._execute("DELETE FROM results")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        :return: Hit/miss counters of this process and number of entries in memory
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["disk_enabled"] = self.db_path is not None
+
+        return stats
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _put_in_memory(self, key: str, value: Dict, stored_at: float):
+        with self._lock:
+            self._memory[key] = (stored_at, value)
+            self._memory.move_to_end(key)
+
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        # a connection must not cross a fork, every worker process opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+
+        return self._db
+
+    def _execute(self, query: str, params: tuple = ()) -> list:
+        if self.db_path is None:
+            return []
+
+        try:
+            with self._db_lock:
+                db = self._connection()
+                rows = db.execute(query, params).fetchall()
+                db.commit()
+                return rows
+
+        except sqlite3.Error as e:
+            print(f"Result cache database error: {e}")
+            self._count("errors")
+            return []
+
+    def _get_from_disk(self, key: str, now: float) -> Optional[tuple]:
+        rows = self._execute("SELECT value, stored_at FROM results WHERE key = ?", (key,))
+
+        if not rows:
+            return None
+
+        value, stored_at = rows[0]
+
+        if now - stored_at > self.ttl_seconds:
+            self._execute("DELETE FROM results WHERE key = ?", (key,))
+            self._count("evictions")
+            return None
+
+        return stored_at, json.loads(value)
+
+    def _put_on_disk(self, key: str, value: Dict, stored_at: float):
+        self._execute("INSERT OR REPLACE INTO results (key, value, stored_at) VALUES (?, ?, ?)", (key, json.dumps(value), stored_at))
+
+        with self._lock:
+            self._disk_stores += 1
+            prune = self._disk_stores % PRUNE_EVERY_N_STORES == 0
+
+        if prune:
+            self.prune_disk(stored_at)
+
+    def prune_disk(self, now: float = None):
+        """
+        Deletes expired entries and the oldest entries above max_db_entries from the SQLite tier.
+
+        :param now: Current timestamp, defaults to time.time()
+        :type now: float
+        """
+        now = now or time.time()
+
+        self._execute("DELETE FROM results WHERE stored_at < ?", (now - self.ttl_seconds,))
+        self._execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_db_entries,),
+        )
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    Returns the process-wide cache configured in settings, or None if caching is disabled.
+
+    :return: Cache instance
+    :rtype: Optional[ResultCache]
+    """
+    global _result_cache
+
+    if not CACHE_ENABLED:
+        return None
+
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(db_path=CACHE_DB_PATH)
+
+    return _result_cache
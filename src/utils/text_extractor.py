@@ -1,12 +1,55 @@
+import math
+import multiprocessing
+import os
 import pymupdf
-import pytesseract
+import signal
+import threading
+import zipfile
 
-from docx import Document
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from io import BytesIO
-from PIL import Image, ImageEnhance, ImageFilter, UnidentifiedImageError
-from src.settings.config import ALLOWED_IMAGE_EXTENSIONS
+from lxml import etree
+from PIL import Image, ImageFilter, UnidentifiedImageError
+from src.settings.config import (
+    ALLOWED_IMAGE_EXTENSIONS,
+    ASYNC_EXTRACTION_WORKERS,
+    EXTRACTION_WORKERS,
+    LONG_DOCUMENT_MAX_WINDOWS,
+    LONG_DOCUMENT_STRIDE,
+    OCR_DPI,
+    OCR_ENGINE_POOL_SIZE,
+    OCR_FAST_SCALE,
+    OCR_FAST_TOP_FRACTION,
+    OCR_MAX_PAGE_PIXELS,
+    OCR_PARALLEL,
+    OCR_PARALLEL_MIN_PAGES,
+    OCR_PROCESS_WORKERS,
+    OCR_WORKERS_PER_REQUEST,
+    TEXT_CHUNK_CHARS,
+)
+from src.utils.docx_reader import iter_docx_text, iter_unique_images
+from src.utils.intake import FileBuffer, open_stream, open_upload
+from src.utils.metrics import OCR_FALLBACKS, PAGES, file_type_context, time_stage
+from src.utils.ocr_engine import OcrError, get_ocr_engine
+from src.utils.tiered_ocr import OcrPass, fast_image, get_ocr_pass, ocr_pass_context, read_tiered
+from typing import Dict, Iterator, List, Optional, Tuple
 from werkzeug.datastructures import FileStorage
 
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+_ocr_process_pool = None
+_ocr_process_pool_lock = threading.Lock()
+
+_image_ocr_pool = None
+_image_ocr_pool_lock = threading.Lock()
+
+_extraction_process_pool = None
+_extraction_process_pool_lock = threading.Lock()
+_extraction_worker_tokenizer = None
+
 def extract_file_extension(filename: str) -> str:
     """
     Extracts file extension from filename
@@ -18,164 +61,727 @@ def extract_file_extension(filename: str) -> str:
     """
     return filename.rsplit('.', 1)[1].lower()
 
-def extract_text_from_image(image_bytes: bytes) -> str:
+def ocr_image(image: Image.Image) -> str:
     """
-    Extracts text from a byte image representation.
-    Increases sharpness and contrast for better reading.
+    Reads text from a greyscale image. Increases sharpness for better reading.
 
-    :param image_bytes: byte representation of an image
-    :image_bytes type: bytes
+    :param image: greyscale ('L') image
+    :image type: PIL.Image.Image
     :return: Text read from the image
     :rtype: str
     """
     try:
-        image = Image.open(BytesIO(image_bytes)).convert('L')
         image = image.filter(ImageFilter.SHARPEN)
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1)
 
-        text = pytesseract.image_to_string(image)
+        with time_stage('ocr'):
+            text = get_ocr_engine().image_to_string(image)
+
         return text.strip()
-    
+
+    except OcrError as e:
+        print(f"Error: OCR failed to extract text: {e}")
+        return ""
+
+def _ocr_image_at_tier(image: Image.Image, tier: str) -> Optional[str]:
+    if tier == 'fast':
+        image = fast_image(image)
+
+        if image is None:
+            return None
+
+    return ocr_image(image)
+
+def extract_text_from_image(image_bytes: FileBuffer) -> str:
+    """
+    Extracts text from a byte image representation, see ocr_image().
+    Under a fast tier OCR pass, a downscaled image is read first, see src/utils/tiered_ocr.py
+
+    :param image_bytes: byte representation of an image, bytes or a memory-mapped upload (see open_upload())
+    :image_bytes type: FileBuffer
+    :return: Text read from the image
+    :rtype: str
+    """
+    try:
+        image = Image.open(open_stream(image_bytes)).convert('L')
     except UnidentifiedImageError:
         print("Error: Invalid image data")
         return ""
-    except pytesseract.TesseractError:
-        print("Error: Tesseract failed to extract text")
-        return ""
-    
-def extract_text_from_pdf(file_bytes: bytes) -> str:
+
+    return read_tiered(partial(_ocr_image_at_tier, image))
+
+def get_render_dpi(page: pymupdf.Page, dpi: int = None, max_pixels: int = None) -> int:
+    """
+    Resolution a page is rendered at for OCR - dpi, lowered if the page would have more than max_pixels pixels at dpi.
+
+    :param page: Page of an open PDF document
+    :type page: pymupdf.Page
+    :param dpi: target resolution, OCR_DPI by default
+    :type dpi: int
+    :param max_pixels: max pixels of a rendered page, OCR_MAX_PAGE_PIXELS by default
+    :type max_pixels: int
+    :return: Resolution in dots per inch
+    :rtype: int
+    """
+    dpi = dpi or OCR_DPI
+    max_pixels = max_pixels or OCR_MAX_PAGE_PIXELS
+
+    # page size is given in points, 72 per inch
+    pixels = page.rect.width * page.rect.height * (dpi / 72) ** 2
+
+    if pixels > max_pixels:
+        dpi = max(1, int(dpi * math.sqrt(max_pixels / pixels)))
+
+    return dpi
+
+def _ocr_pdf_page_at_tier(page: pymupdf.Page, tier: str) -> str:
+    dpi = get_render_dpi(page)
+    clip = None
+
+    if tier == 'fast':
+        dpi = max(1, int(dpi * OCR_FAST_SCALE))
+
+        if OCR_FAST_TOP_FRACTION < 1.0:
+            clip = pymupdf.Rect(page.rect.x0, page.rect.y0, page.rect.x1, page.rect.y0 + page.rect.height * OCR_FAST_TOP_FRACTION)
+
+    with time_stage('rasterise'):
+        pix_map = page.get_pixmap(dpi=dpi, clip=clip, colorspace=pymupdf.csGRAY, alpha=False)
+        image = Image.frombuffer('L', (pix_map.width, pix_map.height), pix_map.samples_mv, 'raw', 'L', pix_map.stride, 1)
+
+    # pix_map owns the pixels, it has to stay alive until OCR is done
+    text = ocr_image(image)
+    del image, pix_map
+
+    return text
+
+def ocr_pdf_page(page: pymupdf.Page) -> str:
+    """
+    Renders a PDF page to a greyscale image and reads it with ocr_image().
+    The image is a view of the rendered pixmap's samples - no PNG encoding and decoding, no copies.
+    Under a fast tier OCR pass, the page is rendered at a lower resolution first, see src/utils/tiered_ocr.py
+
+    :param page: Page of an open PDF document
+    :type page: pymupdf.Page
+    :return: Text read from the page
+    :rtype: str
+    """
+    return read_tiered(partial(_ocr_pdf_page_at_tier, page))
+
+def _ocr_pdf_pages(file_bytes: bytes, page_numbers: List[int]) -> Dict[int, str]:
+    """
+    Runs in an OCR worker process. Opens its own copy of the document, since pymupdf documents can't be pickled.
+    """
+    pdf_doc = pymupdf.open(stream=file_bytes, filetype='pdf')
+    page_texts = {}
+
+    try:
+        with file_type_context('pdf'):
+            for page_num in page_numbers:
+                try:
+                    page_texts[page_num] = ocr_pdf_page(pdf_doc.load_page(page_num))
+                except pymupdf.FileDataError as e:
+                    print(f"Structural error occured while processing page {page_num}: {e}")
+    finally:
+        pdf_doc.close()
+
+    return page_texts
+
+def _ocr_pdf_pages_worker(file_bytes: bytes, page_numbers: List[int], ocr_pass: OcrPass = None) -> Tuple[Dict[int, str], OcrPass]:
+    # some exceptions (e.g. pytesseract's TesseractNotFoundError) can't be unpickled in the parent,
+    # which would mark the whole pool as broken - they're passed back as plain RuntimeErrors
+    try:
+        # the pass is a copy in this process, it's sent back with the reads it counted
+        with ocr_pass_context(ocr_pass):
+            return _ocr_pdf_pages(file_bytes, page_numbers), ocr_pass
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+def _init_ocr_worker():
+    # Tesseract spreads a single page over all cores with OpenMP - with one page per process, that just oversubscribes the CPU
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+def _get_ocr_process_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by all requests, so OCR_PROCESS_WORKERS caps the number of pages OCR'd at the same time 
+    in the whole worker process. 'spawn' is used, because forking a process with torch thread pools running can deadlock.
+    """
+    global _ocr_process_pool
+
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is None:
+            _ocr_process_pool = ProcessPoolExecutor(
+                max_workers=OCR_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_ocr_worker,
+            )
+
+    return _ocr_process_pool
+
+def _reset_ocr_process_pool():
+    global _ocr_process_pool
+
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is not None:
+            _ocr_process_pool.shutdown(wait=False, cancel_futures=True)
+        _ocr_process_pool = None
+
+def _ocr_pdf_pages_in_parallel(file_bytes: bytes, page_numbers: List[int]) -> Dict[int, str]:
+    """
+    Splits pages into at most OCR_WORKERS_PER_REQUEST chunks and OCRs the chunks in the shared process pool.
+    Falls back to serial OCR if the pool breaks (e.g. a worker gets killed).
+    """
+    n_chunks = max(1, min(OCR_WORKERS_PER_REQUEST, len(page_numbers)))
+    chunks = [page_numbers[i::n_chunks] for i in range(n_chunks)]
+    ocr_pass = get_ocr_pass()
+
+    try:
+        pool = _get_ocr_process_pool()
+        # a fresh pass per chunk, so that reads counted before aren't sent back and counted again
+        futures = [pool.submit(_ocr_pdf_pages_worker, file_bytes, chunk, OcrPass(ocr_pass.tier) if ocr_pass else None) for chunk in chunks]
+
+        page_texts = {}
+        for chunk, future in zip(chunks, futures):
+            try:
+                chunk_texts, chunk_pass = future.result()
+            except BrokenProcessPool:
+                raise # a subclass of RuntimeError, but the whole pool is gone - handled below
+            except RuntimeError as e:
+                # the chunk failed in its worker, its pages are left out like a page that can't be read serially
+                print(f"Error occured while OCRing pages {chunk}: {e}")
+                continue
+
+            page_texts.update(chunk_texts)
+
+            if ocr_pass:
+                ocr_pass.add(chunk_pass)
+
+        return page_texts
+
+    except BrokenProcessPool as e:
+        print(f"OCR process pool failed, falling back to serial OCR: {e}")
+        _reset_ocr_process_pool()
+        return _ocr_pdf_pages(file_bytes, page_numbers)
+
+def extract_text_from_pdf(file_bytes: FileBuffer, parallel_ocr: bool = None) -> str:
     """
     Extracts text from a byte pdf representation. 
-    If no text can be found, function tries to convert
-    file_bytes to image and supply to extract_text_from_image(). 
+    If no text can be found on a page, function tries to render the page
+    to an image and supply it to extract_text_from_image().
 
-    :param file_bytes: byte representation of the PDF file
-    :file_bytes type: bytes
+    Pages with a text layer are read first. Pages that need OCR are then OCR'd in a process pool
+    when there is more than one of them, output keeps the page order either way.
+
+    :param file_bytes: byte representation of the PDF file, bytes or a memory-mapped upload (see open_upload())
+    :file_bytes type: FileBuffer
+    :param parallel_ocr: whether pages without text can be OCR'd in parallel, OCR_PARALLEL by default
+    :parallel_ocr type: bool
     :return: Text read from the PDF
     :rtype: str
     """
+    if parallel_ocr is None:
+        parallel_ocr = OCR_PARALLEL
+
+    pdf_doc = None
+
     try:
-        pdf_doc = pymupdf.open(stream=file_bytes, filetype='pdf')
+        with time_stage('pdf_parse'):
+            pdf_doc = pymupdf.open(stream=memoryview(file_bytes), filetype='pdf')
 
-        text = ''
-        for page_num in range(len(pdf_doc)):
-            try:
-                page = pdf_doc.load_page(page_num)
+            page_texts = {}
+            pages_to_ocr = []
+            for page_num in range(len(pdf_doc)):
+                try:
+                    page = pdf_doc.load_page(page_num)
 
-                page_text = page.get_text().strip()
+                    page_text = page.get_text().strip()
 
-                if page_text:
-                    text += page_text + '\n'
+                    if page_text:
+                        page_texts[page_num] = page_text
+                    else:
+                        pages_to_ocr.append(page_num)
 
-                else:
-                    pix_map = page.get_pixmap(dpi=300)
-                    image_bytes = pix_map.tobytes("png")
-                    image_text = extract_text_from_image(image_bytes)
+                except pymupdf.FileDataError as e:
+                    print(f"Structural error occured while processing page {page_num}: {e}")
 
-                    if image_text:
-                        text += image_text + '\n'
-            
-            except pymupdf.FileDataError as e:
-                print(f"Structural error occured while processing page {page_num}: {e}")
+        PAGES.labels(method='text').inc(len(page_texts))
+        PAGES.labels(method='ocr').inc(len(pages_to_ocr))
 
-        pdf_doc.close()
+        if pages_to_ocr:
+            OCR_FALLBACKS.labels(file_type='pdf').inc()
+
+        if parallel_ocr and len(pages_to_ocr) >= OCR_PARALLEL_MIN_PAGES:
+            # worker processes need a copy of their own anyway, an mmap can't be pickled
+            page_texts.update(_ocr_pdf_pages_in_parallel(bytes(file_bytes), pages_to_ocr))
+        else:
+            for page_num in pages_to_ocr:
+                try:
+                    page_texts[page_num] = ocr_pdf_page(pdf_doc.load_page(page_num))
+                except pymupdf.FileDataError as e:
+                    print(f"Structural error occured while processing page {page_num}: {e}")
+
+        text = '\n'.join(page_texts[page_num] for page_num in sorted(page_texts) if page_texts[page_num])
         return text.strip()
     
     except pymupdf.FileDataError as e:
         print(f"Error reading file bytes: {e}")
         return ""
-    
-def extract_text_from_docx(docx_bytes: bytes) -> str:
+
+    finally:
+        # closed on any error too, the document holds on to the upload
+        if pdf_doc is not None:
+            pdf_doc.close()
+
+def _get_image_ocr_pool() -> ThreadPoolExecutor:
+    """
+    Thread pool OCR-ing images embedded in documents, shared by all requests. Threads are enough -
+    tesserocr releases the GIL while it recognises, and pytesseract waits for a tesseract process.
+    """
+    global _image_ocr_pool
+
+    with _image_ocr_pool_lock:
+        if _image_ocr_pool is None:
+            _image_ocr_pool = ThreadPoolExecutor(max_workers=OCR_ENGINE_POOL_SIZE, thread_name_prefix='image-ocr')
+
+    return _image_ocr_pool
+
+def _extract_text_from_image_safely(image_bytes: bytes, ocr_pass: OcrPass = None) -> str:
+    # pool threads don't inherit the request's file_type label nor its OCR pass
+    try:
+        with file_type_context('docx'), ocr_pass_context(ocr_pass):
+            return extract_text_from_image(image_bytes)
+    except Exception as e:
+        print(f"Error extracting text from image in docx: {e}")
+        return ""
+
+def extract_text_from_docx(docx_bytes: FileBuffer, parallel_ocr: bool = None) -> str:
     """
-    Extracts text from a byte representation of docx.
-    If no text can be found, function tries to convert
-    docx_bytes to image and supply to extract_text_from_image().
+    Extracts text from a byte representation of docx - paragraphs, tables, headers and footers, see src/utils/docx_reader.py.
+    If no text can be found, function OCRs the embedded images instead. Duplicate images are OCR'd once,
+    and with more than one image left they're OCR'd in parallel; output keeps the image order either way.
 
-    :param docx_bytes: byte representation of the DOCX file
-    :docx_bytes type: bytes
+    :param docx_bytes: byte representation of the DOCX file, bytes or a memory-mapped upload (see open_upload())
+    :docx_bytes type: FileBuffer
+    :param parallel_ocr: whether images can be OCR'd in parallel, OCR_PARALLEL by default
+    :parallel_ocr type: bool
     :return: Text read from the DOCX
     :rtype: str
     """
+    if parallel_ocr is None:
+        parallel_ocr = OCR_PARALLEL
+
     try:
-        document = Document(BytesIO(docx_bytes))
+        with time_stage('docx_parse'):
+            archive = zipfile.ZipFile(open_stream(docx_bytes))
+            text = '\n'.join(iter_docx_text(archive))
 
-        text = '\n'.join([p.text for p in document.paragraphs])
-        
         if not text.strip():
-            image_texts = []
-            
-            for rel in document.part.rels.values():
-                if "image" in rel.reltype:
-                    try:
-                        image_data = rel.target_part.blob
-                        text = extract_text_from_image(image_data)
-                        image_texts.append(text)
-                    
-                    except Exception as e:
-                        print(f"Error extracting text from image in docx: {e}")
-            
-            text = "\n".join(image_texts)
-        
+            OCR_FALLBACKS.labels(file_type='docx').inc()
+            images = list(iter_unique_images(archive))
+            extract_image_text = partial(_extract_text_from_image_safely, ocr_pass=get_ocr_pass())
+
+            if parallel_ocr and len(images) >= OCR_PARALLEL_MIN_PAGES:
+                image_texts = list(_get_image_ocr_pool().map(extract_image_text, images))
+            else:
+                image_texts = [extract_image_text(image) for image in images]
+
+            text = "\n".join(image_text for image_text in image_texts if image_text)
+
         return text.strip()
-    
+
     except Exception as e:
         print(f"Error processing docx: {e}")
         return ""
-    
-def extract_text_from_txt(txt_bytes: bytes) -> str:
+
+def extract_text_from_txt(txt_bytes: FileBuffer) -> str:
     """
     Extracts text from a byte representation of txt.
 
-    :param txt_bytes: byte representation of the TXT file
-    :txt_bytes type: bytes
+    :param txt_bytes: byte representation of the TXT file, bytes or a memory-mapped upload (see open_upload())
+    :txt_bytes type: FileBuffer
     :return: Text read from the TXT
     :rtype: str
     """
     try:
-        text = txt_bytes.decode('utf-8')
+        text = str(txt_bytes, 'utf-8')
         return text.strip()
     
     except UnicodeDecodeError:
         print("File encoding is not valid UTF-8.")
         return ""
 
-def extract_text(file: FileStorage) -> str:
+def iter_text_from_pdf(file_bytes: FileBuffer) -> Iterator[str]:
+    """
+    Lazy version of extract_text_from_pdf(). Yields text page by page, in order.
+    A page without text is rasterised and OCR'd only when the consumer asks for it,
+    so pages after the consumer stops are never OCR'd.
+
+    :param file_bytes: byte representation of the PDF file, bytes or a memory-mapped upload
+    :file_bytes type: FileBuffer
+    :return: Generator of page texts
+    :rtype: Iterator[str]
+    """
+    try:
+        pdf_doc = pymupdf.open(stream=memoryview(file_bytes), filetype='pdf')
+    except pymupdf.FileDataError as e:
+        print(f"Error reading file bytes: {e}")
+        return
+
+    any_ocr = False
+
+    try:
+        for page_num in range(len(pdf_doc)):
+            try:
+                page = pdf_doc.load_page(page_num)
+                page_text = page.get_text().strip()
+
+                if page_text:
+                    PAGES.labels(method='text').inc()
+                else:
+                    if not any_ocr:
+                        OCR_FALLBACKS.labels(file_type='pdf').inc()
+                        any_ocr = True
+
+                    PAGES.labels(method='ocr').inc()
+                    page_text = ocr_pdf_page(page)
+
+            except pymupdf.FileDataError as e:
+                print(f"Structural error occured while processing page {page_num}: {e}")
+                continue
+
+            if page_text:
+                yield page_text
+    finally:
+        pdf_doc.close()
+
+def iter_text_from_docx(docx_bytes: FileBuffer) -> Iterator[str]:
+    """
+    Lazy version of extract_text_from_docx(). Yields non-empty paragraphs and table rows as they're parsed,
+    or if there are none, text read from embedded images, one unique image at a time.
+
+    :param docx_bytes: byte representation of the DOCX file, bytes or a memory-mapped upload
+    :docx_bytes type: FileBuffer
+    :return: Generator of paragraph / image texts
+    :rtype: Iterator[str]
+    """
+    try:
+        archive = zipfile.ZipFile(open_stream(docx_bytes))
+    except zipfile.BadZipFile as e:
+        print(f"Error processing docx: {e}")
+        return
+
+    found_text = False
+
+    try:
+        for line in iter_docx_text(archive):
+            found_text = True
+            yield line
+    except etree.XMLSyntaxError as e:
+        print(f"Error processing docx: {e}")
+
+    if found_text:
+        return
+
+    OCR_FALLBACKS.labels(file_type='docx').inc()
+
+    for image_bytes in iter_unique_images(archive):
+        image_text = _extract_text_from_image_safely(image_bytes, get_ocr_pass())
+
+        if image_text:
+            yield image_text
+
+def iter_text_from_txt(txt_bytes: FileBuffer, chunk_chars: int = TEXT_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Lazy version of extract_text_from_txt(). Yields blocks of whole lines, at least chunk_chars long (except the last one).
+
+    :param txt_bytes: byte representation of the TXT file, bytes or a memory-mapped upload
+    :txt_bytes type: FileBuffer
+    :param chunk_chars: min length of a block
+    :chunk_chars type: int
+    :return: Generator of text blocks
+    :rtype: Iterator[str]
+    """
+    lines = []
+    n_chars = 0
+
+    for line in extract_text_from_txt(txt_bytes).splitlines():
+        lines.append(line)
+        n_chars += len(line) + 1
+
+        if n_chars >= chunk_chars:
+            yield '\n'.join(lines)
+            lines, n_chars = [], 0
+
+    if lines:
+        yield '\n'.join(lines)
+
+def get_token_budget(tokenizer, max_windows: int = LONG_DOCUMENT_MAX_WINDOWS, stride: int = LONG_DOCUMENT_STRIDE) -> int:
+    """
+    Number of text tokens the classifier reads at most: one window of the tokenizer's max input length
+    without special tokens, plus what every further window adds past its overlap with the previous one.
+
+    :param tokenizer: tokenizer the text will be classified with
+    :tokenizer type: transformers.DistilBertTokenizerFast
+    :param max_windows: window budget per text
+    :max_windows type: int
+    :param stride: number of tokens consecutive windows overlap by
+    :stride type: int
+    :return: Token budget
+    :rtype: int
+    """
+    window = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+    return window + max(0, max_windows - 1) * (window - stride)
+
+def take_text_within_token_budget(chunks: Iterator[str], tokenizer, max_tokens: int = None) -> str:
+    """
+    Consumes text chunks until they add up to max_tokens tokens, then stops the generator.
+    Everything after that would be truncated by prepare_text() anyway, or fall outside the window budget
+    of a long document (LONG_DOCUMENT_MAX_WINDOWS).
+
+    :param chunks: Generator of text chunks, e.g. iter_text_from_pdf()
+    :chunks type: Iterator[str]
+    :param tokenizer: tokenizer the text will be classified with
+    :tokenizer type: transformers.DistilBertTokenizerFast
+    :param max_tokens: token budget, defaults to the tokens the classifier reads, see get_token_budget()
+    :max_tokens type: int
+    :return: Text of the consumed chunks
+    :rtype: str
+    """
+    if max_tokens is None:
+        max_tokens = get_token_budget(tokenizer)
+
+    texts = []
+    n_tokens = 0
+
+    try:
+        for chunk in chunks:
+            texts.append(chunk)
+            n_tokens += len(tokenizer.tokenize(chunk))
+
+            if n_tokens >= max_tokens:
+                break
+    finally:
+        chunks.close() # runs the generator's cleanup, e.g. closes the PDF
+
+    return '\n'.join(texts).strip()
+
+def extract_text_within_token_budget(file: FileStorage, tokenizer, max_tokens: int = None) -> str:
+    """
+    Extracts only as much text from file as the model can take in. 
+    PDF pages, DOCX paragraphs and TXT lines are read lazily and reading stops once the token budget is full.
+    Images are read as a whole, there's nothing to stop early there.
+
+    :param file: File received in request form-data
+    :type file: FileStorage
+    :param tokenizer: tokenizer the text will be classified with
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param max_tokens: token budget, see take_text_within_token_budget()
+    :type max_tokens: int
+    :return: Text read from the beginning of the file
+    :rtype: str
+    """
+    filename = file.filename.lower().strip()
+
+    if filename.endswith('pdf'):
+        iter_text = iter_text_from_pdf
+    elif filename.endswith('.docx'):
+        iter_text = iter_text_from_docx
+    elif filename.endswith('.txt'):
+        iter_text = iter_text_from_txt
+    else:
+        return _extract_whole_text(file)
+
+    # a memory-mapped upload is paged in only as far as the chunks taken reach
+    with open_upload(file) as file_bytes:
+        return take_text_within_token_budget(iter_text(file_bytes), tokenizer, max_tokens)
+
+def extract_text(file: FileStorage, tokenizer=None, max_tokens: int = None, ocr_pass: OcrPass = None) -> str:
     """
     Governs text extraction from file. 
+    If a tokenizer is given, only text that fits the model input is extracted, see extract_text_within_token_budget().
 
     :param file: File received in request form-data
     :type file: FileStorage
+    :param tokenizer: optional tokenizer, enables lazy extraction
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param max_tokens: token budget for lazy extraction
+    :type max_tokens: int
+    :param ocr_pass: tiered OCR pass to read pages and images under, records the reads; full resolution only if None
+    :type ocr_pass: OcrPass
     :return: Text read from the file
     :rtype: str
     """
+    file_type = extract_file_extension(file.filename) if '.' in file.filename else ''
+
+    with file_type_context(file_type), ocr_pass_context(ocr_pass), time_stage('extract'):
+        if tokenizer is not None:
+            return extract_text_within_token_budget(file, tokenizer, max_tokens)
 
+        return _extract_whole_text(file)
+
+def _extract_whole_text(file: FileStorage) -> str:
     filename = file.filename.lower().strip()
     
     if filename.endswith('pdf'):
-        file_bytes = file.read()
-        text = extract_text_from_pdf(file_bytes)
-        
-        return text
-    
+        extract = extract_text_from_pdf
     elif filename.endswith('.docx'):
-        docx_bytes = file.read()
-        text = extract_text_from_docx(docx_bytes)
-
-        return text
-    
+        extract = extract_text_from_docx
     elif filename.endswith('.txt'):
-        txt_bytes = file.read()
-        text = extract_text_from_txt(txt_bytes)
-
-        return text
-        
+        extract = extract_text_from_txt
     elif filename.endswith(ALLOWED_IMAGE_EXTENSIONS):
-        image_bytes = file.read()
-        text = extract_text_from_image(image_bytes)
-        
-        return text
-    
+        extract = extract_text_from_image
     else:
         print("Error: Unsupported file type")
-        return None
\ No newline at end of file
+        return None
+
+    with open_upload(file) as file_bytes:
+        return extract(file_bytes)
+
+def _get_extraction_pool() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by all multi-file requests. Created on first use, so that it's created in the worker process
+    and not in a parent that forks it.
+    Threads are enough here - Tesseract runs in its own process and PyMuPDF releases the GIL while rendering.
+    """
+    global _extraction_pool
+
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix='extract')
+
+    return _extraction_pool
+
+def _extract_text_safely(file: FileStorage, ocr_pass: OcrPass = None, tokenizer=None) -> str:
+    try:
+        return extract_text(file, tokenizer=tokenizer, ocr_pass=ocr_pass)
+    except Exception as e:
+        print(f"Error extracting text from {file.filename}: {e}")
+        return ""
+
+def extract_texts(files: List[FileStorage], tokenizer=None, ocr_passes: List[OcrPass] = None) -> List[str]:
+    """
+    Extracts text from many files in parallel.
+    A file that fails is reported as an empty string, so that it doesn't affect the others.
+
+    :param files: Files received in request form-data
+    :type files: List[FileStorage]
+    :param tokenizer: optional tokenizer, enables lazy extraction, see extract_text()
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param ocr_passes: tiered OCR pass of every file, see extract_text()
+    :type ocr_passes: List[OcrPass]
+    :return: Text read from every file, in the order of files
+    :rtype: List[str]
+    """
+    extract = partial(_extract_text_safely, tokenizer=tokenizer)
+    ocr_passes = ocr_passes or [None] * len(files)
+
+    if len(files) <= 1:
+        return [extract(file, ocr_pass) for file, ocr_pass in zip(files, ocr_passes)]
+
+    return list(_get_extraction_pool().map(extract, files, ocr_passes))
+
+
+def _init_extraction_worker(tokenizer=None):
+    global _extraction_worker_tokenizer, OCR_PARALLEL
+
+    # the pool itself is what spreads the work over cores - a nested OCR pool in every worker would oversubscribe them
+    OCR_PARALLEL = False
+    _init_ocr_worker()
+
+    # Ctrl+C reaches the whole process group - the parent decides what happens to its tasks, a worker dying would break the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # sent once per worker process, rather than pickled with every lazy extraction task
+    _extraction_worker_tokenizer = tokenizer
+
+def extract_text_in_worker(file_bytes: bytes, filename: str, lazy: bool = False, ocr_pass: OcrPass = None) -> str:
+    """
+    Extracts text from raw file bytes inside a worker of the extraction process pool, see get_extraction_process_pool().
+
+    :param file_bytes: uploaded file content
+    :type file_bytes: bytes
+    :param filename: name of the uploaded file, tells the file type
+    :type filename: str
+    :param lazy: extract only text that fits the model input, using the tokenizer the pool was created with
+    :type lazy: bool
+    :param ocr_pass: tiered OCR pass, a copy in the worker - see extract_text_and_ocr_pass_in_worker()
+    :type ocr_pass: OcrPass
+    :return: Text read from the file
+    :rtype: str
+    """
+    file = FileStorage(stream=BytesIO(file_bytes), filename=filename)
+
+    # same as in _ocr_pdf_pages_worker(), an exception that can't be unpickled would break the pool
+    try:
+        return extract_text(file, tokenizer=_extraction_worker_tokenizer if lazy else None, ocr_pass=ocr_pass)
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+def extract_text_and_ocr_pass_in_worker(file_bytes: bytes, filename: str, lazy: bool, ocr_pass: OcrPass) -> Tuple[str, OcrPass]:
+    """
+    extract_text_in_worker() under a tiered OCR pass, which is sent back with the reads counted in the worker.
+
+    :return: A tuple consisting of: text read from the file and the pass
+    :rtype: Tuple[str, OcrPass]
+    """
+    return extract_text_in_worker(file_bytes, filename, lazy, ocr_pass), ocr_pass
+
+def extract_text_from_path_in_worker(path: str, lazy: bool = False, ocr_pass: OcrPass = None) -> Tuple[str, OcrPass]:
+    """
+    extract_text_and_ocr_pass_in_worker() for a file on disk, read by the worker itself - only the path is
+    sent to it, and a large file is memory-mapped rather than read, see open_upload().
+
+    :param path: path of the file, its extension tells the file type
+    :type path: str
+    :return: A tuple consisting of: text read from the file and the pass
+    :rtype: Tuple[str, OcrPass]
+    """
+    with open(path, 'rb') as f:
+        file = FileStorage(stream=f, filename=os.path.basename(path))
+
+        try:
+            return extract_text(file, tokenizer=_extraction_worker_tokenizer if lazy else None, ocr_pass=ocr_pass), ocr_pass
+        except Exception as e:
+            raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+def get_extraction_process_pool(tokenizer=None, max_workers: int = ASYNC_EXTRACTION_WORKERS) -> ProcessPoolExecutor:
+    """
+    Process pool used by the async app (and run_bulk.py) to run whole extractions off the event loop, see extract_text_in_worker().
+    Created on first use with max_workers 'spawn' processes; tokenizer is handed to every worker once,
+    for lazy extraction.
+
+    :param tokenizer: optional tokenizer, enables lazy extraction in workers
+    :type tokenizer: transformers.DistilBertTokenizerFast
+    :param max_workers: number of processes, when the pool is created
+    :type max_workers: int
+    :return: Pool instance
+    :rtype: ProcessPoolExecutor
+    """
+    global _extraction_process_pool
+
+    with _extraction_process_pool_lock:
+        if _extraction_process_pool is None:
+            _extraction_process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_extraction_worker,
+                initargs=(tokenizer,),
+            )
+
+    return _extraction_process_pool
+
+def reset_extraction_process_pool(broken_pool: ProcessPoolExecutor = None):
+    """
+    Shuts the extraction process pool down, e.g. after it broke. The next call to get_extraction_process_pool() starts a new one.
+
+    :param broken_pool: the pool that broke - reset only if it's still the current one. Every extraction in flight fails
+    when a pool breaks, and the ones that notice late mustn't shut down (and cancel the work of) its replacement
+    :type broken_pool: ProcessPoolExecutor
+    """
+    global _extraction_process_pool
+
+    with _extraction_process_pool_lock:
+        if broken_pool is not None and broken_pool is not _extraction_process_pool:
+            return
+
+        if _extraction_process_pool is not None:
+            _extraction_process_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_process_pool = None
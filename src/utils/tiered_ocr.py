@@ -0,0 +1,304 @@
+import contextvars
+import threading
+import time
+
+from contextlib import contextmanager
+from PIL import Image
+from src.settings.config import (
+    OCR_ESCALATION_CONFIDENCE,
+    OCR_FAST_MIN_CHARS,
+    OCR_FAST_MIN_SIDE,
+    OCR_FAST_SCALE,
+    OCR_FAST_TIER_TEXT_MODES,
+    OCR_FAST_TOP_FRACTION,
+    OCR_TIERS,
+)
+from src.utils.metrics import OCR_ESCALATIONS, OCR_TIER_READS, OCR_TIER_SECONDS
+from typing import Callable, Dict, Iterator, Optional
+
+"""
+Tiered OCR - a cheap read first, full resolution only when it's needed.
+
+Every page without a text layer used to be rendered at OCR_DPI and every image OCR'd at full resolution,
+even though a page read at half the resolution usually tells the classifier all it needs. Now an extraction
+can be started at the 'fast' tier (OcrPass('fast'), see new_ocr_pass()):
+
+    fast - PDF pages rendered at OCR_FAST_SCALE of the full dpi, images downscaled by it (down to OCR_FAST_MIN_SIDE),
+           optionally only the top OCR_FAST_TOP_FRACTION of a page, where titles usually are,
+    full - what OCR has always been.
+
+A fast read with fewer than OCR_FAST_MIN_CHARS letters and digits is too short to go by - that page or image is
+read again at the full tier right away. Once the document is classified, review_ocr_pass() tells whether its
+fast text left the classifier unsure (confidence below OCR_ESCALATION_CONFIDENCE); if so, the route extracts it
+again at the full tier and classifies it again.
+
+Fast reads are lower quality text, so only requests in OCR_FAST_TIER_TEXT_MODES start at the fast tier -
+by default those that don't get file_text back (?text=none). Reads, time spent per tier, the share of fast reads
+that were good enough and escalations are reported under GET /ocr-tier-stats and in Prometheus metrics.
+
+The pass an extraction runs under is set with ocr_pass_context() (like file_type_context() in metrics.py)
+and picked up by the OCR functions of text_extractor.py. Threads and processes don't inherit it -
+the pass is handed to them explicitly, and passes that come back from worker processes are added up.
+"""
+
+_ocr_pass = contextvars.ContextVar('ocr_pass', default=None)
+
+
+class OcrPass:
+    """
+    OCR done while extracting one document, starting at the given tier.
+    """
+
+    def __init__(self, tier: str = 'fast'):
+        self.tier = tier
+        self.reads = {name: 0 for name in OCR_TIERS}
+        self.seconds = {name: 0.0 for name in OCR_TIERS}
+        self.short_escalations = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        # sent to and back from OCR worker processes, a lock can't be pickled
+        return {name: value for name, value in self.__dict__.items() if name != '_lock'}
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def fast_reads_kept(self) -> int:
+        return self.reads['fast'] - self.short_escalations
+
+    def _timed(self, read: Callable[[str], Optional[str]], tier: str) -> Optional[str]:
+        start = time.perf_counter()
+        text = read(tier)
+        seconds = time.perf_counter() - start
+
+        if text is None:
+            return None
+
+        with self._lock:
+            self.reads[tier] += 1
+            self.seconds[tier] += seconds
+
+        OCR_TIER_SECONDS.labels(tier=tier).observe(seconds)
+        return text
+
+    def read(self, read: Callable[[str], Optional[str]]) -> str:
+        """
+        Reads a page or an image at the tier of this pass, escalating a fast read that's too short.
+
+        :param read: Reads the page or image at given tier, returns None if there's no cheaper fast read of it
+        :type read: Callable[[str], Optional[str]]
+        :return: Text read
+        :rtype: str
+        """
+        if self.tier == 'fast':
+            text = self._timed(read, 'fast')
+
+            if text is not None:
+                if not is_too_short(text):
+                    OCR_TIER_READS.labels(tier='fast', outcome='kept').inc()
+                    return text
+
+                OCR_TIER_READS.labels(tier='fast', outcome='escalated').inc()
+                OCR_ESCALATIONS.labels(reason='short_text').inc()
+
+                with self._lock:
+                    self.short_escalations += 1
+
+        OCR_TIER_READS.labels(tier='full', outcome='kept').inc()
+        return self._timed(read, 'full')
+
+    def add(self, other: 'OcrPass'):
+        """
+        Adds up the reads of a pass that ran in a worker process.
+
+        :param other: Pass returned by the worker
+        :type other: OcrPass
+        """
+        with self._lock:
+            for tier in OCR_TIERS:
+                self.reads[tier] += other.reads[tier]
+                self.seconds[tier] += other.seconds[tier]
+            self.short_escalations += other.short_escalations
+
+
+class OcrTierStats:
+    """
+    Counters of tiered OCR in this process, fed by review_ocr_pass().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._reads = {tier: 0 for tier in OCR_TIERS}
+            self._seconds = {tier: 0.0 for tier in OCR_TIERS}
+            # documents - started at the fast tier, fast_documents - classified from text of fast reads
+            self._counts = {"documents": 0, "fast_documents": 0, "short_text_escalations": 0, "low_confidence_escalations": 0}
+
+    def record(self, ocr_pass: OcrPass, escalated: bool):
+        with self._lock:
+            for tier in OCR_TIERS:
+                self._reads[tier] += ocr_pass.reads[tier]
+                self._seconds[tier] += ocr_pass.seconds[tier]
+
+            self._counts["short_text_escalations"] += ocr_pass.short_escalations
+
+            # a second, full tier pass of an escalated document adds its reads, it's not another document
+            if ocr_pass.tier == 'fast':
+                self._counts["documents"] += 1
+                self._counts["fast_documents"] += ocr_pass.fast_reads_kept > 0
+            self._counts["low_confidence_escalations"] += escalated
+
+    def stats(self) -> Dict:
+        """
+        :return: Reads and time per tier, the share of fast reads that were kept, and escalations
+        :rtype: Dict
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            reads, seconds = dict(self._reads), dict(self._seconds)
+
+        fast_kept = reads['fast'] - stats["short_text_escalations"]
+
+        for tier in OCR_TIERS:
+            stats[tier] = {"reads": reads[tier], "seconds": seconds[tier], "avg_ms": seconds[tier] / reads[tier] * 1000 if reads[tier] else None}
+
+        # a fast read is a hit if it had enough text, a fast document if its classification was kept
+        stats["fast_hit_rate"] = fast_kept / reads['fast'] if reads['fast'] else None
+        stats["fast_document_hit_rate"] = 1 - stats["low_confidence_escalations"] / stats["fast_documents"] if stats["fast_documents"] else None
+        return stats
+
+
+ocr_tier_stats = OcrTierStats()
+
+
+@contextmanager
+def ocr_pass_context(ocr_pass: Optional[OcrPass]) -> Iterator[None]:
+    """
+    Runs OCR inside the block (in this thread) under given pass. Without a pass, everything is read at the full tier.
+
+    :param ocr_pass: Pass of the document being extracted, or None
+    :type ocr_pass: Optional[OcrPass]
+    """
+    token = _ocr_pass.set(ocr_pass)
+
+    try:
+        yield
+    finally:
+        _ocr_pass.reset(token)
+
+
+def get_ocr_pass() -> Optional[OcrPass]:
+    """
+    :return: Pass OCR runs under in this thread, see ocr_pass_context()
+    :rtype: Optional[OcrPass]
+    """
+    return _ocr_pass.get()
+
+
+def read_tiered(read: Callable[[str], Optional[str]]) -> str:
+    """
+    Reads a page or an image under the current pass, see OcrPass.read(), or at the full tier if there's none.
+
+    :param read: Reads the page or image at given tier
+    :type read: Callable[[str], Optional[str]]
+    :return: Text read
+    :rtype: str
+    """
+    ocr_pass = _ocr_pass.get()
+
+    if ocr_pass is None:
+        return read('full')
+
+    return ocr_pass.read(read)
+
+
+def is_too_short(text: str, min_chars: int = OCR_FAST_MIN_CHARS) -> bool:
+    """
+    Tells whether a fast read has too little text to go by. Only letters and digits count,
+    a blurry low-resolution read tends to come out as punctuation.
+
+    :param text: Text of a fast read
+    :type text: str
+    :param min_chars: Letters and digits needed
+    :type min_chars: int
+    :return: True if the page or image should be read at the full tier
+    :rtype: bool
+    """
+    return sum(char.isalnum() for char in text) < min_chars
+
+
+def fast_image(image: Image.Image, scale: float = OCR_FAST_SCALE, min_side: int = OCR_FAST_MIN_SIDE, top_fraction: float = OCR_FAST_TOP_FRACTION) -> Optional[Image.Image]:
+    """
+    The image the fast tier reads - its top top_fraction, downscaled by scale, but not below min_side pixels on the longer side.
+
+    :param image: Full resolution image
+    :type image: PIL.Image.Image
+    :param scale: Downscaling factor
+    :type scale: float
+    :param min_side: Min length of the longer side after downscaling
+    :type min_side: int
+    :param top_fraction: Share of the image height read, from the top
+    :type top_fraction: float
+    :return: Smaller image, None if it can't be any smaller than the full one
+    :rtype: Optional[PIL.Image.Image]
+    """
+    width, height = image.size
+    scale = min(1.0, max(scale, min_side / max(width, height)))
+    crop_height = max(1, int(height * top_fraction))
+
+    if scale >= 1.0 and crop_height >= height:
+        return None
+
+    if crop_height < height:
+        image = image.crop((0, 0, width, crop_height))
+
+    if scale < 1.0:
+        image = image.resize((max(1, int(width * scale)), max(1, int(crop_height * scale))), Image.Resampling.BOX)
+
+    return image
+
+
+def new_ocr_pass(text_mode: str, fast_text_modes: tuple = OCR_FAST_TIER_TEXT_MODES) -> Optional[OcrPass]:
+    """
+    Pass a request's extraction starts with - at the fast tier if its text mode allows it, otherwise None (full tier).
+
+    :param text_mode: Text mode of the request, one of TEXT_MODES
+    :type text_mode: str
+    :param fast_text_modes: Text modes that start at the fast tier
+    :type fast_text_modes: tuple
+    :return: Pass to extract the document with
+    :rtype: Optional[OcrPass]
+    """
+    return OcrPass('fast') if text_mode in fast_text_modes else None
+
+
+def review_ocr_pass(ocr_pass: Optional[OcrPass], confidence: Optional[float], threshold: float = OCR_ESCALATION_CONFIDENCE) -> Optional[OcrPass]:
+    """
+    Records a classified document's OCR in the tier stats and tells whether it has to be read again:
+    if any of its text came from fast reads and the classifier's confidence is below threshold.
+
+    :param ocr_pass: Pass the document was extracted with, None if it wasn't tiered
+    :type ocr_pass: Optional[OcrPass]
+    :param confidence: Classifier's confidence, None if the text couldn't be classified
+    :type confidence: Optional[float]
+    :param threshold: Confidence needed to keep a classification of fast reads
+    :type threshold: float
+    :return: A full tier pass to extract the document again with, or None if the result stands
+    :rtype: Optional[OcrPass]
+    """
+    if ocr_pass is None:
+        return None
+
+    escalate = ocr_pass.tier == 'fast' and ocr_pass.fast_reads_kept > 0 and (confidence is None or confidence < threshold)
+    ocr_tier_stats.record(ocr_pass, escalate)
+
+    if not escalate:
+        return None
+
+    OCR_ESCALATIONS.labels(reason='low_confidence').inc()
+    return OcrPass('full')
@@ -2,9 +2,12 @@ import torch
 
 from flask import Request
 
-from transformers import DistilBertForSequenceClassification, DistilBertTokenizer
+from transformers import DistilBertForSequenceClassification, DistilBertTokenizerFast
+from typing import List, Optional
 
-from src.settings.config import ALLOWED_EXTENSIONS, ALLOWED_MIME_TYPES
+from src.settings.config import ALLOWED_EXTENSIONS, ALLOWED_MIME_TYPES, MAX_FILES_PER_REQUEST, MAX_REQUEST_BYTES, MAX_UPLOAD_BYTES, TEXT_MODES
+from src.utils.intake import get_upload_size, sniff_upload
+from src.utils.metrics import UPLOADS_REJECTED
 from src.utils.text_extractor import extract_file_extension
 
 from werkzeug.datastructures import FileStorage
@@ -14,6 +17,13 @@ class ValidationError(Exception):
     def __init__(self, message):
         super().__init__(message)
 
+# an upload or a whole request over the size limits, answered with 413
+class PayloadTooLargeError(ValidationError):
+    pass
+
+def _megabytes(n_bytes: int) -> str:
+    return f"{n_bytes / (1024 * 1024):.1f} MB"
+
 def is_allowed_file(filename: str, ext: str) -> bool:
     """
     Validates whether the file is allowed by checking filename and extension.
@@ -27,14 +37,14 @@ def is_allowed_file(filename: str, ext: str) -> bool:
     """
     return '.' in filename and ext in ALLOWED_EXTENSIONS
 
-def validate_model_state(pretrained_model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizer, device: torch.device):
+def validate_model_state(pretrained_model: DistilBertForSequenceClassification, tokenizer: DistilBertTokenizerFast, device: torch.device):
     """
     Checks if model has been preloaded correctly
 
     :param pretrained_model: DistilBERT-type model instance
     :type pretrained_model: transformers.DistilBertForSequenceClassification
     :param tokenizer: DistilBERT-type tokenizer, applied to text
-    :type tokenizer: transformers.DistilBertTokenizer
+    :type tokenizer: transformers.DistilBertTokenizerFast
     :param device: Device type (CPU or GPU) as read by PyTorch
     :type device: torch.device
     """
@@ -54,11 +64,94 @@ def get_and_validate_uploaded_file(request: Request) -> FileStorage:
         raise ValidationError("No file provided")
 
     file = request.files['file']
-    
-    if file.filename == '':
+    validate_uploaded_file(file)
+
+    return file
+
+def get_and_validate_uploaded_files(request: Request, max_files: int = MAX_FILES_PER_REQUEST) -> List[FileStorage]:
+    """
+    Gets files uploaded under the 'files' key of a multi-file request.
+    Files themselves are not validated here, so that one bad file doesn't fail the whole batch - 
+    use validate_uploaded_file() on each of them.
+
+    :param request: Received request object
+    :type request: flask.Request
+    :param max_files: Max number of files accepted in one request
+    :type max_files: int
+    :return: Uploaded files, in the order they were sent
+    :rtype: List[FileStorage]
+    """
+    files = request.files.getlist('files')
+
+    if not files:
+        raise ValidationError("No files provided")
+
+    if len(files) > max_files:
+        raise ValidationError(f"Too many files. Max {max_files} files per request, got: {len(files)}")
+
+    return files
+
+def get_and_validate_text_mode(request: Request) -> str:
+    """
+    Reads the 'text' query parameter, telling whether the client needs file_text in the response.
+
+    :param request: Received request object
+    :type request: flask.Request
+    :return: one of TEXT_MODES, 'full' by default
+    :rtype: str
+    """
+    text_mode = request.args.get('text', 'full')
+
+    if text_mode not in TEXT_MODES:
+        raise ValidationError(f"Invalid text mode. Allowed modes include: {', '.join(TEXT_MODES)}")
+
+    return text_mode
+
+def get_and_validate_text_max_chars(request: Request) -> Optional[int]:
+    """
+    Reads the 'text_max_chars' query parameter, the number of characters of file_text the client needs,
+    see src/utils/response_shaping.py
+
+    :param request: Received request object
+    :type request: flask.Request
+    :return: a positive number of characters, None if file_text is to be sent whole
+    :rtype: Optional[int]
+    """
+    text_max_chars = request.args.get('text_max_chars')
+
+    if text_max_chars is None:
+        return None
+
+    if not text_max_chars.isdigit() or int(text_max_chars) < 1:
+        raise ValidationError(f"Invalid text_max_chars. Expected a positive number of characters, got: {text_max_chars}")
+
+    return int(text_max_chars)
+
+def validate_request_size(content_length: Optional[int], max_bytes: int = MAX_REQUEST_BYTES):
+    """
+    Rejects a request by its Content-Length header, before the body is read and parsed.
+
+    :param content_length: Value of the Content-Length header, None if it's not sent
+    :type content_length: Optional[int]
+    :param max_bytes: Max size of a request body
+    :type max_bytes: int
+    """
+    if content_length is not None and int(content_length) > max_bytes:
+        UPLOADS_REJECTED.labels(reason='request_too_large').inc()
+        raise PayloadTooLargeError(f"Request too large. Max {_megabytes(max_bytes)} per request, got: {_megabytes(int(content_length))}")
+
+def validate_uploaded_file(file: FileStorage):
+    """
+    Validates a single uploaded file - filename, extension and MIME type, then its size against
+    the limit of its type and its real type sniffed from the content, see src/utils/intake.py
+
+    :param file: Uploaded file
+    :type file: FileStorage
+    """
+    if not file.filename:
         raise ValidationError("Empty filename")
 
-    ext = extract_file_extension(file.filename)
+    ext = extract_file_extension(file.filename) if '.' in file.filename else ''
 
     if not is_allowed_file(file.filename, ext):
         raise ValidationError(f"File type not allowed. Allowed types include: {', '.join(ALLOWED_EXTENSIONS)}")
@@ -67,8 +160,22 @@ def get_and_validate_uploaded_file(request: Request) -> FileStorage:
 
     if file.mimetype != expected_mime: # python-magic would be a nice to have to check real mime-type of the file content
         raise ValidationError(f"MIME type doesn't match expected type for .{ext}. Expected: {expected_mime}, got: {file.mimetype}")
-    
-    return file
+
+    size = get_upload_size(file)
+
+    if size == 0:
+        UPLOADS_REJECTED.labels(reason='empty').inc()
+        raise ValidationError("Empty file")
+
+    if size > MAX_UPLOAD_BYTES[ext]:
+        UPLOADS_REJECTED.labels(reason='too_large').inc()
+        raise PayloadTooLargeError(f"File too large. Max size for .{ext} is {_megabytes(MAX_UPLOAD_BYTES[ext])}, got: {_megabytes(size)}")
+
+    sniffed_type = sniff_upload(file)
+
+    if sniffed_type != ('jpg' if ext == 'jpeg' else ext):
+        UPLOADS_REJECTED.labels(reason='type_mismatch').inc()
+        raise ValidationError(f"File content doesn't match .{ext}, it looks like: {sniffed_type or 'unknown binary data'}")
 
 def validate_file_text(file_text: str):
     """
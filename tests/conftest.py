@@ -0,0 +1,8 @@
+import pytest
+
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+
+
+@pytest.fixture(scope='session')
+def tiny_model_and_tokenizer():
+    return build_tiny_model_and_tokenizer()
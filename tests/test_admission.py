@@ -0,0 +1,139 @@
+import asyncio
+import pymupdf
+import pytest
+import threading
+import time
+import zipfile
+
+from docx import Document
+from io import BytesIO
+from werkzeug.datastructures import FileStorage
+
+from src.utils.admission import AdmissionController, OverloadedError, RequestCost, estimate_cost
+
+def make_pdf(page_texts: list) -> bytes:
+    pdf_doc = pymupdf.open()
+    for text in page_texts:
+        page = pdf_doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    pdf_bytes = pdf_doc.tobytes()
+    pdf_doc.close()
+    return pdf_bytes
+
+def make_docx(text: str = None, images: tuple = ()) -> bytes:
+    docx_bytes = BytesIO()
+    document = Document()
+    if text:
+        document.add_paragraph(text)
+    document.save(docx_bytes)
+
+    with zipfile.ZipFile(docx_bytes, 'a') as archive:
+        for i, image in enumerate(images):
+            archive.writestr(f"word/media/image{i}.png", image)
+
+    return docx_bytes.getvalue()
+
+@pytest.mark.parametrize("content, filename, lazy, expected", [
+    (b"invoice", "a.txt", False, RequestCost(0, 1)),
+    (b"\x89PNG", "a.png", False, RequestCost(1, 1)),
+    (make_pdf(["Invoice"] * 4), "a.pdf", False, RequestCost(0, 1)),
+    (make_pdf([None] * 4), "a.pdf", False, RequestCost(4, 1)),
+    (make_pdf(["Invoice", None] * 3), "a.pdf", False, RequestCost(2, 1)), # every 2nd page scanned, 1 of 3 samples
+    (make_pdf([None] * 4), "a.pdf", True, RequestCost(2, 1)),
+    (make_docx("Contract"), "a.docx", False, RequestCost(0, 1)),
+    (make_docx(images=(b"scan 1", b"scan 2", b"scan 1")), "a.docx", False, RequestCost(2, 1)),
+    (b"%PDF-1.7 broken", "a.pdf", False, RequestCost(0, 1)),
+    (b"invoice line\n" * 100_000, "a.txt", False, RequestCost(0, 5)), # 1.2 MB, a unit per 256 kB
+    (b"invoice line\n" * 100_000, "a.txt", True, RequestCost(0, 1)), # read only up to the model input
+])
+def test_estimate_cost(content, filename, lazy, expected):
+    file = FileStorage(BytesIO(content), filename)
+
+    assert estimate_cost([file], lazy=lazy) == expected
+    assert file.stream.tell() == 0
+
+def test_large_text_upload_costs_more_than_a_small_one():
+    small = estimate_cost([FileStorage(BytesIO(b"invoice"), "a.txt")])
+    large = estimate_cost([FileStorage(BytesIO(b"x" * 4 * 1024 * 1024), "a.txt")])
+
+    assert large.kind == small.kind == 'text'
+    assert large.text_units == 16 and small.text_units == 1
+
+def test_cheap_requests_are_admitted_while_ocr_budget_is_full():
+    controller = AdmissionController(ocr_budget=2, text_budget=4, max_waiting=1, max_wait_seconds=0.01)
+    controller.acquire(RequestCost(2, 1))
+
+    with controller.admit(RequestCost(0, 1)):
+        assert controller.stats()["text"]["in_flight"] == 2
+
+    with pytest.raises(OverloadedError) as e:
+        controller.acquire(RequestCost(1, 1))
+
+    assert e.value.retry_after >= 1
+    assert controller.stats()["ocr"]["shed_timeout"] == 1
+
+def test_full_queue_sheds_right_away():
+    controller = AdmissionController(ocr_budget=1, text_budget=4, max_waiting=1, max_wait_seconds=5)
+    taken = controller.acquire(RequestCost(1, 1))
+    waiter = threading.Thread(target=lambda: controller.release(controller.acquire(RequestCost(1, 1)), 0.0))
+    waiter.start()
+
+    while not controller.stats()["ocr"]["waiting"]:
+        time.sleep(0.001)
+
+    start = time.perf_counter()
+    with pytest.raises(OverloadedError):
+        controller.acquire(RequestCost(1, 1))
+    assert time.perf_counter() - start < 0.5
+
+    controller.release(taken, 0.1)
+    waiter.join(timeout=5)
+
+    stats = controller.stats()["ocr"]
+    assert stats["admitted"] == 2 and stats["queued"] == 1 and stats["shed_queue_full"] == 1
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+def test_ocr_requests_leave_request_threads_to_text():
+    controller = AdmissionController(ocr_budget=1, text_budget=4, max_waiting=16, max_wait_seconds=5, ocr_threads=2)
+    taken = controller.acquire(RequestCost(1, 1))
+    waiter = threading.Thread(target=lambda: controller.release(controller.acquire(RequestCost(1, 1)), 0.0))
+    waiter.start()
+
+    while not controller.stats()["ocr"]["waiting"]:
+        time.sleep(0.001)
+
+    # the queue has room, but both OCR threads are taken - shed at once, text still gets in
+    start = time.perf_counter()
+    with pytest.raises(OverloadedError):
+        controller.acquire(RequestCost(1, 1))
+    assert time.perf_counter() - start < 0.5
+
+    with controller.admit(RequestCost(0, 1)):
+        assert controller.stats()["text"]["threads"] == 1
+
+    controller.release(taken, 0.1)
+    waiter.join(timeout=5)
+
+    stats = controller.stats()["ocr"]
+    assert stats["shed_no_thread"] == 1 and stats["shed_queue_full"] == 0 and stats["threads"] == 0
+
+def test_oversized_request_runs_alone():
+    controller = AdmissionController(ocr_budget=4, text_budget=4)
+
+    with controller.admit(RequestCost(100, 1)) as cost:
+        assert cost == RequestCost(4, 1)
+
+def test_async_waiters_are_admitted_after_release():
+    controller = AdmissionController(ocr_budget=1, text_budget=4, max_waiting=2, max_wait_seconds=5)
+
+    async def main():
+        async with controller.admit_async(RequestCost(1, 1)):
+            waiter = asyncio.create_task(controller.acquire_async(RequestCost(1, 1)))
+            await asyncio.sleep(0.02)
+            assert not waiter.done()
+
+        return await waiter
+
+    assert asyncio.run(main()) == RequestCost(1, 1)
+    assert controller.stats()["ocr"]["waiting"] == 0
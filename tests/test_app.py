@@ -1,7 +1,16 @@
+import gzip
+import json
 import pytest
 
 from io import BytesIO
-from src.app import app
+from src.app import app, model_registry, result_cache
+from src.model.registry import ModelVersion
+from src.utils.admission import AdmissionController, RequestCost
+from src.utils.job_queue import JobQueue
+from src.utils.near_duplicates import get_near_duplicate_index
+from src.utils.tiered_ocr import ocr_tier_stats
+
+VERSION = model_registry.active.version
 
 @pytest.fixture
 def client():
@@ -9,6 +18,19 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture(autouse=True)
+def empty_result_cache():
+    if result_cache:
+        result_cache.clear()
+
+@pytest.fixture(autouse=True)
+def admission(mocker):
+    # a fresh controller per test, every request costs one file of text work unless a test says otherwise
+    controller = AdmissionController(ocr_budget=4, text_budget=4, max_waiting=1, max_wait_seconds=0.05)
+    mocker.patch("src.app.admission", controller)
+    mocker.patch("src.app.estimate_cost", return_value=RequestCost(0, 1))
+    return controller
+
 def test_no_file_in_request(client):
     response = client.post('/classify-file')
     assert response.status_code == 400
@@ -43,5 +65,263 @@ def test_success(client, mocker):
     assert response.get_json() == {
         "file_class": "test_class", 
         "confidence": 0.95, 
-        "file_text": "foo bar"
-    }
\ No newline at end of file
+        "file_text": "foo bar",
+        "model_version": VERSION
+    }
+
+def test_classify_files_no_files(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    response = client.post('/classify-files')
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "No files provided"}
+
+def test_classify_files_per_file_results(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch("src.app.extract_texts", side_effect=lambda files, tokenizer=None, ocr_passes=None: ["invoice text" if f.filename == "a.txt" else "" for f in files])
+    classify = mocker.patch('src.app.classify_files', return_value=[('invoice', 0.9)])
+
+    data = {'files': [
+        (BytesIO(b"invoice text"), 'a.txt', 'text/plain'),
+        (BytesIO(b"\x89PNG"), 'b.gif', 'image/gif'),
+        (BytesIO(b"  \n"), 'c.txt', 'text/plain'), # passes intake, yields no text
+    ]}
+    response = client.post('/classify-files', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results[0] == {"filename": "a.txt", "file_class": "invoice", "confidence": 0.9, "file_text": "invoice text"}
+    assert results[1]["filename"] == "b.gif" and "File type not allowed" in results[1]["error"]
+    assert results[2] == {"filename": "c.txt", "error": "Text extraction result is empty"}
+    classify.assert_called_once()
+    assert classify.call_args.args[0] == ["invoice text"]
+
+def test_classify_files_classification_failure(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch("src.app.extract_texts", return_value=["foo bar"])
+    mocker.patch('src.app.classify_files', return_value=[(None, None)])
+
+    data = {'files': [(BytesIO(b"foo bar"), 'a.txt', 'text/plain')]}
+    response = client.post('/classify-files', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"results": [{"filename": "a.txt", "error": "Unable to classify document."}], "model_version": VERSION}
+
+def test_repeated_upload_served_from_cache(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    extract = mocker.patch("src.app.extract_text", return_value="foo bar")
+    classify = mocker.patch('src.app.classify_file', return_value=('invoice', 0.95))
+
+    for _ in range(2):
+        data = {'file': (BytesIO(b"same bytes"), 'file.txt', 'text/plain')}
+        response = client.post('/classify-file', data=data, content_type='multipart/form-data')
+        assert response.get_json() == {"file_class": "invoice", "confidence": 0.95, "file_text": "foo bar", "model_version": VERSION}
+
+    assert extract.call_count == 1
+    assert classify.call_count == 1
+
+    stats = client.get('/cache-stats').get_json()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+def test_text_mode_none_extracts_lazily_and_omits_text(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    tokenizer = mocker.Mock()
+    mocker.patch.object(model_registry, 'active', ModelVersion(VERSION, mocker.Mock(), tokenizer, 'cpu'))
+    extract = mocker.patch("src.app.extract_text", return_value="foo bar")
+    mocker.patch('src.app.classify_file', return_value=('invoice', 0.95))
+
+    data = {'file': (BytesIO(b"dummy content"), 'file.txt', 'text/plain')}
+    response = client.post('/classify-file?text=none', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert response.get_json() == {"file_class": "invoice", "confidence": 0.95, "model_version": VERSION}
+    assert extract.call_args.kwargs["tokenizer"] is tokenizer
+
+def test_invalid_text_mode(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+
+    data = {'file': (BytesIO(b"dummy content"), 'file.txt', 'text/plain')}
+    response = client.post('/classify-file?text=some', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    assert "Invalid text mode" in response.get_json()["error"]
+
+def test_text_max_chars_truncates_response_but_not_cache(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch("src.app.extract_text", return_value="foo bar")
+    mocker.patch('src.app.classify_file', return_value=('invoice', 0.95))
+
+    data = {'file': (BytesIO(b"same bytes"), 'file.txt', 'text/plain')}
+    response = client.post('/classify-file?text_max_chars=3', data=data, content_type='multipart/form-data')
+
+    assert response.get_json() == {"file_class": "invoice", "confidence": 0.95, "file_text": "foo", "file_text_truncated": True, "file_text_length": 7, "model_version": VERSION}
+
+    data = {'file': (BytesIO(b"same bytes"), 'file.txt', 'text/plain')}
+    response = client.post('/classify-file', data=data, content_type='multipart/form-data')
+
+    assert response.get_json()["file_text"] == "foo bar"
+
+@pytest.mark.parametrize("text_max_chars", ["0", "-5", "many"])
+def test_invalid_text_max_chars(client, mocker, text_max_chars):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+
+    data = {'file': (BytesIO(b"dummy content"), 'file.txt', 'text/plain')}
+    response = client.post(f'/classify-file?text_max_chars={text_max_chars}', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    assert "Invalid text_max_chars" in response.get_json()["error"]
+
+def test_long_text_is_gzipped_for_clients_accepting_it(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch("src.app.extract_texts", return_value=["invoice total " * 1000])
+    mocker.patch('src.app.classify_files', return_value=[('invoice', 0.95)])
+
+    data = {'files': [(BytesIO(b"invoice text"), 'a.txt', 'text/plain')]}
+    response = client.post('/classify-files', data=data, content_type='multipart/form-data', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(response.data) < 1000
+    assert json.loads(gzip.decompress(response.data))["results"][0]["file_text"] == "invoice total " * 1000
+
+    data = {'files': [(BytesIO(b"invoice text"), 'a.txt', 'text/plain')]}
+    response = client.post('/classify-files', data=data, content_type='multipart/form-data')
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()["results"][0]["file_text"] == "invoice total " * 1000
+
+def test_unsure_fast_ocr_is_read_again_at_full_resolution(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    ocr_tier_stats.reset()
+
+    def fake_extract_text(file, tokenizer=None, ocr_pass=None):
+        ocr_pass.reads[ocr_pass.tier] += 1
+        return "blurry inv0ice" if ocr_pass.tier == 'fast' else "invoice total"
+
+    extract = mocker.patch("src.app.extract_text", side_effect=fake_extract_text)
+    mocker.patch('src.app.classify_file', side_effect=lambda text, *args, **kwargs: ('invoice', 0.95) if text == "invoice total" else ('passport', 0.4))
+
+    data = {'file': (BytesIO(b"\x89PNG\r\n\x1a\n scan"), 'scan.png', 'image/png')}
+    response = client.post('/classify-file?text=none', data=data, content_type='multipart/form-data')
+
+    assert response.get_json() == {"file_class": "invoice", "confidence": 0.95, "model_version": VERSION}
+    assert [call.kwargs["ocr_pass"].tier for call in extract.call_args_list] == ['fast', 'full']
+
+    stats = client.get('/ocr-tier-stats').get_json()
+    assert stats["low_confidence_escalations"] == 1
+    assert stats["fast"]["reads"] == 1 and stats["full"]["reads"] == 1
+
+def test_lazy_result_in_cache_does_not_answer_full_text_request(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    extract = mocker.patch("src.app.extract_text", return_value="foo bar")
+    mocker.patch('src.app.classify_file', return_value=('invoice', 0.95))
+
+    for text_mode in ('none', 'full', 'none'):
+        data = {'file': (BytesIO(b"same bytes"), 'file.txt', 'text/plain')}
+        client.post(f'/classify-file?text={text_mode}', data=data, content_type='multipart/form-data')
+
+    assert extract.call_count == 2
+
+@pytest.fixture
+def job_queue(tmp_path, mocker):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.sqlite"), max_queued=1)
+    mocker.patch("src.app.job_queue", queue)
+    return queue
+
+def test_submit_job_and_poll_status(client, job_queue):
+    data = {'file': (BytesIO(b"invoice text"), 'a.txt', 'text/plain')}
+    response = client.post('/jobs?text=none', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert response.headers["Location"] == f"/jobs/{job_id}"
+    assert client.get(f'/jobs/{job_id}').get_json()["status"] == "queued"
+
+    job = job_queue.claim()
+    assert job["payload"] == b"invoice text" and job["text_mode"] == "none"
+    job_queue.complete(job_id, job["lease_id"], {"file_class": "invoice", "confidence": 0.9})
+
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert status["status"] == "done"
+    assert status["result"] == {"file_class": "invoice", "confidence": 0.9}
+
+def test_submit_job_when_queue_is_full(client, job_queue):
+    job_queue.submit(b"queued", "a.txt", "text/plain", "full")
+
+    data = {'file': (BytesIO(b"invoice text"), 'b.txt', 'text/plain')}
+    response = client.post('/jobs', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+def test_submit_job_validates_upload(client, job_queue):
+    data = {'file': (BytesIO(b"GIF89a"), 'a.gif', 'image/gif')}
+    response = client.post('/jobs', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    assert job_queue.stats()["depth"] == 0
+
+def test_unknown_job(client, job_queue):
+    assert client.get('/jobs/missing').status_code == 404
+
+def test_upload_over_size_limit(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch.dict("src.utils.validators.MAX_UPLOAD_BYTES", {"txt": 4})
+    extract = mocker.patch("src.app.extract_text")
+
+    data = {'file': (BytesIO(b"invoice text"), 'a.txt', 'text/plain')}
+    response = client.post('/classify-file', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 413
+    assert "File too large" in response.get_json()["error"]
+    extract.assert_not_called()
+
+def test_overloaded_requests_are_shed(client, admission, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch("src.app.estimate_cost", return_value=RequestCost(ocr_units=3, text_units=1))
+    extract = mocker.patch("src.app.extract_text")
+
+    admission.release(admission.acquire(RequestCost(ocr_units=1)), held_seconds=2.5) # OCR requests take ~2.5 s
+    admission.acquire(RequestCost(ocr_units=4)) # all OCR budget taken
+
+    data = {'file': (BytesIO(b"\x89PNG\r\n\x1a\n"), 'scan.png', 'image/png')}
+    response = client.post('/classify-file', data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    extract.assert_not_called()
+
+    stats = client.get('/admission-stats').get_json()
+    assert stats["enabled"] and stats["ocr"]["shed_timeout"] == 1 and stats["ocr"]["in_flight"] == 4
+
+def test_result_cached_for_one_model_version_is_not_served_by_another(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    mocker.patch("src.app.extract_text", return_value="foo bar")
+    classify = mocker.patch('src.app.classify_file', return_value=('invoice', 0.95))
+
+    for version in (VERSION, 'retrained', 'retrained'):
+        mocker.patch.object(model_registry, 'active', ModelVersion(version, mocker.Mock(), mocker.Mock(), 'cpu'))
+
+        data = {'file': (BytesIO(b"same bytes"), 'file.txt', 'text/plain')}
+        response = client.post('/classify-file', data=data, content_type='multipart/form-data')
+        assert response.get_json()["model_version"] == version
+
+    assert classify.call_count == 2
+
+    stats = client.get('/model-version').get_json()
+    assert stats["active"] == 'retrained' and stats["resident"] == [{"version": 'retrained', "in_flight": 0, "loaded_at": mocker.ANY, "state": 'active'}]
+
+def test_near_duplicate_stats_of_the_served_version(client, mocker):
+    mocker.patch('src.utils.near_duplicates.NEAR_DUPLICATE_ENABLED', True)
+    mocker.patch.object(model_registry, 'active', ModelVersion('retrained', mocker.Mock(), mocker.Mock(), 'cpu'))
+    index = get_near_duplicate_index(model_registry.active.model)
+    signature = index.hasher.signature("invoice number 1234 total amount due within 30 days of the invoice date")
+
+    index.add(signature, 'invoice', 0.95)
+    index.lookup(signature)
+
+    stats = client.get('/near-duplicate-stats').get_json()
+    assert stats["enabled"] and stats["entries"] == 1 and stats["hits"] == 1
+
+    mocker.patch('src.utils.near_duplicates.NEAR_DUPLICATE_ENABLED', False)
+    assert client.get('/near-duplicate-stats').get_json() == {"enabled": False}
@@ -0,0 +1,188 @@
+import pytest
+
+from io import BytesIO
+from starlette.testclient import TestClient
+from src.asgi_app import app, model_registry, result_cache
+from src.model.registry import ModelVersion
+from src.utils.admission import AdmissionController, RequestCost
+from src.utils.job_queue import JobQueue
+from src.utils.text_extractor import reset_extraction_process_pool
+
+VERSION = model_registry.active.version
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def empty_result_cache():
+    if result_cache:
+        result_cache.clear()
+
+@pytest.fixture(autouse=True)
+def admission(mocker):
+    # a fresh controller per test, every request costs one file of text work unless a test says otherwise
+    controller = AdmissionController(ocr_budget=4, text_budget=4, max_waiting=1, max_wait_seconds=0.05)
+    mocker.patch("src.asgi_app.admission", controller)
+    mocker.patch("src.asgi_app.estimate_cost", return_value=RequestCost(0, 1))
+    return controller
+
+def test_no_file_in_request(client):
+    response = client.post('/classify-file')
+    assert response.status_code == 400
+
+def test_no_selected_file(client):
+    files = {'file': ('', BytesIO(b""), 'application/octet-stream')}  # Empty filename
+    response = client.post('/classify-file', files=files)
+    assert response.status_code == 400
+
+def test_classification_failure(client, mocker):
+    mocker.patch("src.asgi_app.validate_model_state", return_value=None)
+    mocker.patch("src.asgi_app.get_and_validate_uploaded_file", return_value=BytesIO(b"dummy content"))
+    mocker.patch("src.asgi_app.extract_text_async", return_value="dummy text")
+    mocker.patch("src.asgi_app.validate_file_text", return_value=None)
+    mocker.patch("src.asgi_app.classify_file_async", return_value=(None, None))
+
+    files = {'file': ('file.pdf', BytesIO(b"dummy content"), 'application/pdf')}
+    response = client.post('/classify-file', files=files)
+    assert response.status_code == 400
+    assert response.json() == {"error": "Unable to classify document."}
+
+def test_success(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    mocker.patch("src.asgi_app.extract_text_async", return_value="foo bar")
+    mocker.patch('src.asgi_app.classify_file_async', return_value=('test_class', 0.95))
+
+    files = {'file': ('file.pdf', BytesIO(b"%PDF-1.7 dummy content"), 'application/pdf')}
+    response = client.post('/classify-file', files=files)
+    assert response.status_code == 200
+    assert response.json() == {
+        "file_class": "test_class",
+        "confidence": 0.95,
+        "file_text": "foo bar",
+        "model_version": VERSION
+    }
+
+def test_classify_files_no_files(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    response = client.post('/classify-files')
+    assert response.status_code == 400
+    assert response.json() == {"error": "No files provided"}
+
+def test_classify_files_per_file_results(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    mocker.patch("src.asgi_app.extract_text_async", side_effect=lambda file, lazy=False, ocr_pass=None: "invoice text" if file.filename == "a.txt" else "")
+    classify = mocker.patch('src.asgi_app.classify_files_async', return_value=[('invoice', 0.9)])
+
+    files = [
+        ('files', ('a.txt', BytesIO(b"invoice text"), 'text/plain')),
+        ('files', ('b.gif', BytesIO(b"\x89PNG"), 'image/gif')),
+        ('files', ('c.txt', BytesIO(b"  \n"), 'text/plain')), # passes intake, yields no text
+    ]
+    response = client.post('/classify-files', files=files)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0] == {"filename": "a.txt", "file_class": "invoice", "confidence": 0.9, "file_text": "invoice text"}
+    assert results[1]["filename"] == "b.gif" and "File type not allowed" in results[1]["error"]
+    assert results[2] == {"filename": "c.txt", "error": "Text extraction result is empty"}
+    classify.assert_called_once()
+    assert classify.call_args.args[0] == ["invoice text"]
+
+def test_classify_files_extraction_error_is_per_file(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    mocker.patch("src.asgi_app.extract_text_async", side_effect=RuntimeError("boom"))
+    classify = mocker.patch('src.asgi_app.classify_files_async', return_value=[])
+
+    files = [('files', ('a.txt', BytesIO(b"foo"), 'text/plain'))]
+    response = client.post('/classify-files', files=files)
+
+    assert response.status_code == 200
+    assert response.json() == {"results": [{"filename": "a.txt", "error": "Text extraction result is empty"}], "model_version": VERSION}
+    assert classify.call_args.args[0] == []
+
+def test_repeated_upload_served_from_cache(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    extract = mocker.patch("src.asgi_app.extract_text_async", return_value="foo bar")
+    classify = mocker.patch('src.asgi_app.classify_file_async', return_value=('invoice', 0.95))
+
+    for _ in range(2):
+        files = {'file': ('file.txt', BytesIO(b"same bytes"), 'text/plain')}
+        response = client.post('/classify-file', files=files)
+        assert response.json() == {"file_class": "invoice", "confidence": 0.95, "file_text": "foo bar", "model_version": VERSION}
+
+    assert extract.call_count == 1
+    assert classify.call_count == 1
+
+    stats = client.get('/cache-stats').json()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+def test_text_mode_none_extracts_lazily_and_omits_text(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    extract = mocker.patch("src.asgi_app.extract_text_async", return_value="foo bar")
+    mocker.patch('src.asgi_app.classify_file_async', return_value=('invoice', 0.95))
+
+    files = {'file': ('file.txt', BytesIO(b"dummy content"), 'text/plain')}
+    response = client.post('/classify-file?text=none', files=files)
+
+    assert response.status_code == 200
+    assert response.json() == {"file_class": "invoice", "confidence": 0.95, "model_version": VERSION}
+    assert extract.call_args.kwargs["lazy"] is True
+
+def test_invalid_text_mode(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+
+    files = {'file': ('file.txt', BytesIO(b"dummy content"), 'text/plain')}
+    response = client.post('/classify-file?text=some', files=files)
+
+    assert response.status_code == 400
+    assert "Invalid text mode" in response.json()["error"]
+
+def test_long_text_is_truncated_or_gzipped(client, mocker):
+    mocker.patch('src.asgi_app.validate_model_state', return_value=None)
+    mocker.patch("src.asgi_app.extract_text_async", return_value="contract terms " * 1000)
+    mocker.patch('src.asgi_app.classify_file_async', return_value=('contract', 0.95))
+
+    files = {'file': ('file.txt', BytesIO(b"contract"), 'text/plain')}
+    response = client.post('/classify-file', files=files, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert int(response.num_bytes_downloaded) < 1000
+    assert response.json()["file_text"] == "contract terms " * 1000
+
+    files = {'file': ('file.txt', BytesIO(b"contract"), 'text/plain')}
+    response = client.post('/classify-file?text_max_chars=8', files=files, headers={'Accept-Encoding': 'gzip'})
+
+    assert 'content-encoding' not in response.headers
+    assert response.json() == {"file_class": "contract", "confidence": 0.95, "file_text": "contract", "file_text_truncated": True, "file_text_length": 15000, "model_version": VERSION}
+
+def test_extraction_and_inference_off_the_event_loop(client, mocker, tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    mocker.patch.object(model_registry, 'active', ModelVersion('tiny', model, tokenizer, 'cpu'))
+    reset_extraction_process_pool()
+
+    try:
+        files = {'file': ('file.txt', BytesIO(b"invoice total amount due"), 'text/plain')}
+        response = client.post('/classify-file', files=files)
+    finally:
+        reset_extraction_process_pool()
+
+    assert response.status_code == 200
+    assert response.json()["file_text"] == "invoice total amount due"
+    assert response.json()["file_class"] in model.config.id2label.values()
+    assert response.json()["model_version"] == 'tiny'
+
+def test_submit_job_and_poll_status(client, mocker, tmp_path):
+    job_queue = JobQueue(db_path=str(tmp_path / "jobs.sqlite"))
+    mocker.patch("src.asgi_app.job_queue", job_queue)
+
+    files = {'file': ('a.txt', BytesIO(b"invoice text"), 'text/plain')}
+    response = client.post('/jobs', files=files)
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert job_queue.claim()["payload"] == b"invoice text"
+    assert client.get(f'/jobs/{job_id}').json()["status"] == "running"
+    assert client.get('/jobs/missing').status_code == 404
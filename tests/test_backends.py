@@ -0,0 +1,78 @@
+import pytest
+import torch
+
+from src.model.backends import EagerBackend, InferenceBackend, OnnxBackend, QuantizedBackend, build_backend
+from src.model.model_preloader import load_model_and_tokenizer
+from src.model.model_utils import classify_batch, prepare_texts
+
+TEXTS = ["invoice total amount due", "passport nationality date of birth and expiry"]
+
+@pytest.fixture
+def prepared_texts(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+    return prepare_texts(TEXTS, tokenizer, torch.device('cpu'))
+
+def test_eager_backend_matches_model(tiny_model_and_tokenizer, prepared_texts):
+    model, _ = tiny_model_and_tokenizer
+
+    with torch.no_grad():
+        expected = model(**prepared_texts).logits
+
+    assert torch.equal(EagerBackend(model)(**prepared_texts).logits, expected)
+
+def test_int8_backend_close_to_eager(tiny_model_and_tokenizer, prepared_texts):
+    model, _ = tiny_model_and_tokenizer
+
+    eager = EagerBackend(model)(**prepared_texts).logits
+    quantized = QuantizedBackend(model)(**prepared_texts).logits
+
+    assert quantized.shape == eager.shape
+    assert torch.equal(quantized.argmax(dim=-1), eager.argmax(dim=-1))
+    # int8 weights of the small random model drift more than those of the fine-tuned one, ~10% of the logits' norm
+    assert torch.linalg.norm(quantized - eager) / torch.linalg.norm(eager) < 0.15
+    assert any(p.dtype == torch.float32 for p in model.parameters()) # original model left untouched
+
+def test_onnx_backend_matches_eager(tiny_model_and_tokenizer, prepared_texts, tmp_path):
+    pytest.importorskip("onnxruntime")
+    model, _ = tiny_model_and_tokenizer
+    onnx_path = str(tmp_path / "model.onnx")
+
+    backend = OnnxBackend(model, onnx_path=onnx_path)
+    eager = EagerBackend(model)(**prepared_texts).logits
+
+    assert torch.allclose(backend(**prepared_texts).logits, eager, atol=1e-4)
+    assert OnnxBackend(model, onnx_path=onnx_path).onnx_path == onnx_path # reuses the exported graph
+
+def test_backend_must_implement_call(tiny_model_and_tokenizer):
+    class Incomplete(InferenceBackend):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete(tiny_model_and_tokenizer[0])
+
+def test_classify_batch_with_backend(tiny_model_and_tokenizer, prepared_texts):
+    model, _ = tiny_model_and_tokenizer
+
+    assert classify_batch(build_backend('eager', model), prepared_texts) == classify_batch(model, prepared_texts)
+
+def test_unknown_backend(tiny_model_and_tokenizer):
+    model, _ = tiny_model_and_tokenizer
+
+    with pytest.raises(ValueError, match="Unknown model backend"):
+        build_backend('tensorrt', model)
+
+def test_loader_rejects_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown model backend"):
+        load_model_and_tokenizer(backend='tensorrt')
+
+def test_loader_wraps_model_in_backend(tiny_model_and_tokenizer, mocker):
+    model, tokenizer = tiny_model_and_tokenizer
+    mocker.patch("src.model.model_preloader.DistilBertForSequenceClassification.from_pretrained", return_value=model)
+    mocker.patch("src.model.model_preloader.DistilBertTokenizerFast.from_pretrained", return_value=tokenizer)
+    mocker.patch("src.model.model_preloader.torch.cuda.is_available", return_value=False)
+
+    backend, loaded_tokenizer, device = load_model_and_tokenizer(backend='int8')
+
+    assert isinstance(backend, QuantizedBackend)
+    assert loaded_tokenizer is tokenizer
+    assert device == torch.device('cpu')
@@ -0,0 +1,102 @@
+import pytest
+import threading
+import torch
+
+from src.model import batching
+from src.model.batching import BatchScheduler, get_scheduler
+from src.model.model_utils import classify_text, prepare_text
+from src.utils.classifier import classify_file, classify_files
+
+TEXTS = [
+    "invoice total amount due",
+    "passport nationality date of birth",
+    "contract of employment between the party and the party",
+    "driving license number 123",
+]
+
+@pytest.fixture
+def scheduler(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    scheduler = BatchScheduler(model, tokenizer, torch.device('cpu'), max_batch_size=4, max_wait_ms=50)
+    yield scheduler
+    scheduler.close()
+
+def test_batched_results_match_single_inference(tiny_model_and_tokenizer, scheduler):
+    model, tokenizer = tiny_model_and_tokenizer
+
+    results = scheduler.classify_many(TEXTS)
+
+    for text, (label, confidence) in zip(TEXTS, results):
+        expected_label, expected_confidence = classify_text(model, prepare_text(text, tokenizer, torch.device('cpu')))
+        assert label == expected_label
+        assert confidence == pytest.approx(expected_confidence, abs=1e-5)
+
+def test_concurrent_callers_share_a_batch(scheduler, mocker):
+    spy = mocker.spy(batching, 'classify_texts')
+    results = {}
+    barrier = threading.Barrier(len(TEXTS))
+
+    def worker(i):
+        barrier.wait()
+        results[i] = scheduler.classify(TEXTS[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(TEXTS))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == len(TEXTS)
+    assert spy.call_count < len(TEXTS)
+
+def test_max_batch_size_respected(tiny_model_and_tokenizer, mocker):
+    model, tokenizer = tiny_model_and_tokenizer
+    spy = mocker.spy(batching, 'classify_texts')
+    scheduler = BatchScheduler(model, tokenizer, torch.device('cpu'), max_batch_size=3, max_wait_ms=50)
+
+    results = scheduler.classify_many(TEXTS * 2)
+    scheduler.close()
+
+    assert len(results) == 8
+    assert all(len(call.args[1]) <= 3 for call in spy.call_args_list)
+
+def test_batch_error_propagates_to_every_caller(scheduler, mocker):
+    mocker.patch.object(batching, 'classify_texts', side_effect=RuntimeError("boom"))
+
+    futures = [scheduler.submit(text) for text in TEXTS]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="boom"):
+            future.result()
+
+def test_invalid_batch_size(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    with pytest.raises(ValueError):
+        BatchScheduler(model, tokenizer, torch.device('cpu'), max_batch_size=0)
+
+def test_get_scheduler_is_shared_per_model(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    assert get_scheduler(model, tokenizer, torch.device('cpu')) is get_scheduler(model, tokenizer, torch.device('cpu'))
+
+def test_classify_file_goes_through_scheduler(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+
+    label, confidence = classify_file(TEXTS[0], model, tokenizer, torch.device('cpu'))
+
+    assert label in ('invoice', 'driving_license', 'contract', 'passport')
+    assert 0 <= confidence <= 1
+
+@pytest.mark.parametrize("text", [None, "", "   "])
+def test_classify_file_empty_text(tiny_model_and_tokenizer, text):
+    model, tokenizer = tiny_model_and_tokenizer
+    assert classify_file(text, model, tokenizer, torch.device('cpu')) == (None, None)
+
+def test_classify_files_single_batch(tiny_model_and_tokenizer, mocker):
+    model, tokenizer = tiny_model_and_tokenizer
+    spy = mocker.spy(batching, 'classify_texts')
+
+    results = classify_files([TEXTS[0], "", TEXTS[1], None], model, tokenizer, torch.device('cpu'))
+
+    assert results[1] == (None, None) and results[3] == (None, None)
+    assert results[0][0] is not None and results[2][0] is not None
+    assert spy.call_count == 1
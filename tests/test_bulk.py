@@ -0,0 +1,105 @@
+import json
+import pytest
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from src.utils.bulk import BulkClassifier, BulkOutput, iter_files
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "docs"
+    (root / "2023" / "march").mkdir(parents=True)
+    (root / "a_invoice.txt").write_text("Invoice number 42, total due")
+    (root / "2023" / "contract.txt").write_text("This agreement is made between the parties")
+    (root / "2023" / "march" / "empty.txt").write_text("")
+    (root / "2023" / "march" / "fake.pdf").write_text("not a pdf at all")
+    (root / "notes.md").write_text("not a supported type")
+    return root
+
+@pytest.fixture
+def bulk(mocker):
+    # mocks don't cross process boundaries, so the process pool is swapped for threads
+    pool = ThreadPoolExecutor(max_workers=2)
+    mocker.patch("src.utils.bulk.get_extraction_process_pool", return_value=pool)
+    classify = mocker.patch("src.utils.bulk.classify_file", side_effect=lambda text, *args, **kwargs: ("invoice" if "Invoice" in text else "contract", 0.9))
+    bulk = BulkClassifier(model=None, tokenizer=None, device=None, text_mode='full', workers=2, classify_threads=2)
+    yield bulk, classify
+    pool.shutdown()
+
+def read_output(path):
+    with open(path) as f:
+        return {record["path"]: record for record in map(json.loads, f)}
+
+def test_iter_files_walks_the_tree_in_order(tree):
+    assert list(iter_files(str(tree))) == ["a_invoice.txt", "notes.md", "2023/contract.txt", "2023/march/empty.txt", "2023/march/fake.pdf"]
+
+def test_every_supported_file_gets_a_result_line(tree, tmp_path, bulk):
+    bulk, _ = bulk
+    output = tmp_path / "results.jsonl"
+
+    summary = bulk.run(str(tree), str(output))
+
+    records = read_output(output)
+    assert set(records) == {"a_invoice.txt", "2023/contract.txt", "2023/march/empty.txt", "2023/march/fake.pdf"}
+    assert records["a_invoice.txt"] == {"path": "a_invoice.txt", "file_class": "invoice", "confidence": 0.9, "file_text": "Invoice number 42, total due"}
+    assert records["2023/contract.txt"]["file_class"] == "contract"
+    assert records["2023/march/empty.txt"]["error"] == "Empty file"
+    assert "doesn't match .pdf" in records["2023/march/fake.pdf"]["error"]
+    assert summary["files"] == 4 and summary["errors"] == 2 and summary["skipped"] == 0
+
+def test_run_resumes_after_a_crash(tree, tmp_path, bulk):
+    bulk, classify = bulk
+    output = tmp_path / "results.jsonl"
+    # written before the crash: one result, one error and a line cut off halfway
+    output.write_text(json.dumps({"path": "a_invoice.txt", "file_class": "invoice", "confidence": 0.9}) + "\n"
+                      + json.dumps({"path": "2023/march/empty.txt", "error": "Empty file"}) + "\n"
+                      + '{"path": "2023/contract.txt", "file_cl')
+
+    summary = bulk.run(str(tree), str(output))
+
+    assert summary["skipped"] == 2 and summary["files"] == 2
+    assert [call.args[0] for call in classify.call_args_list] == ["This agreement is made between the parties"]
+    assert set(read_output(output)) == {"a_invoice.txt", "2023/march/empty.txt", "2023/contract.txt", "2023/march/fake.pdf"}
+
+    # failed files are only tried again when asked to
+    assert BulkOutput(str(output)).load_done(retry_errors=True) == {"a_invoice.txt", "2023/contract.txt"}
+
+def test_stopped_run_finishes_files_in_flight(tree, tmp_path, bulk):
+    bulk, _ = bulk
+    output = tmp_path / "results.jsonl"
+    bulk.stop()
+
+    assert bulk.run(str(tree), str(output))["files"] == 0
+    assert not output.exists()
+
+class BrokenPool:
+    def submit(self, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        return future
+
+@pytest.mark.parametrize("broken_pools, interrupted", [(2, 0), (100, 2)])
+def test_files_of_a_dead_worker_are_not_recorded_as_errors(tree, tmp_path, mocker, broken_pools, interrupted):
+    pool = ThreadPoolExecutor(max_workers=2)
+    pools = [BrokenPool() for _ in range(broken_pools)]
+    mocker.patch("src.utils.bulk.get_extraction_process_pool", side_effect=lambda *args: pools.pop(0) if pools else pool)
+    reset = mocker.patch("src.utils.bulk.reset_extraction_process_pool")
+    mocker.patch("src.utils.bulk.classify_file", return_value=("invoice", 0.9))
+    output = tmp_path / "results.jsonl"
+
+    try:
+        summary = BulkClassifier(model=None, tokenizer=None, device=None, text_mode='full', workers=2, classify_threads=2).run(str(tree), str(output))
+    finally:
+        pool.shutdown()
+
+    records = read_output(output)
+    assert summary["interrupted"] == interrupted
+    assert not [record for record in records.values() if "worker" in record.get("error", "")]
+    assert all(not isinstance(call.args[0], ThreadPoolExecutor) for call in reset.call_args_list)
+
+    if interrupted:
+        # left for the next run, which gets them done
+        assert set(records) == {"2023/march/empty.txt", "2023/march/fake.pdf"}
+        assert BulkOutput(str(output)).load_done() == {"2023/march/empty.txt", "2023/march/fake.pdf"}
+    else:
+        assert records["a_invoice.txt"]["file_class"] == "invoice" and len(records) == 4
@@ -0,0 +1,83 @@
+import mmap
+import pymupdf
+import pytest
+import tempfile
+import zipfile
+
+from io import BytesIO
+from werkzeug.datastructures import FileStorage
+
+from src.utils.intake import get_upload_size, open_upload, sniff_file_type, sniff_upload
+from src.utils.text_extractor import extract_text
+
+def make_pdf(text: str) -> bytes:
+    pdf_doc = pymupdf.open()
+    pdf_doc.new_page().insert_text((72, 72), text)
+    pdf_bytes = pdf_doc.tobytes()
+    pdf_doc.close()
+    return pdf_bytes
+
+def make_zip(*names: str) -> bytes:
+    zip_bytes = BytesIO()
+    with zipfile.ZipFile(zip_bytes, 'w') as archive:
+        for name in names:
+            archive.writestr(name, "<xml/>")
+    return zip_bytes.getvalue()
+
+def spooled_to_disk(content: bytes, filename: str) -> FileStorage:
+    # what werkzeug and Starlette hand over for a large upload
+    stream = tempfile.TemporaryFile()
+    stream.write(content)
+    stream.seek(0)
+    return FileStorage(stream=stream, filename=filename)
+
+@pytest.mark.parametrize("head, expected", [
+    (b"%PDF-1.7\n%\xe2\xe3\xcf\xd3", "pdf"),
+    (b"\r\n%PDF-1.4", "pdf"), # junk before the header is allowed
+    (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", "png"),
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "jpg"),
+    (b"PK\x03\x04\x14\x00", "zip"),
+    (b"Contract of employment", "txt"),
+    ("Umowa zlecenie, łódź".encode()[:-1], "txt"), # cut in the middle of a character
+    (b"GIF89a\x01\x00\x01\x00\x00", None),
+    (b"\xff\xfe\xfa", None),
+])
+def test_sniff_file_type(head, expected):
+    assert sniff_file_type(head) == expected
+
+def test_sniff_upload_tells_docx_from_other_zips():
+    docx = FileStorage(BytesIO(make_zip("[Content_Types].xml", "word/document.xml")), "a.docx")
+    xlsx = FileStorage(BytesIO(make_zip("[Content_Types].xml", "xl/workbook.xml")), "b.docx")
+
+    assert sniff_upload(docx) == "docx"
+    assert sniff_upload(xlsx) == "zip"
+    assert docx.stream.tell() == 0
+
+def test_get_upload_size_keeps_the_position():
+    file = FileStorage(BytesIO(b"12345"), "a.txt")
+    file.stream.seek(2)
+
+    assert get_upload_size(file) == 5
+    assert file.stream.tell() == 2
+
+def test_small_uploads_are_read():
+    with open_upload(FileStorage(BytesIO(b"small"), "a.txt"), mmap_min_bytes=1024) as buffer:
+        assert buffer == b"small"
+
+def test_spooled_uploads_are_memory_mapped():
+    file = spooled_to_disk(b"x" * 4096, "a.txt")
+
+    with open_upload(file, mmap_min_bytes=1024) as buffer:
+        assert isinstance(buffer, mmap.mmap) and len(buffer) == 4096
+
+    assert buffer.closed
+
+@pytest.mark.parametrize("content, filename, expected", [
+    (b"invoice total amount due\n" * 100_000, "a.txt", "invoice total amount due"),
+    (make_pdf("Invoice 2024/01"), "a.pdf", "Invoice 2024/01"),
+])
+def test_extraction_from_memory_mapped_upload(content, filename, expected, mocker):
+    mocker.patch("src.utils.text_extractor.open_upload", side_effect=lambda file: open_upload(file, mmap_min_bytes=1))
+    text = extract_text(spooled_to_disk(content, filename))
+
+    assert text.startswith(expected)
@@ -0,0 +1,154 @@
+import pytest
+import time
+
+from src.utils.job_queue import DONE, EXPIRED, FAILED, QUEUED, RUNNING, JobQueue, QueueFullError
+from src.utils.job_worker import JobWorkerPool, process_job
+from src.utils.validators import ValidationError
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return JobQueue(db_path=str(tmp_path / "jobs.sqlite"), max_queued=3, max_attempts=2, retry_delay_seconds=0)
+
+def submit(job_queue, name="scan.pdf"):
+    return job_queue.submit(b"%PDF-1.7", name, "application/pdf", "full")
+
+def fail(job_queue, error, retry=True):
+    job = job_queue.claim()
+    return job_queue.fail(job["job_id"], job["lease_id"], error, retry=retry)
+
+def test_job_goes_from_queued_to_done(job_queue):
+    job_id = submit(job_queue)
+    assert job_queue.get(job_id)["status"] == QUEUED
+
+    job = job_queue.claim()
+    assert job["job_id"] == job_id and job["payload"] == b"%PDF-1.7" and job["attempts"] == 1
+    assert job_queue.get(job_id)["status"] == RUNNING
+    assert job_queue.claim() is None
+
+    assert job_queue.complete(job_id, job["lease_id"], {"file_class": "invoice", "confidence": 0.9})
+
+    status = job_queue.get(job_id)
+    assert status["status"] == DONE
+    assert status["result"] == {"file_class": "invoice", "confidence": 0.9}
+
+def test_jobs_are_claimed_in_submit_order(job_queue):
+    first, second = submit(job_queue, "a.pdf"), submit(job_queue, "b.pdf")
+
+    assert [job_queue.claim()["job_id"], job_queue.claim()["job_id"]] == [first, second]
+
+def test_failed_job_is_retried_until_attempts_run_out(job_queue):
+    job_id = submit(job_queue)
+
+    fail(job_queue, "OCR crashed")
+    assert job_queue.get(job_id)["status"] == QUEUED
+
+    fail(job_queue, "OCR crashed again")
+    status = job_queue.get(job_id)
+    assert status["status"] == FAILED and status["attempts"] == 2 and status["error"] == "OCR crashed again"
+    assert job_queue.claim() is None
+
+def test_permanent_failure_is_not_retried(job_queue):
+    job_id = submit(job_queue)
+
+    fail(job_queue, "Text extraction result is empty", retry=False)
+
+    assert job_queue.get(job_id)["status"] == FAILED
+
+def test_queue_depth_is_bounded(job_queue):
+    for _ in range(3):
+        submit(job_queue)
+
+    with pytest.raises(QueueFullError) as error:
+        submit(job_queue)
+    assert error.value.retry_after >= 1
+
+    job = job_queue.claim()
+    job_queue.complete(job["job_id"], job["lease_id"], {}) # a finished job frees its slot
+    submit(job_queue)
+    assert job_queue.stats()["depth"] == 3
+
+def test_expire_recovers_lost_and_stale_jobs(job_queue):
+    lost = submit(job_queue, "lost.pdf")
+    job_queue.claim() # its worker dies, the lease runs out
+    stale = submit(job_queue, "stale.pdf")
+    finished = submit(job_queue, "finished.pdf")
+
+    now = time.time()
+    job_queue._execute("UPDATE jobs SET lease_until = ? WHERE job_id = ?", (now - 1, lost))
+    job_queue._execute("UPDATE jobs SET expires_at = ? WHERE job_id = ?", (now - 1, stale))
+    job_queue._execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (DONE, now - job_queue.result_ttl_seconds - 1, finished))
+
+    assert job_queue.expire(now) == {"requeued": 1, "expired": 1, "deleted": 1}
+    assert job_queue.get(lost)["status"] == QUEUED
+    assert job_queue.get(stale)["status"] == EXPIRED
+    assert job_queue.get(finished) is None
+
+def test_job_of_a_lost_lease_is_left_to_its_new_worker(job_queue):
+    job_id = submit(job_queue)
+    stalled = job_queue.claim()
+    job_queue._execute("UPDATE jobs SET lease_until = ? WHERE job_id = ?", (time.time() - 1, job_id))
+    job_queue.expire()
+
+    current = job_queue.claim()
+    assert current["job_id"] == job_id and current["lease_id"] != stalled["lease_id"]
+
+    # the stalled worker comes back - it can't renew, fail or complete the job anymore
+    assert not job_queue.renew(job_id, stalled["lease_id"])
+    assert not job_queue.fail(job_id, stalled["lease_id"], "OCR crashed")
+    assert not job_queue.complete(job_id, stalled["lease_id"], {"file_class": "passport", "confidence": 0.5})
+    assert job_queue.get(job_id)["status"] == RUNNING
+
+    assert job_queue.renew(job_id, current["lease_id"])
+    assert job_queue.complete(job_id, current["lease_id"], {"file_class": "invoice", "confidence": 0.9})
+    assert job_queue.get(job_id)["result"] == {"file_class": "invoice", "confidence": 0.9}
+
+def test_worker_renews_the_lease_of_a_long_job(tmp_path):
+    job_queue = JobQueue(db_path=str(tmp_path / "jobs.sqlite"), lease_seconds=0.3)
+    job_id = submit(job_queue)
+    expired = []
+
+    def process(job):
+        # well past the lease, the housekeeping of another worker keeps looking for lost jobs
+        for _ in range(8):
+            time.sleep(0.1)
+            expired.append(job_queue.expire()["requeued"])
+        return {"file_class": "invoice", "confidence": 0.9}
+
+    pool = JobWorkerPool(job_queue, process, renew_seconds=0.05)
+
+    assert pool.run_once()
+    assert sum(expired) == 0
+    assert job_queue.get(job_id)["status"] == DONE and job_queue.get(job_id)["attempts"] == 1
+
+def test_worker_pool_processes_and_fails_jobs(job_queue):
+    good, empty, flaky = submit(job_queue, "good.pdf"), submit(job_queue, "empty.pdf"), submit(job_queue, "flaky.pdf")
+    calls = []
+
+    def process(job):
+        calls.append(job["filename"])
+
+        if job["filename"] == "empty.pdf":
+            raise ValidationError("Text extraction result is empty")
+        if job["filename"] == "flaky.pdf" and calls.count("flaky.pdf") == 1:
+            raise RuntimeError("OCR pool broke")
+
+        return {"file_class": "invoice", "confidence": 0.9}
+
+    pool = JobWorkerPool(job_queue, process, workers=2, poll_seconds=0.01)
+    pool.start()
+
+    deadline = time.time() + 5
+    while job_queue.stats()["depth"] and time.time() < deadline:
+        time.sleep(0.01)
+    pool.stop()
+
+    assert job_queue.get(good)["result"] == {"file_class": "invoice", "confidence": 0.9}
+    assert job_queue.get(empty)["status"] == FAILED and calls.count("empty.pdf") == 1
+    assert job_queue.get(flaky)["status"] == DONE and job_queue.get(flaky)["attempts"] == 2
+
+def test_process_job_matches_classify_file_response(mocker):
+    mocker.patch("src.utils.job_worker.extract_text", return_value="invoice total")
+    mocker.patch("src.utils.job_worker.classify_file", return_value=("invoice", 0.9))
+    job = {"payload": b"invoice total", "filename": "a.txt", "mimetype": "text/plain", "text_mode": "none"}
+
+    assert process_job(job, model=None, tokenizer=None, device=None) == {"file_class": "invoice", "confidence": 0.9}
@@ -0,0 +1,143 @@
+import math
+import numpy as np
+import pytest
+import threading
+import time
+
+from src.model.lexical import LexicalClassifier, calibrate_threshold, cross_validate, fit_lexical_classifier, hash_features
+from concurrent.futures import ThreadPoolExecutor
+from src.model.batching import BatchScheduler
+from src.utils import classifier
+from src.utils.classifier import cascade_stats, classify_file, classify_files
+
+TRAINING = [
+    ("INVOICE no 123 total amount due vat", "invoice"),
+    ("invoice date total due tax amount", "invoice"),
+    ("tax invoice amount due by date", "invoice"),
+    ("PASSPORT nationality date of birth expiry", "passport"),
+    ("passport number nationality issue date", "passport"),
+    ("passport surname given names nationality", "passport"),
+    ("CONTRACT OF EMPLOYMENT between the party and the employee", "contract"),
+    ("employment contract agreement between the parties", "contract"),
+    ("this agreement is a contract of employment", "contract"),
+    ("DRIVING LICENCE number issue expiry category", "driving_license"),
+    ("driving license licence number date of birth", "driving_license"),
+    ("driver licence categories issue expiry", "driving_license"),
+]
+
+@pytest.fixture(scope='module')
+def lexical_model():
+    model = fit_lexical_classifier([text for text, _ in TRAINING], [label for _, label in TRAINING], n_features=2 ** 12)
+    model.threshold = 0.6
+    return model
+
+@pytest.fixture(autouse=True)
+def empty_cascade_stats():
+    cascade_stats.reset()
+
+def test_hash_features_are_stable_and_normalised():
+    indices, values = hash_features("Invoice total, invoice DUE", n_features=1024)
+
+    assert indices.tolist() == hash_features("invoice total invoice due", n_features=1024)[0].tolist()
+    assert np.linalg.norm(values) == pytest.approx(1.0)
+    assert hash_features("", n_features=1024)[0].size == 0
+
+def test_fit_predict_save_load(lexical_model, tmp_path):
+    assert lexical_model.predict("invoice total amount due")[0] == "invoice"
+    assert lexical_model.predict("passport nationality")[0] == "passport"
+
+    lexical_model.save(str(tmp_path / "lexical.npz"))
+    loaded = LexicalClassifier.load(str(tmp_path / "lexical.npz"))
+
+    assert loaded.labels == lexical_model.labels and loaded.threshold == 0.6
+    assert loaded.predict("employment contract") == pytest.approx(lexical_model.predict("employment contract"))
+
+def test_calibrate_threshold():
+    confidences = [0.99, 0.95, 0.9, 0.8, 0.6]
+    agreements = [True, True, True, False, True]
+
+    assert calibrate_threshold(confidences, agreements, target_agreement=1.0) == 0.9
+    assert calibrate_threshold(confidences, agreements, target_agreement=0.8) == 0.6
+    assert calibrate_threshold([0.9, 0.9], [True, False], target_agreement=1.0) == math.inf # ties can't be split
+
+def test_cross_validate_predicts_every_text_out_of_fold():
+    labels, confidences = cross_validate([text for text, _ in TRAINING], [label for _, label in TRAINING], folds=3, n_features=2 ** 12)
+
+    assert len(labels) == len(confidences) == len(TRAINING)
+    assert sum(label == expected for label, (_, expected) in zip(labels, TRAINING)) >= len(TRAINING) // 2
+
+def test_confident_texts_skip_the_transformer(lexical_model, mocker):
+    mocker.patch("src.utils.classifier.get_lexical_classifier", return_value=lexical_model)
+    mocker.patch("src.utils.classifier.random.random", return_value=1.0) # no audits
+    scheduler = mocker.patch("src.utils.classifier.get_scheduler").return_value
+    scheduler.classify.return_value = ("contract", 0.9)
+
+    label, confidence = classify_file("invoice total amount due vat tax", None, None, None)
+    assert label == "invoice" and confidence >= 0.6
+    scheduler.classify.assert_not_called()
+
+    lexical_model.threshold = 1.01
+    try:
+        assert classify_file("invoice total amount due vat tax", None, None, None) == ("contract", 0.9)
+    finally:
+        lexical_model.threshold = 0.6
+
+    stats = cascade_stats.stats()
+    assert stats["early_exits"] == 1 and stats["deferred"] == 1
+    assert stats["early_exit_rate"] == 0.5 and stats["agreement_on_deferred"] == 0.0
+
+def test_classify_files_defers_only_unsure_texts(lexical_model, mocker):
+    mocker.patch("src.utils.classifier.get_lexical_classifier", return_value=lexical_model)
+    mocker.patch("src.utils.classifier.random.random", return_value=1.0)
+    scheduler = mocker.patch("src.utils.classifier.get_scheduler").return_value
+    scheduler.classify_many.side_effect = lambda texts: [("contract", 0.8)] * len(texts)
+
+    results = classify_files(["invoice total amount due vat tax", "zzz qqq", ""], None, None, None)
+
+    assert results[0][0] == "invoice"
+    assert results[1] == ("contract", 0.8)
+    assert results[2] == (None, None)
+    scheduler.classify_many.assert_called_once_with(["zzz qqq"])
+
+def test_cpu_saved_is_estimated_from_the_scheduler(mocker):
+    scheduler = mocker.Mock(cpu_seconds=1.0, texts_classified=10)
+
+    cascade_stats.record_lexical(0.001, early_exit=True)
+    cascade_stats.record_lexical(0.001, early_exit=True)
+
+    assert cascade_stats.stats(scheduler)["cpu_seconds_saved"] == pytest.approx(2 * 0.1 - 0.002)
+
+def test_cpu_times_under_concurrency_are_of_the_measured_work_only(lexical_model, mocker):
+    # both stages wait instead of computing, while another thread burns CPU - none of it is theirs
+    mocker.patch.object(lexical_model, 'predict', side_effect=lambda text: time.sleep(0.01) or ("invoice", 0.5))
+    mocker.patch("src.utils.classifier.get_lexical_classifier", return_value=lexical_model)
+    mocker.patch("src.model.batching.classify_texts", side_effect=lambda model, texts, *args: time.sleep(0.01) or [("contract", 0.9)] * len(texts))
+    scheduler = BatchScheduler(mocker.Mock(), None, None, max_wait_ms=1)
+    mocker.patch("src.utils.classifier.get_scheduler", return_value=scheduler)
+    busy = threading.Event()
+
+    def burn():
+        while not busy.is_set():
+            sum(range(1000))
+
+    burner = threading.Thread(target=burn)
+    burner.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as requests:
+            results = list(requests.map(lambda i: classify_file(f"request {i}", None, None, None), range(32)))
+    finally:
+        busy.set()
+        burner.join()
+        scheduler.close()
+
+    assert results == [("contract", 0.9)] * 32
+    stats = cascade_stats.stats(scheduler)
+    assert stats["lexical_texts"] == 32 and scheduler.texts_classified == 32
+    assert stats["lexical_cpu_seconds"] < 0.1 and scheduler.cpu_seconds < 0.1
+    assert stats["transformer_cpu_ms_per_text"] < 5
+
+def test_cascade_is_off_without_a_model(mocker):
+    mocker.patch("src.utils.classifier.get_lexical_classifier", return_value=None)
+
+    assert classifier.cascade_report(None, None, None) == {"enabled": False}
@@ -0,0 +1,101 @@
+import os
+import pymupdf
+import pytest
+import subprocess
+import sys
+
+from io import BytesIO
+from prometheus_client import REGISTRY
+from werkzeug.datastructures import FileStorage
+
+from src.app import app
+from src.utils.metrics import file_type_context, time_stage
+from src.utils.text_extractor import extract_text, extract_text_from_pdf
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def make_pdf(page_texts):
+    doc = pymupdf.open()
+    for text in page_texts:
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+def test_time_stage_labels_with_file_type():
+    before = sample('classifier_stage_seconds_count', stage='test_stage', file_type='pdf')
+
+    with file_type_context('pdf'), time_stage('test_stage'):
+        pass
+
+    assert sample('classifier_stage_seconds_count', stage='test_stage', file_type='pdf') == before + 1
+
+def test_time_stage_records_failures():
+    before = sample('classifier_stage_seconds_count', stage='test_failing_stage', file_type='')
+
+    with pytest.raises(ValueError):
+        with time_stage('test_failing_stage'):
+            raise ValueError("boom")
+
+    assert sample('classifier_stage_seconds_count', stage='test_failing_stage', file_type='') == before + 1
+
+def test_extract_text_times_extraction_per_file_type():
+    before = sample('classifier_stage_seconds_count', stage='extract', file_type='txt')
+
+    extract_text(FileStorage(stream=BytesIO(b"foo"), filename="a.txt"))
+
+    assert sample('classifier_stage_seconds_count', stage='extract', file_type='txt') == before + 1
+
+def test_pdf_pages_and_ocr_fallbacks_are_counted(mocker):
+    mocker.patch("src.utils.text_extractor.ocr_pdf_page", return_value="scanned")
+    text_pages = sample('classifier_pdf_pages_total', method='text')
+    ocr_pages = sample('classifier_pdf_pages_total', method='ocr')
+    fallbacks = sample('classifier_ocr_fallbacks_total', file_type='pdf')
+
+    extract_text_from_pdf(make_pdf(["page zero", None, "page two"]), parallel_ocr=False)
+
+    assert sample('classifier_pdf_pages_total', method='text') == text_pages + 2
+    assert sample('classifier_pdf_pages_total', method='ocr') == ocr_pages + 1
+    assert sample('classifier_ocr_fallbacks_total', file_type='pdf') == fallbacks + 1
+
+def test_metrics_route_counts_requests(client, mocker):
+    mocker.patch('src.app.validate_model_state', return_value=None)
+    before = sample('classifier_requests_total', endpoint='classify-file', status='400')
+
+    client.post('/classify-file')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'classifier_requests_in_flight' in body
+    assert 'classifier_request_seconds_bucket{endpoint="classify-file"' in body
+    assert sample('classifier_requests_total', endpoint='classify-file', status='400') == before + 1
+
+def test_metrics_of_processes_are_summed_up(tmp_path):
+    # every process records into its own files in METRICS_DIR, a fresh interpreter is needed to pick that up
+    script = (
+        "import multiprocessing\n"
+        "from src.utils.metrics import PAGES, render_metrics\n"
+        "def count(): PAGES.labels(method='ocr').inc(2)\n"
+        "if __name__ == '__main__':\n"
+        "    p = multiprocessing.get_context('spawn').Process(target=count); p.start(); p.join()\n"
+        "    PAGES.labels(method='ocr').inc()\n"
+        "    print(render_metrics()[0].decode())\n"
+    )
+    script_path = tmp_path / "record.py"
+    script_path.write_text(script)
+    env = {**os.environ, 'METRICS_DIR': str(tmp_path / "metrics"), 'PYTHONPATH': os.getcwd()}
+
+    output = subprocess.run([sys.executable, str(script_path)], env=env, capture_output=True, text=True, check=True).stdout
+
+    assert 'classifier_pdf_pages_total{method="ocr"} 3.0' in output
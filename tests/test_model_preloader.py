@@ -0,0 +1,65 @@
+import pytest
+import torch
+
+from safetensors.torch import load_file, save_file
+from src.model.backends import EagerBackend
+from src.model.model_preloader import load_model_and_tokenizer, load_model_from_snapshot, mmap_safetensors
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from transformers import DistilBertForSequenceClassification
+
+@pytest.fixture(scope='module')
+def snapshot_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("snapshot")
+    build_tiny_model_and_tokenizer(save_dir=str(path))
+    return str(path)
+
+def test_mmap_safetensors_matches_load_file(tmp_path):
+    path = str(tmp_path / "tensors.safetensors")
+    tensors = {
+        "float": torch.randn(3, 4),
+        "half": torch.randn(5).half(),
+        "long": torch.arange(6).reshape(2, 3),
+        "empty": torch.empty(0, 2),
+    }
+    save_file(tensors, path)
+
+    mapped = mmap_safetensors(path)
+    expected = load_file(path)
+
+    assert mapped.keys() == expected.keys()
+    for name in expected:
+        assert mapped[name].dtype == expected[name].dtype
+        assert torch.equal(mapped[name], expected[name])
+
+def test_snapshot_loads_same_model_as_from_pretrained(snapshot_dir):
+    mapped = load_model_from_snapshot(snapshot_dir)
+    regular = DistilBertForSequenceClassification.from_pretrained(snapshot_dir).eval()
+    input_ids = torch.randint(5, 50, (2, 16))
+
+    with torch.no_grad():
+        expected = regular(input_ids=input_ids, attention_mask=torch.ones_like(input_ids)).logits
+        logits = mapped(input_ids=input_ids, attention_mask=torch.ones_like(input_ids)).logits
+
+    assert torch.equal(logits, expected)
+    assert not any(p.is_meta for p in mapped.parameters())
+
+def test_snapshot_falls_back_when_checkpoint_does_not_match(snapshot_dir, mocker):
+    mocker.patch("src.model.model_preloader.mmap_safetensors", return_value={"unexpected.weight": torch.zeros(1)})
+    from_pretrained = mocker.patch("src.model.model_preloader.DistilBertForSequenceClassification.from_pretrained")
+
+    load_model_from_snapshot(snapshot_dir)
+
+    from_pretrained.assert_called_once_with(snapshot_dir, local_files_only=True)
+
+def test_load_model_and_tokenizer_from_snapshot_offline(snapshot_dir, mocker):
+    mocker.patch("src.model.model_preloader.torch.cuda.is_available", return_value=False)
+
+    backend, tokenizer, device = load_model_and_tokenizer(model_name="not-a-hub-name", model_path=snapshot_dir)
+
+    assert isinstance(backend, EagerBackend)
+    assert tokenizer("invoice")["input_ids"]
+    assert device == torch.device('cpu')
+
+def test_load_model_and_tokenizer_validates_name_without_snapshot():
+    with pytest.raises(ValueError, match="model_name incorrect"):
+        load_model_and_tokenizer(model_name="short", model_path=None)
@@ -0,0 +1,118 @@
+import pytest
+import torch
+
+from src.model.model_utils import classify_batch, classify_texts, encode_windows, get_encoder, prepare_text, prepare_texts, prepare_texts_bucketed
+from src.settings.config import ID_TO_LABEL
+
+CPU = torch.device('cpu')
+SHORT = "invoice total"
+LONG = "contract of employment between the party and the party " * 20
+
+def test_prepare_text_matches_tokenizer(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+
+    prepared = prepare_text(LONG, tokenizer, CPU)
+    expected = tokenizer(LONG, truncation=True, padding=True, return_tensors='pt')
+
+    assert torch.equal(prepared['input_ids'], expected['input_ids'])
+    assert torch.equal(prepared['attention_mask'], expected['attention_mask'])
+
+def test_prepare_text_truncates_to_model_input(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+
+    prepared = prepare_text(LONG * 10, tokenizer, CPU)
+
+    assert prepared['input_ids'].shape == (1, 512)
+    assert prepared['input_ids'][0, -1].item() == tokenizer.sep_token_id
+
+def test_prepare_texts_pads_to_longest(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+
+    prepared = prepare_texts([SHORT, LONG], tokenizer, CPU)
+    short_length = len(tokenizer(SHORT)['input_ids'])
+
+    assert prepared['input_ids'].shape[0] == 2
+    assert prepared['attention_mask'][0].sum().item() == short_length
+    assert (prepared['input_ids'][0, short_length:] == tokenizer.pad_token_id).all()
+
+def test_bucketed_batches_pad_to_own_longest(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+    texts = [LONG, SHORT, SHORT + " due", LONG + " party"]
+
+    buckets = prepare_texts_bucketed(texts, tokenizer, CPU, buckets=(16, 512))
+
+    assert sorted(i for indices, _ in buckets for i in indices) == [0, 1, 2, 3]
+    short_indices, short_batch = buckets[0]
+    assert short_indices == [1, 2]
+    assert short_batch['input_ids'].shape[1] == len(tokenizer(SHORT + " due")['input_ids'])
+
+def test_classify_texts_matches_single_batch(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    texts = [LONG, SHORT, "passport nationality", LONG + " party"]
+
+    bucketed = classify_texts(model, texts, tokenizer, CPU)
+    single_batch = classify_batch(model, prepare_texts(texts, tokenizer, CPU))
+
+    for (label, confidence), (expected_label, expected_confidence) in zip(bucketed, single_batch):
+        assert label == expected_label
+        assert confidence == pytest.approx(expected_confidence, abs=1e-5)
+
+def test_encoder_is_cached_and_tokenizer_untouched(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+    truncation_before = tokenizer.backend_tokenizer.truncation
+
+    encoder = get_encoder(tokenizer)
+
+    assert get_encoder(tokenizer) is encoder
+    assert encoder is not tokenizer.backend_tokenizer
+    assert tokenizer.backend_tokenizer.truncation == truncation_before
+
+def test_encode_windows_overlap_and_budget(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+
+    short_windows, long_windows = encode_windows([SHORT, LONG * 10], tokenizer, max_windows=3, stride=16)
+
+    assert len(short_windows) == 1
+    assert len(long_windows) == 3
+    for window in long_windows:
+        assert len(window.ids) == 512
+        assert window.ids[0] == tokenizer.cls_token_id and window.ids[-1] == tokenizer.sep_token_id
+
+    # every window starts with the last 16 text tokens of the one before it
+    assert long_windows[1].ids[1:17] == long_windows[0].ids[-17:-1]
+
+def test_classify_texts_averages_window_logits(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    texts = [SHORT, LONG * 10]
+
+    results = classify_texts(model, texts, tokenizer, CPU, max_windows=4, stride=16)
+
+    with torch.no_grad():
+        long_windows = encode_windows([LONG * 10], tokenizer, max_windows=4, stride=16)[0]
+        input_ids = torch.tensor([window.ids for window in long_windows])
+        mean_logits = model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids)).logits.mean(dim=0)
+    probabilities = torch.softmax(mean_logits, dim=0)
+
+    assert results[0] == pytest.approx(classify_texts(model, [SHORT], tokenizer, CPU)[0], abs=1e-5)
+    assert results[1][1] == pytest.approx(probabilities.max().item(), abs=1e-5)
+    assert results[1][0] == ID_TO_LABEL[probabilities.argmax().item()]
+
+def test_classify_texts_runs_all_windows_in_one_pass_per_bucket(tiny_model_and_tokenizer, mocker):
+    model, tokenizer = tiny_model_and_tokenizer
+    forward = mocker.spy(model, 'forward')
+
+    classify_texts(model, [LONG * 10, LONG * 10, SHORT], tokenizer, CPU, max_windows=4, stride=16)
+
+    assert forward.call_count == 2 # the 8 full windows and the short text
+    assert sorted(call.kwargs['input_ids'].shape[0] for call in forward.call_args_list) == [1, 8]
+
+def test_windows_dont_change_texts_within_one_window(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    texts = [LONG, SHORT, "passport nationality"]
+
+    windowed = classify_texts(model, texts, tokenizer, CPU, max_windows=4)
+    truncated = classify_texts(model, texts, tokenizer, CPU, max_windows=1)
+
+    for (label, confidence), (expected_label, expected_confidence) in zip(windowed, truncated):
+        assert label == expected_label
+        assert confidence == pytest.approx(expected_confidence, abs=1e-5)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+import random
+
+from src.utils import near_duplicates
+from src.utils.classifier import classify_file, classify_files
+from src.utils.near_duplicates import MinHasher, NearDuplicateIndex, close_near_duplicate_index, get_near_duplicate_index, normalise_text
+
+INVOICE = ("Invoice number INV-2024-0193. Bill to: Northwind Traders Ltd, 14 Harbour Road, Leeds. "
+           "Description: consulting services, March 2024. Subtotal 1,250.00 GBP, VAT 20% 250.00 GBP, "
+           "total amount due 1,500.00 GBP within 30 days of the invoice date. Bank transfer to sort code 12-34-56.")
+CONTRACT = ("This contract of employment is made between Contoso Holdings plc (the employer) and Jane Smith "
+            "(the employee). The employee will work 37.5 hours a week as a senior analyst, starting on 1 April. "
+            "Either party may end this agreement with four weeks notice in writing.")
+
+@pytest.fixture(autouse=True)
+def no_indexes(mocker):
+    mocker.patch.object(near_duplicates, 'NEAR_DUPLICATE_ENABLED', True)
+    mocker.patch.object(near_duplicates, '_near_duplicate_indexes', {})
+
+def ocr_noise(text: str, rate: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    swaps = {'o': '0', 'l': '1', 'e': 'c', 'i': 'l', 'a': 'o'}
+
+    return ''.join(swaps.get(char, char) if rng.random() < rate else char for char in text)
+
+def test_normalise_text():
+    assert normalise_text("  INVOICE-no:\n 12/34  ") == "invoice no 12 34"
+    assert normalise_text("x" * 10_000, max_chars=100) == "x" * 100
+
+def test_signature_is_stable_and_skips_short_texts():
+    hasher = MinHasher()
+
+    assert np.array_equal(hasher.signature(INVOICE), MinHasher().signature(INVOICE.upper()))
+    assert hasher.signature("invoice 12") is None
+
+def test_noisy_copy_hits_and_other_document_misses():
+    index = NearDuplicateIndex(max_entries=100)
+    hasher = index.hasher
+
+    assert index.add(hasher.signature(INVOICE), "invoice", 0.97)
+
+    assert index.lookup(hasher.signature(ocr_noise(INVOICE, rate=0.02))) == ("invoice", pytest.approx(0.97))
+    assert index.lookup(hasher.signature(CONTRACT)) is None
+
+    stats = index.stats()
+    assert stats["lookups"] == 2 and stats["hits"] == 1 and stats["stores"] == 1 and stats["entries"] == 1
+
+def test_unsure_results_are_not_stored():
+    index = NearDuplicateIndex(max_entries=100, min_confidence=0.8)
+
+    assert not index.add(index.hasher.signature(INVOICE), "invoice", 0.6)
+    assert index.lookup(index.hasher.signature(INVOICE)) is None
+
+def test_entries_are_bounded_and_reused_ones_survive_eviction():
+    index = NearDuplicateIndex(max_entries=8)
+    rng = random.Random(0)
+    texts = [' '.join(rng.choice(INVOICE.split() + CONTRACT.split()) for _ in range(30)) for _ in range(15)]
+
+    for i, text in enumerate(texts[:8]):
+        index.add(index.hasher.signature(text), f"doc{i}", 0.9)
+
+    assert index.lookup(index.hasher.signature(texts[0]))[0] == "doc0"
+
+    for i, text in enumerate(texts[8:], start=8):
+        index.add(index.hasher.signature(text), f"doc{i}", 0.9)
+
+    # doc0 was reused, it got a second chance and the next oldest went instead
+    stats = index.stats()
+    assert stats["entries"] == 8 and stats["evictions"] == 7
+    assert index.lookup(index.hasher.signature(texts[0]))[0] == "doc0"
+    assert index.lookup(index.hasher.signature(texts[1])) is None
+    assert index.lookup(index.hasher.signature(texts[14]))[0] == "doc14"
+
+def test_save_and_load(tmp_path):
+    index = NearDuplicateIndex(max_entries=100)
+    index.add(index.hasher.signature(INVOICE), "invoice", 0.97)
+    index.save(str(tmp_path / "index.npz"))
+
+    loaded = NearDuplicateIndex(max_entries=100)
+    assert loaded.load(str(tmp_path / "index.npz"))
+    assert loaded.lookup(loaded.hasher.signature(INVOICE)) == ("invoice", pytest.approx(0.97))
+
+    # other settings, other signatures - nothing is loaded
+    assert not NearDuplicateIndex(max_entries=50).load(str(tmp_path / "index.npz"))
+
+def test_index_is_saved_and_loaded_per_model_version(tmp_path, mocker):
+    mocker.patch.object(near_duplicates, 'NEAR_DUPLICATE_INDEX_DIR', str(tmp_path))
+    model = mocker.Mock()
+
+    index = get_near_duplicate_index(model, 'distilbert@a1b2c3')
+    index.add(index.hasher.signature(INVOICE), "invoice", 0.97)
+    close_near_duplicate_index(model)
+
+    assert get_near_duplicate_index(model, 'distilbert@a1b2c3') is not index
+    assert get_near_duplicate_index(model).lookup(index.hasher.signature(INVOICE))[0] == "invoice"
+    close_near_duplicate_index(model)
+
+    # another model at the same path - its version differs, the labels of the old one aren't reused
+    assert get_near_duplicate_index(model, 'distilbert@d4e5f6').lookup(index.hasher.signature(INVOICE)) is None
+    close_near_duplicate_index(model)
+
+    # a file renamed or copied over from another version is rejected too
+    other = NearDuplicateIndex(model_version='distilbert@d4e5f6')
+    assert not other.load(near_duplicates.index_path('distilbert@a1b2c3'))
+
+def test_disabled(mocker):
+    mocker.patch.object(near_duplicates, 'NEAR_DUPLICATE_ENABLED', False)
+    scheduler = mocker.patch("src.utils.classifier.get_scheduler").return_value
+    scheduler.classify.return_value = ("invoice", 0.97)
+
+    assert get_near_duplicate_index(scheduler.model) is None
+    assert classify_file(INVOICE, None, None, None) == ("invoice", 0.97)
+
+def test_disabled_when_long_documents_are_read_in_windows(mocker):
+    mocker.patch.object(near_duplicates, 'LONG_DOCUMENT_MAX_WINDOWS', 4)
+    mocker.patch("src.utils.classifier.get_lexical_classifier", return_value=None)
+    scheduler = mocker.patch("src.utils.classifier.get_scheduler").return_value
+    scheduler.classify.side_effect = [("invoice", 0.97), ("contract", 0.95)]
+    # the same first pages, the rest of the document differs
+    longer = INVOICE * 12 + CONTRACT * 12
+
+    assert get_near_duplicate_index(scheduler.model) is None
+    assert classify_file(INVOICE * 12, None, None, None) == ("invoice", 0.97)
+    assert classify_file(longer, None, None, None) == ("contract", 0.95)
+    assert scheduler.classify.call_count == 2
+
+def test_near_duplicates_skip_the_transformer(mocker):
+    mocker.patch("src.utils.classifier.get_lexical_classifier", return_value=None)
+    scheduler = mocker.patch("src.utils.classifier.get_scheduler").return_value
+    scheduler.classify.return_value = ("invoice", 0.97)
+    scheduler.classify_many.side_effect = lambda texts: [("contract", 0.95)] * len(texts)
+
+    assert classify_file(INVOICE, None, None, None) == ("invoice", 0.97)
+    assert classify_file(ocr_noise(INVOICE, rate=0.01, seed=1), None, None, None) == ("invoice", pytest.approx(0.97))
+    scheduler.classify.assert_called_once()
+
+    results = classify_files([ocr_noise(INVOICE, rate=0.02, seed=2), CONTRACT], None, None, None)
+
+    assert results == [("invoice", pytest.approx(0.97)), ("contract", 0.95)]
+    scheduler.classify_many.assert_called_once_with([CONTRACT])
+    assert get_near_duplicate_index(scheduler.model).stats()["hits"] == 2
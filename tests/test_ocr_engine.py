@@ -0,0 +1,106 @@
+import pytest
+import threading
+import time
+
+from PIL import Image
+from types import SimpleNamespace
+
+from src.utils import ocr_engine
+from src.utils.ocr_engine import OcrEngine, OcrError, PytesseractEngine, TesserocrEngine, build_ocr_engine, get_ocr_engine
+
+class FakeHandle:
+    created = []
+
+    def __init__(self, lang='eng', path=None):
+        if path == 'missing':
+            raise RuntimeError("Failed to init API, possibly an invalid tessdata path")
+
+        self.busy = False
+        self.image = None
+        FakeHandle.created.append(self)
+
+    def SetImage(self, image):
+        assert not self.busy, "handle used by two threads at once"
+        self.busy = True
+        self.image = image
+
+    def GetUTF8Text(self):
+        if self.image.size[0] == 0:
+            raise RuntimeError("Failed to recognize. No image set?")
+
+        time.sleep(0.01)
+        return f"text of {self.image.size[0]}px"
+
+    def Clear(self):
+        self.busy = False
+
+    def End(self):
+        pass
+
+@pytest.fixture
+def fake_tesserocr(mocker):
+    FakeHandle.created = []
+    mocker.patch.dict('sys.modules', {'tesserocr': SimpleNamespace(PyTessBaseAPI=FakeHandle)})
+
+def test_tesserocr_engine_reads_pil_images(fake_tesserocr):
+    engine = TesserocrEngine(pool_size=2)
+
+    assert engine.image_to_string(Image.new('L', (40, 10))) == "text of 40px"
+    assert engine.image_to_string(Image.new('L', (50, 10))) == "text of 50px"
+    assert len(FakeHandle.created) == 1 # the handle is reused
+
+def test_tesserocr_engine_never_shares_a_handle_between_threads(fake_tesserocr):
+    engine = TesserocrEngine(pool_size=3)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(engine.image_to_string(Image.new('L', (10, 10))))) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 12
+    assert 1 <= len(FakeHandle.created) <= 3
+
+def test_engine_errors_are_raised_as_ocr_errors(fake_tesserocr, mocker):
+    engine = TesserocrEngine(pool_size=1)
+
+    with pytest.raises(OcrError, match="tesserocr: RuntimeError"):
+        engine.image_to_string(Image.new('L', (0, 0)))
+
+    # the handle went back to the pool
+    assert engine.image_to_string(Image.new('L', (40, 10))) == "text of 40px"
+
+    mocker.patch('src.utils.ocr_engine.pytesseract.image_to_string', side_effect=ocr_engine.pytesseract.TesseractError(1, "Image too small"))
+    with pytest.raises(OcrError, match="pytesseract: TesseractError"):
+        PytesseractEngine().image_to_string(Image.new('L', (40, 10)))
+
+def test_engine_must_implement_read():
+    class Incomplete(OcrEngine):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_build_ocr_engine_falls_back_to_pytesseract(fake_tesserocr):
+    assert isinstance(build_ocr_engine('tesserocr', tessdata_path='missing'), PytesseractEngine)
+
+def test_build_ocr_engine_falls_back_without_tesserocr(mocker):
+    mocker.patch.dict('sys.modules', {'tesserocr': None}) # import fails
+
+    assert isinstance(build_ocr_engine('tesserocr'), PytesseractEngine)
+
+def test_build_ocr_engine_unknown_name():
+    with pytest.raises(ValueError, match="Unknown OCR engine"):
+        build_ocr_engine('easyocr')
+
+def test_get_ocr_engine_is_created_once_per_process(mocker):
+    mocker.patch.object(ocr_engine, '_ocr_engine', None)
+    build = mocker.patch('src.utils.ocr_engine.build_ocr_engine', side_effect=lambda name: PytesseractEngine())
+
+    assert get_ocr_engine() is get_ocr_engine()
+    build.assert_called_once()
+
+    mocker.patch('src.utils.ocr_engine.os.getpid', return_value=-1) # as if in a forked worker
+    get_ocr_engine()
+    assert build.call_count == 2
@@ -0,0 +1,168 @@
+import os
+import pytest
+import threading
+import time
+import torch
+import weakref
+
+from src.model import batching, model_utils, registry as registry_module
+from src.model.model_utils import prepare_texts
+from src.model.registry import ModelRegistry, activate_version, list_versions, read_current_version
+from src.model.snapshot import model_identity
+from src.utils import near_duplicates
+from src.utils.near_duplicates import get_near_duplicate_index
+from src.model.startup import StartupProfile
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+from src.utils.classifier import classify_file
+
+@pytest.fixture(autouse=True)
+def cpu_only(mocker):
+    mocker.patch("src.model.model_preloader.torch.cuda.is_available", return_value=False)
+    # thread pools are process-wide, tests mustn't change them for the rest of the session
+    mocker.patch("src.model.startup.torch.set_num_threads")
+    mocker.patch("src.model.startup.torch.set_num_interop_threads")
+
+@pytest.fixture
+def registry_dir(tmp_path):
+    for seed, version in enumerate(('v1', 'v2', 'v3')):
+        build_tiny_model_and_tokenizer(save_dir=str(tmp_path / version), seed=seed)
+
+    activate_version(str(tmp_path), 'v1')
+    return str(tmp_path)
+
+def make_registry(registry_dir: str, **kwargs) -> ModelRegistry:
+    profile = StartupProfile(warmup_lengths=(16,), warmup_batch_sizes=(1,), warmup_rounds=2)
+    return ModelRegistry(registry_dir=registry_dir, profile=profile, **kwargs)
+
+def logits(served, text: str) -> torch.Tensor:
+    with torch.no_grad():
+        return served.model(**prepare_texts([text], served.tokenizer, served.device)).logits
+
+def test_activate_replaces_current(registry_dir):
+    assert list_versions(registry_dir) == ['v1', 'v2', 'v3']
+
+    activate_version(registry_dir, 'v2')
+    assert read_current_version(registry_dir) == 'v2'
+
+    with pytest.raises(ValueError, match="Unknown model version"):
+        activate_version(registry_dir, 'v9')
+
+    assert read_current_version(registry_dir) == 'v2'
+    assert not [name for name in os.listdir(registry_dir) if name.startswith('.')]
+
+def test_in_flight_request_finishes_on_the_version_it_started_with(registry_dir):
+    registry = make_registry(registry_dir)
+    assert registry.active.version == 'v1'
+
+    with registry.use() as old:
+        expected = logits(old, "invoice total due")
+        classify_file("invoice total due", old.model, tokenizer=old.tokenizer, device=old.device)
+
+        assert registry.swap_to('v2')
+
+        assert registry.active.version == 'v2'
+        assert old.version == 'v1' and torch.equal(logits(old, "invoice total due"), expected)
+        assert [(resident["version"], resident["state"]) for resident in registry.stats()["resident"]] == [('v2', 'active'), ('v1', 'draining')]
+
+    with registry.use() as served:
+        assert served.version == 'v2' and not torch.equal(logits(served, "invoice total due"), expected)
+
+    registry.release_drained()
+
+    stats = registry.stats()
+    assert [resident["version"] for resident in stats["resident"]] == ['v2']
+    assert stats["swaps"] == 1 and stats["last_swap"]["from"] == 'v1' and stats["last_swap"]["to"] == 'v2'
+    # the scheduler holding the old weights is gone with them, and so are the encoders of the old tokenizer
+    assert id(old.model) not in batching._schedulers
+    assert not [key for key, cached in model_utils._encoders.items() if cached[0] is old.tokenizer]
+
+def test_idle_swap_frees_eager_weights_without_a_full_collection(registry_dir, mocker):
+    registry = make_registry(registry_dir)
+    old_weights = weakref.ref(registry.active.model.model)
+    collect = mocker.patch("src.model.registry.gc.collect")
+
+    assert registry.swap_to('v2')
+
+    collect.assert_not_called()
+    assert old_weights() is None
+    assert [resident["version"] for resident in registry.stats()["resident"]] == ['v2']
+
+def test_no_more_than_two_versions_resident(registry_dir, mocker):
+    registry = make_registry(registry_dir)
+    load = mocker.spy(registry_module, 'load_model_and_tokenizer')
+
+    with registry.use():
+        registry.swap_to('v2')
+        swap = threading.Thread(target=registry.swap_to, args=('v3',))
+        swap.start()
+        time.sleep(0.3)
+
+        # v1 is still serving a request and v2 is active, v3 waits to be loaded
+        assert swap.is_alive() and registry.active.version == 'v2'
+        assert [call.kwargs["model_path"] for call in load.call_args_list] == [os.path.join(registry_dir, 'v2')]
+
+    swap.join(timeout=30)
+
+    assert registry.active.version == 'v3'
+    assert len(registry.stats()["resident"]) <= 2
+
+def test_failed_load_keeps_the_active_version(registry_dir):
+    os.makedirs(os.path.join(registry_dir, 'broken'))
+    with open(os.path.join(registry_dir, 'broken', 'config.json'), 'w') as f:
+        f.write("{not json")
+
+    registry = make_registry(registry_dir)
+
+    assert not registry.swap_to('broken')
+
+    stats = registry.stats()
+    assert stats["active"] == 'v1' and stats["swaps"] == 0 and 'broken' in stats["failed"]
+
+    with registry.use() as served:
+        assert served.version == 'v1' and served.model is not None
+
+def test_watcher_swaps_when_current_changes(registry_dir):
+    registry = make_registry(registry_dir, poll_seconds=0.05)
+
+    try:
+        with registry.use():
+            pass
+
+        activate_version(registry_dir, 'v2')
+        deadline = time.monotonic() + 30
+
+        while registry.active.version != 'v2' and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert registry.active.version == 'v2'
+    finally:
+        registry.stop()
+
+def test_without_a_registry_the_version_identifies_the_model(tmp_path):
+    snapshot_dir = str(tmp_path / 'distilbert')
+    build_tiny_model_and_tokenizer(save_dir=snapshot_dir, seed=0)
+
+    registry = ModelRegistry(registry_dir=None, model_path=snapshot_dir, profile=StartupProfile(warmup=False))
+    assert registry.active.version == model_identity(model_path=snapshot_dir) and registry.active.version.startswith('distilbert@')
+
+    # another model at the same MODEL_PATH, cached results of the old one mustn't be served for it
+    build_tiny_model_and_tokenizer(save_dir=snapshot_dir, seed=1)
+    assert model_identity(model_path=snapshot_dir) != registry.active.version
+
+    assert model_identity('org/model', revision='abc123') == 'org/model@abc123'
+
+def test_every_version_gets_its_own_saved_near_duplicate_index(registry_dir, tmp_path, mocker):
+    mocker.patch.object(near_duplicates, 'NEAR_DUPLICATE_INDEX_DIR', str(tmp_path / 'indexes'))
+    mocker.patch.object(near_duplicates, 'NEAR_DUPLICATE_ENABLED', True)
+    mocker.patch.object(near_duplicates, '_near_duplicate_indexes', {})
+    registry = make_registry(registry_dir)
+    index = get_near_duplicate_index(registry.active.model)
+    index.add(index.hasher.signature("invoice number 1234 total amount due within 30 days of the invoice date"), 'invoice', 0.95)
+
+    assert index.model_version == 'v1'
+    assert registry.swap_to('v2')
+
+    # v1's index was saved as it was released, v2 starts from its own
+    assert os.path.exists(near_duplicates.index_path('v1'))
+    assert get_near_duplicate_index(registry.active.model).model_version == 'v2'
+    assert get_near_duplicate_index(registry.active.model).stats()["entries"] == 0
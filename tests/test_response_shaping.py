@@ -0,0 +1,48 @@
+import gzip
+import json
+import pytest
+import random
+
+from src.utils.response_shaping import accepts_gzip, iter_gzip_json, should_compress, truncate_text
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, False),
+    ("", False),
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("deflate, GZIP;q=0.5", True),
+    ("gzip;q=0", False),
+    ("*", True),
+    ("identity", False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) == expected
+
+def test_truncate_text_leaves_cached_result_as_it_is():
+    result = {"file_class": "contract", "confidence": 0.9, "file_text": "terms and conditions"}
+
+    truncated = truncate_text(result, 5)
+
+    assert truncated == {"file_class": "contract", "confidence": 0.9, "file_text": "terms", "file_text_truncated": True, "file_text_length": 20}
+    assert result["file_text"] == "terms and conditions"
+    assert truncate_text(result, 20) is result
+    assert truncate_text(result, None) is result
+    assert truncate_text({"file_class": "contract"}, 5) == {"file_class": "contract"}
+
+def test_only_responses_with_enough_text_are_compressed():
+    long_result = {"file_class": "contract", "file_text": "x" * 10_000}
+
+    assert should_compress(long_result, "gzip")
+    assert should_compress({"results": [{"filename": "a.pdf", "error": "Empty file"}, long_result]}, "gzip")
+    assert not should_compress(long_result, None)
+    assert not should_compress({"file_class": "contract", "file_text": "short"}, "gzip")
+    assert not should_compress({"file_class": "contract"}, "gzip")
+
+def test_gzip_stream_decompresses_to_the_payload():
+    rng = random.Random(0)
+    payload = {"results": [{"filename": f"{i}.txt", "file_class": "invoice", "file_text": " ".join(f"Zażółć{rng.random()}" for _ in range(500))} for i in range(20)]}
+
+    chunks = list(iter_gzip_json(payload, chunk_bytes=1024))
+
+    assert len(chunks) > 1
+    assert json.loads(gzip.decompress(b"".join(chunks))) == payload
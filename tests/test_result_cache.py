@@ -0,0 +1,89 @@
+from io import BytesIO
+from src.utils import result_cache as result_cache_module
+from src.utils.result_cache import ResultCache, make_cache_key
+from werkzeug.datastructures import FileStorage
+
+RESULT = {"file_class": "invoice", "confidence": 0.97, "file_text": "INVOICE total due"}
+
+def make_filestorage(content: bytes, filename: str = "file.pdf"):
+    return FileStorage(stream=BytesIO(content), filename=filename)
+
+def test_cache_key_depends_on_content_and_model():
+    key = make_cache_key(make_filestorage(b"abc"), "model-a")
+
+    assert key == make_cache_key(make_filestorage(b"abc", "other name.pdf"), "model-a")
+    assert key != make_cache_key(make_filestorage(b"abd"), "model-a")
+    assert key != make_cache_key(make_filestorage(b"abc"), "model-b")
+
+def test_cache_key_rewinds_file():
+    file = make_filestorage(b"abc" * 1000)
+    make_cache_key(file, "model")
+    assert file.read() == b"abc" * 1000
+
+def test_memory_hit_and_miss():
+    cache = ResultCache(max_entries=10)
+
+    assert cache.get("key") is None
+    cache.put("key", RESULT)
+    assert cache.get("key") == RESULT
+
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    cache.get("a") # a is now most recently used
+    cache.put("c", RESULT)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == RESULT
+    assert cache.get("c") == RESULT
+
+def test_ttl_expiry(mocker):
+    clock = mocker.patch.object(result_cache_module.time, "time", return_value=1000.0)
+    cache = ResultCache(ttl_seconds=60)
+    cache.put("key", RESULT)
+
+    clock.return_value = 1059.0
+    assert cache.get("key") == RESULT
+
+    clock.return_value = 1061.0
+    assert cache.get("key") is None
+
+def test_disk_tier_shared_between_instances(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite")
+    ResultCache(db_path=db_path).put("key", RESULT)
+
+    other_worker = ResultCache(db_path=db_path)
+    assert other_worker.get("key") == RESULT
+    assert other_worker.stats()["disk_hits"] == 1
+
+    assert other_worker.get("key") == RESULT # promoted to memory
+    assert other_worker.stats()["memory_hits"] == 1
+
+def test_disk_tier_expiry(tmp_path, mocker):
+    clock = mocker.patch.object(result_cache_module.time, "time", return_value=1000.0)
+    db_path = str(tmp_path / "cache.sqlite")
+    ResultCache(db_path=db_path, ttl_seconds=60).put("key", RESULT)
+
+    clock.return_value = 1100.0
+    assert ResultCache(db_path=db_path, ttl_seconds=60).get("key") is None
+
+def test_disk_tier_size_bound(tmp_path):
+    cache = ResultCache(max_entries=1, db_path=str(tmp_path / "cache.sqlite"), max_db_entries=3)
+    for i in range(10):
+        cache.put(f"key{i}", RESULT)
+    cache.prune_disk()
+
+    assert cache._execute("SELECT COUNT(*) FROM results")[0][0] == 3
+    assert cache.get("key9") == RESULT
+    assert cache.get("key0") is None
+
+def test_disk_errors_are_misses(tmp_path):
+    cache = ResultCache(db_path=str(tmp_path / "missing-dir" / "cache.sqlite"))
+
+    cache.put("key", RESULT)
+    assert cache.get("other") is None
+    assert cache.stats()["errors"] > 0
@@ -0,0 +1,83 @@
+import pytest
+import torch
+
+from src.model.backends import EagerBackend, QuantizedBackend
+from src.model.model_preloader import load_model_and_tokenizer
+from src.model.model_utils import prepare_texts
+from src.model.startup import StartupProfile, apply_thread_budget, prepare_model
+from src.model.tiny_model import build_tiny_model_and_tokenizer
+
+@pytest.fixture(autouse=True)
+def thread_settings(mocker):
+    # thread pools are process-wide, tests mustn't change them for the rest of the session
+    return mocker.patch("src.model.startup.torch.set_num_threads"), mocker.patch("src.model.startup.torch.set_num_interop_threads")
+
+def small_profile(**kwargs):
+    return StartupProfile(warmup_lengths=(16, 64), warmup_batch_sizes=(1, 2), warmup_rounds=2, **kwargs)
+
+def test_processes_share_the_core_budget(thread_settings):
+    set_num_threads, set_num_interop_threads = thread_settings
+
+    assert StartupProfile(processes=4, core_budget=8).intra_op_threads == 2
+    assert StartupProfile(processes=4, core_budget=2).intra_op_threads == 1
+
+    set_num_interop_threads.side_effect = RuntimeError("cannot set number of interop threads after parallel work has started")
+    assert apply_thread_budget(StartupProfile(processes=2, core_budget=6)) == 3
+    set_num_threads.assert_called_once_with(3)
+
+def test_unknown_optimization_is_rejected():
+    with pytest.raises(ValueError, match="Unknown model optimization"):
+        StartupProfile(optimization='tensorrt')
+
+def test_traced_forward_pass_matches_eager(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+    device = torch.device('cpu')
+    backend = EagerBackend(model)
+    backend.optimize('trace', prepare_texts(["invoice total due", "invoice"], tokenizer, device))
+
+    # other batch sizes and lengths than traced with, padded and not
+    for texts in (["a short invoice"], ["contract between the parties " * 20, "passport"]):
+        prepared_texts = prepare_texts(texts, tokenizer, device)
+
+        with torch.no_grad():
+            expected = model(**prepared_texts).logits
+
+        assert torch.allclose(backend(**prepared_texts).logits, expected, atol=1e-5)
+
+def test_warm_up_reports_cold_and_warm_latency_of_every_shape(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+
+    report = prepare_model(EagerBackend(model), tokenizer, torch.device('cpu'), small_profile(processes=1, core_budget=2))
+
+    assert report["threads"] == 2 and report["optimization"] == 'none'
+    assert set(report["shapes"]) == {"1x16", "2x16", "1x64", "2x64"}
+    assert all(latency["cold_ms"] > 0 and latency["warm_ms"] > 0 for latency in report["shapes"].values())
+
+def test_failing_optimization_falls_back_to_eager(tiny_model_and_tokenizer, mocker):
+    model, tokenizer = tiny_model_and_tokenizer
+    mocker.patch("src.model.backends.torch.compile", return_value=mocker.Mock(side_effect=RuntimeError("no C++ compiler")))
+    backend = EagerBackend(model)
+
+    report = prepare_model(backend, tokenizer, torch.device('cpu'), small_profile(optimization='compile'))
+
+    assert report["optimization"] == 'none' and backend.forward is model
+    assert len(report["shapes"]) == 4
+
+def test_only_eager_backend_is_optimized(tiny_model_and_tokenizer):
+    model, tokenizer = tiny_model_and_tokenizer
+
+    report = prepare_model(QuantizedBackend(model), tokenizer, torch.device('cpu'), small_profile(optimization='trace', warmup=False))
+
+    assert report["optimization"] == 'none' and report["shapes"] == {}
+
+def test_model_is_prepared_at_load_unless_left_to_forked_workers(tmp_path, mocker):
+    build_tiny_model_and_tokenizer(save_dir=str(tmp_path))
+    mocker.patch("src.model.model_preloader.torch.cuda.is_available", return_value=False)
+    prepare = mocker.patch("src.model.model_preloader.prepare_model")
+
+    load_model_and_tokenizer(model_path=str(tmp_path), profile=StartupProfile(after_fork=True))
+    prepare.assert_not_called()
+
+    backend, tokenizer, device = load_model_and_tokenizer(model_path=str(tmp_path), profile=StartupProfile())
+    prepare.assert_called_once()
+    assert prepare.call_args.args[:3] == (backend, tokenizer, device)
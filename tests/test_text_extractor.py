@@ -1,12 +1,31 @@
+import pymupdf
 import pytest
+import zipfile
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from docx import Document
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
+from PIL import Image
+from unittest.mock import MagicMock
 from werkzeug.datastructures import FileStorage
 
 from src.utils.text_extractor import (
     extract_file_extension,
+    extract_text_from_docx,
+    extract_text_from_image,
+    extract_text_from_pdf,
     extract_text_from_txt,
     extract_text,
+    extract_text_in_worker,
+    extract_texts,
+    get_render_dpi,
+    get_token_budget,
+    ocr_pdf_page,
+    reset_extraction_process_pool,
 )
+from src.utils import text_extractor
+from src.utils.ocr_engine import OcrError
 
 @pytest.mark.parametrize("filename,expected", [
     ("foo.txt", "txt"),
@@ -39,4 +58,269 @@ def test_extract_text_unsupported_extension(capfd):
     fs = make_filestorage(b"", "file.xyz")
     assert extract_text(fs) is None
     captured = capfd.readouterr()
-    assert "Error: Unsupported file type" in captured.out
\ No newline at end of file
+    assert "Error: Unsupported file type" in captured.out
+
+def test_extract_texts_keeps_order():
+    files = [make_filestorage(f"text {i}".encode(), f"file{i}.txt") for i in range(6)]
+    assert extract_texts(files) == [f"text {i}" for i in range(6)]
+
+def test_extract_texts_failure_does_not_affect_others(mocker):
+    def fake_extract_text(file, tokenizer=None, ocr_pass=None):
+        if file.filename == "file1.txt":
+            raise RuntimeError("boom")
+        return file.filename
+
+    mocker.patch("src.utils.text_extractor.extract_text", side_effect=fake_extract_text)
+    files = [make_filestorage(b"", f"file{i}.txt") for i in range(3)]
+
+    assert extract_texts(files) == ["file0.txt", "", "file2.txt"]
+
+def make_pdf(pages):
+    """
+    Builds a PDF where a string is a page with a text layer and None is a page without text, which needs OCR.
+    """
+    pdf_doc = pymupdf.open()
+    for page_text in pages:
+        page = pdf_doc.new_page()
+        if page_text:
+            page.insert_text((72, 72), page_text)
+    pdf_bytes = pdf_doc.tobytes()
+    pdf_doc.close()
+    return pdf_bytes
+
+@pytest.fixture
+def thread_ocr_pool(mocker):
+    # mocks don't cross process boundaries, so the process pool is swapped for threads
+    pool = ThreadPoolExecutor(max_workers=4)
+    mocker.patch("src.utils.text_extractor._get_ocr_process_pool", return_value=pool)
+    mocker.patch("src.utils.text_extractor.ocr_pdf_page", side_effect=lambda page: f"ocr page {page.number}")
+    yield pool
+    pool.shutdown()
+
+def test_pdf_parallel_ocr_keeps_page_order(thread_ocr_pool):
+    pdf_bytes = make_pdf(["text page 0", None, "text page 2", None, None])
+
+    assert extract_text_from_pdf(pdf_bytes) == "text page 0\nocr page 1\ntext page 2\nocr page 3\nocr page 4"
+
+def test_pdf_parallel_ocr_caps_workers_per_request(thread_ocr_pool, mocker):
+    mocker.patch("src.utils.text_extractor.OCR_WORKERS_PER_REQUEST", 2)
+    submit = mocker.spy(thread_ocr_pool, "submit")
+    pdf_bytes = make_pdf([None] * 7)
+
+    text = extract_text_from_pdf(pdf_bytes)
+
+    assert submit.call_count == 2
+    assert text.splitlines() == [f"ocr page {i}" for i in range(7)]
+
+def test_pdf_single_page_ocr_is_serial(thread_ocr_pool, mocker):
+    get_pool = mocker.patch("src.utils.text_extractor._get_ocr_process_pool")
+
+    assert extract_text_from_pdf(make_pdf(["text page 0", None])) == "text page 0\nocr page 1"
+    get_pool.assert_not_called()
+
+def test_pdf_serial_when_parallel_disabled(thread_ocr_pool, mocker):
+    get_pool = mocker.patch("src.utils.text_extractor._get_ocr_process_pool")
+
+    assert extract_text_from_pdf(make_pdf([None, None]), parallel_ocr=False) == "ocr page 0\nocr page 1"
+    get_pool.assert_not_called()
+
+def test_pdf_broken_pool_falls_back_to_serial(mocker):
+    pool = MagicMock()
+    pool.submit.side_effect = BrokenProcessPool("worker died")
+    mocker.patch("src.utils.text_extractor._get_ocr_process_pool", return_value=pool)
+    mocker.patch("src.utils.text_extractor._reset_ocr_process_pool")
+    mocker.patch("src.utils.text_extractor.ocr_pdf_page", side_effect=lambda page: f"ocr page {page.number}")
+
+    assert extract_text_from_pdf(make_pdf([None, None, None])) == "ocr page 0\nocr page 1\nocr page 2"
+
+def test_pdf_pool_broken_while_ocring_falls_back_to_serial(mocker):
+    broken = Future()
+    broken.set_exception(BrokenProcessPool("worker killed"))
+    pool = MagicMock()
+    pool.submit.return_value = broken
+    mocker.patch("src.utils.text_extractor._get_ocr_process_pool", return_value=pool)
+    reset = mocker.patch("src.utils.text_extractor._reset_ocr_process_pool")
+    mocker.patch("src.utils.text_extractor.ocr_pdf_page", side_effect=lambda page: f"ocr page {page.number}")
+
+    assert extract_text_from_pdf(make_pdf([None, None, None])) == "ocr page 0\nocr page 1\nocr page 2"
+    reset.assert_called_once()
+
+def test_pdf_failed_ocr_chunk_is_left_out(thread_ocr_pool, mocker):
+    mocker.patch("src.utils.text_extractor.OCR_WORKERS_PER_REQUEST", 2)
+    worker = text_extractor._ocr_pdf_pages_worker
+
+    def fail_chunk_with_page_1(file_bytes, chunk, ocr_pass):
+        if 1 in chunk:
+            raise RuntimeError("TesseractError: failed")
+        return worker(file_bytes, chunk, ocr_pass)
+
+    mocker.patch("src.utils.text_extractor._ocr_pdf_pages_worker", side_effect=fail_chunk_with_page_1)
+
+    # pages 1 and 3 were OCR'd together and failed, like a page that can't be read they're left out
+    assert extract_text_from_pdf(make_pdf(["text page 0", None, None, None])) == "text page 0\nocr page 2"
+
+def test_pdf_is_closed_when_ocr_raises(mocker):
+    pdf_bytes = make_pdf([None])
+    opened = []
+    open_pdf = pymupdf.open
+    mocker.patch("src.utils.text_extractor.pymupdf.open", side_effect=lambda *args, **kwargs: opened.append(open_pdf(*args, **kwargs)) or opened[-1])
+    mocker.patch("src.utils.text_extractor.ocr_pdf_page", side_effect=MemoryError)
+
+    with pytest.raises(MemoryError):
+        extract_text_from_pdf(pdf_bytes)
+
+    assert len(opened) == 1 and opened[0].is_closed
+
+def make_docx(paragraphs):
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    docx_bytes = BytesIO()
+    document.save(docx_bytes)
+    return docx_bytes.getvalue()
+
+def make_png(color):
+    png_bytes = BytesIO()
+    Image.new('L', (8, 8), color).save(png_bytes, format='PNG')
+    return png_bytes.getvalue()
+
+def test_docx_reads_tables_headers_and_footers():
+    document = Document()
+    document.sections[0].header.paragraphs[0].text = "ACME Ltd invoice"
+    document.add_paragraph("Bill to: John Doe")
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text, table.cell(0, 1).text = "Item", "Amount"
+    table.cell(1, 0).text, table.cell(1, 1).text = "Consulting", "100.00"
+    document.add_paragraph("")
+    document.sections[0].footer.paragraphs[0].text = "Page 1"
+    docx_bytes = BytesIO()
+    document.save(docx_bytes)
+
+    assert extract_text_from_docx(docx_bytes.getvalue()) == "ACME Ltd invoice\nBill to: John Doe\nItem\tAmount\nConsulting\t100.00\nPage 1"
+
+def test_image_only_docx_ocrs_every_unique_image_once(mocker):
+    docx_bytes = BytesIO(make_docx([]))
+    with zipfile.ZipFile(docx_bytes, 'a') as archive: # the same scan pasted three times, and another one
+        for i, color in enumerate((0, 255, 0, 0)):
+            archive.writestr(f"word/media/image{i}.png", make_png(color))
+    ocr = mocker.patch("src.utils.text_extractor.extract_text_from_image", side_effect=lambda image_bytes: f"colour {Image.open(BytesIO(image_bytes)).getpixel((0, 0))}")
+
+    text = extract_text_from_docx(docx_bytes.getvalue(), parallel_ocr=True)
+
+    assert ocr.call_count == 2
+    assert text.splitlines() == ["colour 0", "colour 255"]
+
+def test_broken_docx():
+    assert extract_text_from_docx(b"not a zip") == ""
+
+def test_lazy_pdf_stops_ocr_once_budget_is_full(tiny_model_and_tokenizer, mocker):
+    _, tokenizer = tiny_model_and_tokenizer
+    ocr = mocker.patch("src.utils.text_extractor.ocr_pdf_page", side_effect=lambda page: "invoice total amount due " * 5)
+    fs = make_filestorage(make_pdf([None] * 10), "scan.pdf", "application/pdf")
+
+    text = extract_text(fs, tokenizer=tokenizer, max_tokens=40)
+
+    assert ocr.call_count == 2 # 20 tokens per page
+    assert text.count("invoice") == 10
+
+def test_lazy_pdf_reads_text_layer_pages_in_order(tiny_model_and_tokenizer, mocker):
+    _, tokenizer = tiny_model_and_tokenizer
+    mocker.patch("src.utils.text_extractor.ocr_pdf_page", return_value="ocr")
+    fs = make_filestorage(make_pdf(["page zero", None, "page two"]), "doc.pdf", "application/pdf")
+
+    assert extract_text(fs, tokenizer=tokenizer, max_tokens=1000) == "page zero\nocr\npage two"
+
+def test_lazy_docx_stops_after_budget(tiny_model_and_tokenizer, mocker):
+    _, tokenizer = tiny_model_and_tokenizer
+    fs = make_filestorage(make_docx(["contract"] + [f"party {i}" for i in range(100)]), "doc.docx")
+
+    text = extract_text(fs, tokenizer=tokenizer, max_tokens=10)
+
+    assert text.startswith("contract\nparty 0")
+    assert "party 99" not in text
+
+def test_lazy_txt_blocks_keep_whole_lines(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+    lines = [f"line {i} of the contract" for i in range(1000)]
+    fs = make_filestorage("\n".join(lines).encode(), "doc.txt")
+
+    text = extract_text(fs, tokenizer=tokenizer, max_tokens=50)
+
+    assert text.splitlines() == lines[:len(text.splitlines())]
+    assert len(text.splitlines()) < 1000
+
+def test_lazy_extraction_without_budget_matches_full(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+    pdf_bytes = make_pdf(["page zero", "page one"])
+
+    full = extract_text(make_filestorage(pdf_bytes, "doc.pdf"))
+    lazy = extract_text(make_filestorage(pdf_bytes, "doc.pdf"), tokenizer=tokenizer, max_tokens=10_000)
+
+    assert lazy == full
+
+def test_token_budget_covers_every_window(tiny_model_and_tokenizer):
+    _, tokenizer = tiny_model_and_tokenizer
+
+    assert get_token_budget(tokenizer, max_windows=1) == 510
+    assert get_token_budget(tokenizer, max_windows=3, stride=128) == 510 + 2 * 382
+
+def test_lazy_image_is_read_whole(tiny_model_and_tokenizer, mocker):
+    _, tokenizer = tiny_model_and_tokenizer
+    ocr = mocker.patch("src.utils.text_extractor.extract_text_from_image", return_value="passport")
+
+    assert extract_text(make_filestorage(b"img", "scan.png"), tokenizer=tokenizer) == "passport"
+    ocr.assert_called_once_with(b"img")
+
+def test_extract_text_in_worker_uses_pool_tokenizer_when_lazy(tiny_model_and_tokenizer, mocker):
+    _, tokenizer = tiny_model_and_tokenizer
+    mocker.patch("src.utils.text_extractor._extraction_worker_tokenizer", tokenizer)
+    txt_bytes = "\n".join(["invoice total amount due"] * 1000).encode("utf-8")
+
+    assert extract_text_in_worker(txt_bytes, "doc.txt") == txt_bytes.decode("utf-8")
+    assert len(extract_text_in_worker(txt_bytes, "doc.txt", lazy=True)) < len(txt_bytes)
+
+def test_extract_text_in_worker_wraps_errors(mocker):
+    mocker.patch("src.utils.text_extractor.extract_text_from_image", side_effect=ValueError("bad image"))
+
+    with pytest.raises(RuntimeError, match="ValueError: bad image"):
+        extract_text_in_worker(b"img", "scan.png")
+
+
+def test_get_render_dpi_caps_page_pixels():
+    page = pymupdf.open().new_page(width=595, height=842) # A4
+
+    assert get_render_dpi(page, dpi=300, max_pixels=50_000_000) == 300
+    assert get_render_dpi(page, dpi=300, max_pixels=2_000_000) < 300
+
+    width, height = 595 / 72 * get_render_dpi(page, dpi=300, max_pixels=2_000_000), 842 / 72 * get_render_dpi(page, dpi=300, max_pixels=2_000_000)
+    assert width * height <= 2_000_000
+
+def test_ocr_pdf_page_renders_greyscale_without_png(mocker):
+    engine = mocker.patch("src.utils.text_extractor.get_ocr_engine").return_value
+    engine.image_to_string.return_value = " scanned \n"
+    page = pymupdf.open(stream=make_pdf([None]), filetype='pdf').load_page(0)
+
+    assert ocr_pdf_page(page) == "scanned"
+
+    image = engine.image_to_string.call_args.args[0]
+    assert image.mode == 'L'
+    assert abs(image.size[0] - page.rect.width / 72 * 300) <= 1
+    assert abs(image.size[1] - page.rect.height / 72 * 300) <= 1
+
+def test_image_the_engine_fails_on_reads_as_no_text(mocker):
+    engine = mocker.patch("src.utils.text_extractor.get_ocr_engine").return_value
+    engine.image_to_string.side_effect = OcrError("tesserocr: RuntimeError: Failed to recognize")
+
+    assert extract_text_from_image(make_png(255)) == ""
+
+def test_only_the_pool_that_broke_is_reset(mocker):
+    broken, current = MagicMock(), MagicMock()
+    mocker.patch.object(text_extractor, '_extraction_process_pool', current)
+
+    reset_extraction_process_pool(broken) # noticed late, the pool was replaced already
+    assert text_extractor._extraction_process_pool is current
+    current.shutdown.assert_not_called()
+
+    reset_extraction_process_pool(current)
+    assert text_extractor._extraction_process_pool is None
+    current.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
@@ -0,0 +1,110 @@
+import pickle
+import pymupdf
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+
+from src.utils.text_extractor import extract_text_from_image, extract_text_from_pdf
+from src.utils.tiered_ocr import OcrPass, fast_image, is_too_short, new_ocr_pass, ocr_pass_context, ocr_tier_stats, review_ocr_pass
+
+LONG_TEXT = "Invoice number 1234, total amount due within 30 days"
+
+def make_scanned_pdf(n_pages: int) -> bytes:
+    pdf_doc = pymupdf.open()
+    for _ in range(n_pages):
+        pdf_doc.new_page(width=595, height=842) # A4, no text layer
+    pdf_bytes = pdf_doc.tobytes()
+    pdf_doc.close()
+    return pdf_bytes
+
+@pytest.fixture
+def ocr_engine(mocker):
+    # reads a page well only at full resolution (an A4 page at 300 dpi is 2480 px wide)
+    engine = mocker.patch("src.utils.text_extractor.get_ocr_engine").return_value
+    engine.image_to_string.side_effect = lambda image: LONG_TEXT if image.size[0] > 2000 else "Inv0ice"
+    return engine
+
+@pytest.fixture(autouse=True)
+def empty_tier_stats():
+    ocr_tier_stats.reset()
+
+def test_fast_image_downscales_and_crops():
+    image = Image.new('L', (2480, 3508))
+
+    assert fast_image(image, scale=0.5, min_side=1000).size == (1240, 1754)
+    assert fast_image(image, scale=0.2, min_side=1000).size[1] == 1000
+    assert fast_image(image, scale=0.5, min_side=1000, top_fraction=0.25).size == (1240, 438)
+    assert fast_image(Image.new('L', (800, 600)), scale=0.5, min_side=1000) is None
+
+def test_is_too_short():
+    assert is_too_short("- . ,;: ~~ '' -- " * 10, min_chars=5)
+    assert is_too_short("Inv0ice", min_chars=40)
+    assert not is_too_short(LONG_TEXT, min_chars=40)
+
+def test_short_fast_read_is_escalated(ocr_engine):
+    ocr_pass = OcrPass('fast')
+
+    with ocr_pass_context(ocr_pass):
+        assert extract_text_from_pdf(make_scanned_pdf(1), parallel_ocr=False) == LONG_TEXT
+
+    widths = [call.args[0].size[0] for call in ocr_engine.image_to_string.call_args_list]
+    assert widths[0] < 1300 and widths[1] > 2000
+    assert ocr_pass.reads == {'fast': 1, 'full': 1}
+    assert ocr_pass.short_escalations == 1 and ocr_pass.fast_reads_kept == 0
+
+def test_good_fast_read_is_kept(ocr_engine):
+    ocr_engine.image_to_string.side_effect = lambda image: LONG_TEXT
+    image_bytes = BytesIO()
+    Image.new('RGB', (2480, 3508), 'white').save(image_bytes, format='PNG')
+    ocr_pass = OcrPass('fast')
+
+    with ocr_pass_context(ocr_pass):
+        assert extract_text_from_image(image_bytes.getvalue()) == LONG_TEXT
+
+    assert ocr_engine.image_to_string.call_args.args[0].size == (1240, 1754)
+    assert ocr_pass.reads == {'fast': 1, 'full': 0}
+
+def test_without_pass_everything_is_read_at_full_resolution(ocr_engine):
+    assert extract_text_from_pdf(make_scanned_pdf(1), parallel_ocr=False) == LONG_TEXT
+    assert ocr_engine.image_to_string.call_count == 1
+
+def test_reads_in_worker_processes_are_added_up(ocr_engine, mocker):
+    ocr_engine.image_to_string.side_effect = lambda image: LONG_TEXT
+    # mocks don't cross process boundaries, so the process pool is swapped for threads
+    pool = ThreadPoolExecutor(max_workers=2)
+    mocker.patch("src.utils.text_extractor._get_ocr_process_pool", return_value=pool)
+    ocr_pass = OcrPass('fast')
+
+    with ocr_pass_context(ocr_pass):
+        extract_text_from_pdf(make_scanned_pdf(4), parallel_ocr=True)
+    pool.shutdown()
+
+    assert ocr_pass.reads == {'fast': 4, 'full': 0}
+
+    # what a worker process gets and sends back
+    copy = pickle.loads(pickle.dumps(ocr_pass))
+    copy.add(ocr_pass)
+    assert copy.reads == {'fast': 8, 'full': 0}
+
+def test_unsure_classification_of_fast_text_is_escalated():
+    ocr_pass = OcrPass('fast')
+    ocr_pass.reads['fast'] = 2
+
+    assert review_ocr_pass(ocr_pass, 0.95, threshold=0.8) is None
+    assert review_ocr_pass(ocr_pass, 0.5, threshold=0.8).tier == 'full'
+    assert review_ocr_pass(ocr_pass, None, threshold=0.8).tier == 'full'
+    assert review_ocr_pass(OcrPass('fast'), 0.5, threshold=0.8) is None # no OCR, nothing to read again
+    assert review_ocr_pass(OcrPass('full'), 0.5, threshold=0.8) is None
+    assert review_ocr_pass(None, 0.5) is None
+
+    stats = ocr_tier_stats.stats()
+    assert stats["documents"] == 4 and stats["fast_documents"] == 3
+    assert stats["low_confidence_escalations"] == 2
+    assert stats["fast"]["reads"] == 6
+
+def test_only_text_modes_without_text_start_fast():
+    assert new_ocr_pass('none', fast_text_modes=('none',)).tier == 'fast'
+    assert new_ocr_pass('full', fast_text_modes=('none',)) is None
+    assert new_ocr_pass('none', fast_text_modes=()) is None
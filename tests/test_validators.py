@@ -5,7 +5,16 @@ from flask import Request
 from io import BytesIO
 from src.app import app
 from src.settings.config import ALLOWED_EXTENSIONS, ALLOWED_MIME_TYPES
-from src.utils.validators import get_and_validate_uploaded_file, is_allowed_file, validate_model_state, ValidationError
+from src.utils.validators import (
+    get_and_validate_uploaded_file,
+    get_and_validate_uploaded_files,
+    is_allowed_file,
+    validate_model_state,
+    validate_request_size,
+    validate_uploaded_file,
+    PayloadTooLargeError,
+    ValidationError,
+)
 from unittest.mock import MagicMock
 from werkzeug.datastructures import FileStorage
 
@@ -90,4 +99,56 @@ def test_success_returns_filestorage(client, filename, mimetype, content):
 
     assert isinstance(file_obj, FileStorage)
     assert file_obj.filename == filename
-    assert file_obj.mimetype == mimetype
\ No newline at end of file
+    assert file_obj.mimetype == mimetype
+
+@pytest.mark.parametrize("filename, mimetype", [
+    ("", "text/plain"),
+    ("noextension", "text/plain"),
+    ("file.gif", "image/gif"),
+    ("file.pdf", "text/plain"),
+])
+def test_validate_uploaded_file_invalid(filename, mimetype):
+    with pytest.raises(ValidationError):
+        validate_uploaded_file(MockFileStorage(filename, mimetype))
+
+def test_validate_uploaded_file_valid():
+    validate_uploaded_file(FileStorage(BytesIO(b"%PDF-1.7 ..."), "file.pdf", content_type="application/pdf"))
+
+def test_get_uploaded_files_in_order(client):
+    request = Request.from_values(
+        "/classify-files", method="POST",
+        data={"files": [(BytesIO(b"a"), "a.txt", "text/plain"), (BytesIO(b"b"), "b.gif", "image/gif")]},
+    )
+    files = get_and_validate_uploaded_files(request)
+
+    assert [f.filename for f in files] == ["a.txt", "b.gif"]
+
+def test_get_uploaded_files_too_many(client):
+    request = Request.from_values(
+        "/classify-files", method="POST",
+        data={"files": [(BytesIO(b"a"), f"{i}.txt", "text/plain") for i in range(3)]},
+    )
+    with pytest.raises(ValidationError, match="Too many files"):
+        get_and_validate_uploaded_files(request, max_files=2)
+
+@pytest.mark.parametrize("content, filename, mimetype, error", [
+    (b"", "a.txt", "text/plain", "Empty file"),
+    (b"\x89PNG\r\n\x1a\n", "scan.pdf", "application/pdf", "looks like: png"),
+    (b"GIF89a\x01\x00", "photo.jpg", "image/jpeg", "looks like: unknown binary data"),
+])
+def test_validate_uploaded_file_content(content, filename, mimetype, error):
+    with pytest.raises(ValidationError, match=error):
+        validate_uploaded_file(FileStorage(BytesIO(content), filename, content_type=mimetype))
+
+def test_validate_uploaded_file_size(mocker):
+    mocker.patch.dict("src.utils.validators.MAX_UPLOAD_BYTES", {"txt": 4})
+
+    validate_uploaded_file(FileStorage(BytesIO(b"1234"), "a.txt", content_type="text/plain"))
+    with pytest.raises(PayloadTooLargeError, match="File too large"):
+        validate_uploaded_file(FileStorage(BytesIO(b"12345"), "a.txt", content_type="text/plain"))
+
+def test_validate_request_size():
+    validate_request_size(None, max_bytes=10)
+    validate_request_size(10, max_bytes=10)
+    with pytest.raises(PayloadTooLargeError, match="Request too large"):
+        validate_request_size(11, max_bytes=10)